@@ -0,0 +1,308 @@
+"""
+Doctor calendar: conflict checks and free-slot search
+
+Each appointment occupies [data_consulta, data_consulta + duracao_minutos). The
+intervals of the active appointments live in the R*Tree ``agenda_intervalos``
+(kept in sync by triggers in init_db), keyed by minute and by doctor, so a
+conflict check or the busy intervals of a day/week are an index lookup,
+O(log n + k), instead of a scan of every appointment. Free slots come from a
+sweep over the sorted busy intervals within the office hours.
+
+Minutos contam a partir de 2000-01-01 00:00 no horário local gravado (sem fuso),
+o mesmo relógio de data_consulta.
+"""
+import heapq
+from bisect import bisect_left
+from datetime import datetime, timedelta, time
+
+# Duração assumida para consultas sem duração gravada
+DURACAO_PADRAO_MINUTOS = 50
+DURACAO_MINIMA_MINUTOS, DURACAO_MAXIMA_MINUTOS = 10, 240
+
+# Expediente e granularidade dos horários sugeridos
+INICIO_EXPEDIENTE = time(8, 0)
+FIM_EXPEDIENTE = time(18, 0)
+DIAS_ATENDIMENTO = {0, 1, 2, 3, 4}  # segunda a sexta
+PASSO_MINUTOS = 30
+
+_EPOCA = datetime(2000, 1, 1)
+
+# data_consulta (canônica, datas_utils) em minutos, em SQL
+# (strftime('%s') trata a data sem fuso como UTC; 946684800 = 2000-01-01 00:00)
+SQL_MINUTOS = "(CAST(strftime('%s', {coluna}) AS INTEGER) - 946684800) / 60"
+
+
+def para_minutos(momento):
+    return int((momento - _EPOCA).total_seconds()) // 60
+
+
+def de_minutos(minutos):
+    return _EPOCA + timedelta(minutes=minutos)
+
+
+def converter_data_consulta(valor):
+    """datetime de 'YYYY-MM-DDTHH:MM' (datetime-local) ou 'YYYY-MM-DD HH:MM[:SS]' (ValueError se inválida)"""
+    return datetime.fromisoformat(str(valor).strip().replace('T', ' ')).replace(second=0, microsecond=0)
+
+
+def converter_duracao(valor):
+    """Duração em minutos dentro dos limites (padrão se ausente ou inválida)"""
+    try:
+        duracao = int(valor)
+    except (TypeError, ValueError):
+        return DURACAO_PADRAO_MINUTOS
+    return min(max(duracao, DURACAO_MINIMA_MINUTOS), DURACAO_MAXIMA_MINUTOS)
+
+
+def conflitos(cursor, medico_id, inicio, duracao_minutos, ignorar_id=None):
+    """Agendamentos ativos do médico que se sobrepõem a [inicio, inicio + duração)"""
+    inicio_min = para_minutos(inicio)
+    cursor.execute('''
+        SELECT a.id, a.data_consulta, a.duracao_minutos, p.nome as paciente_nome
+        FROM agenda_intervalos r
+        JOIN agendamentos a ON a.id = r.id
+        JOIN pacientes p ON a.paciente_id = p.id
+        WHERE r.medico_min <= :medico AND r.medico_max >= :medico
+        AND r.inicio < :fim AND r.fim > :inicio
+        AND r.id != :ignorar
+        ORDER BY r.inicio
+    ''', {'medico': medico_id, 'inicio': inicio_min, 'fim': inicio_min + duracao_minutos,
+          'ignorar': ignorar_id or 0})
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def intervalos_ocupados(cursor, medico_id, inicio, fim, ignorar_id=None):
+    """[(início, fim)] em minutos dos agendamentos do médico que tocam [inicio, fim), ordenados"""
+    cursor.execute('''
+        SELECT inicio, fim FROM agenda_intervalos
+        WHERE medico_min <= :medico AND medico_max >= :medico
+        AND inicio < :fim AND fim > :inicio AND id != :ignorar
+        ORDER BY inicio
+    ''', {'medico': medico_id, 'inicio': para_minutos(inicio), 'fim': para_minutos(fim),
+          'ignorar': ignorar_id or 0})
+    return [(row['inicio'], row['fim']) for row in cursor.fetchall()]
+
+
+def horarios_livres(cursor, medico_id, dia, dias=1, duracao_minutos=DURACAO_PADRAO_MINUTOS,
+                    agora=None, ignorar_id=None):
+    """Inícios livres (datetime) a cada PASSO_MINUTOS no expediente, de `dia` por `dias` dias"""
+    agora = agora or datetime.now()
+    primeiro = datetime.combine(dia, time.min)
+    ocupados = intervalos_ocupados(cursor, medico_id, primeiro, primeiro + timedelta(days=dias), ignorar_id)
+    inicios = [inicio for inicio, _ in ocupados]
+    # Maior fim entre os intervalos que começam antes de cada posição (intervalos podem se sobrepor)
+    fins_acumulados, maior = [], None
+    for _, fim in ocupados:
+        maior = fim if maior is None else max(maior, fim)
+        fins_acumulados.append(maior)
+
+    livres = []
+    for deslocamento in range(dias):
+        data = (primeiro + timedelta(days=deslocamento)).date()
+        if data.weekday() not in DIAS_ATENDIMENTO:
+            continue
+        candidato = para_minutos(datetime.combine(data, INICIO_EXPEDIENTE))
+        fim_expediente = para_minutos(datetime.combine(data, FIM_EXPEDIENTE))
+        minimo = para_minutos(agora) + 1
+        while candidato + duracao_minutos <= fim_expediente:
+            # Intervalos que começam antes do fim do candidato: livre se nenhum termina depois do início
+            posicao = bisect_left(inicios, candidato + duracao_minutos)
+            if candidato >= minimo and (posicao == 0 or fins_acumulados[posicao - 1] <= candidato):
+                livres.append(de_minutos(candidato))
+            candidato += PASSO_MINUTOS
+    return livres
+
+
+def proximos_horarios_livres(cursor, medico_id, apos=None, duracao_minutos=DURACAO_PADRAO_MINUTOS,
+                             quantidade=3, limite_dias=60, ignorar_id=None):
+    """Os primeiros `quantidade` horários livres a partir de `apos`, procurando semana a semana"""
+    apos = apos or datetime.now()
+    encontrados = []
+    for semana in range(0, limite_dias, 7):
+        dia = apos.date() + timedelta(days=semana)
+        for horario in horarios_livres(cursor, medico_id, dia, min(7, limite_dias - semana),
+                                       duracao_minutos, agora=apos, ignorar_id=ignorar_id):
+            encontrados.append(horario)
+            if len(encontrados) == quantidade:
+                return encontrados
+    return encontrados
+
+
+# Recorrências do planejador de séries (dias entre as sessões)
+RECORRENCIAS = {'semanal': 7, 'quinzenal': 14}
+
+
+def planejar_serie(cursor, medico_id, inicio, recorrencia, quantidade, duracao_minutos=DURACAO_PADRAO_MINUTOS):
+    """Datas da série (inicio + n * recorrência) e os conflitos de cada uma: [{'inicio', 'conflitos'}]"""
+    passo = timedelta(days=RECORRENCIAS[recorrencia])
+    return [{'inicio': inicio + passo * n,
+             'conflitos': conflitos(cursor, medico_id, inicio + passo * n, duracao_minutos)}
+            for n in range(quantidade)]
+
+
+def agendar_serie(conn, paciente_id, medico_id, inicio, recorrencia, quantidade, sessoes_max,
+                  duracao_minutos=DURACAO_PADRAO_MINUTOS, observacoes=''):
+    """
+    Cria as próximas `quantidade` sessões do paciente e um agendamento para cada uma
+    numa única transação (BEGIN IMMEDIATE: a verificação de conflitos e as inserções
+    não intercalam com outro agendamento). Tudo ou nada: se alguma data conflita com a
+    agenda do médico nada é gravado. ValueError se a série passa de `sessoes_max`.
+    Retorna {'plano', 'criadas', 'primeira_sessao'} (criadas = 0 quando há conflito).
+    """
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            SELECT COUNT(*) as total, COALESCE(MAX(numero_sessao), 0) as ultima
+            FROM sessoes WHERE paciente_id = ?
+        ''', (paciente_id,))
+        existentes = cursor.fetchone()
+        restantes = sessoes_max - existentes['total']
+        if restantes <= 0:
+            raise ValueError(f'Paciente já possui o máximo de {sessoes_max} sessões')
+        if quantidade > restantes:
+            raise ValueError(f'A série pode ter no máximo {restantes} sessões (limite de {sessoes_max} por paciente)')
+
+        plano = planejar_serie(cursor, medico_id, inicio, recorrencia, quantidade, duracao_minutos)
+        primeira = existentes['ultima'] + 1
+        if any(item['conflitos'] for item in plano):
+            conn.rollback()
+            return {'plano': plano, 'criadas': 0, 'primeira_sessao': primeira}
+
+        serie = [(primeira + n, item['inicio']) for n, item in enumerate(plano)]
+        cursor.executemany('''
+            INSERT INTO sessoes (paciente_id, numero_sessao, data_sessao, realizada)
+            VALUES (?, ?, ?, 0)
+        ''', [(paciente_id, numero, data.date().isoformat()) for numero, data in serie])
+        cursor.executemany('''
+            INSERT INTO agendamentos
+            (paciente_id, medico_id, data_consulta, duracao_minutos, observacoes, criado_por, sessao_id)
+            VALUES (?, ?, ?, ?, ?, ?, (SELECT MAX(id) FROM sessoes WHERE paciente_id = ? AND numero_sessao = ?))
+        ''', [(paciente_id, medico_id, data.strftime('%Y-%m-%d %H:%M:%S'), duracao_minutos, observacoes,
+               medico_id, paciente_id, numero) for numero, data in serie])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {'plano': plano, 'criadas': len(serie), 'primeira_sessao': primeira}
+
+
+# Operações em lote sobre a agenda de um médico num período (ausência do profissional)
+ACOES_LOTE = {'adiar': 'Adiar', 'transferir': 'Transferir para outro profissional', 'cancelar': 'Cancelar'}
+
+
+def _conflitos_lote(cursor, medico_id, novos, ignorar):
+    """
+    Verifica de uma vez os novos intervalos [(inicio, fim, agendamento_id)] em minutos
+    contra a agenda do médico (menos os ids em `ignorar`, que estão saindo dela) e entre
+    si: uma consulta ao R*Tree para o período todo e uma varredura ordenada.
+    Retorna [(agendamento_id, id do agendamento com que conflita)].
+    """
+    if not novos:
+        return []
+    cursor.execute('''
+        SELECT id, inicio, fim FROM agenda_intervalos
+        WHERE medico_min <= :medico AND medico_max >= :medico
+        AND inicio < :fim AND fim > :inicio
+    ''', {'medico': medico_id, 'inicio': min(n[0] for n in novos), 'fim': max(n[1] for n in novos)})
+    intervalos = [(row['inicio'], row['fim'], row['id'], False) for row in cursor.fetchall()
+                  if row['id'] not in ignorar]
+    intervalos += [(inicio, fim, agendamento_id, True) for inicio, fim, agendamento_id in novos]
+    intervalos.sort()
+
+    encontrados, ativos = [], []  # ativos: heap por fim dos intervalos que ainda não terminaram
+    for inicio, fim, agendamento_id, novo in intervalos:
+        while ativos and ativos[0][0] <= inicio:
+            heapq.heappop(ativos)
+        for _, outro_id, outro_novo in ativos:
+            if novo:
+                encontrados.append((agendamento_id, outro_id))
+            elif outro_novo:
+                encontrados.append((outro_id, agendamento_id))
+        heapq.heappush(ativos, (fim, agendamento_id, novo))
+    return encontrados
+
+
+def reorganizar_agenda(conn, medico_id, inicio, fim, acao, deslocamento=None, medico_destino=None,
+                       motivo='', executado_por=None):
+    """
+    Adia (por `deslocamento`), transfere para `medico_destino` ou cancela todas as consultas
+    ativas do médico em [inicio, fim) numa única transação (BEGIN IMMEDIATE): verifica os
+    conflitos do lote de uma vez, grava as novas datas, zera as confirmações das consultas
+    que mudaram (o agendador libera de novo na janela), registra a operação em
+    operacoes_agenda e enfileira os avisos. Tudo ou nada: com algum conflito nada é gravado.
+    Retorna {'agendamentos', 'conflitos', 'operacao_id'} (operacao_id None se não aplicou).
+    """
+    if acao not in ACOES_LOTE:
+        raise ValueError(f'Ação inválida: {acao}')
+    if acao == 'adiar' and not deslocamento:
+        raise ValueError('Informe quantos dias adiar')
+    if acao == 'transferir' and (not medico_destino or medico_destino == medico_id):
+        raise ValueError('Escolha outro profissional para receber as consultas')
+
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            SELECT a.id, a.paciente_id, a.data_consulta, a.duracao_minutos, a.sessao_id, p.nome as paciente_nome
+            FROM agendamentos a JOIN pacientes p ON a.paciente_id = p.id
+            WHERE a.medico_id = ? AND a.status = 'agendado'
+            AND a.data_consulta >= ? AND a.data_consulta < ?
+            ORDER BY a.data_consulta
+        ''', (medico_id, inicio.strftime('%Y-%m-%d %H:%M:%S'), fim.strftime('%Y-%m-%d %H:%M:%S')))
+        agendamentos = [dict(row) for row in cursor.fetchall()]
+        destino = medico_destino if acao == 'transferir' else medico_id
+        for agendamento in agendamentos:
+            agendamento['nova_data'] = converter_data_consulta(agendamento['data_consulta'])
+            if acao == 'adiar':
+                agendamento['nova_data'] += deslocamento
+
+        conflitos_lote = []
+        if acao != 'cancelar' and agendamentos:
+            novos = [(para_minutos(a['nova_data']),
+                      para_minutos(a['nova_data']) + (a['duracao_minutos'] or DURACAO_PADRAO_MINUTOS), a['id'])
+                     for a in agendamentos]
+            pares = _conflitos_lote(cursor, destino, novos, {a['id'] for a in agendamentos})
+            if pares:
+                cursor.execute(f'''
+                    SELECT a.id, a.data_consulta, p.nome as paciente_nome
+                    FROM agendamentos a JOIN pacientes p ON a.paciente_id = p.id
+                    WHERE a.id IN ({', '.join('?' * len(pares))})
+                ''', [outro_id for _, outro_id in pares])
+                outros = {row['id']: dict(row) for row in cursor.fetchall()}
+                por_id = {a['id']: a for a in agendamentos}
+                conflitos_lote = [{'agendamento': por_id[agendamento_id],
+                                   'conflito': por_id.get(outro_id) or outros.get(outro_id)}
+                                  for agendamento_id, outro_id in pares]
+        if conflitos_lote or not agendamentos:
+            conn.rollback()
+            return {'agendamentos': agendamentos, 'conflitos': conflitos_lote, 'operacao_id': None}
+
+        ids = [(a['id'],) for a in agendamentos]
+        if acao == 'cancelar':
+            cursor.executemany("UPDATE agendamentos SET status = 'cancelado' WHERE id = ?", ids)
+        else:
+            cursor.executemany('UPDATE agendamentos SET data_consulta = ?, medico_id = ? WHERE id = ?',
+                               [(a['nova_data'].strftime('%Y-%m-%d %H:%M:%S'), destino, a['id'])
+                                for a in agendamentos])
+            cursor.executemany('UPDATE sessoes SET data_sessao = ? WHERE id = ?',
+                               [(a['nova_data'].date().isoformat(), a['sessao_id'])
+                                for a in agendamentos if a['sessao_id']])
+            cursor.executemany('DELETE FROM confirmacoes_consulta WHERE agendamento_id = ?', ids)
+
+        cursor.execute('''
+            INSERT INTO operacoes_agenda
+            (acao, medico_id, medico_destino_id, inicio, fim, deslocamento_dias, motivo, afetados, executado_por)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (acao, medico_id, medico_destino if acao == 'transferir' else None,
+              inicio.strftime('%Y-%m-%d %H:%M:%S'), fim.strftime('%Y-%m-%d %H:%M:%S'),
+              deslocamento.days if acao == 'adiar' else None, motivo, len(agendamentos), executado_por))
+        operacao_id = cursor.lastrowid
+
+        from notificacoes import notificar_reorganizacao
+        notificar_reorganizacao(cursor, operacao_id, acao, medico_id, destino, agendamentos, motivo)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {'agendamentos': agendamentos, 'conflitos': [], 'operacao_id': operacao_id}
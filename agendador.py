@@ -0,0 +1,162 @@
+"""
+In-process scheduler for periodic maintenance jobs
+
+Every worker process starts the scheduler thread, but only the holder of the
+lease in ``agendador_lider`` runs jobs: the lease is taken or renewed with a
+single conditional upsert and expires after TTL_LIDERANCA seconds, so if the
+leader dies another worker takes over on its next check. Each job's next run
+time lives in ``agendador_tarefas``, so a new leader keeps the cadence instead
+of running everything again. Page views no longer do this write work.
+
+Uso manual (executa as tarefas vencidas, respeitando a liderança):
+    python agendador.py
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from database import get_db_connection
+
+# Segundos entre verificações da liderança e das tarefas vencidas
+INTERVALO_VERIFICACAO = 15
+
+# Validade da liderança sem renovação (maior que a tarefa mais longa)
+TTL_LIDERANCA = 90
+
+# AGENDADOR_ATIVO=0 desliga o agendador neste processo (ex.: scripts, testes)
+AGENDADOR_ATIVO = os.environ.get('AGENDADOR_ATIVO', '1') != '0'
+
+
+class Agendador:
+    """Executa as tarefas registradas na cadência de cada uma, só no processo líder"""
+
+    def __init__(self, intervalo=INTERVALO_VERIFICACAO, ttl=TTL_LIDERANCA):
+        self.intervalo = intervalo
+        self.ttl = ttl
+        self.dono = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.tarefas = {}
+        self._parar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def registrar(self, nome, intervalo, funcao):
+        """Registra funcao() para rodar a cada `intervalo` segundos"""
+        self.tarefas[nome] = (intervalo, funcao)
+
+    def iniciar(self):
+        """Inicia a thread do agendador (sem efeito se já está rodando)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if not AGENDADOR_ATIVO or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._executar, name='agendador', daemon=True)
+            self._thread.start()
+            atexit.register(self.parar)
+
+    def parar(self):
+        """Para a thread e libera a liderança para outro processo assumir já"""
+        self._parar.set()
+        try:
+            with get_db_connection() as conn:
+                conn.execute('DELETE FROM agendador_lider WHERE dono = ?', (self.dono,))
+                conn.commit()
+        except Exception as e:
+            logging.warning(f"Não foi possível liberar a liderança do agendador: {e}")
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                self.executar_pendentes()
+            except Exception as e:
+                logging.error(f"Erro no agendador: {e}")
+            self._parar.wait(self.intervalo)
+
+    def renovar_lideranca(self, cursor):
+        """Assume ou renova a liderança se ela é deste processo ou expirou; retorna se é líder"""
+        agora = time.time()
+        cursor.execute('''
+            INSERT INTO agendador_lider (id, dono, expira_em) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET dono = excluded.dono, expira_em = excluded.expira_em
+            WHERE agendador_lider.dono = excluded.dono OR agendador_lider.expira_em < ?
+        ''', (self.dono, agora + self.ttl, agora))
+        cursor.execute('SELECT dono FROM agendador_lider WHERE id = 1')
+        lider = cursor.fetchone()
+        return lider is not None and lider['dono'] == self.dono
+
+    def executar_pendentes(self):
+        """Roda as tarefas vencidas se este processo é o líder; retorna {tarefa: resultado}"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            lider = self.renovar_lideranca(cursor)
+            conn.commit()
+            if not lider:
+                return {}
+            cursor.execute('SELECT nome, proxima_execucao FROM agendador_tarefas')
+            proximas = {row['nome']: row['proxima_execucao'] for row in cursor.fetchall()}
+
+        resultados = {}
+        for nome, (intervalo, funcao) in self.tarefas.items():
+            if proximas.get(nome, 0) > time.time():
+                continue
+            inicio = time.time()
+            try:
+                resultados[nome] = funcao()
+            except Exception as e:
+                logging.error(f"Erro na tarefa agendada {nome}: {e}")
+                resultados[nome] = f'erro: {e}'
+            with get_db_connection() as conn:
+                conn.execute('''
+                    INSERT INTO agendador_tarefas (nome, ultima_execucao, proxima_execucao, ultimo_resultado)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(nome) DO UPDATE SET ultima_execucao = excluded.ultima_execucao,
+                        proxima_execucao = excluded.proxima_execucao, ultimo_resultado = excluded.ultimo_resultado
+                ''', (nome, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), inicio + intervalo,
+                      str(resultados[nome])))
+                conn.commit()
+        return resultados
+
+
+def _despachar_notificacoes():
+    from notificacoes import despachar
+    return despachar()
+
+
+def _enfileirar_lembretes():
+    from notificacoes import enfileirar_lembretes
+    return enfileirar_lembretes()
+
+
+def _atualizar_rollup():
+    from rollup_utils import atualizar_rollup_diario
+    return atualizar_rollup_diario()
+
+
+def _disponibilizar_confirmacoes():
+    from agendamento_utils import atualizar_confirmacoes_disponiveis
+    return atualizar_confirmacoes_disponiveis()
+
+
+agendador = Agendador()
+
+# Confirmações de consulta liberadas 3 dias antes (antes rodava a cada visita ao painel do paciente)
+agendador.registrar('confirmacoes_disponiveis', 300, _disponibilizar_confirmacoes)
+
+# Fila de notificações (notificacoes.py), enviada fora das requisições
+agendador.registrar('notificacoes', INTERVALO_VERIFICACAO, _despachar_notificacoes)
+
+# Rollup diário dos gráficos de tendência: só os dias alterados desde a última execução
+agendador.registrar('rollup_diario', 3600, _atualizar_rollup)
+
+# Lembretes 24h e 2h antes das consultas, entregues pela mesma fila
+agendador.registrar('lembretes_consulta', 60, _enfileirar_lembretes)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(agendador.executar_pendentes() or 'Nenhuma tarefa executada (outro processo é o líder ou nada venceu)')
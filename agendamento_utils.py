@@ -5,55 +5,64 @@ import sqlite3
 import logging
 from datetime import datetime, timedelta
 from database import get_db_connection
+from datas_utils import agora_canonico
 
-def atualizar_confirmacoes_disponiveis():
+# Dias antes da consulta em que a confirmação é liberada (configuração janela_confirmacao_dias)
+JANELA_CONFIRMACAO_PADRAO = 3
+
+def atualizar_confirmacoes_disponiveis(janela_dias=None, agora=None):
     """
-    Verifica agendamentos e disponibiliza confirmações 3 dias antes da consulta.
-    Deve ser executada diariamente (pode ser chamada via cron ou task scheduler).
+    Disponibiliza a confirmação de todos os agendamentos que entraram na janela
+    (de agora até `janela_dias` dias antes da consulta) num único INSERT ... SELECT.
+    Idempotente: a chave única em confirmacoes_consulta.agendamento_id descarta o que
+    outra execução concorrente já criou.
+    Executada periodicamente pelo agendador (agendador.py), nunca durante a visualização de páginas.
+    Retorna {'criadas': ..., 'na_janela': ..., 'janela_dias': ...}.
     """
     try:
+        if janela_dias is None:
+            from database import get_config
+            try:
+                janela_dias = int(get_config('janela_confirmacao_dias', JANELA_CONFIRMACAO_PADRAO))
+            except (TypeError, ValueError):
+                janela_dias = JANELA_CONFIRMACAO_PADRAO
+        agora = agora or datetime.now()
+        parametros = {
+            'agora': agora.strftime('%Y-%m-%d %H:%M:%S'),
+            'limite': (agora + timedelta(days=janela_dias)).strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        # data_consulta é canônica (datas_utils), comparada como texto pelo índice
+        na_janela = '''
+            FROM agendamentos a
+            JOIN pacientes p ON a.paciente_id = p.id
+            JOIN medicos m ON a.medico_id = m.id
+            WHERE a.status = 'agendado'
+            AND a.data_consulta >= :agora
+            AND a.data_consulta <= :limite
+        '''
+        
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Data limite: agendamentos que estão até 3 dias no futuro devem ter confirmação disponível
-            data_limite = datetime.now() + timedelta(days=3)
-            
-            # Buscar agendamentos que precisam ter confirmação disponibilizada
-            cursor.execute('''
-                SELECT a.id, a.paciente_id, a.medico_id, a.data_consulta, 
-                       p.nome as paciente_nome, m.nome as medico_nome
-                FROM agendamentos a
-                JOIN pacientes p ON a.paciente_id = p.id
-                JOIN medicos m ON a.medico_id = m.id
-                LEFT JOIN confirmacoes_consulta cc ON a.id = cc.agendamento_id
-                WHERE a.data_consulta <= ? 
-                AND a.status = 'agendado'
-                AND cc.id IS NULL
-                AND a.data_consulta >= datetime('now')
-            ''', (data_limite.strftime('%Y-%m-%d %H:%M:%S'),))
-            
-            agendamentos_para_confirmar = cursor.fetchall()
-            
-            count = 0
-            for agendamento in agendamentos_para_confirmar:
-                # Criar entrada na tabela de confirmações
-                cursor.execute('''
-                    INSERT INTO confirmacoes_consulta 
-                    (agendamento_id, disponivel_confirmacao, data_disponibilizacao)
-                    VALUES (?, 1, ?)
-                ''', (agendamento['id'], datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-                
-                count += 1
-                logging.info(f"Confirmação disponibilizada para {agendamento['paciente_nome']} - consulta em {agendamento['data_consulta']}")
-            
+            cursor.execute(f'''
+                INSERT INTO confirmacoes_consulta (agendamento_id, disponivel_confirmacao, data_disponibilizacao)
+                SELECT a.id, 1, :agora
+                {na_janela}
+                AND NOT EXISTS (SELECT 1 FROM confirmacoes_consulta cc WHERE cc.agendamento_id = a.id)
+                ON CONFLICT (agendamento_id) DO NOTHING
+            ''', parametros)
+            criadas = cursor.rowcount
+            
+            cursor.execute(f'SELECT COUNT(*) as total {na_janela}', parametros)
+            total = cursor.fetchone()['total']
             conn.commit()
-            
-            logging.info(f"Atualizadas {count} confirmações de consulta")
-            return count
+        
+        if criadas:
+            logging.info(f"Confirmações disponibilizadas: {criadas} (janela de {janela_dias} dias)")
+        return {'criadas': criadas, 'na_janela': total, 'janela_dias': janela_dias}
             
     except Exception as e:
         logging.error(f"Erro ao atualizar confirmações: {e}")
-        return 0
+        return {'criadas': 0, 'na_janela': 0, 'janela_dias': janela_dias}
 
 def obter_confirmacoes_pendentes(paciente_id):
     """
@@ -105,6 +114,13 @@ def confirmar_consulta(confirmacao_id, paciente_id, confirmado, observacoes=None
             ''', (confirmado, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), observacoes, confirmacao_id, paciente_id))
             
             if cursor.rowcount > 0:
+                from notificacoes import notificar_confirmacao
+                notificar_confirmacao(cursor, confirmacao_id)
+                if confirmado == 0:
+                    # Libera o horário e oferece a vaga à lista de espera do médico
+                    from lista_espera_utils import cancelar_pelo_paciente
+                    cursor.execute('SELECT agendamento_id FROM confirmacoes_consulta WHERE id = ?', (confirmacao_id,))
+                    cancelar_pelo_paciente(cursor, cursor.fetchone()['agendamento_id'])
                 conn.commit()
                 status = "confirmada" if confirmado == 1 else "cancelada"
                 logging.info(f"Consulta {status} pelo paciente {paciente_id}")
@@ -117,19 +133,32 @@ def confirmar_consulta(confirmacao_id, paciente_id, confirmado, observacoes=None
         logging.error(f"Erro ao confirmar consulta: {e}")
         return False
 
-def criar_agendamento(paciente_id, medico_id, data_consulta, observacoes=None, criado_por=None):
+def criar_agendamento(paciente_id, medico_id, data_consulta, observacoes=None, criado_por=None, duracao_minutos=None):
     """
-    Cria um novo agendamento de consulta
+    Cria um novo agendamento de consulta.
+    Retorna None se a data é inválida ou se o horário conflita com outra consulta do médico.
     """
+    from agenda_utils import conflitos, converter_data_consulta, converter_duracao
     try:
+        inicio = converter_data_consulta(data_consulta)
+        duracao = converter_duracao(duracao_minutos)
+        
         with get_db_connection() as conn:
             cursor = conn.cursor()
+            # Trava de escrita antes da verificação: outro agendamento não intercala entre
+            # a checagem de conflitos e a inserção
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            sobrepostos = conflitos(cursor, medico_id, inicio, duracao)
+            if sobrepostos:
+                logging.warning(f"Agendamento não criado: conflito com {[a['id'] for a in sobrepostos]} do médico {medico_id}")
+                return None
             
             cursor.execute('''
                 INSERT INTO agendamentos 
-                (paciente_id, medico_id, data_consulta, observacoes, criado_por)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (paciente_id, medico_id, data_consulta, observacoes, criado_por))
+                (paciente_id, medico_id, data_consulta, duracao_minutos, observacoes, criado_por)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (paciente_id, medico_id, inicio.strftime('%Y-%m-%d %H:%M:%S'), duracao, observacoes, criado_por))
             
             agendamento_id = cursor.lastrowid
             conn.commit()
@@ -158,9 +187,9 @@ def obter_agendamentos_futuros(medico_id=None, paciente_id=None):
                 JOIN pacientes p ON a.paciente_id = p.id
                 JOIN medicos m ON a.medico_id = m.id
                 LEFT JOIN confirmacoes_consulta cc ON a.id = cc.agendamento_id
-                WHERE a.data_consulta >= datetime('now')
+                WHERE a.data_consulta >= ?
             '''
-            params = []
+            params = [agora_canonico()]
             
             if medico_id:
                 query += ' AND a.medico_id = ?'
@@ -266,34 +295,4 @@ def obter_agendamentos_equipe(equipe_id):
             
     except Exception as e:
         logging.error(f"Erro ao buscar agendamentos da equipe: {e}")
-        return []
-
-def obter_todos_agendamentos_admin():
-    """
-    Retorna TODOS os agendamentos do sistema (para admin geral)
-    """
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT a.id, a.data_consulta, a.observacoes, a.status, a.data_criacao,
-                       p.nome as paciente_nome, p.cpf as paciente_cpf, p.telefone as paciente_telefone,
-                       m.nome as medico_nome, m.tipo as medico_tipo,
-                       e.nome as equipe_nome,
-                       cc.id as confirmacao_id, cc.confirmado, cc.data_confirmacao, 
-                       cc.observacoes_paciente, cc.disponivel_confirmacao
-                FROM agendamentos a
-                JOIN pacientes p ON a.paciente_id = p.id
-                JOIN medicos m ON a.medico_id = m.id
-                LEFT JOIN equipes e ON m.equipe_id = e.id
-                LEFT JOIN confirmacoes_consulta cc ON a.id = cc.agendamento_id
-                ORDER BY a.data_consulta DESC
-            ''', ())
-            
-            results = cursor.fetchall()
-            return [dict(row) for row in results]
-            
-    except Exception as e:
-        logging.error(f"Erro ao buscar todos os agendamentos: {e}")
         return []
\ No newline at end of file
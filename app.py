@@ -36,7 +36,7 @@ def ensure_db_initialized():
             raise
 
 # Import routes
-from routes import admin, medico, paciente, equipe, financeiro, preferencias, admin_senhas, sessoes, relatorios
+from routes import admin, medico, paciente, equipe, financeiro, preferencias, admin_senhas, sessoes, relatorios, analytics, busca, calendario
 from auth import auth_bp
 
 # Register blueprints
@@ -50,6 +50,15 @@ app.register_blueprint(preferencias.preferencias_bp, url_prefix='/preferencias')
 app.register_blueprint(admin_senhas.admin_senhas_bp, url_prefix='/admin')
 app.register_blueprint(sessoes.sessoes_bp, url_prefix='/sessoes')
 app.register_blueprint(relatorios.relatorios_bp)
+app.register_blueprint(analytics.analytics_bp)
+app.register_blueprint(busca.busca_bp)
+app.register_blueprint(calendario.calendario_bp)
+
+@app.before_request
+def iniciar_agendador():
+    """Start this worker's background scheduler (periodic jobs never run inside page views)"""
+    from agendador import agendador
+    agendador.iniciar()
 
 @app.route('/')
 def index():
@@ -70,6 +79,10 @@ def index():
     else:
         return redirect(url_for('auth.login'))
 
+# Timestamps gravados (canônicos) para exibição: {{ valor|data_hora }}
+from datas_utils import formatar_data_hora
+app.jinja_env.filters['data_hora'] = formatar_data_hora
+
 @app.context_processor
 def inject_user():
     """Make user info available in all templates"""
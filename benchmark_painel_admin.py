@@ -0,0 +1,189 @@
+"""
+Benchmark of the admin dashboard payload (painel_admin) as the data grows
+
+Each scale runs on a temporary copy of the database inflated with synthetic
+patients (2 senhas and 8 sessions each, spread over the last 12 months) and times
+the bundle against the previous sequential implementation (one query per card),
+checking that both return the same payload. The result cache is bypassed.
+
+Uso:
+    python benchmark_painel_admin.py
+    python benchmark_painel_admin.py --escalas 0,10000,50000 --repeticoes 30
+    python benchmark_painel_admin.py --limite-ms 150    # sai com 1 se o p95 do pacote passar do limite
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+from database import get_db_connection
+from dinheiro_utils import centavos_para_reais
+from painel_admin import montar_painel_admin
+from sql_utils import rows_to_dicts
+
+
+def _painel_sequencial(cursor, mes_atual):
+    """Implementação anterior do admin.dashboard (referência de tempo e de resultado)"""
+    from regras_pagamento import apurar_mes
+
+    cursor.execute('SELECT COUNT(*) as total FROM medicos WHERE ativo = 1')
+    total_medicos = cursor.fetchone()['total']
+    cursor.execute('SELECT COUNT(*) as total FROM pacientes WHERE status = ?', ('ativo',))
+    total_pacientes = cursor.fetchone()['total']
+    cursor.execute('SELECT COUNT(*) as total FROM equipes WHERE ativo = 1')
+    total_equipes = cursor.fetchone()['total']
+
+    apuracao = apurar_mes(cursor, mes_atual)
+    faturamento_bruto_centavos = apuracao['faturamento_centavos']
+
+    cursor.execute('''
+        SELECT COUNT(*) as senhas_pendentes, COALESCE(SUM(valor_centavos), 0) as valor_pendente
+        FROM senhas WHERE aprovada_admin = 0 AND ativo = 1
+    ''')
+    pendentes = cursor.fetchone()
+
+    cursor.execute('''
+        SELECT COUNT(*) as total_sessoes, COUNT(CASE WHEN realizada = 1 THEN 1 END) as sessoes_realizadas
+        FROM sessoes s
+        JOIN pacientes p ON s.paciente_id = p.id
+        WHERE strftime('%Y-%m', COALESCE(s.data_sessao, s.data_criacao)) = ?
+    ''', (mes_atual,))
+    sessoes = cursor.fetchone()
+
+    cursor.execute('''
+        SELECT p.nome as paciente, m.nome as medico, s.data_sessao, s.numero_sessao
+        FROM sessoes s
+        JOIN pacientes p ON s.paciente_id = p.id
+        JOIN medicos m ON p.medico_id = m.id
+        WHERE s.realizada = 1
+        ORDER BY s.data_sessao DESC
+        LIMIT 10
+    ''')
+    atividades_recentes = rows_to_dicts(cursor.fetchall())
+
+    financeiro = {
+        'faturamento_bruto': centavos_para_reais(faturamento_bruto_centavos),
+        'faturamento_liquido': centavos_para_reais(faturamento_bruto_centavos - apuracao['total_equipes_centavos']
+                                                   - apuracao['total_externos_centavos']),
+        'total_senhas_aprovadas': len(apuracao['senhas']),
+        'senhas_pendentes': pendentes['senhas_pendentes'],
+        'valor_pendente': centavos_para_reais(pendentes['valor_pendente']),
+        'total_sessoes': sessoes['total_sessoes'],
+        'sessoes_realizadas': sessoes['sessoes_realizadas'],
+        'mes_referencia': mes_atual
+    }
+    return {'total_medicos': total_medicos, 'total_pacientes': total_pacientes,
+            'total_equipes': total_equipes, 'financeiro': financeiro,
+            'atividades_recentes': atividades_recentes}
+
+
+def inflar_dados(conn, pacientes, semente=42):
+    """Acrescenta pacientes sintéticos com senhas e sessões nos últimos 12 meses"""
+    if not pacientes:
+        return
+    aleatorio = random.Random(semente)
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM medicos WHERE ativo = 1')
+    medicos = [row['id'] for row in cursor.fetchall()]
+    cursor.execute('SELECT COALESCE(MAX(id), 0) as ultimo FROM pacientes')
+    primeiro = cursor.fetchone()['ultimo'] + 1
+    hoje = datetime.now()
+
+    def data_aleatoria():
+        return hoje - timedelta(days=aleatorio.randint(0, 365), minutes=aleatorio.randint(0, 1440))
+
+    cursor.executemany('''
+        INSERT INTO pacientes (id, nome, cpf, localizacao, medico_id, status, data_criacao)
+        VALUES (?, ?, ?, ?, ?, 'ativo', ?)
+    ''', [(pid, f'Paciente {pid}', f'bench-{pid}', aleatorio.choice(['Belo Horizonte', 'Contagem']),
+           aleatorio.choice(medicos), data_aleatoria().strftime('%Y-%m-%d %H:%M:%S'))
+          for pid in range(primeiro, primeiro + pacientes)])
+
+    senhas, sessoes = [], []
+    for pid in range(primeiro, primeiro + pacientes):
+        for n in range(2):
+            data = data_aleatoria()
+            aprovada = aleatorio.random() < 0.8
+            senhas.append((pid, f'B{pid}-{n}', '0000', 800.0, int(aprovada),
+                           data.strftime('%Y-%m-%d %H:%M:%S') if aprovada else None,
+                           data.strftime('%Y-%m-%d %H:%M:%S')))
+        for numero in range(1, 9):
+            sessoes.append((pid, numero, data_aleatoria().strftime('%Y-%m-%d'), int(aleatorio.random() < 0.7)))
+
+    cursor.executemany('''
+        INSERT INTO senhas (paciente_id, codigo, senha, valor, aprovada_admin, data_aprovacao, data_criacao)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', senhas)
+    cursor.executemany('''
+        INSERT INTO sessoes (paciente_id, numero_sessao, data_sessao, realizada)
+        VALUES (?, ?, ?, ?)
+    ''', sessoes)
+    conn.commit()
+
+
+def _medir(funcao, cursor, mes, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao(cursor, mes)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    p95 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))]
+    return resultado, statistics.median(tempos), p95
+
+
+def executar(origem, escalas, repeticoes):
+    """Mede cada escala numa cópia temporária do banco; retorna [(escala, mediana, p95, ...)]"""
+    mes = datetime.now().strftime('%Y-%m')
+    resultados = []
+    with tempfile.TemporaryDirectory() as diretorio:
+        for escala in escalas:
+            copia = os.path.join(diretorio, f'bench-{escala}.db')
+            shutil.copyfile(origem, copia)
+            database.DATABASE_PATH = copia
+            database.init_db()
+
+            with get_db_connection() as conn:
+                inflar_dados(conn, escala)
+                cursor = conn.cursor()
+                cursor.execute('ANALYZE')
+                cursor.execute('SELECT COUNT(*) as total FROM sessoes')
+                total_sessoes = cursor.fetchone()['total']
+
+                esperado, mediana_seq, p95_seq = _medir(_painel_sequencial, cursor, mes, repeticoes)
+                obtido, mediana, p95 = _medir(montar_painel_admin, cursor, mes, repeticoes)
+                if obtido != esperado:
+                    raise SystemExit(f"Resultado divergente na escala {escala}: {obtido} != {esperado}")
+
+            resultados.append((escala, total_sessoes, mediana_seq, p95_seq, mediana, p95))
+            print(f"+{escala:>7} pacientes ({total_sessoes:>7} sessões): "
+                  f"sequencial {mediana_seq:7.1f} ms (p95 {p95_seq:7.1f}) | "
+                  f"pacote {mediana:7.1f} ms (p95 {p95:7.1f})")
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do dashboard administrativo')
+    parser.add_argument('--db', default=database.DATABASE_PATH, help='Banco de origem (não é alterado)')
+    parser.add_argument('--escalas', default='0,5000,20000',
+                        help='Pacientes sintéticos acrescentados em cada rodada (separados por vírgula)')
+    parser.add_argument('--repeticoes', type=int, default=20, help='Execuções medidas por rodada')
+    parser.add_argument('--limite-ms', type=float, help='p95 máximo aceito para o pacote na maior escala')
+    args = parser.parse_args(argv)
+
+    escalas = [int(escala) for escala in args.escalas.split(',') if escala.strip()]
+    resultados = executar(args.db, escalas, max(1, args.repeticoes))
+
+    if args.limite_ms is not None and resultados and resultados[-1][-1] > args.limite_ms:
+        print(f"p95 do pacote ({resultados[-1][-1]:.1f} ms) acima do limite de {args.limite_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,160 @@
+"""
+In-process result cache for report and dashboard aggregates
+
+Entries are keyed by (artifact name, params, versions of what the result read).
+GRAFO_DEPENDENCIAS maps each cached artifact to its dependencies: fact tables
+(``versoes_tabelas``, bumped on every write) and entities (``versoes_entidades``:
+'medico:<id>', 'equipe:<id>', 'config:<chave>', bumped by triggers only when a
+payout-relevant field changes). Editing one doctor's session value or one team's
+percentage therefore leaves the other teams' dashboards hot, and a repeated load
+between writes costs a single version lookup. A stale key just becomes unreachable
+and ages out of the LRU; each worker process keeps its own cache, while the versions
+live in the database, so every process sees the same invalidations.
+
+Valores em cache são compartilhados entre requisições: quem os lê não deve alterá-los.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from database import obter_versoes_dependencias
+from regras_pagamento import CONFIGS_REGRAS
+
+# Configurações lidas pelas regras de pagamento (outras chaves não afetam relatórios)
+_CONFIGS_PAGAMENTO = [f'config:{chave}' for chave in CONFIGS_REGRAS]
+_FATOS = ['pacientes', 'senhas', 'sessoes', 'laudos']
+
+# Artefato em cache -> dependências para os parâmetros dados
+GRAFO_DEPENDENCIAS = {
+    # Visões da clínica inteira: qualquer médico/equipe, e as regras de pagamento
+    'admin.dashboard': lambda mes: _FATOS + ['medico:*', 'equipe:*'] + _CONFIGS_PAGAMENTO,
+    'relatorios.admin_dashboard': lambda mes: _FATOS + ['medico:*', 'equipe:*'] + _CONFIGS_PAGAMENTO,
+    'relatorio_pdf': lambda mes: _FATOS + ['medico:*', 'equipe:*'] + _CONFIGS_PAGAMENTO,
+    # Visões de uma equipe: pagas pela porcentagem da própria equipe
+    'relatorios.equipe_dashboard': lambda equipe_id, mes: ['pacientes', 'senhas', f'equipe:{equipe_id}'],
+    'equipe.dashboard': lambda equipe_id, mes: ['pacientes', 'senhas', 'sessoes', f'equipe:{equipe_id}'],
+    # Pagamento de um médico por sessão
+    'medico.pagamento': lambda medico_id, mes: _FATOS + [f'medico:{medico_id}'] + _CONFIGS_PAGAMENTO,
+    # Séries da API de analytics (routes/analytics.py)
+    'analytics.faturamento_equipes': lambda mes: ['pacientes', 'senhas', 'equipe:*', 'medico:*'],
+    'analytics.faturamento_medicos': lambda mes: ['pacientes', 'senhas', 'equipe:*', 'medico:*'],
+    'analytics.resumo': lambda mes: _FATOS + ['medico:*', 'equipe:*'] + _CONFIGS_PAGAMENTO,
+    # Lida do rollup diário, recalculado pelo agendador: muda quando o job grava
+    'analytics.evolucao_mensal': lambda meses, mes_fim: ['rollup_diario'],
+    # Totais e contagens por equipe/médico da listagem de agendamentos (routes/admin.py)
+    'admin.agendamentos': lambda dia: ['agendamentos', 'confirmacoes_consulta', 'medicos', 'equipes'],
+    # Eventos .ics das consultas de um médico (routes/calendario.py)
+    'calendario.medico': lambda medico_id, dia: [f'agenda:{medico_id}', f'medico:{medico_id}'],
+}
+
+
+def dependencias_artefato(nome, params):
+    return GRAFO_DEPENDENCIAS[nome](*params)
+
+
+# Limites do cache por processo
+MAX_ENTRADAS = 256
+MAX_BYTES = 32 * 1024 * 1024
+
+
+def _tamanho_aproximado(valor, limite_profundidade=4):
+    """Tamanho aproximado em bytes de dicts/listas de valores simples"""
+    tamanho = sys.getsizeof(valor)
+    if limite_profundidade <= 0:
+        return tamanho
+    if isinstance(valor, dict):
+        tamanho += sum(_tamanho_aproximado(k, 0) + _tamanho_aproximado(v, limite_profundidade - 1)
+                       for k, v in valor.items())
+    elif isinstance(valor, (list, tuple)):
+        tamanho += sum(_tamanho_aproximado(v, limite_profundidade - 1) for v in valor)
+    return tamanho
+
+
+class CacheResultados:
+    """LRU com limite de entradas e de bytes, seguro entre threads"""
+
+    def __init__(self, max_entradas=MAX_ENTRADAS, max_bytes=MAX_BYTES):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave):
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return entrada
+
+    def guardar(self, chave, valor, dependencias=()):
+        tamanho = _tamanho_aproximado(valor)
+        if tamanho > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(chave, None)
+            if anterior is not None:
+                self._bytes -= anterior[1]
+            self._entradas[chave] = (valor, tamanho, dependencias)
+            self._bytes += tamanho
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, tamanho_removido, _) = self._entradas.popitem(last=False)
+                self._bytes -= tamanho_removido
+
+    def invalidar(self, dependencias):
+        """Remove já as entradas que leram alguma das dependências (libera memória neste processo)"""
+        dependencias = set(dependencias)
+        with self._lock:
+            for chave in [c for c, (_, _, deps) in self._entradas.items() if dependencias.intersection(deps)]:
+                self._bytes -= self._entradas.pop(chave)[1]
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estatisticas(self):
+        with self._lock:
+            return {'entradas': len(self._entradas), 'bytes': self._bytes,
+                    'acertos': self.acertos, 'falhas': self.falhas}
+
+
+cache_resultados = CacheResultados()
+
+
+def versao_artefato(nome, params, cursor=None):
+    """Versões das dependências do artefato, na ordem do grafo (parte da chave de cache)"""
+    dependencias = dependencias_artefato(nome, params)
+    versoes = obter_versoes_dependencias(dependencias, cursor)
+    return tuple(versoes[dependencia] for dependencia in dependencias)
+
+
+def em_cache(nome, params, calcular, cursor=None, versao=None):
+    """
+    Resultado de calcular() para o artefato (nome, params), reaproveitado enquanto
+    nenhuma das suas dependências mudar. params deve ser uma tupla de valores simples;
+    versao evita uma segunda consulta quando o chamador já obteve versao_artefato().
+    """
+    if versao is None:
+        versao = versao_artefato(nome, params, cursor)
+    chave = (nome, params, versao)
+
+    entrada = cache_resultados.obter(chave)
+    if entrada is not None:
+        return entrada[0]
+
+    valor = calcular()
+    cache_resultados.guardar(chave, valor, dependencias_artefato(nome, params))
+    return valor
+
+
+def invalidar(*dependencias):
+    """
+    Descarta do cache deste processo os artefatos que leram essas entidades.
+    As versões no banco já mudam pelos triggers; isto só antecipa a liberação.
+    """
+    cache_resultados.invalidar(dependencias)
@@ -0,0 +1,148 @@
+"""
+iCalendar (.ics) feeds of the appointments, one per doctor and one per team
+
+Calendar apps subscribe to a secret URL (medicos.token_calendario) and poll it
+every few minutes. Every change to a doctor's appointments, their confirmations
+or a patient's name or phone bumps the entity version 'agenda:<medico_id>' (triggers in
+init_db, with the time of the change), so a poll first compares ETag and
+Last-Modified against those versions and answers 304 without reading the
+appointments. When something did change only that doctor's events are rebuilt:
+each doctor's VEVENT block is cached by version and a team feed concatenates the
+blocks of its doctors.
+"""
+import secrets
+from datetime import datetime, timedelta
+from agenda_utils import DURACAO_PADRAO_MINUTOS, converter_data_consulta
+from database import obter_versoes_dependencias
+
+# Janela de consultas publicadas no feed (a partir do dia atual)
+DIAS_PASSADOS_CALENDARIO = 60
+DIAS_FUTUROS_CALENDARIO = 365
+
+# Fuso das datas gravadas (data_consulta não tem fuso); o Brasil não tem horário de verão
+FUSO_CALENDARIO = 'America/Sao_Paulo'
+_VTIMEZONE = [
+    'BEGIN:VTIMEZONE', f'TZID:{FUSO_CALENDARIO}',
+    'BEGIN:STANDARD', 'DTSTART:19700101T000000', 'TZOFFSETFROM:-0300', 'TZOFFSETTO:-0300', 'TZNAME:-03',
+    'END:STANDARD', 'END:VTIMEZONE',
+]
+
+# Confirmação do paciente -> STATUS do evento
+_STATUS_CONFIRMACAO = {None: 'TENTATIVE', 1: 'CONFIRMED', 0: 'CANCELLED'}
+
+
+def gerar_token():
+    return secrets.token_urlsafe(24)
+
+
+def chave_agenda(medico_id):
+    """Entidade versionada das consultas de um médico (versoes_entidades)"""
+    return f'agenda:{medico_id}'
+
+
+def _escapar(texto):
+    """Texto de propriedade (RFC 5545 3.3.11)"""
+    return (str(texto or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _dobrar(linha):
+    """Quebra linhas de mais de 75 octetos (continuação começa com espaço)"""
+    dados = linha.encode('utf-8')
+    if len(dados) <= 75:
+        return linha
+    partes, inicio, limite = [], 0, 75
+    while inicio < len(dados):
+        fim = min(inicio + limite, len(dados))
+        while fim < len(dados) and (dados[fim] & 0xC0) == 0x80:  # não corta um caractere UTF-8
+            fim -= 1
+        partes.append(dados[inicio:fim].decode('utf-8'))
+        inicio, limite = fim, 74
+    return '\r\n '.join(partes)
+
+
+def _data_ics(momento):
+    return momento.strftime('%Y%m%dT%H%M%S')
+
+
+def eventos_medico(cursor, medico_id, dia):
+    """Bloco de VEVENTs (texto pronto) das consultas do médico na janela em torno de `dia`"""
+    inicio_janela = datetime.combine(dia - timedelta(days=DIAS_PASSADOS_CALENDARIO), datetime.min.time())
+    fim_janela = datetime.combine(dia + timedelta(days=DIAS_FUTUROS_CALENDARIO), datetime.min.time())
+    cursor.execute('''
+        SELECT a.id, a.data_consulta, a.duracao_minutos, a.observacoes, a.status, a.data_criacao,
+               p.nome as paciente_nome, p.telefone as paciente_telefone, m.nome as medico_nome,
+               cc.confirmado, cc.observacoes_paciente
+        FROM agendamentos a
+        JOIN pacientes p ON a.paciente_id = p.id
+        JOIN medicos m ON a.medico_id = m.id
+        LEFT JOIN confirmacoes_consulta cc ON cc.agendamento_id = a.id
+        WHERE a.medico_id = ?
+        AND a.data_consulta >= ? AND a.data_consulta < ?
+        ORDER BY a.data_consulta
+    ''', (medico_id, inicio_janela.strftime('%Y-%m-%d %H:%M:%S'), fim_janela.strftime('%Y-%m-%d %H:%M:%S')))
+
+    linhas = []
+    for agendamento in cursor.fetchall():
+        try:
+            inicio = converter_data_consulta(agendamento['data_consulta'])
+        except ValueError:
+            continue
+        fim = inicio + timedelta(minutes=agendamento['duracao_minutos'] or DURACAO_PADRAO_MINUTOS)
+        try:
+            carimbo = converter_data_consulta(agendamento['data_criacao'])
+        except (TypeError, ValueError):
+            carimbo = inicio
+        status = ('CANCELLED' if agendamento['status'] != 'agendado'
+                  else _STATUS_CONFIRMACAO.get(agendamento['confirmado'], 'TENTATIVE'))
+
+        descricao = [f"Profissional: {agendamento['medico_nome']}"]
+        if agendamento['paciente_telefone']:
+            descricao.append(f"Telefone: {agendamento['paciente_telefone']}")
+        if agendamento['observacoes']:
+            descricao.append(f"Observações: {agendamento['observacoes']}")
+        if agendamento['observacoes_paciente']:
+            descricao.append(f"Paciente: {agendamento['observacoes_paciente']}")
+
+        linhas += [
+            'BEGIN:VEVENT',
+            f"UID:agendamento-{agendamento['id']}@neurosystem",
+            f'DTSTAMP:{_data_ics(carimbo)}Z',
+            f'DTSTART;TZID={FUSO_CALENDARIO}:{_data_ics(inicio)}',
+            f'DTEND;TZID={FUSO_CALENDARIO}:{_data_ics(fim)}',
+            f"SUMMARY:{_escapar('Consulta - ' + agendamento['paciente_nome'])}",
+            f"DESCRIPTION:{_escapar(chr(10).join(descricao))}",
+            f'STATUS:{status}',
+            'END:VEVENT',
+        ]
+    return '\r\n'.join(_dobrar(linha) for linha in linhas)
+
+
+def montar_calendario(nome, blocos):
+    """Documento VCALENDAR com os blocos de eventos"""
+    cabecalho = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//NeuroSystem//Agenda//PT-BR',
+                 'CALSCALE:GREGORIAN', 'METHOD:PUBLISH', f'X-WR-CALNAME:{_escapar(nome)}',
+                 f'X-WR-TIMEZONE:{FUSO_CALENDARIO}', 'REFRESH-INTERVAL;VALUE=DURATION:PT15M',
+                 'X-PUBLISHED-TTL:PT15M'] + _VTIMEZONE
+    partes = ['\r\n'.join(_dobrar(linha) for linha in cabecalho)]
+    partes += [bloco for bloco in blocos if bloco]
+    partes.append('END:VCALENDAR')
+    return '\r\n'.join(partes) + '\r\n'
+
+
+def versao_feed(cursor, medicos, equipe_id=None):
+    """
+    Versões das agendas e dos cadastros dos médicos (e da composição da equipe) e o
+    momento da última mudança de agenda (datetime UTC ou None se nenhuma mudou ainda)
+    """
+    dependencias = [chave for medico_id in medicos for chave in (chave_agenda(medico_id), f'medico:{medico_id}')]
+    if equipe_id is not None:
+        dependencias.append(f'equipe:{equipe_id}')
+    versoes = obter_versoes_dependencias(dependencias, cursor)
+    cursor.execute(f'''
+        SELECT MAX(atualizado_em) as ultima FROM versoes_entidades
+        WHERE chave IN ({', '.join('?' * len(dependencias))})
+    ''', dependencias)
+    ultima = cursor.fetchone()['ultima']
+    return (tuple(versoes[dependencia] for dependencia in dependencias),
+            datetime.strptime(ultima, '%Y-%m-%d %H:%M:%S') if ultima else None)
@@ -1,12 +1,18 @@
 import sqlite3
 import os
 from contextlib import contextmanager
+from pathlib import Path
 import logging
 from datetime import datetime
 
 # SQLite database path
 DATABASE_PATH = 'neuropsychology.db'
 
+# Tables whose writes bump a counter in versoes_tabelas (cache keys of reports)
+TABELAS_VERSIONADAS = ['equipes', 'medicos', 'pacientes', 'senhas', 'sessoes', 'laudos',
+                       'agendamentos', 'confirmacoes_consulta', 'configuracoes', 'lista_espera',
+                       'rollup_diario']
+
 @contextmanager
 def get_db_connection():
     """Context manager for SQLite database connections"""
@@ -24,6 +30,62 @@ def get_db_connection():
         if conn:
             conn.close()
 
+@contextmanager
+def get_db_readonly_connection():
+    """Read-only connection (mode=ro), safe to open from worker processes"""
+    conn = None
+    try:
+        uri = Path(DATABASE_PATH).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        yield conn
+    except Exception as e:
+        logging.error(f"Database error: {e}")
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+def obter_versoes_tabelas(tabelas, cursor=None):
+    """Current version counter of each table (see versoes_tabelas)"""
+    placeholders = ', '.join('?' * len(tabelas))
+    query = f'SELECT tabela, versao FROM versoes_tabelas WHERE tabela IN ({placeholders})'
+    if cursor is None:
+        with get_db_connection() as conn:
+            linhas = conn.execute(query, list(tabelas)).fetchall()
+    else:
+        cursor.execute(query, list(tabelas))
+        linhas = cursor.fetchall()
+    versoes = {linha['tabela']: linha['versao'] for linha in linhas}
+    return {tabela: versoes.get(tabela, 0) for tabela in tabelas}
+
+def obter_versoes_dependencias(dependencias, cursor=None):
+    """
+    Versions of cache dependencies: table names (versoes_tabelas) or entity keys
+    such as 'medico:3', 'equipe:*' and 'config:chave' (versoes_entidades)
+    """
+    tabelas = [d for d in dependencias if ':' not in d]
+    entidades = [d for d in dependencias if ':' in d]
+    query = (f"SELECT tabela as chave, versao FROM versoes_tabelas WHERE tabela IN ({', '.join('?' * len(tabelas))}) "
+             f"UNION ALL "
+             f"SELECT chave, versao FROM versoes_entidades WHERE chave IN ({', '.join('?' * len(entidades))})")
+    if cursor is None:
+        with get_db_connection() as conn:
+            linhas = conn.execute(query, tabelas + entidades).fetchall()
+    else:
+        cursor.execute(query, tabelas + entidades)
+        linhas = cursor.fetchall()
+    versoes = {linha['chave']: linha['versao'] for linha in linhas}
+    return {dependencia: versoes.get(dependencia, 0) for dependencia in dependencias}
+
+def _adicionar_coluna(cursor, tabela, coluna, definicao):
+    """Adds a column to an existing table if missing; returns True when it was added"""
+    cursor.execute(f'PRAGMA table_info({tabela})')
+    if coluna in [row[1] for row in cursor.fetchall()]:
+        return False
+    cursor.execute(f'ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}')
+    return True
+
 def init_db():
     """Initialize the SQLite database with all required tables"""
     with get_db_connection() as conn:
@@ -36,6 +98,7 @@ def init_db():
                 nome TEXT NOT NULL,
                 admin_id INTEGER,
                 porcentagem_participacao REAL DEFAULT 50.00,
+                porcentagem_pontos_base INTEGER,
                 ativo INTEGER DEFAULT 1,
                 data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP
             )
@@ -51,6 +114,7 @@ def init_db():
                 tipo TEXT NOT NULL DEFAULT 'medico',
                 equipe_id INTEGER,
                 valor_sessao REAL DEFAULT 30.00,
+                valor_sessao_centavos INTEGER,
                 ativo INTEGER DEFAULT 1,
                 data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (equipe_id) REFERENCES equipes (id)
@@ -98,6 +162,7 @@ def init_db():
                 senha TEXT NOT NULL,
                 tipo TEXT NOT NULL DEFAULT 'teste_neuropsicologico',
                 valor REAL DEFAULT 800.00,
+                valor_centavos INTEGER,
                 ativo INTEGER DEFAULT 1,
                 aprovada_admin INTEGER DEFAULT 0,
                 data_aprovacao DATETIME,
@@ -122,10 +187,9 @@ def init_db():
             )
         ''')
         
-        # Drop and recreate agendamentos table with correct structure
-        cursor.execute('DROP TABLE IF EXISTS agendamentos')
+        # Create agendamentos table
         cursor.execute('''
-            CREATE TABLE agendamentos (
+            CREATE TABLE IF NOT EXISTS agendamentos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 paciente_id INTEGER NOT NULL,
                 medico_id INTEGER NOT NULL,
@@ -140,10 +204,9 @@ def init_db():
             )
         ''')
         
-        # Drop and recreate confirmacoes_consulta table
-        cursor.execute('DROP TABLE IF EXISTS confirmacoes_consulta')
+        # Create confirmacoes_consulta table (one row per appointment, see the unique index below)
         cursor.execute('''
-            CREATE TABLE confirmacoes_consulta (
+            CREATE TABLE IF NOT EXISTS confirmacoes_consulta (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 agendamento_id INTEGER NOT NULL,
                 disponivel_confirmacao INTEGER DEFAULT 0,
@@ -165,6 +228,7 @@ def init_db():
                 paciente_id INTEGER NOT NULL,
                 senha_id INTEGER NOT NULL,
                 valor_senha REAL NOT NULL,
+                valor_senha_centavos INTEGER,
                 mes_referencia TEXT NOT NULL,
                 data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (paciente_id) REFERENCES pacientes (id),
@@ -181,6 +245,11 @@ def init_db():
                 faturamento_base REAL NOT NULL,
                 porcentagem_equipe REAL NOT NULL,
                 valor_equipe REAL NOT NULL,
+                faturamento_base_centavos INTEGER,
+                porcentagem_pontos_base INTEGER,
+                valor_equipe_centavos INTEGER,
+                status TEXT DEFAULT 'calculado',
+                data_pagamento DATETIME,
                 data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (equipe_id) REFERENCES equipes (id)
             )
@@ -197,6 +266,8 @@ def init_db():
                 sessoes_pagas INTEGER DEFAULT 8,
                 valor_por_sessao REAL NOT NULL,
                 valor_total REAL NOT NULL,
+                valor_por_sessao_centavos INTEGER,
+                valor_total_centavos INTEGER,
                 finalizado_antes BOOLEAN DEFAULT 0,
                 data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (medico_id) REFERENCES medicos (id),
@@ -204,6 +275,30 @@ def init_db():
             )
         ''')
         
+        # Create faturamento_medicos table - Monthly per-patient payout of doctors (medico_pagamento)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS faturamento_medicos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                medico_id INTEGER NOT NULL,
+                paciente_id INTEGER NOT NULL,
+                mes_referencia TEXT NOT NULL,
+                sessoes_realizadas INTEGER DEFAULT 0,
+                sessoes_garantidas INTEGER DEFAULT 8,
+                laudo_finalizado INTEGER DEFAULT 0,
+                valor_por_sessao REAL NOT NULL,
+                sessoes_pagas INTEGER DEFAULT 0,
+                valor_total REAL DEFAULT 0,
+                valor_por_sessao_centavos INTEGER,
+                valor_total_centavos INTEGER,
+                data_calculo DATETIME DEFAULT CURRENT_TIMESTAMP,
+                status TEXT DEFAULT 'pendente',
+                data_pagamento DATETIME,
+                FOREIGN KEY (medico_id) REFERENCES medicos (id),
+                FOREIGN KEY (paciente_id) REFERENCES pacientes (id),
+                UNIQUE(medico_id, paciente_id, mes_referencia)
+            )
+        ''')
+        
         # Create configuracoes table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS configuracoes (
@@ -226,46 +321,587 @@ def init_db():
             )
         ''')
         
-        # Create agendamentos table for scheduling next appointments
+        # Integer money columns (centavos / pontos base) for databases created before them.
+        # The legacy REAL columns stay as the display value; triggers keep both in sync.
+        from dinheiro_utils import SQL_CENTAVOS, SQL_PONTOS_BASE
+        colunas_centavos = [
+            ('equipes', 'porcentagem_pontos_base', 'porcentagem_participacao', SQL_PONTOS_BASE),
+            ('medicos', 'valor_sessao_centavos', 'valor_sessao', SQL_CENTAVOS),
+            ('senhas', 'valor_centavos', 'valor', SQL_CENTAVOS),
+            ('faturamento_clinica', 'valor_senha_centavos', 'valor_senha', SQL_CENTAVOS),
+            ('pagamentos_equipe', 'faturamento_base_centavos', 'faturamento_base', SQL_CENTAVOS),
+            ('pagamentos_equipe', 'porcentagem_pontos_base', 'porcentagem_equipe', SQL_PONTOS_BASE),
+            ('pagamentos_equipe', 'valor_equipe_centavos', 'valor_equipe', SQL_CENTAVOS),
+            ('pagamentos_medicos_externos', 'valor_por_sessao_centavos', 'valor_por_sessao', SQL_CENTAVOS),
+            ('pagamentos_medicos_externos', 'valor_total_centavos', 'valor_total', SQL_CENTAVOS),
+            ('faturamento_medicos', 'valor_por_sessao_centavos', 'valor_por_sessao', SQL_CENTAVOS),
+            ('faturamento_medicos', 'valor_total_centavos', 'valor_total', SQL_CENTAVOS),
+        ]
+        _adicionar_coluna(cursor, 'faturamento_medicos', 'data_pagamento', 'DATETIME')
+        _adicionar_coluna(cursor, 'pagamentos_equipe', 'status', "TEXT DEFAULT 'calculado'")
+        _adicionar_coluna(cursor, 'pagamentos_equipe', 'data_pagamento', 'DATETIME')
+        for tabela, coluna, coluna_real, expr in colunas_centavos:
+            _adicionar_coluna(cursor, tabela, coluna, 'INTEGER')
+            cursor.execute(f'''
+                UPDATE {tabela} SET {coluna} = {expr.format(coluna=coluna_real)}
+                WHERE {coluna} IS NULL AND {coluna_real} IS NOT NULL
+            ''')
+
+        # Master data is still written as REAL by the forms: derive the integer column
+        for tabela, coluna, coluna_real, expr in colunas_centavos[:3]:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{coluna}_{tabela}_ins AFTER INSERT ON {tabela}
+                WHEN NEW.{coluna} IS NULL
+                BEGIN
+                    UPDATE {tabela} SET {coluna} = {expr.format(coluna='NEW.' + coluna_real)} WHERE id = NEW.id;
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{coluna}_{tabela}_upd AFTER UPDATE OF {coluna_real} ON {tabela}
+                BEGIN
+                    UPDATE {tabela} SET {coluna} = {expr.format(coluna='NEW.' + coluna_real)} WHERE id = NEW.id;
+                END
+            ''')
+
+        # Ledgers are upserted per natural key; older databases may hold duplicates from
+        # INSERT OR REPLACE without a unique key, so keep the latest row before indexing
+        chaves_lancamentos = {
+            'faturamento_clinica': 'senha_id, mes_referencia',
+            'pagamentos_equipe': 'equipe_id, mes_referencia',
+            'pagamentos_medicos_externos': 'medico_id, paciente_id, mes_referencia',
+        }
+        for tabela, chave in chaves_lancamentos.items():
+            indice = f'uq_{tabela}_chave'
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (indice,))
+            if not cursor.fetchone():
+                cursor.execute(f'''
+                    DELETE FROM {tabela}
+                    WHERE id NOT IN (SELECT MAX(id) FROM {tabela} GROUP BY {chave})
+                ''')
+                cursor.execute(f'CREATE UNIQUE INDEX {indice} ON {tabela} ({chave})')
+
+        # Progress of the historical recalculation CLI (recalculo_historico.py), one row per month
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS agendamentos (
+            CREATE TABLE IF NOT EXISTS recalculo_meses (
+                mes_referencia TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pendente',
+                faturamento_centavos INTEGER,
+                pagamentos_equipe_centavos INTEGER,
+                pagamentos_externos_centavos INTEGER,
+                pagamentos_medicos_centavos INTEGER,
+                erro TEXT,
+                data_conclusao DATETIME
+            )
+        ''')
+
+        # Create rollup_diario table - Daily pre-aggregated metrics for trend charts
+        # (equipe_id = 0 identifies external doctors)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_diario (
+                dia TEXT NOT NULL,
+                equipe_id INTEGER NOT NULL DEFAULT 0,
+                medico_id INTEGER NOT NULL DEFAULT 0,
+                localizacao TEXT NOT NULL DEFAULT '',
+                receita_centavos INTEGER DEFAULT 0,
+                senhas_aprovadas INTEGER DEFAULT 0,
+                sessoes_realizadas INTEGER DEFAULT 0,
+                agendamentos INTEGER DEFAULT 0,
+                confirmacoes INTEGER DEFAULT 0,
+                PRIMARY KEY (dia, equipe_id, medico_id, localizacao)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollup_diario_equipe ON rollup_diario (equipe_id, dia)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rollup_diario_medico ON rollup_diario (medico_id, dia)')
+
+        # Indexes for the admin dashboard bundle (painel_admin) and live metrics:
+        # month/day ranges and the latest sessions held, the pending-senhas count, and
+        # the per-patient session/laudo lookups of the payout rules
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessoes_data ON sessoes (data_sessao, realizada, paciente_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessoes_paciente ON sessoes (paciente_id, realizada, data_sessao)')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_senhas_pendentes ON senhas (valor_centavos)
+            WHERE aprovada_admin = 0 AND ativo = 1
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_senhas_mes_aprovacao
+            ON senhas (strftime('%Y-%m', COALESCE(data_aprovacao, data_criacao)))
+            WHERE aprovada_admin = 1 AND ativo = 1
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_laudos_paciente ON laudos (paciente_id)')
+
+        # Indexes for the keyset-paginated admin listings (paginacao_utils): each sort
+        # column is read in index order, so a page never scans the rows before it
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pacientes_nome ON pacientes (nome)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pacientes_data_criacao ON pacientes (data_criacao)')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_senhas_pendentes_data ON senhas (data_criacao)
+            WHERE aprovada_admin = 0 AND ativo = 1
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_senhas_paciente ON senhas (paciente_id, tipo)')
+
+        # Appointment times in one canonical format (datas_utils.FORMATO_CANONICO): the old
+        # datetime-local values ('YYYY-MM-DDTHH:MM') are migrated and any later write in
+        # another format is normalized, so data_consulta sorts and compares as plain text
+        from datas_utils import SQL_CANONICO
+        canonico = SQL_CANONICO.format(coluna='data_consulta')
+        cursor.execute(f'UPDATE agendamentos SET data_consulta = {canonico} WHERE data_consulta != {canonico}')
+        for evento, sufixo in (('INSERT', 'ins'), ('UPDATE OF data_consulta', 'upd')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_agendamentos_data_canonica_{sufixo} AFTER {evento} ON agendamentos
+                WHEN NEW.data_consulta != {SQL_CANONICO.format(coluna='NEW.data_consulta')}
+                BEGIN
+                    UPDATE agendamentos SET data_consulta = {canonico} WHERE id = NEW.id;
+                END
+            ''')
+        cursor.execute('DROP INDEX IF EXISTS idx_agendamentos_data')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_agendamentos_data_consulta ON agendamentos (data_consulta)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_agendamentos_medico_data ON agendamentos (medico_id, data_consulta)')
+
+        # One confirmation per appointment: the confirmation sweep inserts with ON CONFLICT DO
+        # NOTHING on this key, so concurrent runs cannot create duplicates. Duplicates left
+        # by the old row-by-row sweep are removed first (an answered row wins, then the newest).
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_confirmacoes_agendamento_unico'")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                DELETE FROM confirmacoes_consulta WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY agendamento_id ORDER BY confirmado IS NULL, id DESC
+                        ) as ordem
+                        FROM confirmacoes_consulta
+                    ) WHERE ordem > 1
+                )
+            ''')
+            cursor.execute('DROP INDEX IF EXISTS idx_confirmacoes_agendamento')
+            cursor.execute('''
+                CREATE UNIQUE INDEX idx_confirmacoes_agendamento_unico
+                ON confirmacoes_consulta (agendamento_id)
+            ''')
+
+        # Days whose rollup must be recomputed by the incremental job (filled by triggers)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rollup_dias_pendentes (
+                dia TEXT PRIMARY KEY
+            )
+        ''')
+
+        rollup_triggers = {
+            'senhas': "date(COALESCE({r}.data_aprovacao, {r}.data_criacao))",
+            'sessoes': "date({r}.data_sessao)",
+            'agendamentos': "date({r}.data_consulta)",
+            'confirmacoes_consulta': "date({r}.data_confirmacao)",
+        }
+        for tabela, expr_dia in rollup_triggers.items():
+            novo, antigo = expr_dia.format(r='NEW'), expr_dia.format(r='OLD')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_rollup_{tabela}_ins AFTER INSERT ON {tabela}
+                WHEN {novo} IS NOT NULL
+                BEGIN
+                    INSERT OR IGNORE INTO rollup_dias_pendentes (dia) VALUES ({novo});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_rollup_{tabela}_upd AFTER UPDATE ON {tabela}
+                BEGIN
+                    INSERT OR IGNORE INTO rollup_dias_pendentes (dia)
+                    SELECT {novo} WHERE {novo} IS NOT NULL
+                    UNION SELECT {antigo} WHERE {antigo} IS NOT NULL;
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_rollup_{tabela}_del AFTER DELETE ON {tabela}
+                WHEN {antigo} IS NOT NULL
+                BEGIN
+                    INSERT OR IGNORE INTO rollup_dias_pendentes (dia) VALUES ({antigo});
+                END
+            ''')
+
+        # Moving a patient to another doctor/location re-attributes all of its history
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_rollup_pacientes_upd
+            AFTER UPDATE OF medico_id, localizacao ON pacientes
+            BEGIN
+                INSERT OR IGNORE INTO rollup_dias_pendentes (dia)
+                SELECT date(COALESCE(data_aprovacao, data_criacao)) FROM senhas WHERE paciente_id = NEW.id
+                UNION SELECT date(data_sessao) FROM sessoes WHERE paciente_id = NEW.id
+                UNION SELECT date(data_consulta) FROM agendamentos WHERE paciente_id = NEW.id;
+            END
+        ''')
+
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_rollup_medicos_upd
+            AFTER UPDATE OF equipe_id ON medicos
+            WHEN COALESCE(NEW.equipe_id, 0) != COALESCE(OLD.equipe_id, 0)
+            BEGIN
+                INSERT OR IGNORE INTO rollup_dias_pendentes (dia)
+                SELECT date(COALESCE(s.data_aprovacao, s.data_criacao)) FROM senhas s
+                JOIN pacientes p ON s.paciente_id = p.id WHERE p.medico_id = NEW.id
+                UNION SELECT date(se.data_sessao) FROM sessoes se
+                JOIN pacientes p ON se.paciente_id = p.id WHERE p.medico_id = NEW.id
+                UNION SELECT date(data_consulta) FROM agendamentos WHERE medico_id = NEW.id;
+            END
+        ''')
+
+        # Rollups built before the integer revenue column are rebuilt from scratch
+        if _adicionar_coluna(cursor, 'rollup_diario', 'receita_centavos', 'INTEGER DEFAULT 0'):
+            cursor.execute('DELETE FROM rollup_diario')
+
+        # First run: schedule the whole history for the incremental rollup job
+        cursor.execute('''
+            INSERT OR IGNORE INTO rollup_dias_pendentes (dia)
+            SELECT dia FROM (
+                SELECT date(COALESCE(data_aprovacao, data_criacao)) as dia FROM senhas
+                UNION SELECT date(data_sessao) FROM sessoes
+                UNION SELECT date(data_consulta) FROM agendamentos
+                UNION SELECT date(data_confirmacao) FROM confirmacoes_consulta
+            )
+            WHERE dia IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM rollup_diario)
+        ''')
+
+        # Doctor calendar (agenda_utils): appointment durations and an R*Tree of the active
+        # appointments' [start, end) minutes per doctor for conflict checks and free slots
+        from agenda_utils import SQL_MINUTOS, DURACAO_PADRAO_MINUTOS
+        _adicionar_coluna(cursor, 'agendamentos', 'duracao_minutos', f'INTEGER DEFAULT {DURACAO_PADRAO_MINUTOS}')
+        # Session an appointment was booked for (series planned by agenda_utils.agendar_serie)
+        _adicionar_coluna(cursor, 'agendamentos', 'sessao_id', 'INTEGER REFERENCES sessoes (id)')
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'agenda_intervalos'")
+        agenda_nova = cursor.fetchone() is None
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS agenda_intervalos
+            USING rtree_i32(id, inicio, fim, medico_min, medico_max)
+        ''')
+
+        def intervalo(r):
+            inicio = SQL_MINUTOS.format(coluna=f'{r}.data_consulta')
+            duracao = f'COALESCE({r}.duracao_minutos, {DURACAO_PADRAO_MINUTOS})'
+            return (f"SELECT {r}.id, {inicio}, {inicio} + {duracao}, {r}.medico_id, {r}.medico_id",
+                    f"{r}.status = 'agendado' AND {inicio} IS NOT NULL AND {duracao} > 0")
+
+        selecao, condicao = intervalo('NEW')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_agenda_agendamentos_ins AFTER INSERT ON agendamentos
+            BEGIN
+                INSERT INTO agenda_intervalos (id, inicio, fim, medico_min, medico_max) {selecao} WHERE {condicao};
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_agenda_agendamentos_upd
+            AFTER UPDATE OF data_consulta, duracao_minutos, medico_id, status ON agendamentos
+            BEGIN
+                DELETE FROM agenda_intervalos WHERE id = OLD.id;
+                INSERT INTO agenda_intervalos (id, inicio, fim, medico_min, medico_max) {selecao} WHERE {condicao};
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_agenda_agendamentos_del AFTER DELETE ON agendamentos
+            BEGIN
+                DELETE FROM agenda_intervalos WHERE id = OLD.id;
+            END
+        ''')
+        if agenda_nova:
+            selecao, condicao = intervalo('a')
+            cursor.execute(f'''
+                INSERT INTO agenda_intervalos (id, inicio, fim, medico_min, medico_max)
+                {selecao} FROM agendamentos a WHERE {condicao}
+            ''')
+
+        # Background scheduler (agendador.py): leader lease shared by the worker processes
+        # and the next run of each periodic job
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agendador_lider (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                dono TEXT NOT NULL,
+                expira_em REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agendador_tarefas (
+                nome TEXT PRIMARY KEY,
+                ultima_execucao DATETIME,
+                proxima_execucao REAL NOT NULL DEFAULT 0,
+                ultimo_resultado TEXT
+            )
+        ''')
+
+        # Notification outbox (notificacoes.py): written in the transaction of the event,
+        # sent by the scheduler; one row per recipient and channel
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notificacoes_saida (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                evento TEXT NOT NULL,
+                origem TEXT NOT NULL,
+                origem_id INTEGER NOT NULL,
+                destino TEXT NOT NULL,
+                canal TEXT NOT NULL,
+                destinatario TEXT NOT NULL,
+                assunto TEXT,
+                corpo TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pendente',
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                proxima_tentativa REAL NOT NULL DEFAULT 0,
+                ultimo_erro TEXT,
+                criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
+                enviada_em DATETIME
+            )
+        ''')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_notificacoes_evento
+            ON notificacoes_saida (evento, origem, origem_id, canal, destinatario)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notificacoes_pendentes
+            ON notificacoes_saida (proxima_tentativa) WHERE status = 'pendente'
+        ''')
+        _adicionar_coluna(cursor, 'confirmacoes_consulta', 'notificado_medico', 'INTEGER DEFAULT 0')
+        _adicionar_coluna(cursor, 'confirmacoes_consulta', 'notificado_admin', 'INTEGER DEFAULT 0')
+
+        # Appointment reminders already queued (notificacoes.enfileirar_lembretes): one row
+        # per appointment, reminder and date, so a rescheduled appointment is reminded again
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lembretes_consulta (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                agendamento_id INTEGER NOT NULL,
+                tipo TEXT NOT NULL,
+                data_consulta TEXT NOT NULL,
+                criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (agendamento_id, tipo, data_consulta),
+                FOREIGN KEY (agendamento_id) REFERENCES agendamentos (id)
+            )
+        ''')
+
+        # Waitlist per doctor and location (lista_espera_utils): a patient's cancellation
+        # offers the slot to the next one waiting; the in-memory queues follow the table
+        # version, so the table must be listed in TABELAS_VERSIONADAS
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lista_espera (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 paciente_id INTEGER NOT NULL,
                 medico_id INTEGER NOT NULL,
-                data_agendamento DATETIME NOT NULL,
+                localizacao TEXT NOT NULL,
+                prioridade INTEGER NOT NULL DEFAULT 0,
                 observacoes TEXT,
-                ativo INTEGER DEFAULT 1,
-                confirmacao_disponivel INTEGER DEFAULT 0,
-                data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+                status TEXT NOT NULL DEFAULT 'aguardando',
+                agendamento_id INTEGER,
+                data_oferta DATETIME,
+                criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (paciente_id) REFERENCES pacientes (id),
-                FOREIGN KEY (medico_id) REFERENCES medicos (id)
+                FOREIGN KEY (medico_id) REFERENCES medicos (id),
+                FOREIGN KEY (agendamento_id) REFERENCES agendamentos (id)
             )
         ''')
-        
-        # Create confirmacoes_consulta table for patient confirmations
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS confirmacoes_consulta (
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_lista_espera_aguardando
+            ON lista_espera (paciente_id, medico_id) WHERE status = 'aguardando'
+        ''')
+
+        # Bulk operations on a doctor's calendar (agenda_utils.reorganizar_agenda): one row
+        # per operation, also the origin of the notifications it queues
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS operacoes_agenda (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                agendamento_id INTEGER NOT NULL,
-                paciente_id INTEGER NOT NULL,
-                confirmado INTEGER, -- 1 = confirmado, 0 = negado, NULL = pendente
-                data_confirmacao DATETIME,
-                observacoes_paciente TEXT,
-                notificado_medico INTEGER DEFAULT 0,
-                notificado_admin INTEGER DEFAULT 0,
-                data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (agendamento_id) REFERENCES agendamentos (id),
-                FOREIGN KEY (paciente_id) REFERENCES pacientes (id)
+                acao TEXT NOT NULL,
+                medico_id INTEGER NOT NULL,
+                medico_destino_id INTEGER,
+                inicio DATETIME NOT NULL,
+                fim DATETIME NOT NULL,
+                deslocamento_dias INTEGER,
+                motivo TEXT,
+                afetados INTEGER NOT NULL DEFAULT 0,
+                executado_por INTEGER,
+                criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (medico_id) REFERENCES medicos (id),
+                FOREIGN KEY (medico_destino_id) REFERENCES medicos (id),
+                FOREIGN KEY (executado_por) REFERENCES medicos (id)
             )
         ''')
-        
+
+        # Full-text search over patients, session notes and laudo descriptions (busca_utils).
+        # One FTS5 document per source row, rowid = id * 4 + origem (0 paciente, 1 sessão,
+        # 2 laudo) so the triggers can replace a document by rowid; CPF and phone are also
+        # indexed as bare digits. Accents are folded by the tokenizer.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'busca_pacientes'")
+        indice_busca_novo = cursor.fetchone() is None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS busca_pacientes USING fts5(
+                    nome, documento, texto, paciente_id UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '2 3 4'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            logging.warning(f"FTS5 indisponível, busca de pacientes desativada: {e}")
+        else:
+            cursor.execute("INSERT INTO busca_pacientes (busca_pacientes, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+
+            def so_digitos(coluna):
+                for caractere in ('.', '-', '/', ' ', '(', ')', '+'):
+                    coluna = f"replace({coluna}, '{caractere}', '')"
+                return coluna
+
+            cpf, telefone = "COALESCE({r}.cpf, '')", "COALESCE({r}.telefone, '')"
+            documento = f"{cpf} || ' ' || {telefone} || ' ' || {so_digitos(cpf)} || ' ' || {so_digitos(telefone)}"
+            fontes = {
+                # tabela: (origem, colunas que alteram o documento, nome, documento, texto, paciente_id, condição)
+                'pacientes': (0, 'nome, cpf, telefone', '{r}.nome', documento, "''", '{r}.id', '1'),
+                'sessoes': (1, 'observacoes, paciente_id', "''", "''", '{r}.observacoes', '{r}.paciente_id',
+                            "COALESCE({r}.observacoes, '') != ''"),
+                'laudos': (2, 'descricao, paciente_id', "''", "''", '{r}.descricao', '{r}.paciente_id',
+                           "COALESCE({r}.descricao, '') != ''"),
+            }
+            for tabela, (origem, colunas, nome, documento, texto, paciente_id, condicao) in fontes.items():
+                valores = ', '.join(expr.format(r='NEW') for expr in (nome, documento, texto, paciente_id))
+                inserir = f'''INSERT INTO busca_pacientes (rowid, nome, documento, texto, paciente_id)
+                    SELECT NEW.id * 4 + {origem}, {valores} WHERE {condicao.format(r='NEW')};'''
+                apagar = f"DELETE FROM busca_pacientes WHERE rowid = OLD.id * 4 + {origem};"
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_ins AFTER INSERT ON {tabela}
+                    BEGIN
+                        {inserir}
+                    END
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_upd AFTER UPDATE OF {colunas} ON {tabela}
+                    BEGIN
+                        {apagar}
+                        {inserir}
+                    END
+                ''')
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_busca_{tabela}_del AFTER DELETE ON {tabela}
+                    BEGIN
+                        {apagar}
+                    END
+                ''')
+                if indice_busca_novo:
+                    r = tabela[0]
+                    cursor.execute(f'''
+                        INSERT INTO busca_pacientes (rowid, nome, documento, texto, paciente_id)
+                        SELECT {r}.id * 4 + {origem}, {', '.join(expr.format(r=r) for expr in (nome, documento, texto, paciente_id))}
+                        FROM {tabela} {r} WHERE {condicao.format(r=r)}
+                    ''')
+
+        # Data version counters: every write to a versioned table bumps its counter, so
+        # derived results (PDFs, cached aggregates) can be keyed by the versions they read
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS versoes_tabelas (
+                tabela TEXT PRIMARY KEY,
+                versao INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        for tabela in TABELAS_VERSIONADAS:
+            cursor.execute('INSERT OR IGNORE INTO versoes_tabelas (tabela, versao) VALUES (?, 0)', (tabela,))
+            for evento, sufixo in (('INSERT', 'ins'), ('UPDATE', 'upd'), ('DELETE', 'del')):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{sufixo} AFTER {evento} ON {tabela}
+                    BEGIN
+                        UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = '{tabela}';
+                    END
+                ''')
+
+        # Entity versions for fine-grained invalidation ('medico:<id>', 'equipe:<id>',
+        # 'config:<chave>'; 'medico:*' / 'equipe:*' change with any of them). Only changes
+        # that affect payouts or report content bump them, so routine edits keep caches hot.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS versoes_entidades (
+                chave TEXT PRIMARY KEY,
+                versao INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        incrementar = ("INSERT INTO versoes_entidades (chave, versao) VALUES {chaves} "
+                       "ON CONFLICT(chave) DO UPDATE SET versao = versao + 1;")
+        gatilhos_entidades = {
+            'trg_entidade_medicos_ins': ('AFTER INSERT ON medicos', None, [
+                "'medico:*'", "'medico:' || NEW.id", "'equipe:' || COALESCE(NEW.equipe_id, 'externos')"]),
+            'trg_entidade_medicos_upd': ('AFTER UPDATE ON medicos', """
+                OLD.nome IS NOT NEW.nome OR OLD.ativo IS NOT NEW.ativo
+                OR OLD.equipe_id IS NOT NEW.equipe_id
+                OR OLD.valor_sessao_centavos IS NOT NEW.valor_sessao_centavos""", [
+                "'medico:*'", "'medico:' || NEW.id", "'equipe:' || COALESCE(OLD.equipe_id, 'externos')",
+                "'equipe:' || COALESCE(NEW.equipe_id, 'externos')"]),
+            'trg_entidade_medicos_del': ('AFTER DELETE ON medicos', None, [
+                "'medico:*'", "'medico:' || OLD.id", "'equipe:' || COALESCE(OLD.equipe_id, 'externos')"]),
+            'trg_entidade_equipes_ins': ('AFTER INSERT ON equipes', None, ["'equipe:*'", "'equipe:' || NEW.id"]),
+            'trg_entidade_equipes_upd': ('AFTER UPDATE ON equipes', """
+                OLD.nome IS NOT NEW.nome OR OLD.ativo IS NOT NEW.ativo
+                OR OLD.porcentagem_pontos_base IS NOT NEW.porcentagem_pontos_base""",
+                ["'equipe:*'", "'equipe:' || NEW.id"]),
+            'trg_entidade_equipes_del': ('AFTER DELETE ON equipes', None, ["'equipe:*'", "'equipe:' || OLD.id"]),
+            'trg_entidade_configuracoes_ins': ('AFTER INSERT ON configuracoes', None, ["'config:' || NEW.chave"]),
+            'trg_entidade_configuracoes_upd': ('AFTER UPDATE ON configuracoes', 'OLD.valor IS NOT NEW.valor',
+                                               ["'config:' || NEW.chave"]),
+            'trg_entidade_configuracoes_del': ('AFTER DELETE ON configuracoes', None, ["'config:' || OLD.chave"]),
+        }
+        for nome, (evento, condicao, chaves) in gatilhos_entidades.items():
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {nome} {evento}
+                {f'WHEN {condicao}' if condicao else ''}
+                BEGIN
+                    {incrementar.format(chaves=', '.join(f'({chave}, 1)' for chave in chaves))}
+                END
+            ''')
+
+        # Calendar feeds (calendario_utils): 'agenda:<medico_id>' changes with the doctor's
+        # appointments, their confirmations and the names of their patients, and records
+        # when, for the feeds' Last-Modified
+        _adicionar_coluna(cursor, 'versoes_entidades', 'atualizado_em', 'DATETIME')
+        incrementar_agenda = ("INSERT INTO versoes_entidades (chave, versao, atualizado_em) {origem} "
+                              "ON CONFLICT(chave) DO UPDATE SET versao = versao + 1, "
+                              "atualizado_em = excluded.atualizado_em;")
+        por_agendamento = ("SELECT DISTINCT 'agenda:' || medico_id, 1, CURRENT_TIMESTAMP "
+                           "FROM agendamentos WHERE {condicao}")
+        gatilhos_agenda = {
+            'trg_agenda_versao_agendamentos_ins': ('AFTER INSERT ON agendamentos',
+                                                   "VALUES ('agenda:' || NEW.medico_id, 1, CURRENT_TIMESTAMP)"),
+            'trg_agenda_versao_agendamentos_upd': ('AFTER UPDATE ON agendamentos',
+                                                   "VALUES ('agenda:' || OLD.medico_id, 1, CURRENT_TIMESTAMP), "
+                                                   "('agenda:' || NEW.medico_id, 1, CURRENT_TIMESTAMP)"),
+            'trg_agenda_versao_agendamentos_del': ('AFTER DELETE ON agendamentos',
+                                                   "VALUES ('agenda:' || OLD.medico_id, 1, CURRENT_TIMESTAMP)"),
+            'trg_agenda_versao_confirmacoes_ins': ('AFTER INSERT ON confirmacoes_consulta',
+                                                   por_agendamento.format(condicao='id = NEW.agendamento_id')),
+            'trg_agenda_versao_confirmacoes_upd': ('AFTER UPDATE ON confirmacoes_consulta',
+                                                   por_agendamento.format(condicao='id IN (OLD.agendamento_id, NEW.agendamento_id)')),
+            'trg_agenda_versao_confirmacoes_del': ('AFTER DELETE ON confirmacoes_consulta',
+                                                   por_agendamento.format(condicao='id = OLD.agendamento_id')),
+            'trg_agenda_versao_pacientes_upd': ('AFTER UPDATE OF nome, telefone ON pacientes',
+                                                por_agendamento.format(condicao='paciente_id = NEW.id')),
+        }
+        for nome, (evento, origem) in gatilhos_agenda.items():
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {nome} {evento}
+                BEGIN
+                    {incrementar_agenda.format(origem=origem)}
+                END
+            ''')
+        _adicionar_coluna(cursor, 'medicos', 'token_calendario', 'TEXT')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_medicos_token_calendario
+            ON medicos (token_calendario) WHERE token_calendario IS NOT NULL
+        ''')
+
+        # Rendered monthly report PDFs (content-addressed files under cache/pdf)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS relatorios_pdf (
+                mes_referencia TEXT NOT NULL,
+                versao_dados TEXT NOT NULL,
+                hash_conteudo TEXT NOT NULL,
+                tamanho INTEGER,
+                data_geracao DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (mes_referencia, versao_dados)
+            )
+        ''')
+
         # Insert default configurations
         default_configs = [
             ('valor_teste_neuropsicologico', '800', 'Valor da senha de teste neuropsicológico'),
             ('valor_consulta_sessao', '80', 'Valor da senha de consulta/sessão'),
             ('sessoes_max', '8', 'Número máximo de sessões por paciente'),
             ('valor_sessao_medico_externo', '112.50', 'Valor por sessão para médicos externos (900/8)'),
-            ('garantia_8_sessoes', '1', 'Garantir pagamento de 8 sessões mesmo se finalizar antes')
+            ('garantia_8_sessoes', '1', 'Garantir pagamento de 8 sessões mesmo se finalizar antes'),
+            ('sessoes_garantidas', '8', 'Sessões pagas ao médico externo quando o laudo sai no mês de início'),
+            ('janela_confirmacao_dias', '3', 'Dias antes da consulta em que o paciente pode confirmar presença')
         ]
         
         for chave, valor, descricao in default_configs:
@@ -287,46 +923,6 @@ def init_db():
         conn.commit()
         logging.info("SQLite database initialized successfully")
 
-def verificar_confirmacoes_disponiveis():
-    """Verifica agendamentos que devem liberar confirmação (1 dia antes)"""
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Buscar agendamentos que estão a 1 dia de distância e ainda não liberaram confirmação
-            cursor.execute('''
-                UPDATE agendamentos 
-                SET confirmacao_disponivel = 1
-                WHERE DATE(data_agendamento) = DATE('now', '+1 day')
-                AND confirmacao_disponivel = 0
-                AND ativo = 1
-            ''')
-            
-            # Buscar agendamentos que foram liberados para confirmação hoje
-            cursor.execute('''
-                SELECT a.id, a.paciente_id, a.medico_id, a.data_agendamento, p.nome as paciente_nome
-                FROM agendamentos a
-                JOIN pacientes p ON a.paciente_id = p.id
-                WHERE a.confirmacao_disponivel = 1
-                AND a.id NOT IN (SELECT agendamento_id FROM confirmacoes_consulta)
-            ''')
-            
-            agendamentos_para_confirmar = cursor.fetchall()
-            
-            # Criar registros de confirmação para os novos agendamentos
-            for agendamento in agendamentos_para_confirmar:
-                cursor.execute('''
-                    INSERT INTO confirmacoes_consulta (agendamento_id, paciente_id)
-                    VALUES (?, ?)
-                ''', (agendamento['id'], agendamento['paciente_id']))
-            
-            conn.commit()
-            return len(agendamentos_para_confirmar)
-            
-    except Exception as e:
-        logging.error(f"Erro ao verificar confirmações disponíveis: {e}")
-        return 0
-
 def get_config(chave, default=None):
     """Get configuration value"""
     with get_db_connection() as conn:
@@ -336,50 +932,71 @@ def get_config(chave, default=None):
         return result['valor'] if result else default
 
 def set_config(chave, valor, descricao=None):
-    """Set configuration value"""
+    """
+    Set configuration value; returns True when it changed. An unchanged value is not
+    rewritten, so cached reports that depend on the key stay valid.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT OR REPLACE INTO configuracoes (chave, valor, descricao, data_atualizacao)
+            INSERT INTO configuracoes (chave, valor, descricao, data_atualizacao)
             VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (chave, valor, descricao))
+            ON CONFLICT(chave) DO UPDATE SET
+                valor = excluded.valor,
+                descricao = COALESCE(excluded.descricao, configuracoes.descricao),
+                data_atualizacao = excluded.data_atualizacao
+            WHERE configuracoes.valor IS NOT excluded.valor
+        ''', (chave, str(valor), descricao))
         conn.commit()
+        return cursor.rowcount > 0
 
-def verificar_senhas_aprovadas_para_entrega(paciente_id):
+def verificar_senhas_aprovadas_para_entrega(paciente_id, cursor=None):
     """Verifica se as duas senhas necessárias foram aprovadas para liberação do laudo"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Verificar se existem as duas senhas aprovadas: teste_neuropsicologico (R$800) e consulta_sessao (R$80)
-        cursor.execute('''
-            SELECT tipo, COUNT(*) as count
-            FROM senhas 
-            WHERE paciente_id = ? 
-                AND aprovada_admin = 1 
-                AND ativo = 1 
-                AND tipo IN ('teste_neuropsicologico', 'consulta_sessao')
-            GROUP BY tipo
-        ''', (paciente_id,))
-        
-        resultados = cursor.fetchall()
-        tipos_aprovados = {row['tipo']: row['count'] for row in resultados}
-        
-        # Verificar se ambos os tipos existem e foram aprovados
-        teste_aprovado = tipos_aprovados.get('teste_neuropsicologico', 0) > 0
-        consulta_aprovada = tipos_aprovados.get('consulta_sessao', 0) > 0
-        
-        return teste_aprovado and consulta_aprovada
+    if cursor is None:
+        with get_db_connection() as conn:
+            return verificar_senhas_aprovadas_para_entrega(paciente_id, conn.cursor())
+    
+    # Verificar se existem as duas senhas aprovadas: teste_neuropsicologico (R$800) e consulta_sessao (R$80)
+    cursor.execute('''
+        SELECT tipo, COUNT(*) as count
+        FROM senhas 
+        WHERE paciente_id = ? 
+            AND aprovada_admin = 1 
+            AND ativo = 1 
+            AND tipo IN ('teste_neuropsicologico', 'consulta_sessao')
+        GROUP BY tipo
+    ''', (paciente_id,))
+    
+    resultados = cursor.fetchall()
+    tipos_aprovados = {row['tipo']: row['count'] for row in resultados}
+    
+    # Verificar se ambos os tipos existem e foram aprovados
+    teste_aprovado = tipos_aprovados.get('teste_neuropsicologico', 0) > 0
+    consulta_aprovada = tipos_aprovados.get('consulta_sessao', 0) > 0
+    
+    return teste_aprovado and consulta_aprovada
 
-def liberar_entrega_laudo(paciente_id):
-    """Libera a entrega do laudo após aprovação das duas senhas"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE laudos 
-            SET liberado_entrega = 1, data_liberacao = CURRENT_TIMESTAMP 
-            WHERE paciente_id = ?
-        ''', (paciente_id,))
-        
-        conn.commit()
-        return cursor.rowcount > 0
\ No newline at end of file
+def liberar_entrega_laudo(paciente_id, cursor=None):
+    """
+    Libera a entrega do laudo após aprovação das duas senhas. Com cursor, grava na
+    transação de quem chama (que faz o commit) junto com os avisos ao paciente e ao médico.
+    """
+    if cursor is None:
+        with get_db_connection() as conn:
+            liberado = liberar_entrega_laudo(paciente_id, conn.cursor())
+            conn.commit()
+            return liberado
+    
+    from notificacoes import notificar_laudos_liberados
+    cursor.execute('SELECT id FROM laudos WHERE paciente_id = ? AND COALESCE(liberado_entrega, 0) = 0', (paciente_id,))
+    novos = [row['id'] for row in cursor.fetchall()]
+    
+    cursor.execute('''
+        UPDATE laudos 
+        SET liberado_entrega = 1, data_liberacao = CURRENT_TIMESTAMP 
+        WHERE paciente_id = ?
+    ''', (paciente_id,))
+    liberado = cursor.rowcount > 0
+    
+    notificar_laudos_liberados(cursor, novos)
+    return liberado
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+Canonical appointment timestamps and their pt-BR labels
+
+``agendamentos.data_consulta`` is stored in one format, FORMATO_CANONICO
+('YYYY-MM-DD HH:MM:SS', local time): init_db migrates the old datetime-local
+values ('YYYY-MM-DDTHH:MM') and a trigger normalizes any write that is not in
+it, so the column sorts and compares as text and range queries use the plain
+index on (data_consulta). Comparisons take the local time from Python
+(``agora_canonico``), never datetime('now'), which is UTC.
+
+The listings format their rows with ``formatar_datas`` in a single pass; parsing
+and labels are memoized, so a page of appointments on a few days costs a handful
+of strftime calls.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+FORMATO_CANONICO = '%Y-%m-%d %H:%M:%S'
+
+# Formato canônico em SQL (migração e trigger de normalização em init_db)
+SQL_CANONICO = "strftime('%Y-%m-%d %H:%M:%S', replace({coluna}, 'T', ' '))"
+
+DIAS_SEMANA = ('Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo')
+MESES = ('Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
+         'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro')
+
+
+@lru_cache(maxsize=8192)
+def _converter(texto):
+    return datetime.fromisoformat(texto.strip().replace('T', ' '))
+
+
+def para_datetime(valor):
+    """datetime de um timestamp gravado (canônico, com 'T' ou sem segundos); None se inválido"""
+    if isinstance(valor, datetime):
+        return valor
+    if not valor:
+        return None
+    try:
+        return _converter(str(valor))
+    except ValueError:
+        return None
+
+
+def canonico(valor):
+    """Timestamp no formato gravado (FORMATO_CANONICO); None se inválido"""
+    momento = para_datetime(valor)
+    return momento.strftime(FORMATO_CANONICO) if momento else None
+
+
+def agora_canonico():
+    return datetime.now().strftime(FORMATO_CANONICO)
+
+
+@lru_cache(maxsize=1024)
+def _rotulos_dia(dia):
+    return dia.strftime('%d/%m/%Y'), f"{DIAS_SEMANA[dia.weekday()]}, {dia.day} de {MESES[dia.month - 1]} de {dia.year}"
+
+
+def _periodo(hora):
+    return 'manhã' if hora < 12 else 'tarde' if hora < 18 else 'noite'
+
+
+def rotulos_data(valor):
+    """{'data_formatada', 'hora_formatada', 'data_completa', 'periodo'} de um timestamp"""
+    momento = para_datetime(valor)
+    if momento is None:
+        return {'data_formatada': valor, 'hora_formatada': '', 'data_completa': valor, 'periodo': ''}
+    data_formatada, data_completa = _rotulos_dia(momento.date())
+    return {'data_formatada': data_formatada, 'hora_formatada': f'{momento.hour:02d}:{momento.minute:02d}',
+            'data_completa': data_completa, 'periodo': _periodo(momento.hour)}
+
+
+def formatar_data_hora(valor, formato='%d/%m/%Y %H:%M'):
+    """Timestamp para exibição (filtro de template data_hora); o próprio valor se inválido"""
+    momento = para_datetime(valor)
+    return momento.strftime(formato) if momento else (valor or '')
+
+
+def formatar_datas(linhas, campo='data_consulta', agora=None):
+    """
+    Acrescenta os rótulos de `campo` a cada linha (dicts) numa única passada e separa
+    futuras e passadas em relação a `agora`: retorna (futuras, passadas), na ordem dada.
+    Linhas com data inválida contam como passadas.
+    """
+    agora = agora or datetime.now()
+    futuras, passadas = [], []
+    for linha in linhas:
+        linha.update(rotulos_data(linha.get(campo)))
+        momento = para_datetime(linha.get(campo))
+        (futuras if momento is not None and momento >= agora else passadas).append(linha)
+    return futuras, passadas
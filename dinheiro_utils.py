@@ -0,0 +1,79 @@
+"""
+Fixed-point money helpers for the clinic's financial calculations
+
+Amounts are handled as integer centavos and percentages as integer basis points
+(1% = 100 pontos base), so sums are exact and SQLite can aggregate them with pure
+integer arithmetic. Conversion to reais (float) only happens at the presentation
+boundary, through centavos_para_reais().
+"""
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+
+PONTOS_BASE_100_PORCENTO = 10000
+
+# SQL expression used by migrations and triggers to derive centavos from legacy REAL
+# columns (the epsilon absorbs binary representation errors such as 0.285 * 100)
+SQL_CENTAVOS = "CAST(ROUND({coluna} * 100 + 0.000001) AS INTEGER)"
+SQL_PONTOS_BASE = "CAST(ROUND({coluna} * 100 + 0.000001) AS INTEGER)"
+
+
+def _decimal(valor):
+    """Converte valor (str, int, float, Decimal) em Decimal sem herdar erro binário do float"""
+    if isinstance(valor, Decimal):
+        return valor
+    if isinstance(valor, str):
+        valor = valor.strip().replace('R$', '').strip()
+        # Aceita formato brasileiro "1.234,56"
+        if ',' in valor:
+            valor = valor.replace('.', '').replace(',', '.')
+    return Decimal(str(valor))
+
+
+def para_centavos(valor, default=0):
+    """Converte um valor em reais para centavos inteiros (arredondamento meio-para-cima)"""
+    if valor is None or valor == '':
+        return default
+    try:
+        return int((_decimal(valor) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError, TypeError):
+        return default
+
+
+def para_pontos_base(percentual, default=0):
+    """Converte um percentual (ex.: 50.5) em pontos base inteiros (5050)"""
+    return para_centavos(percentual, default)
+
+
+def centavos_para_reais(centavos):
+    """Converte centavos inteiros em reais (float) para exibição nos templates"""
+    return (centavos or 0) / 100
+
+
+def pontos_base_para_percentual(pontos_base):
+    """Converte pontos base em percentual (float) para exibição"""
+    return (pontos_base or 0) / 100
+
+
+def aplicar_pontos_base(centavos, pontos_base):
+    """
+    Aplica um percentual em pontos base sobre um valor em centavos, em aritmética inteira
+    com arredondamento meio-para-cima (mesma regra de (c * bp + 5000) / 10000 no SQLite)
+    """
+    centavos, pontos_base = int(centavos or 0), int(pontos_base or 0)
+    produto = centavos * pontos_base
+    metade = PONTOS_BASE_100_PORCENTO // 2
+    if produto >= 0:
+        return (produto + metade) // PONTOS_BASE_100_PORCENTO
+    return -((-produto + metade) // PONTOS_BASE_100_PORCENTO)
+
+
+def somar_centavos(valores):
+    """Soma exata de uma sequência de centavos (lista, array('q') ou array NumPy de inteiros)"""
+    return int(sum(int(v or 0) for v in valores))
+
+
+def formatar_reais(centavos):
+    """Formata centavos no padrão brasileiro: R$ 1.234,56"""
+    centavos = int(centavos or 0)
+    sinal = '-' if centavos < 0 else ''
+    inteiro, resto = divmod(abs(centavos), 100)
+    return f"{sinal}R$ {inteiro:,}".replace(',', '.') + f",{resto:02d}"
@@ -0,0 +1,240 @@
+"""
+Streaming exports of the financial ledgers and reports
+
+The generators here read the sqlite cursor in fetchmany batches and yield the file in
+chunks, so a response can be streamed to the browser (Flask ``stream_with_context``)
+without building the whole list in memory: the first chunk leaves before the query
+finishes and memory stays flat regardless of the number of rows. XLSX files are
+written incrementally with zipfile over a non-seekable buffer (no extra dependency).
+
+Remessa de pagamentos do mês: médicos externos (faturamento_medicos) e equipes
+(pagamentos_equipe) com valor a pagar e ainda não pagos, em CSV ou num arquivo
+de largura fixa no estilo CNAB (header, um detalhe por favorecido e trailer com
+quantidade e total em centavos).
+"""
+import csv
+import io
+import unicodedata
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+from flask import Response, stream_with_context
+from database import get_db_connection
+
+TAMANHO_LOTE = 1000
+
+QUERY_REMESSA = '''
+    SELECT 'medico' as tipo, f.medico_id as favorecido_id, m.nome as favorecido,
+           COUNT(*) as lancamentos, SUM(f.valor_total_centavos) as valor_centavos
+    FROM faturamento_medicos f
+    JOIN medicos m ON f.medico_id = m.id
+    WHERE f.mes_referencia = ? AND f.status != 'pago'
+    GROUP BY f.medico_id, m.nome
+    HAVING SUM(f.valor_total_centavos) > 0
+    UNION ALL
+    SELECT 'equipe', pe.equipe_id, e.nome, 1, pe.valor_equipe_centavos
+    FROM pagamentos_equipe pe
+    JOIN equipes e ON pe.equipe_id = e.id
+    WHERE pe.mes_referencia = ? AND COALESCE(pe.status, '') != 'pago'
+    AND pe.valor_equipe_centavos > 0
+    ORDER BY 1, 3
+'''
+
+
+def iterar_remessa(mes_referencia):
+    """Favorecidos a pagar no mês, lidos do cursor um a um"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(QUERY_REMESSA, (mes_referencia, mes_referencia))
+        for row in cursor:
+            yield row
+
+
+def iterar_consulta(query, params=()):
+    """Linhas da consulta em lotes de TAMANHO_LOTE (fetchmany), uma conexão por exportação"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        while True:
+            lote = cursor.fetchmany(TAMANHO_LOTE)
+            if not lote:
+                break
+            yield lote
+
+
+def _centavos_csv(centavos):
+    """Centavos inteiros como texto com vírgula decimal (1234,56)"""
+    sinal = '-' if centavos < 0 else ''
+    return f"{sinal}{abs(centavos) // 100},{abs(centavos) % 100:02d}"
+
+
+def _valor_csv(row, chave, tipo):
+    valor = row[chave]
+    if valor is None:
+        return ''
+    return _centavos_csv(valor) if tipo == 'centavos' else valor
+
+
+def _valor_xlsx(row, chave, tipo):
+    valor = row[chave]
+    if valor is None:
+        return ''
+    return valor / 100 if tipo == 'centavos' else valor
+
+
+def gerar_csv(colunas, lotes):
+    """
+    CSV (separador ';') a partir de lotes de linhas. colunas é uma lista de
+    (chave, título, tipo), tipo 'texto', 'numero' ou 'centavos'.
+    """
+    yield '\ufeff' + _linha_csv([titulo for _, titulo, _ in colunas])
+    for lote in lotes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        for row in lote:
+            writer.writerow([_valor_csv(row, chave, tipo) for chave, _, tipo in colunas])
+        yield buffer.getvalue()
+
+
+class _BufferSaida:
+    """Destino não posicionável para o zipfile: acumula bytes até serem enviados"""
+
+    def __init__(self):
+        self.dados = bytearray()
+
+    def write(self, dados):
+        self.dados += dados
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        dados = bytes(self.dados)
+        self.dados.clear()
+        return dados
+
+
+_XLSX_ARQUIVOS_FIXOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+
+def _celula_xlsx(valor):
+    if isinstance(valor, bool):
+        valor = int(valor)
+    if isinstance(valor, (int, float)):
+        return f'<c><v>{valor}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(valor))}</t></is></c>'
+
+
+def gerar_xlsx(colunas, lotes, nome_planilha='Dados'):
+    """XLSX de uma planilha a partir de lotes de linhas (mesmo formato de colunas de gerar_csv)"""
+    saida = _BufferSaida()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as xlsx:
+        for nome, conteudo in _XLSX_ARQUIVOS_FIXOS.items():
+            xlsx.writestr(nome, conteudo)
+        xlsx.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(nome_planilha[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'))
+        yield saida.retirar()
+
+        with xlsx.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                '<row>' + ''.join(_celula_xlsx(titulo) for _, titulo, _ in colunas) + '</row>'
+            ).encode('utf-8'))
+            for lote in lotes:
+                planilha.write(''.join(
+                    '<row>' + ''.join(_celula_xlsx(_valor_xlsx(row, chave, tipo)) for chave, _, tipo in colunas) + '</row>'
+                    for row in lote
+                ).encode('utf-8'))
+                yield saida.retirar()
+            planilha.write(b'</sheetData></worksheet>')
+    yield saida.retirar()
+
+
+def resposta_exportacao(nome_arquivo, colunas, lotes, formato='csv', nome_planilha='Dados'):
+    """Response em streaming no formato pedido ('csv' ou 'xlsx')"""
+    if formato == 'xlsx':
+        gerador = gerar_xlsx(colunas, lotes, nome_planilha)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        formato, gerador, mimetype = 'csv', gerar_csv(colunas, lotes), 'text/csv'
+
+    return Response(stream_with_context(gerador), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={nome_arquivo}.{formato}'})
+
+
+def _linha_csv(valores):
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=';').writerow(valores)
+    return buffer.getvalue()
+
+
+def gerar_remessa_csv(mes_referencia):
+    """Remessa do mês em CSV (separador ';', valores com vírgula decimal)"""
+    yield '\ufeff' + _linha_csv(['tipo', 'favorecido_id', 'favorecido', 'lancamentos',
+                                 'valor', 'valor_centavos', 'mes_referencia'])
+    for row in iterar_remessa(mes_referencia):
+        yield _linha_csv([row['tipo'], row['favorecido_id'], row['favorecido'], row['lancamentos'],
+                          _centavos_csv(row['valor_centavos']), row['valor_centavos'], mes_referencia])
+
+
+def _alfa(texto, tamanho):
+    """Campo alfanumérico CNAB: maiúsculo, sem acentos, alinhado à esquerda"""
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode('ascii')
+    return texto.upper()[:tamanho].ljust(tamanho)
+
+
+def _num(valor, tamanho):
+    """Campo numérico CNAB: zeros à esquerda"""
+    return str(int(valor or 0))[-tamanho:].zfill(tamanho)
+
+
+def gerar_remessa_cnab(mes_referencia, nome_empresa='CLINICA NEUROPSICOLOGIA'):
+    """
+    Remessa do mês em registros de 240 posições no estilo CNAB:
+    0 = header, 3 = detalhe (um por favorecido), 9 = trailer.
+    Dados bancários dos favorecidos não são cadastrados no sistema e vão zerados.
+    """
+    agora = datetime.now()
+    yield (_num(0, 1) + _alfa(nome_empresa, 30) + _alfa('REMESSA PAGAMENTOS', 20)
+           + _num(mes_referencia.replace('-', ''), 6) + agora.strftime('%d%m%Y%H%M%S')).ljust(240) + '\r\n'
+
+    quantidade, total_centavos = 0, 0
+    for row in iterar_remessa(mes_referencia):
+        quantidade += 1
+        total_centavos += row['valor_centavos']
+        yield (_num(3, 1) + _num(quantidade, 6) + _alfa(row['tipo'], 6) + _num(row['favorecido_id'], 10)
+               + _alfa(row['favorecido'], 40) + _num(0, 5) + _num(0, 12)  # agência / conta
+               + _num(row['valor_centavos'], 15) + _num(mes_referencia.replace('-', ''), 6)).ljust(240) + '\r\n'
+
+    yield (_num(9, 1) + _num(quantidade, 6) + _num(total_centavos, 18)).ljust(240) + '\r\n'
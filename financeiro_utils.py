@@ -1,11 +1,46 @@
 """
 Utilities for neuropsychology clinic financial calculations
+
+Each ledger has an _apurar_* function (read only, works on any cursor, including the
+read-only connections of the recalculation workers) and a _gravar_* function that
+upserts the month into the ledger table. The amounts come from the single apuração
+of regras_pagamento; the _apurar_* functions only shape it per ledger and accept an
+apuração already computed, so a report evaluates the rules once per month.
 """
 from database import get_db_connection
+from dinheiro_utils import centavos_para_reais, somar_centavos
+from regras_pagamento import apurar_mes
+from medico_pagamento import _resultado_pagamento_medico, _gravar_pagamento_medico
+import json
 import logging
 from datetime import datetime
 
 
+def _apurar_faturamento_clinica(cursor, mes_referencia, apuracao=None):
+    """Lançamentos de faturamento da clínica do mês (senhas ativas aprovadas pelo admin)"""
+    apuracao = apuracao or apurar_mes(cursor, mes_referencia)
+    return apuracao['senhas']
+
+
+def _gravar_faturamento_clinica(cursor, mes_referencia, lancamentos):
+    """Upsert dos lançamentos do mês; remove senhas que deixaram de contar no mês"""
+    cursor.executemany('''
+        INSERT INTO faturamento_clinica 
+        (paciente_id, senha_id, valor_senha, valor_senha_centavos, mes_referencia)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (senha_id, mes_referencia) DO UPDATE SET
+            paciente_id = excluded.paciente_id,
+            valor_senha = excluded.valor_senha,
+            valor_senha_centavos = excluded.valor_senha_centavos
+    ''', [(l['paciente_id'], l['senha_id'], centavos_para_reais(l['valor_senha_centavos']),
+           l['valor_senha_centavos'], mes_referencia) for l in lancamentos])
+    
+    cursor.execute('''
+        DELETE FROM faturamento_clinica
+        WHERE mes_referencia = ? AND senha_id NOT IN (SELECT value FROM json_each(?))
+    ''', (mes_referencia, json.dumps([l['senha_id'] for l in lancamentos])))
+
+
 def calcular_faturamento_clinica(mes_referencia=None):
     """
     Calcula o faturamento da clínica baseado apenas nas senhas aprovadas pelo admin
@@ -16,38 +51,61 @@ def calcular_faturamento_clinica(mes_referencia=None):
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Buscar apenas senhas ativas E aprovadas pelo admin
-            cursor.execute('''
-                SELECT s.id, s.paciente_id, s.valor, p.nome as paciente_nome
-                FROM senhas s
-                JOIN pacientes p ON s.paciente_id = p.id
-                WHERE s.ativo = 1 
-                AND s.aprovada_admin = 1
-                AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
-            ''', (mes_referencia,))
-            
-            senhas_mes = cursor.fetchall()
-            faturamento_total = 0
-            
-            for senha in senhas_mes:
-                # Registrar faturamento da clínica
-                cursor.execute('''
-                    INSERT OR REPLACE INTO faturamento_clinica 
-                    (paciente_id, senha_id, valor_senha, mes_referencia)
-                    VALUES (?, ?, ?, ?)
-                ''', (senha['paciente_id'], senha['id'], senha['valor'], mes_referencia))
-                
-                faturamento_total += senha['valor']
-            
+            lancamentos = _apurar_faturamento_clinica(cursor, mes_referencia)
+            _gravar_faturamento_clinica(cursor, mes_referencia, lancamentos)
             conn.commit()
-            return faturamento_total
+            return centavos_para_reais(somar_centavos(l['valor_senha_centavos'] for l in lancamentos))
             
     except Exception as e:
         logging.error(f"Erro ao calcular faturamento da clínica: {e}")
         return 0
 
 
+def _apurar_pagamentos_equipe(cursor, mes_referencia, apuracao=None):
+    """Pagamentos das equipes do mês, baseados APENAS nas senhas dos médicos da própria equipe"""
+    apuracao = apuracao or apurar_mes(cursor, mes_referencia)
+    return [
+        {
+            'equipe_id': equipe['equipe_id'],
+            'equipe': equipe['equipe'],
+            'porcentagem': equipe['porcentagem'],
+            'porcentagem_pontos_base': equipe['porcentagem_pontos_base'],
+            'faturamento_base': centavos_para_reais(equipe['faturamento_base_centavos']),
+            'faturamento_base_centavos': equipe['faturamento_base_centavos'],
+            'valor': centavos_para_reais(equipe['valor_centavos']),
+            'valor_centavos': equipe['valor_centavos']
+        }
+        for equipe in apuracao['equipes']
+        if equipe['faturamento_base_centavos'] > 0
+    ]
+
+
+def _gravar_pagamentos_equipe(cursor, mes_referencia, pagamentos_equipe):
+    """Upsert dos pagamentos das equipes no mês; pagamentos já pagos ficam como foram pagos"""
+    cursor.executemany('''
+        INSERT INTO pagamentos_equipe 
+        (equipe_id, mes_referencia, faturamento_base, porcentagem_equipe, valor_equipe,
+         faturamento_base_centavos, porcentagem_pontos_base, valor_equipe_centavos)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (equipe_id, mes_referencia) DO UPDATE SET
+            faturamento_base = excluded.faturamento_base,
+            porcentagem_equipe = excluded.porcentagem_equipe,
+            valor_equipe = excluded.valor_equipe,
+            faturamento_base_centavos = excluded.faturamento_base_centavos,
+            porcentagem_pontos_base = excluded.porcentagem_pontos_base,
+            valor_equipe_centavos = excluded.valor_equipe_centavos
+        WHERE COALESCE(pagamentos_equipe.status, '') != 'pago'
+    ''', [(p['equipe_id'], mes_referencia, p['faturamento_base'], p['porcentagem'], p['valor'],
+           p['faturamento_base_centavos'], p['porcentagem_pontos_base'], p['valor_centavos'])
+          for p in pagamentos_equipe])
+    
+    cursor.execute('''
+        DELETE FROM pagamentos_equipe
+        WHERE mes_referencia = ? AND COALESCE(status, '') != 'pago'
+        AND equipe_id NOT IN (SELECT value FROM json_each(?))
+    ''', (mes_referencia, json.dumps([p['equipe_id'] for p in pagamentos_equipe])))
+
+
 def calcular_pagamentos_equipe(mes_referencia=None):
     """
     Calcula os pagamentos das equipes baseado APENAS nas senhas dos médicos da própria equipe
@@ -58,51 +116,8 @@ def calcular_pagamentos_equipe(mes_referencia=None):
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Buscar equipes ativas
-            cursor.execute('''
-                SELECT id, nome, porcentagem_participacao
-                FROM equipes 
-                WHERE ativo = 1
-            ''')
-            
-            equipes = cursor.fetchall()
-            pagamentos_equipe = []
-            
-            for equipe in equipes:
-                # Calcular faturamento APENAS dos médicos desta equipe
-                cursor.execute('''
-                    SELECT SUM(s.valor) as faturamento_equipe
-                    FROM senhas s
-                    JOIN pacientes p ON s.paciente_id = p.id
-                    JOIN medicos m ON p.medico_id = m.id
-                    WHERE m.equipe_id = ?
-                    AND s.ativo = 1 
-                    AND s.aprovada_admin = 1
-                    AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
-                ''', (equipe['id'], mes_referencia))
-                
-                result = cursor.fetchone()
-                faturamento_equipe = result['faturamento_equipe'] if result and result['faturamento_equipe'] else 0
-                
-                if faturamento_equipe > 0:
-                    valor_equipe = faturamento_equipe * (equipe['porcentagem_participacao'] / 100)
-                    
-                    # Registrar pagamento da equipe
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO pagamentos_equipe 
-                        (equipe_id, mes_referencia, faturamento_base, porcentagem_equipe, valor_equipe)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (equipe['id'], mes_referencia, faturamento_equipe, 
-                          equipe['porcentagem_participacao'], valor_equipe))
-                    
-                    pagamentos_equipe.append({
-                        'equipe': equipe['nome'],
-                        'porcentagem': equipe['porcentagem_participacao'],
-                        'faturamento_base': faturamento_equipe,
-                        'valor': valor_equipe
-                    })
-            
+            pagamentos_equipe = _apurar_pagamentos_equipe(cursor, mes_referencia)
+            _gravar_pagamentos_equipe(cursor, mes_referencia, pagamentos_equipe)
             conn.commit()
             return pagamentos_equipe
             
@@ -111,9 +126,63 @@ def calcular_pagamentos_equipe(mes_referencia=None):
         return []
 
 
+def _apurar_pagamentos_medicos_externos(cursor, mes_referencia, apuracao=None):
+    """Pagamentos dos médicos externos do mês por paciente, pelas regras de regras_pagamento"""
+    apuracao = apuracao or apurar_mes(cursor, mes_referencia)
+    
+    pagamentos = []
+    for medico in apuracao['sessoes_medicos']:
+        if not medico['is_externo']:
+            continue
+        for paciente in medico['pacientes']:
+            pagamentos.append({
+                'medico_id': medico['medico_id'],
+                'paciente_id': paciente['paciente_id'],
+                'medico': medico['medico_nome'],
+                'paciente': paciente['paciente_nome'],
+                'sessoes_realizadas': paciente['sessoes_realizadas'],
+                'sessoes_pagas': paciente['sessoes_pagas'],
+                'regra': paciente['regra'],
+                'valor_por_sessao': centavos_para_reais(medico['valor_sessao_centavos']),
+                'valor_por_sessao_centavos': medico['valor_sessao_centavos'],
+                'valor_total': centavos_para_reais(paciente['valor_centavos']),
+                'valor_total_centavos': paciente['valor_centavos'],
+                # Sessões garantidas pagas além das realizadas
+                'finalizado_antes': paciente['sessoes_realizadas'] < paciente['sessoes_pagas']
+            })
+    return pagamentos
+
+
+def _gravar_pagamentos_medicos_externos(cursor, mes_referencia, pagamentos):
+    """Upsert dos pagamentos dos médicos externos no mês"""
+    cursor.executemany('''
+        INSERT INTO pagamentos_medicos_externos 
+        (medico_id, paciente_id, mes_referencia, sessoes_realizadas, 
+         sessoes_pagas, valor_por_sessao, valor_total, finalizado_antes,
+         valor_por_sessao_centavos, valor_total_centavos)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (medico_id, paciente_id, mes_referencia) DO UPDATE SET
+            sessoes_realizadas = excluded.sessoes_realizadas,
+            sessoes_pagas = excluded.sessoes_pagas,
+            valor_por_sessao = excluded.valor_por_sessao,
+            valor_total = excluded.valor_total,
+            finalizado_antes = excluded.finalizado_antes,
+            valor_por_sessao_centavos = excluded.valor_por_sessao_centavos,
+            valor_total_centavos = excluded.valor_total_centavos
+    ''', [(p['medico_id'], p['paciente_id'], mes_referencia, p['sessoes_realizadas'],
+           p['sessoes_pagas'], p['valor_por_sessao'], p['valor_total'], p['finalizado_antes'],
+           p['valor_por_sessao_centavos'], p['valor_total_centavos']) for p in pagamentos])
+    
+    cursor.execute('''
+        DELETE FROM pagamentos_medicos_externos
+        WHERE mes_referencia = ?
+        AND medico_id || '-' || paciente_id NOT IN (SELECT value FROM json_each(?))
+    ''', (mes_referencia, json.dumps([f"{p['medico_id']}-{p['paciente_id']}" for p in pagamentos])))
+
+
 def calcular_pagamentos_medicos_externos(mes_referencia=None):
     """
-    Calcula pagamentos dos médicos externos por sessão (garantindo 8 sessões)
+    Calcula pagamentos dos médicos externos por sessão (regras de regras_pagamento)
     """
     if not mes_referencia:
         mes_referencia = datetime.now().strftime('%Y-%m')
@@ -121,58 +190,8 @@ def calcular_pagamentos_medicos_externos(mes_referencia=None):
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Buscar médicos externos (não vinculados a equipe) com seus valores por sessão
-            cursor.execute('''
-                SELECT DISTINCT p.medico_id, m.nome as medico_nome, m.valor_sessao, 
-                       p.id as paciente_id, p.nome as paciente_nome, p.status
-                FROM pacientes p
-                JOIN medicos m ON p.medico_id = m.id
-                WHERE m.equipe_id IS NULL AND m.ativo = 1
-                AND strftime('%Y-%m', p.data_criacao) <= ?
-            ''', (mes_referencia,))
-            
-            medicos_pacientes = cursor.fetchall()
-            pagamentos = []
-            
-            for mp in medicos_pacientes:
-                # Contar sessões realizadas
-                cursor.execute('''
-                    SELECT COUNT(*) as sessoes_realizadas
-                    FROM sessoes 
-                    WHERE paciente_id = ? AND realizada = 1
-                    AND strftime('%Y-%m', data_sessao) = ?
-                ''', (mp['paciente_id'], mes_referencia))
-                
-                sessoes = cursor.fetchone()
-                sessoes_realizadas = sessoes['sessoes_realizadas'] if sessoes else 0
-                
-                # Médicos externos sempre recebem por 8 sessões (mesmo se finalizar antes)
-                # Usar o valor_sessao específico do médico
-                sessoes_pagas = 8
-                valor_total = sessoes_pagas * mp['valor_sessao']
-                finalizado_antes = sessoes_realizadas < 8 and mp['status'] == 'finalizado'
-                
-                # Registrar pagamento
-                cursor.execute('''
-                    INSERT OR REPLACE INTO pagamentos_medicos_externos 
-                    (medico_id, paciente_id, mes_referencia, sessoes_realizadas, 
-                     sessoes_pagas, valor_por_sessao, valor_total, finalizado_antes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (mp['medico_id'], mp['paciente_id'], mes_referencia, 
-                      sessoes_realizadas, sessoes_pagas, mp['valor_sessao'], 
-                      valor_total, finalizado_antes))
-                
-                pagamentos.append({
-                    'medico': mp['medico_nome'],
-                    'paciente': mp['paciente_nome'],
-                    'sessoes_realizadas': sessoes_realizadas,
-                    'sessoes_pagas': sessoes_pagas,
-                    'valor_por_sessao': mp['valor_sessao'],
-                    'valor_total': valor_total,
-                    'finalizado_antes': finalizado_antes
-                })
-            
+            pagamentos = _apurar_pagamentos_medicos_externos(cursor, mes_referencia)
+            _gravar_pagamentos_medicos_externos(cursor, mes_referencia, pagamentos)
             conn.commit()
             return pagamentos
             
@@ -181,7 +200,7 @@ def calcular_pagamentos_medicos_externos(mes_referencia=None):
         return []
 
 
-def gerar_dados_pagamentos_medicos(mes_referencia=None):
+def gerar_dados_pagamentos_medicos(mes_referencia=None, apuracao=None):
     """
     Gera dados consolidados de pagamentos para todos os médicos (equipe + externos)
     """
@@ -189,103 +208,46 @@ def gerar_dados_pagamentos_medicos(mes_referencia=None):
         mes_referencia = datetime.now().strftime('%Y-%m')
     
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            pagamentos_consolidados = []
-            
-            # Médicos de equipe
-            cursor.execute('''
-                SELECT DISTINCT m.id, m.nome as medico_nome, m.valor_sessao,
-                       e.id as equipe_id, e.nome as equipe_nome, e.porcentagem_participacao,
-                       COUNT(DISTINCT p.id) as total_pacientes,
-                       COUNT(DISTINCT s.id) as total_senhas,
-                       COALESCE(SUM(s.valor), 0) as faturamento_senhas
-                FROM medicos m
-                JOIN equipes e ON m.equipe_id = e.id
-                LEFT JOIN pacientes p ON m.id = p.medico_id
-                LEFT JOIN senhas s ON p.id = s.paciente_id 
-                    AND s.ativo = 1 
-                    AND s.aprovada_admin = 1
-                    AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
-                WHERE m.ativo = 1 AND e.ativo = 1
-                GROUP BY m.id, m.nome, e.id, e.nome, e.porcentagem_participacao
-                HAVING COUNT(DISTINCT s.id) > 0
-            ''', (mes_referencia,))
-            
-            medicos_equipe = cursor.fetchall()
-            
-            for medico in medicos_equipe:
-                valor_a_pagar = medico['faturamento_senhas'] * (medico['porcentagem_participacao'] / 100)
-                pagamentos_consolidados.append({
-                    'medico_nome': medico['medico_nome'],
-                    'equipe_nome': medico['equipe_nome'],
-                    'total_pacientes': medico['total_pacientes'],
-                    'total_senhas': medico['total_senhas'],
-                    'sessoes_realizadas': 0,  # N/A para médicos de equipe
-                    'porcentagem': medico['porcentagem_participacao'],
-                    'valor_por_sessao': medico['valor_sessao'],
-                    'valor_a_pagar': valor_a_pagar
-                })
-            
-            # Médicos externos
-            cursor.execute('''
-                SELECT DISTINCT m.id, m.nome as medico_nome, m.valor_sessao,
-                       COUNT(DISTINCT p.id) as total_pacientes
-                FROM medicos m
-                LEFT JOIN pacientes p ON m.id = p.medico_id
-                WHERE m.equipe_id IS NULL AND m.ativo = 1
-                AND EXISTS (
-                    SELECT 1 FROM pacientes p2 
-                    WHERE p2.medico_id = m.id 
-                    AND strftime('%Y-%m', p2.data_criacao) <= ?
-                )
-                GROUP BY m.id, m.nome, m.valor_sessao
-            ''', (mes_referencia,))
-            
-            medicos_externos = cursor.fetchall()
-            
-            for medico in medicos_externos:
-                # Calcular sessões realizadas no mês
-                cursor.execute('''
-                    SELECT COUNT(*) as sessoes_realizadas
-                    FROM sessoes s
-                    JOIN pacientes p ON s.paciente_id = p.id
-                    WHERE p.medico_id = ? AND s.realizada = 1
-                    AND strftime('%Y-%m', s.data_sessao) = ?
-                ''', (medico['id'], mes_referencia))
-                
-                sessoes_result = cursor.fetchone()
-                sessoes_realizadas = sessoes_result['sessoes_realizadas'] if sessoes_result else 0
-                
-                # Calcular pacientes finalizados (recebem APENAS 8 sessões por pacote)
-                cursor.execute('''
-                    SELECT COUNT(*) as pacientes_finalizados
-                    FROM pacientes p
-                    WHERE p.medico_id = ? AND p.status = 'finalizado'
-                ''', (medico['id'],))
-                
-                finalizados_result = cursor.fetchone()
-                pacientes_finalizados = finalizados_result['pacientes_finalizados'] if finalizados_result else 0
-                
-                # Médico externo recebe APENAS o valor dos pacotes fechados
-                # Quando fecha o pacote, anula todas as sessões feitas anteriormente
-                # Sessões após 2 meses do fechamento não contam
-                valor_a_pagar = pacientes_finalizados * 8 * medico['valor_sessao']
-                
-                pagamentos_consolidados.append({
-                    'medico_nome': medico['medico_nome'],
-                    'equipe_nome': None,
-                    'total_pacientes': medico['total_pacientes'],
-                    'pacientes_finalizados': pacientes_finalizados,
-                    'total_senhas': 0,  # N/A para médicos externos
-                    'sessoes_realizadas': sessoes_realizadas,
-                    'porcentagem': 0,  # N/A para médicos externos
-                    'valor_por_sessao': medico['valor_sessao'],
-                    'valor_a_pagar': valor_a_pagar
-                })
-            
-            return pagamentos_consolidados
-            
+        if apuracao is None:
+            with get_db_connection() as conn:
+                apuracao = apurar_mes(conn.cursor(), mes_referencia)
+        
+        pagamentos_consolidados = []
+        
+        # Médicos de equipe: participação da equipe sobre as senhas dos seus pacientes
+        for medico in apuracao['medicos_equipe']:
+            pagamentos_consolidados.append({
+                'medico_nome': medico['medico_nome'],
+                'equipe_nome': medico['equipe_nome'],
+                'total_pacientes': medico['total_pacientes'],
+                'total_senhas': medico['total_senhas'],
+                'sessoes_realizadas': 0,  # N/A para médicos de equipe
+                'porcentagem': medico['porcentagem'],
+                'valor_por_sessao': 0,
+                'valor_a_pagar': centavos_para_reais(medico['valor_a_pagar_centavos']),
+                'valor_a_pagar_centavos': medico['valor_a_pagar_centavos']
+            })
+        
+        # Médicos externos: sessões pagas pelas regras do mês
+        for medico in apuracao['sessoes_medicos']:
+            if not medico['is_externo'] or not medico['pacientes']:
+                continue
+            pagamentos_consolidados.append({
+                'medico_nome': medico['medico_nome'],
+                'equipe_nome': None,
+                'total_pacientes': len(medico['pacientes']),
+                'pacientes_finalizados': medico['pacientes_garantia'],
+                'total_senhas': 0,  # N/A para médicos externos
+                'sessoes_realizadas': medico['sessoes_realizadas'],
+                'sessoes_pagas': medico['sessoes_pagas'],
+                'porcentagem': 0,  # N/A para médicos externos
+                'valor_por_sessao': centavos_para_reais(medico['valor_sessao_centavos']),
+                'valor_a_pagar': centavos_para_reais(medico['pagamento_centavos']),
+                'valor_a_pagar_centavos': medico['pagamento_centavos']
+            })
+        
+        return pagamentos_consolidados
+        
     except Exception as e:
         logging.error(f"Erro ao gerar dados de pagamentos médicos: {e}")
         return []
@@ -298,27 +260,108 @@ def gerar_relatorio_financeiro_completo(mes_referencia=None):
     if not mes_referencia:
         mes_referencia = datetime.now().strftime('%Y-%m')
     
-    # Recalcular tudo
-    faturamento_clinica = calcular_faturamento_clinica(mes_referencia)
-    pagamentos_equipe = calcular_pagamentos_equipe(mes_referencia)
-    pagamentos_externos = calcular_pagamentos_medicos_externos(mes_referencia)
+    # Recalcular tudo: uma apuração das regras, gravada em todos os ledgers
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            apuracao = apurar_mes(cursor, mes_referencia)
+            
+            faturamento = _apurar_faturamento_clinica(cursor, mes_referencia, apuracao)
+            pagamentos_equipe = _apurar_pagamentos_equipe(cursor, mes_referencia, apuracao)
+            pagamentos_externos = _apurar_pagamentos_medicos_externos(cursor, mes_referencia, apuracao)
+            
+            _gravar_faturamento_clinica(cursor, mes_referencia, faturamento)
+            _gravar_pagamentos_equipe(cursor, mes_referencia, pagamentos_equipe)
+            _gravar_pagamentos_medicos_externos(cursor, mes_referencia, pagamentos_externos)
+            pagamentos_individuais = [
+                _resultado_pagamento_medico(medico, mes_referencia)
+                for medico in apuracao['sessoes_medicos'] if medico['is_externo']
+            ]
+            for resultado in pagamentos_individuais:
+                _gravar_pagamento_medico(cursor, resultado)
+            conn.commit()
+    except Exception as e:
+        logging.error(f"Erro ao gerar relatório financeiro: {e}")
+        return {
+            'mes_referencia': mes_referencia,
+            'faturamento_clinica': 0,
+            'faturamento_clinica_centavos': 0,
+            'pagamentos_equipe': [],
+            'total_pagamentos_equipe': 0,
+            'total_pagamentos_equipe_centavos': 0,
+            'pagamentos_externos': [],
+            'total_pagamentos_externos': 0,
+            'total_pagamentos_externos_centavos': 0,
+            'pagamentos_medicos': [],
+            'pagamentos_individuais': [],
+            'total_pagamentos_medicos': 0,
+            'total_pagamentos': 0,
+            'resultado_liquido': 0,
+            'resultado_liquido_centavos': 0
+        }
     
     # Calcular dados consolidados dos pagamentos médicos
-    pagamentos_medicos = gerar_dados_pagamentos_medicos(mes_referencia)
+    pagamentos_medicos = gerar_dados_pagamentos_medicos(mes_referencia, apuracao)
     
-    total_pagamentos_equipe = sum([p['valor'] for p in pagamentos_equipe])
-    total_pagamentos_externos = sum([p['valor_total'] for p in pagamentos_externos])
-    total_pagamentos_medicos = sum([p['valor_a_pagar'] for p in pagamentos_medicos])
+    # Totais somados em centavos inteiros e convertidos para reais só no final
+    total_equipe_centavos = apuracao['total_equipes_centavos']
+    total_externos_centavos = apuracao['total_externos_centavos']
+    total_medicos_centavos = somar_centavos(p['valor_a_pagar_centavos'] for p in pagamentos_medicos)
     
     return {
         'mes_referencia': mes_referencia,
-        'faturamento_clinica': faturamento_clinica,
+        'faturamento_clinica': centavos_para_reais(apuracao['faturamento_centavos']),
+        'faturamento_clinica_centavos': apuracao['faturamento_centavos'],
         'pagamentos_equipe': pagamentos_equipe,
-        'total_pagamentos_equipe': total_pagamentos_equipe,
+        'total_pagamentos_equipe': centavos_para_reais(total_equipe_centavos),
+        'total_pagamentos_equipe_centavos': total_equipe_centavos,
         'pagamentos_externos': pagamentos_externos,
-        'total_pagamentos_externos': total_pagamentos_externos,
+        'total_pagamentos_externos': centavos_para_reais(total_externos_centavos),
+        'total_pagamentos_externos_centavos': total_externos_centavos,
         'pagamentos_medicos': pagamentos_medicos,
-        'total_pagamentos_medicos': total_pagamentos_medicos,
-        'total_pagamentos': total_pagamentos_equipe + total_pagamentos_externos,
-        'resultado_liquido': faturamento_clinica - (total_pagamentos_equipe + total_pagamentos_externos)
-    }
\ No newline at end of file
+        'pagamentos_individuais': pagamentos_individuais,
+        'total_pagamentos_medicos': centavos_para_reais(total_medicos_centavos),
+        'total_pagamentos': centavos_para_reais(total_equipe_centavos + total_externos_centavos),
+        'resultado_liquido': centavos_para_reais(apuracao['resultado_centavos']),
+        'resultado_liquido_centavos': apuracao['resultado_centavos']
+    }
+
+
+def marcar_pagamentos_mes_efetuados(mes_referencia, favorecidos):
+    """
+    Marca como pagos, numa única transação, os favorecidos da remessa do mês
+    (tipo 'medico' ou 'equipe', favorecido_id, valor_centavos). Um favorecido só é marcado
+    se o valor em aberto ainda é o da remessa; os que mudaram desde então ficam em aberto.
+    Retorna os lançamentos marcados por tipo e os favorecidos divergentes.
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            marcados = {'medicos': 0, 'equipes': 0, 'divergentes': []}
+            for tipo, favorecido_id, valor_centavos in favorecidos:
+                if tipo == 'medico':
+                    tabela, coluna, valor, aberto = ('faturamento_medicos', 'medico_id', 'valor_total_centavos',
+                                                     "status != 'pago'")
+                else:
+                    tabela, coluna, valor, aberto = ('pagamentos_equipe', 'equipe_id', 'valor_equipe_centavos',
+                                                     "COALESCE(status, '') != 'pago'")
+                filtro = f"mes_referencia = ? AND {coluna} = ? AND {aberto}"
+                cursor.execute(f'SELECT COALESCE(SUM({valor}), 0) FROM {tabela} WHERE {filtro}',
+                               (mes_referencia, favorecido_id))
+                if cursor.fetchone()[0] != valor_centavos:
+                    marcados['divergentes'].append({'tipo': tipo, 'favorecido_id': favorecido_id})
+                    continue
+                cursor.execute(f'''
+                    UPDATE {tabela} SET status = 'pago', data_pagamento = CURRENT_TIMESTAMP
+                    WHERE {filtro} AND {valor} > 0
+                ''', (mes_referencia, favorecido_id))
+                marcados['medicos' if tipo == 'medico' else 'equipes'] += cursor.rowcount
+            
+            conn.commit()
+            return marcados
+            
+    except Exception as e:
+        logging.error(f"Erro ao marcar pagamentos do mês: {e}")
+        return None
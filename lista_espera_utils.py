@@ -0,0 +1,199 @@
+"""
+Waitlist: refilling a doctor's slot when a patient cancels
+
+Patients wait for a doctor at a location (``lista_espera``, one row per request;
+higher prioridade first, then the oldest). When a patient rejects a confirmation
+``cancelar_pelo_paciente`` cancels the appointment, which frees the slot in the
+doctor's calendar, and ``ofertar_vaga`` books the next eligible waiting patient
+into it with a pending confirmation and queues the offer in the notification
+outbox. If that patient declines too, the same path offers it to the next one.
+
+The queues live in memory, one heap per (doctor, location) built from the table,
+so the next patient is a heap pop, O(log n). The index follows the table version
+(versoes_tabelas): its own writes are applied in place and any other change (the
+waitlist pages, another process) makes it rebuild on the next use. Entries that
+are no longer waiting when popped are discarded (lazy deletion).
+"""
+import heapq
+import threading
+from datetime import datetime, timedelta
+from agenda_utils import DURACAO_PADRAO_MINUTOS, conflitos, converter_data_consulta
+from database import obter_versoes_tabelas
+from datas_utils import FORMATO_CANONICO
+
+# Prioridades da lista de espera (a maior sai primeiro)
+PRIORIDADES = {0: 'Normal', 1: 'Alta', 2: 'Urgente'}
+
+# Vagas que começam antes disso (minutos) não são ofertadas: não haveria tempo de avisar
+ANTECEDENCIA_MINIMA_OFERTA = 120
+
+
+def _item(entrada):
+    return (-entrada['prioridade'], entrada['criado_em'], entrada['id'])
+
+
+class IndiceEspera:
+    """Filas da lista de espera em heaps por (medico_id, localizacao)"""
+
+    def __init__(self):
+        self._filas = {}
+        self._versao = None
+        self._trava = threading.Lock()
+
+    def _versao_atual(self, cursor):
+        return obter_versoes_tabelas(['lista_espera'], cursor)['lista_espera']
+
+    def _sincronizar(self, cursor):
+        versao = self._versao_atual(cursor)
+        if versao == self._versao:
+            return
+        cursor.execute('''
+            SELECT id, medico_id, localizacao, prioridade, criado_em
+            FROM lista_espera WHERE status = 'aguardando'
+        ''')
+        filas = {}
+        for entrada in cursor.fetchall():
+            filas.setdefault((entrada['medico_id'], entrada['localizacao']), []).append(_item(entrada))
+        for fila in filas.values():
+            heapq.heapify(fila)
+        self._filas, self._versao = filas, versao
+
+    def _apos_escrita(self, cursor, versao_anterior):
+        """Mantém o índice se a única mudança na tabela foi a nossa; senão reconstrói depois"""
+        versao = self._versao_atual(cursor)
+        self._versao = versao if versao == versao_anterior + 1 else None
+
+    def adicionar(self, cursor, paciente_id, medico_id, localizacao, prioridade=0, observacoes=None):
+        """Coloca o paciente na fila (uma entrada aguardando por paciente e médico); retorna o id"""
+        with self._trava:
+            self._sincronizar(cursor)
+            versao = self._versao
+            cursor.execute('''
+                INSERT INTO lista_espera (paciente_id, medico_id, localizacao, prioridade, observacoes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (paciente_id, medico_id, localizacao, prioridade, observacoes))
+            entrada_id = cursor.lastrowid
+            cursor.execute('SELECT id, prioridade, criado_em FROM lista_espera WHERE id = ?', (entrada_id,))
+            heapq.heappush(self._filas.setdefault((medico_id, localizacao), []), _item(cursor.fetchone()))
+            self._apos_escrita(cursor, versao)
+            return entrada_id
+
+    def retirar(self, cursor, medico_id, localizacao, elegivel):
+        """
+        Próxima entrada aguardando da fila para a qual elegivel(entrada) é verdadeiro, já
+        retirada da fila em memória (o chamador grava a oferta com ``marcar_ofertada``).
+        As que não são elegíveis agora voltam para a fila.
+        """
+        with self._trava:
+            self._sincronizar(cursor)
+            fila = self._filas.get((medico_id, localizacao), [])
+            adiadas, escolhida = [], None
+            while fila:
+                item = heapq.heappop(fila)
+                cursor.execute("SELECT * FROM lista_espera WHERE id = ? AND status = 'aguardando'", (item[2],))
+                entrada = cursor.fetchone()
+                if entrada is None:
+                    continue  # removida ou ofertada desde a construção do índice
+                if elegivel(entrada):
+                    escolhida = entrada
+                    break
+                adiadas.append(item)
+            for item in adiadas:
+                heapq.heappush(fila, item)
+            return escolhida
+
+    def marcar_ofertada(self, cursor, entrada_id, agendamento_id):
+        with self._trava:
+            versao = self._versao
+            cursor.execute('''
+                UPDATE lista_espera SET status = 'ofertada', agendamento_id = ?, data_oferta = ?
+                WHERE id = ?
+            ''', (agendamento_id, datetime.now().strftime(FORMATO_CANONICO), entrada_id))
+            if versao is not None:
+                self._apos_escrita(cursor, versao)
+
+    def invalidar(self):
+        """Reconstrói na próxima consulta (uma entrada retirada não chegou a ser gravada)"""
+        with self._trava:
+            self._versao = None
+
+
+indice = IndiceEspera()
+
+
+def ofertar_vaga(cursor, agendamento_id, agora=None):
+    """
+    Oferece o horário do agendamento cancelado ao próximo da lista de espera do médico
+    no mesmo local: cria a consulta dele (confirmação pendente, já disponível) e enfileira
+    o aviso. Retorna o id do novo agendamento ou None se ninguém pôde receber a vaga.
+    """
+    agora = agora or datetime.now()
+    cursor.execute('''
+        SELECT a.paciente_id, a.medico_id, a.data_consulta, a.duracao_minutos, p.localizacao
+        FROM agendamentos a JOIN pacientes p ON a.paciente_id = p.id
+        WHERE a.id = ?
+    ''', (agendamento_id,))
+    vaga = cursor.fetchone()
+    if not vaga:
+        return None
+    try:
+        inicio = converter_data_consulta(vaga['data_consulta'])
+    except ValueError:
+        return None
+    duracao = vaga['duracao_minutos'] or DURACAO_PADRAO_MINUTOS
+    if inicio < agora + timedelta(minutes=ANTECEDENCIA_MINIMA_OFERTA):
+        return None
+    if conflitos(cursor, vaga['medico_id'], inicio, duracao):
+        return None  # o horário já foi ocupado
+
+    dia = inicio.strftime('%Y-%m-%d')
+
+    def elegivel(entrada):
+        # Paciente ativo, que não é quem cancelou e não tem outra consulta nesse dia
+        if entrada['paciente_id'] == vaga['paciente_id']:
+            return False
+        cursor.execute('''
+            SELECT 1 FROM pacientes p
+            WHERE p.id = ? AND p.status = 'ativo'
+            AND NOT EXISTS (SELECT 1 FROM agendamentos a
+                            WHERE a.paciente_id = p.id AND a.status = 'agendado'
+                            AND a.data_consulta >= ? AND a.data_consulta < date(?, '+1 day'))
+        ''', (entrada['paciente_id'], dia, dia))
+        return cursor.fetchone() is not None
+
+    entrada = indice.retirar(cursor, vaga['medico_id'], vaga['localizacao'], elegivel)
+    if entrada is None:
+        return None
+
+    try:
+        cursor.execute('''
+            INSERT INTO agendamentos
+            (paciente_id, medico_id, data_consulta, duracao_minutos, observacoes, criado_por)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (entrada['paciente_id'], vaga['medico_id'], inicio.strftime(FORMATO_CANONICO), duracao,
+              'Vaga da lista de espera', vaga['medico_id']))
+        novo_id = cursor.lastrowid
+        cursor.execute('''
+            INSERT INTO confirmacoes_consulta (agendamento_id, disponivel_confirmacao, data_disponibilizacao)
+            VALUES (?, 1, ?)
+        ''', (novo_id, agora.strftime(FORMATO_CANONICO)))
+        indice.marcar_ofertada(cursor, entrada['id'], novo_id)
+    except Exception:
+        indice.invalidar()
+        raise
+
+    from notificacoes import notificar_vaga_ofertada
+    notificar_vaga_ofertada(cursor, novo_id)
+    return novo_id
+
+
+def cancelar_pelo_paciente(cursor, agendamento_id):
+    """
+    Cancela a consulta recusada pelo paciente (libera o horário na agenda do médico) e
+    oferece a vaga à lista de espera; retorna o id da consulta ofertada ou None
+    """
+    cursor.execute("UPDATE agendamentos SET status = 'cancelado' WHERE id = ? AND status = 'agendado'",
+                   (agendamento_id,))
+    if not cursor.rowcount:
+        return None
+    return ofertar_vaga(cursor, agendamento_id)
@@ -1,9 +1,8 @@
 from app import app
 
 if __name__ == '__main__':
-    from database import verificar_confirmacoes_disponiveis
-    
-    # Check for appointments that need confirmation
-    verificar_confirmacoes_disponiveis()
+    # Bring the daily rollup up to date (afterwards the scheduler keeps it current)
+    from rollup_utils import atualizar_rollup_diario
+    atualizar_rollup_diario()
     
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -2,19 +2,100 @@
 Sistema de Pagamento de Médicos Externos
 =======================================
 
-Lógica de pagamento:
-1. Médico recebe valor específico por sessão (R$ 16,00 padrão)
+Lógica de pagamento (definida em regras_pagamento):
+1. Médico recebe valor específico por sessão (padrão: valor_sessao_medico_externo)
 2. Durante o mês, sessões são contabilizadas
-3. Se laudo for fechado no mês de início do tratamento:
-   - Garantia de pagamento de 8 sessões completas
+3. Se laudo for fechado no mês de início do tratamento (garantia_8_sessoes ligada):
+   - Garantia de pagamento das sessões garantidas (sessoes_garantidas, 8)
    - Se faltaram sessões, são pagas automaticamente
 4. Pagamento mensal baseado no número de sessões efetivamente pagas
 """
 
+import json
 import sqlite3
 from datetime import datetime, timedelta
-import calendar
 from database import get_db_connection
+from dinheiro_utils import centavos_para_reais, somar_centavos
+from regras_pagamento import apurar_mes
+
+def _resultado_pagamento_medico(medico, mes_referencia):
+    """
+    Converte o médico de uma apuração de regras_pagamento no resultado deste módulo
+    """
+    return {
+        'medico_nome': medico['medico_nome'],
+        'medico_id': medico['medico_id'],
+        'is_externo': medico['is_externo'],
+        'valor_sessao': centavos_para_reais(medico['valor_sessao_centavos']),
+        'valor_sessao_centavos': medico['valor_sessao_centavos'],
+        'sessoes_garantidas': medico['sessoes_garantidas'],
+        'mes_referencia': mes_referencia,
+        'pagamento_total': centavos_para_reais(medico['pagamento_centavos']),
+        'pagamento_total_centavos': medico['pagamento_centavos'],
+        'total_pacientes': len(medico['pacientes']),
+        'detalhes_pacientes': [
+            {
+                'paciente_id': paciente['paciente_id'],
+                'paciente_nome': paciente['paciente_nome'],
+                'sessoes_realizadas': paciente['sessoes_realizadas'],
+                'sessoes_pagas': paciente['sessoes_pagas'],
+                'valor_paciente': centavos_para_reais(paciente['valor_centavos']),
+                'valor_paciente_centavos': paciente['valor_centavos'],
+                'laudo_finalizado': paciente['laudo_mes_inicio'],
+                'laudo_garantia': paciente['regra'] == 'garantia_laudo_mes_inicio',
+                'regra': paciente['regra'],
+                'mes_inicio': paciente['mes_inicio']
+            }
+            for paciente in medico['pacientes']
+        ]
+    }
+
+def _apurar_pagamento_medico(cursor, medico_id, mes_referencia):
+    """
+    Apura (sem gravar) o pagamento de um médico no mês; funciona com conexões somente leitura
+    """
+    apuracao = apurar_mes(cursor, mes_referencia, medico_id=medico_id)
+    if not apuracao['sessoes_medicos']:
+        return {"erro": "Médico não encontrado"}
+    
+    return _resultado_pagamento_medico(apuracao['sessoes_medicos'][0], mes_referencia)
+
+def _gravar_pagamento_medico(cursor, resultado):
+    """
+    Upsert do faturamento do médico no mês. Registros já pagos ficam como foram pagos;
+    pacientes que deixaram de contar no mês são removidos (exceto os já pagos).
+    """
+    medico_id, mes_referencia = resultado['medico_id'], resultado['mes_referencia']
+    valor_sessao_centavos = resultado['valor_sessao_centavos']
+    
+    cursor.executemany('''
+        INSERT INTO faturamento_medicos 
+        (medico_id, paciente_id, mes_referencia, sessoes_realizadas, 
+         sessoes_garantidas, laudo_finalizado, valor_por_sessao, 
+         sessoes_pagas, valor_total, valor_por_sessao_centavos, valor_total_centavos, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'calculado')
+        ON CONFLICT (medico_id, paciente_id, mes_referencia) DO UPDATE SET
+            sessoes_realizadas = excluded.sessoes_realizadas,
+            sessoes_garantidas = excluded.sessoes_garantidas,
+            laudo_finalizado = excluded.laudo_finalizado,
+            valor_por_sessao = excluded.valor_por_sessao,
+            sessoes_pagas = excluded.sessoes_pagas,
+            valor_total = excluded.valor_total,
+            valor_por_sessao_centavos = excluded.valor_por_sessao_centavos,
+            valor_total_centavos = excluded.valor_total_centavos,
+            data_calculo = CURRENT_TIMESTAMP,
+            status = 'calculado'
+        WHERE faturamento_medicos.status != 'pago'
+    ''', [(medico_id, d['paciente_id'], mes_referencia, d['sessoes_realizadas'],
+           resultado['sessoes_garantidas'], 1 if d['laudo_finalizado'] else 0, centavos_para_reais(valor_sessao_centavos),
+           d['sessoes_pagas'], d['valor_paciente'], valor_sessao_centavos, d['valor_paciente_centavos'])
+          for d in resultado['detalhes_pacientes']])
+    
+    cursor.execute('''
+        DELETE FROM faturamento_medicos
+        WHERE medico_id = ? AND mes_referencia = ? AND status != 'pago'
+        AND paciente_id NOT IN (SELECT value FROM json_each(?))
+    ''', (medico_id, mes_referencia, json.dumps([d['paciente_id'] for d in resultado['detalhes_pacientes']])))
 
 def calcular_pagamento_medico_mensal(medico_id, mes_referencia=None):
     """
@@ -30,114 +111,16 @@ def calcular_pagamento_medico_mensal(medico_id, mes_referencia=None):
     if not mes_referencia:
         mes_referencia = datetime.now().strftime("%Y-%m")
     
-    ano, mes = map(int, mes_referencia.split('-'))
-    primeiro_dia = f"{ano}-{mes:02d}-01"
-    ultimo_dia = f"{ano}-{mes:02d}-{calendar.monthrange(ano, mes)[1]}"
-    
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
-        # Obter informações do médico
-        cursor.execute('''
-            SELECT nome, valor_sessao, equipe_id 
-            FROM medicos 
-            WHERE id = ? AND ativo = 1
-        ''', (medico_id,))
-        
-        medico = cursor.fetchone()
-        if not medico:
-            return {"erro": "Médico não encontrado"}
+        resultado = _apurar_pagamento_medico(cursor, medico_id, mes_referencia)
+        # Médico de equipe é pago pela participação da equipe, não entra no faturamento por sessão
+        if 'erro' not in resultado and resultado['is_externo']:
+            _gravar_pagamento_medico(cursor, resultado)
+            conn.commit()
         
-        # Verificar se é médico externo (sem equipe)
-        is_externo = medico['equipe_id'] is None
-        valor_sessao = medico['valor_sessao'] or 16.00
-        
-        # Buscar todos os pacientes do médico
-        cursor.execute('''
-            SELECT id, nome, data_criacao
-            FROM pacientes 
-            WHERE medico_id = ? AND status = 'ativo'
-        ''', (medico_id,))
-        
-        pacientes = cursor.fetchall()
-        
-        pagamento_total = 0
-        detalhes_pacientes = []
-        
-        for paciente in pacientes:
-            paciente_id = paciente['id']
-            data_inicio = datetime.strptime(paciente['data_criacao'][:10], "%Y-%m-%d")
-            mes_inicio = data_inicio.strftime("%Y-%m")
-            
-            # Contar sessões realizadas no mês (tabela sessoes não tem medico_id)
-            cursor.execute('''
-                SELECT COUNT(*) as sessoes_realizadas
-                FROM sessoes 
-                WHERE paciente_id = ?
-                AND data_sessao BETWEEN ? AND ?
-                AND realizada = 1
-            ''', (paciente_id, primeiro_dia, ultimo_dia))
-            
-            sessoes_realizadas = cursor.fetchone()['sessoes_realizadas']
-            
-            # Verificar se laudo foi liberado no mês de início  
-            cursor.execute('''
-                SELECT liberado_entrega, data_liberacao
-                FROM laudos 
-                WHERE paciente_id = ?
-            ''', (paciente_id,))
-            
-            laudo = cursor.fetchone()
-            laudo_fechado_mes_inicio = False
-            
-            if laudo and laudo['liberado_entrega'] == 1 and laudo['data_liberacao']:
-                data_liberacao = datetime.strptime(laudo['data_liberacao'][:10], "%Y-%m-%d")
-                mes_liberacao = data_liberacao.strftime("%Y-%m")
-                laudo_fechado_mes_inicio = (mes_liberacao == mes_inicio)
-            
-            # Calcular sessões a pagar
-            if is_externo and laudo_fechado_mes_inicio and mes_referencia == mes_inicio:
-                # Médico externo + laudo fechado no mês de início = garantia de 8 sessões
-                sessoes_pagas = 8
-            else:
-                # Pagamento normal: apenas sessões efetivamente realizadas
-                sessoes_pagas = sessoes_realizadas
-            
-            valor_paciente = sessoes_pagas * valor_sessao
-            pagamento_total += valor_paciente
-            
-            # Atualizar/inserir registro de faturamento
-            cursor.execute('''
-                INSERT OR REPLACE INTO faturamento_medicos 
-                (medico_id, paciente_id, mes_referencia, sessoes_realizadas, 
-                 sessoes_garantidas, laudo_finalizado, valor_por_sessao, 
-                 sessoes_pagas, valor_total, status)
-                VALUES (?, ?, ?, ?, 8, ?, ?, ?, ?, 'calculado')
-            ''', (medico_id, paciente_id, mes_referencia, sessoes_realizadas,
-                  1 if laudo_fechado_mes_inicio else 0, valor_sessao, 
-                  sessoes_pagas, valor_paciente))
-            
-            detalhes_pacientes.append({
-                'paciente_nome': paciente['nome'],
-                'sessoes_realizadas': sessoes_realizadas,
-                'sessoes_pagas': sessoes_pagas,
-                'valor_paciente': valor_paciente,
-                'laudo_garantia': laudo_fechado_mes_inicio and is_externo,
-                'mes_inicio': mes_inicio
-            })
-        
-        conn.commit()
-        
-        return {
-            'medico_nome': medico['nome'],
-            'medico_id': medico_id,
-            'is_externo': is_externo,
-            'valor_sessao': valor_sessao,
-            'mes_referencia': mes_referencia,
-            'pagamento_total': pagamento_total,
-            'total_pacientes': len(pacientes),
-            'detalhes_pacientes': detalhes_pacientes
-        }
+        return resultado
 
 def calcular_pagamentos_todos_medicos(mes_referencia=None):
     """
@@ -149,30 +132,24 @@ def calcular_pagamentos_todos_medicos(mes_referencia=None):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
-        # Buscar médicos externos (sem equipe)
-        cursor.execute('''
-            SELECT id, nome, valor_sessao
-            FROM medicos 
-            WHERE ativo = 1 AND equipe_id IS NULL
-            ORDER BY nome
-        ''')
-        
-        medicos_externos = cursor.fetchall()
-        
-        resultados = []
-        total_geral = 0
+        # Uma apuração para todos os médicos externos (sem equipe)
+        apuracao = apurar_mes(cursor, mes_referencia)
+        resultados = [
+            _resultado_pagamento_medico(medico, mes_referencia)
+            for medico in apuracao['sessoes_medicos'] if medico['is_externo']
+        ]
+        for resultado in resultados:
+            _gravar_pagamento_medico(cursor, resultado)
+        conn.commit()
         
-        for medico in medicos_externos:
-            resultado = calcular_pagamento_medico_mensal(medico['id'], mes_referencia)
-            if 'erro' not in resultado:
-                resultados.append(resultado)
-                total_geral += float(resultado.get('pagamento_total', 0))
+        total_geral_centavos = somar_centavos(r['pagamento_total_centavos'] for r in resultados)
         
         return {
             'mes_referencia': mes_referencia,
             'total_medicos': len(resultados),
             'pagamentos_individuais': resultados,
-            'total_geral': total_geral
+            'total_geral': centavos_para_reais(total_geral_centavos),
+            'total_geral_centavos': total_geral_centavos
         }
 
 def obter_historico_pagamento_medico(medico_id, limite_meses=6):
@@ -188,7 +165,7 @@ def obter_historico_pagamento_medico(medico_id, limite_meses=6):
                 COUNT(DISTINCT paciente_id) as total_pacientes,
                 SUM(sessoes_realizadas) as total_sessoes_realizadas,
                 SUM(sessoes_pagas) as total_sessoes_pagas,
-                SUM(valor_total) as valor_total,
+                SUM(valor_total_centavos) / 100.0 as valor_total,
                 SUM(laudo_finalizado) as laudos_finalizados
             FROM faturamento_medicos
             WHERE medico_id = ?
@@ -0,0 +1,154 @@
+"""
+Live dashboard metrics (Server-Sent Events / long-poll)
+
+A single feed thread per process watches ``versoes_tabelas`` (bumped by triggers
+on every write) for the tables behind the live metrics. Only when one of those
+versions changes, or the day rolls over, are the metrics recomputed, and only the
+values that actually changed are published to the waiting clients. The cost of an
+open dashboard is therefore a wait on a condition variable: the database sees one
+version lookup per interval per process, however many dashboards are connected,
+and the thread sleeps while nobody is listening.
+
+Cursores são '<instância>:<sequência>'; um cursor de outro processo (ou antigo
+demais) recebe o snapshot completo em vez do delta.
+"""
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import date
+from database import get_db_connection, obter_versoes_tabelas
+from dinheiro_utils import centavos_para_reais
+
+# Tabelas lidas pelas métricas ao vivo
+TABELAS_METRICAS = ['senhas', 'sessoes', 'confirmacoes_consulta']
+
+# Intervalo (segundos) entre leituras das versões pelo feed
+INTERVALO_FEED = 2
+
+# Quantos deltas recentes são guardados para clientes que reconectam
+MAX_ALTERACOES = 100
+
+
+def calcular_metricas(cursor, hoje=None):
+    """Valores atuais das métricas ao vivo"""
+    hoje = hoje or date.today().isoformat()
+    cursor.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM senhas WHERE aprovada_admin = 0 AND ativo = 1) as senhas_pendentes,
+            (SELECT COALESCE(SUM(valor_centavos), 0) FROM senhas
+             WHERE aprovada_admin = 0 AND ativo = 1) as valor_pendente_centavos,
+            (SELECT COUNT(*) FROM sessoes
+             WHERE data_sessao >= :hoje AND data_sessao < date(:hoje, '+1 day')) as sessoes_hoje,
+            (SELECT COUNT(*) FROM sessoes
+             WHERE data_sessao >= :hoje AND data_sessao < date(:hoje, '+1 day')
+             AND realizada = 1) as sessoes_realizadas_hoje,
+            (SELECT COUNT(*) FROM confirmacoes_consulta
+             WHERE disponivel_confirmacao = 1 AND confirmado IS NULL) as confirmacoes_pendentes,
+            (SELECT COUNT(*) FROM confirmacoes_consulta
+             WHERE confirmado = 1 AND date(data_confirmacao) = :hoje) as confirmacoes_hoje
+    ''', {'hoje': hoje})
+    metricas = dict(cursor.fetchone())
+    metricas['valor_pendente'] = centavos_para_reais(metricas.pop('valor_pendente_centavos'))
+    return metricas
+
+
+class FeedMetricas:
+    """Publica as métricas alteradas para os clientes que aguardam (SSE ou long-poll)"""
+
+    def __init__(self, intervalo=INTERVALO_FEED):
+        self.intervalo = intervalo
+        self.instancia = uuid.uuid4().hex[:8]
+        self.sequencia = 0
+        self.metricas = None
+        self._alteracoes = OrderedDict()
+        self._versoes = None
+        self._dia = None
+        self._clientes = 0
+        self._condicao = threading.Condition()
+        self._thread = None
+
+    def cursor_atual(self):
+        return f'{self.instancia}:{self.sequencia}'
+
+    def _iniciar(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._executar, name='feed-metricas', daemon=True)
+            self._thread.start()
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                while self._clientes == 0:
+                    self._condicao.wait()
+            try:
+                self.verificar()
+            except Exception as e:
+                logging.error(f"Erro no feed de métricas ao vivo: {e}")
+            with self._condicao:
+                self._condicao.wait(self.intervalo)
+
+    def verificar(self):
+        """Recalcula as métricas se alguma tabela mudou (ou o dia virou) e publica o delta"""
+        hoje = date.today().isoformat()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            versoes = obter_versoes_tabelas(TABELAS_METRICAS, cursor)
+            if versoes == self._versoes and hoje == self._dia and self.metricas is not None:
+                return
+            novas = calcular_metricas(cursor, hoje)
+
+        with self._condicao:
+            self._versoes, self._dia = versoes, hoje
+            anteriores = self.metricas or {}
+            alteradas = {chave: valor for chave, valor in novas.items() if anteriores.get(chave) != valor}
+            self.metricas = novas
+            if not alteradas:
+                return
+            self.sequencia += 1
+            self._alteracoes[self.sequencia] = alteradas
+            while len(self._alteracoes) > MAX_ALTERACOES:
+                self._alteracoes.popitem(last=False)
+            self._condicao.notify_all()
+
+    def _alteracoes_desde(self, cursor):
+        """Métricas alteradas depois do cursor, ou todas se o cursor não é deste feed"""
+        if self.metricas is None:
+            return {}
+        instancia, _, sequencia = (cursor or '').partition(':')
+        if instancia != self.instancia or not sequencia.isdigit():
+            return dict(self.metricas)
+        sequencia = int(sequencia)
+        if sequencia >= self.sequencia:
+            return {}
+        if sequencia + 1 not in self._alteracoes:
+            return dict(self.metricas)
+        alteradas = {}
+        for seq in range(sequencia + 1, self.sequencia + 1):
+            alteradas.update(self._alteracoes[seq])
+        return alteradas
+
+    def aguardar(self, cursor=None, timeout=25):
+        """
+        Espera até haver métricas novas para o cursor (ou o timeout).
+        Retorna (novo_cursor, métricas alteradas); {} quando nada mudou.
+        """
+        with self._condicao:
+            self._clientes += 1
+            self._iniciar()
+            self._condicao.notify_all()
+        try:
+            if self.metricas is None:
+                self.verificar()
+            with self._condicao:
+                alteradas = self._alteracoes_desde(cursor)
+                if not alteradas:
+                    self._condicao.wait_for(lambda: self._alteracoes_desde(cursor), timeout)
+                    alteradas = self._alteracoes_desde(cursor)
+                return self.cursor_atual(), alteradas
+        finally:
+            with self._condicao:
+                self._clientes -= 1
+
+
+feed_metricas = FeedMetricas()
@@ -0,0 +1,584 @@
+"""
+Notification outbox and its dispatcher
+
+Requests never send messages: the code that confirms an appointment, approves a
+password or releases a laudo calls ``notificar_*`` with its own cursor, which
+writes the messages to ``notificacoes_saida`` in the same transaction (if the
+change rolls back, so do its notifications; a repeated event is ignored by the
+unique key). The background scheduler (agendador.py) runs ``despachar``: it
+claims a batch of due messages by pushing their next attempt forward, hands each
+channel its messages in batches of the provider's size (one SMTP connection per
+batch) and records the outcome; failures are retried with exponential backoff
+until MAX_TENTATIVAS. A channel with a rate limit takes a token per message from
+its bucket (LimiteTaxa); what the bucket cannot cover waits for the next run
+without counting as an attempt.
+
+Appointment reminders (LEMBRETES, 24h and 2h before data_consulta) are queued by
+``enfileirar_lembretes``, also from the scheduler: a range query on the indexed
+data_consulta picks the appointments entering each window and
+``lembretes_consulta`` keeps one row per appointment, reminder and date, so a
+patient is never reminded twice of the same appointment.
+
+Canais: SMTP (SMTP_HOST, SMTP_PORT, SMTP_USUARIO, SMTP_SENHA, SMTP_REMETENTE,
+SMTP_TLS), WhatsApp e SMS por gateways HTTP (WHATSAPP_API_URL, WHATSAPP_TOKEN,
+WHATSAPP_TAXA; SMS_API_URL, SMS_TOKEN, SMS_TAXA; taxa em mensagens por segundo).
+Um canal sem as variáveis de ambiente fica de fora: as mensagens dele continuam
+pendentes (ultimo_erro 'canal não configurado'), sem gastar tentativas, até o canal
+ser configurado. Com NOTIFICACOES_CANAL_LOCAL=1 (desenvolvimento) os canais não
+configurados usam um substituto local que só registra as mensagens no log. Os lembretes vão pelo canal LEMBRETES_CANAL (padrão whatsapp) e não são
+enfileirados enquanto ele não estiver configurado: um lembrete pendente sairia
+atrasado quando o canal fosse configurado.
+
+Uso manual (enfileira os lembretes e envia o que estiver vencido):
+    python notificacoes.py
+"""
+import json
+import logging
+import os
+import re
+import smtplib
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from agenda_utils import converter_data_consulta
+from database import get_db_connection
+from datas_utils import FORMATO_CANONICO, rotulos_data
+
+# Mensagens por lote e lotes por execução do despachante
+TAMANHO_LOTE = 50
+MAX_LOTES = 10
+
+# Tentativas antes de desistir; espera entre elas = BACKOFF_BASE * 2^(tentativa - 1), até BACKOFF_MAXIMO
+MAX_TENTATIVAS = 6
+BACKOFF_BASE = 60
+BACKOFF_MAXIMO = 6 * 3600
+
+# Uma mensagem reservada volta a ficar disponível depois disso se o envio não terminou
+PRAZO_ENVIO = 300
+
+# Mensagens de um canal não configurado voltam a ser verificadas depois disso (segundos)
+ESPERA_CANAL_NAO_CONFIGURADO = 3600
+
+# Quanto o despachante espera por fichas de um canal limitado antes de adiar o resto
+ESPERA_MAXIMA_TAXA = 5
+
+# Mensagens por segundo e por requisição dos gateways HTTP (padrões se o ambiente não define)
+TAXA_GATEWAY = 5
+TAMANHO_LOTE_GATEWAY = 20
+
+# Lembretes de consulta: (evento, antecedência em minutos). Cada um cobre as consultas
+# entre a antecedência do lembrete seguinte (mais curta) e a sua
+LEMBRETES = (('lembrete_24h', 24 * 60), ('lembrete_2h', 2 * 60))
+CANAL_LEMBRETES = os.environ.get('LEMBRETES_CANAL', 'whatsapp')
+
+
+class LimiteTaxa:
+    """Balde de fichas: até `capacidade` mensagens de uma vez, repostas a `taxa` por segundo"""
+
+    def __init__(self, taxa, capacidade=None, relogio=time.monotonic):
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade or taxa)
+        self.fichas = self.capacidade
+        self.relogio = relogio
+        self.atualizado = relogio()
+        self._trava = threading.Lock()
+
+    def _repor(self):
+        agora = self.relogio()
+        self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    def retirar(self, quantidade, espera_maxima=0):
+        """Retira até `quantidade` fichas esperando no máximo `espera_maxima` segundos; retorna quantas"""
+        limite = self.relogio() + espera_maxima
+        while True:
+            with self._trava:
+                self._repor()
+                disponiveis = min(quantidade, int(self.fichas))
+                if disponiveis:
+                    self.fichas -= disponiveis
+                    return disponiveis
+                espera = (1 - self.fichas) / self.taxa
+            if self.relogio() + espera > limite:
+                return 0
+            time.sleep(espera)
+
+    def espera(self, quantidade):
+        """Segundos até haver fichas para `quantidade` mensagens"""
+        with self._trava:
+            self._repor()
+            return max(0.0, (quantidade - self.fichas) / self.taxa)
+
+
+class CanalSMTP:
+    """E-mail por SMTP: o lote inteiro usa uma única conexão"""
+    nome = 'email'
+    tamanho_lote = TAMANHO_LOTE
+
+    def __init__(self, host, porta=587, usuario=None, senha=None, remetente=None, tls=True, limite=None):
+        self.host, self.porta, self.tls = host, porta, tls
+        self.usuario, self.senha = usuario, senha
+        self.remetente = remetente or usuario
+        self.limite = limite
+
+    def enviar_lote(self, mensagens):
+        """{id: None se enviada, senão a mensagem de erro}"""
+        resultados = {}
+        with smtplib.SMTP(self.host, self.porta, timeout=30) as servidor:
+            if self.tls:
+                servidor.starttls()
+            if self.usuario:
+                servidor.login(self.usuario, self.senha)
+            for mensagem in mensagens:
+                email = EmailMessage()
+                email['From'] = self.remetente
+                email['To'] = mensagem['destinatario']
+                email['Subject'] = mensagem['assunto']
+                email.set_content(mensagem['corpo'])
+                try:
+                    servidor.send_message(email)
+                    resultados[mensagem['id']] = None
+                except smtplib.SMTPException as e:
+                    resultados[mensagem['id']] = str(e)
+        return resultados
+
+
+class CanalGateway:
+    """WhatsApp ou SMS por um gateway HTTP: POST JSON {"to", "message"} por mensagem"""
+
+    def __init__(self, nome, url, token=None, taxa=TAXA_GATEWAY, tamanho_lote=TAMANHO_LOTE_GATEWAY, timeout=15):
+        self.nome, self.url, self.token, self.timeout = nome, url, token, timeout
+        self.tamanho_lote = tamanho_lote
+        self.limite = LimiteTaxa(taxa) if taxa else None
+
+    def enviar_lote(self, mensagens):
+        resultados = {}
+        for mensagem in mensagens:
+            dados = json.dumps({'to': mensagem['destinatario'], 'message': mensagem['corpo']}).encode()
+            requisicao = urllib.request.Request(self.url, data=dados, method='POST',
+                                                headers={'Content-Type': 'application/json'})
+            if self.token:
+                requisicao.add_header('Authorization', f'Bearer {self.token}')
+            try:
+                with urllib.request.urlopen(requisicao, timeout=self.timeout):
+                    resultados[mensagem['id']] = None
+            except OSError as e:  # URLError/HTTPError/timeout
+                resultados[mensagem['id']] = str(e)
+        return resultados
+
+
+class CanalLocal:
+    """Substituto de um canal para desenvolvimento e testes: guarda e registra as mensagens"""
+
+    def __init__(self, nome, erro=None, limite=None, tamanho_lote=TAMANHO_LOTE):
+        self.nome = nome
+        self.erro = erro  # se definido, todo envio falha com esse erro
+        self.limite, self.tamanho_lote = limite, tamanho_lote
+        self.enviadas = []
+        self.lotes = []  # tamanho de cada chamada
+
+    def enviar_lote(self, mensagens):
+        self.lotes.append(len(mensagens))
+        if self.erro:
+            return {mensagem['id']: self.erro for mensagem in mensagens}
+        for mensagem in mensagens:
+            logging.info(f"[{self.nome}] para {mensagem['destinatario']}: {mensagem['assunto']}")
+            self.enviadas.append(mensagem)
+        return {mensagem['id']: None for mensagem in mensagens}
+
+
+def canais_configurados():
+    """
+    Canais a partir das variáveis de ambiente. Os não configurados ficam de fora, a não
+    ser que NOTIFICACOES_CANAL_LOCAL=1 peça o substituto local para eles
+    """
+    configurados = {}
+    if os.environ.get('SMTP_HOST'):
+        configurados['email'] = CanalSMTP(os.environ['SMTP_HOST'], int(os.environ.get('SMTP_PORT', 587)),
+                                          os.environ.get('SMTP_USUARIO'), os.environ.get('SMTP_SENHA'),
+                                          os.environ.get('SMTP_REMETENTE'), os.environ.get('SMTP_TLS', '1') != '0')
+    for nome, prefixo in (('whatsapp', 'WHATSAPP'), ('sms', 'SMS')):
+        if os.environ.get(f'{prefixo}_API_URL'):
+            configurados[nome] = CanalGateway(nome, os.environ[f'{prefixo}_API_URL'],
+                                              os.environ.get(f'{prefixo}_TOKEN'),
+                                              float(os.environ.get(f'{prefixo}_TAXA', TAXA_GATEWAY)))
+    if os.environ.get('NOTIFICACOES_CANAL_LOCAL') == '1':
+        for nome in ('email', 'whatsapp', 'sms'):
+            configurados.setdefault(nome, CanalLocal(nome))
+    return configurados
+
+
+canais = canais_configurados()
+if CANAL_LEMBRETES not in canais:
+    logging.warning(f"Lembretes de consulta desativados: canal {CANAL_LEMBRETES} não configurado")
+
+
+# Enfileiramento (no cursor e na transação de quem chama)
+
+def _telefone_internacional(telefone):
+    """Só dígitos, com o código do país (55) para números brasileiros com DDD"""
+    digitos = re.sub(r'\D', '', telefone or '')
+    if len(digitos) in (10, 11):
+        digitos = '55' + digitos
+    return digitos if len(digitos) >= 12 else None
+
+
+def enfileirar(cursor, evento, destinatarios, assunto, corpo, origem, origem_id):
+    """Grava uma mensagem por (destino, canal, endereço); eventos repetidos são ignorados"""
+    cursor.executemany('''
+        INSERT OR IGNORE INTO notificacoes_saida
+        (evento, origem, origem_id, destino, canal, destinatario, assunto, corpo, proxima_tentativa)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(evento, origem, origem_id, destino, canal, endereco, assunto, corpo, time.time())
+          for destino, canal, endereco in destinatarios if endereco])
+
+
+def _destinatarios_medico(cursor, medico_id):
+    cursor.execute('SELECT email FROM medicos WHERE id = ? AND ativo = 1', (medico_id,))
+    medico = cursor.fetchone()
+    return [('medico', 'email', medico['email'])] if medico else []
+
+
+def _destinatarios_admins(cursor):
+    cursor.execute("SELECT email FROM medicos WHERE tipo = 'admin' AND ativo = 1")
+    return [('admin', 'email', row['email']) for row in cursor.fetchall()]
+
+
+def _destinatarios_paciente(cursor, paciente_id):
+    cursor.execute('SELECT email, telefone FROM pacientes WHERE id = ?', (paciente_id,))
+    paciente = cursor.fetchone()
+    if not paciente:
+        return []
+    return [('paciente', 'email', paciente['email']),
+            ('paciente', 'whatsapp', _telefone_internacional(paciente['telefone']))]
+
+
+def notificar_confirmacao(cursor, confirmacao_id):
+    """Resposta do paciente a uma consulta: avisa o médico (e os administradores se cancelou)"""
+    cursor.execute('''
+        SELECT c.confirmado, c.observacoes_paciente, a.data_consulta, a.medico_id, p.nome as paciente_nome
+        FROM confirmacoes_consulta c
+        JOIN agendamentos a ON c.agendamento_id = a.id
+        JOIN pacientes p ON a.paciente_id = p.id
+        WHERE c.id = ?
+    ''', (confirmacao_id,))
+    confirmacao = cursor.fetchone()
+    if not confirmacao or confirmacao['confirmado'] is None:
+        return
+
+    try:
+        data = converter_data_consulta(confirmacao['data_consulta']).strftime('%d/%m/%Y às %H:%M')
+    except ValueError:
+        data = confirmacao['data_consulta']
+    confirmou = confirmacao['confirmado'] == 1
+    corpo = f"{confirmacao['paciente_nome']} {'confirmou' if confirmou else 'cancelou'} a consulta de {data}."
+    if confirmacao['observacoes_paciente']:
+        corpo += f"\nObservações do paciente: {confirmacao['observacoes_paciente']}"
+
+    destinatarios = _destinatarios_medico(cursor, confirmacao['medico_id'])
+    if not confirmou:
+        destinatarios += _destinatarios_admins(cursor)
+    situacao = 'confirmada' if confirmou else 'cancelada'
+    enfileirar(cursor, f'consulta_{situacao}', destinatarios, f"Consulta {situacao}: {confirmacao['paciente_nome']}",
+               corpo, 'confirmacoes_consulta', confirmacao_id)
+
+
+def notificar_senhas_aprovadas(cursor, senha_ids):
+    """Avisa o médico de cada paciente que a senha foi aprovada para faturamento"""
+    for senha_id in senha_ids:
+        cursor.execute('''
+            SELECT s.codigo, s.tipo, p.nome as paciente_nome, p.medico_id
+            FROM senhas s JOIN pacientes p ON s.paciente_id = p.id
+            WHERE s.id = ?
+        ''', (senha_id,))
+        senha = cursor.fetchone()
+        if senha:
+            tipo = (senha['tipo'] or '').replace('_', ' ')
+            enfileirar(cursor, 'senha_aprovada', _destinatarios_medico(cursor, senha['medico_id']),
+                       f"Senha aprovada: {senha['paciente_nome']}",
+                       f"A senha {senha['codigo']} ({tipo}) de {senha['paciente_nome']} foi aprovada para faturamento.",
+                       'senhas', senha_id)
+
+
+def notificar_laudos_liberados(cursor, laudo_ids):
+    """Avisa o paciente e o médico que o laudo está liberado para entrega"""
+    for laudo_id in laudo_ids:
+        cursor.execute('''
+            SELECT l.paciente_id, p.nome as paciente_nome, p.medico_id
+            FROM laudos l JOIN pacientes p ON l.paciente_id = p.id
+            WHERE l.id = ?
+        ''', (laudo_id,))
+        laudo = cursor.fetchone()
+        if not laudo:
+            continue
+        enfileirar(cursor, 'laudo_liberado', _destinatarios_paciente(cursor, laudo['paciente_id']),
+                   'Seu laudo está disponível',
+                   f"Olá, {laudo['paciente_nome']}! Seu laudo neuropsicológico está liberado para entrega.",
+                   'laudos', laudo_id)
+        enfileirar(cursor, 'laudo_liberado', _destinatarios_medico(cursor, laudo['medico_id']),
+                   f"Laudo liberado: {laudo['paciente_nome']}",
+                   f"O laudo de {laudo['paciente_nome']} foi liberado para entrega.",
+                   'laudos', laudo_id)
+
+
+def notificar_vaga_ofertada(cursor, agendamento_id):
+    """Vaga da lista de espera reservada para o paciente: avisa o paciente e o médico"""
+    cursor.execute('''
+        SELECT a.data_consulta, a.paciente_id, a.medico_id, p.nome as paciente_nome, m.nome as medico_nome
+        FROM agendamentos a
+        JOIN pacientes p ON a.paciente_id = p.id
+        JOIN medicos m ON a.medico_id = m.id
+        WHERE a.id = ?
+    ''', (agendamento_id,))
+    consulta = cursor.fetchone()
+    if not consulta:
+        return
+    rotulos = rotulos_data(consulta['data_consulta'])
+    quando = f"{rotulos['data_completa']}, às {rotulos['hora_formatada']}"
+    enfileirar(cursor, 'vaga_ofertada', _destinatarios_paciente(cursor, consulta['paciente_id']),
+               'Abriu um horário para você',
+               f"Olá, {consulta['paciente_nome'].strip()}! Abriu um horário com {consulta['medico_nome'].strip()} "
+               f"e ele foi reservado para você: {quando}. Confirme ou cancele pelo sistema.",
+               'agendamentos', agendamento_id)
+    enfileirar(cursor, 'vaga_ofertada', _destinatarios_medico(cursor, consulta['medico_id']),
+               f"Vaga preenchida pela lista de espera: {consulta['paciente_nome'].strip()}",
+               f"O horário de {quando} foi reservado para {consulta['paciente_nome'].strip()}, "
+               f"da lista de espera, aguardando a confirmação do paciente.",
+               'agendamentos', agendamento_id)
+
+
+def notificar_reorganizacao(cursor, operacao_id, acao, medico_id, medico_destino, agendamentos, motivo=''):
+    """
+    Consultas adiadas, transferidas ou canceladas em lote (agenda_utils.reorganizar_agenda):
+    uma mensagem por paciente com todas as consultas dele; numa transferência o médico que
+    recebe as consultas também é avisado
+    """
+    cursor.execute('SELECT id, nome FROM medicos WHERE id IN (?, ?)', (medico_id, medico_destino))
+    nomes = {row['id']: row['nome'].strip() for row in cursor.fetchall()}
+
+    def quando(valor):
+        rotulos = rotulos_data(valor)
+        return f"{rotulos['data_formatada']} às {rotulos['hora_formatada']}"
+
+    por_paciente = {}
+    for agendamento in agendamentos:
+        por_paciente.setdefault(agendamento['paciente_id'], []).append(agendamento)
+    rodape = f"\nMotivo: {motivo}" if motivo else ''
+    evento, assunto = {'adiar': ('consultas_remarcadas', 'Consulta remarcada'),
+                       'transferir': ('consultas_transferidas', 'Consulta com outro profissional'),
+                       'cancelar': ('consultas_canceladas', 'Consulta cancelada')}[acao]
+
+    for paciente_id, consultas in por_paciente.items():
+        if acao == 'adiar':
+            linhas = [f"- {quando(a['data_consulta'])} remarcada para {quando(a['nova_data'])}" for a in consultas]
+            texto = f"sua consulta com {nomes.get(medico_id, '')} foi remarcada:"
+        elif acao == 'transferir':
+            linhas = [f"- {quando(a['data_consulta'])}" for a in consultas]
+            texto = (f"sua consulta, no mesmo horário, será com {nomes.get(medico_destino, '')} "
+                     f"em vez de {nomes.get(medico_id, '')}:")
+        else:
+            linhas = [f"- {quando(a['data_consulta'])}" for a in consultas]
+            texto = (f"sua consulta com {nomes.get(medico_id, '')} foi cancelada pela clínica "
+                     f"e entraremos em contato para remarcar:")
+        corpo = (f"Olá, {consultas[0]['paciente_nome'].strip()}! Informamos que {texto}\n"
+                 + '\n'.join(linhas) + rodape)
+        enfileirar(cursor, evento, _destinatarios_paciente(cursor, paciente_id), assunto, corpo,
+                   'operacoes_agenda', operacao_id)
+
+    if acao == 'transferir':
+        linhas = [f"- {quando(a['data_consulta'])}: {a['paciente_nome'].strip()}" for a in agendamentos]
+        enfileirar(cursor, evento, _destinatarios_medico(cursor, medico_destino),
+                   f"{len(agendamentos)} consulta(s) transferida(s) para você",
+                   f"Consultas de {nomes.get(medico_id, '')} transferidas para a sua agenda:\n"
+                   + '\n'.join(linhas) + rodape,
+                   'operacoes_agenda', operacao_id)
+
+
+def _endereco_paciente(canal, paciente):
+    return paciente['email'] if canal == 'email' else _telefone_internacional(paciente['telefone'])
+
+
+def enfileirar_lembretes(agora=None, canal=None, canais_envio=None):
+    """
+    Enfileira os lembretes das consultas que entraram na janela de cada um (LEMBRETES)
+    e ainda não foram lembradas nessa data; retorna {evento: quantidade}. Nada é
+    enfileirado se o canal dos lembretes não está configurado
+    """
+    agora = agora or datetime.now()
+    canal = canal or CANAL_LEMBRETES
+    if canal not in (canais if canais_envio is None else canais_envio):
+        return {}
+    totais = {}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            anterior = 0
+            for evento, antecedencia in sorted(LEMBRETES, key=lambda lembrete: lembrete[1]):
+                # Faixa sobre o índice de data_consulta (texto canônico, hora local)
+                cursor.execute('''
+                    SELECT a.id, a.data_consulta, p.nome, p.telefone, p.email, m.nome as medico_nome
+                    FROM agendamentos a
+                    JOIN pacientes p ON a.paciente_id = p.id
+                    JOIN medicos m ON a.medico_id = m.id
+                    LEFT JOIN confirmacoes_consulta cc ON cc.agendamento_id = a.id
+                    WHERE a.data_consulta > ? AND a.data_consulta <= ?
+                    AND a.status = 'agendado' AND COALESCE(cc.confirmado, 1) != 0
+                    AND NOT EXISTS (SELECT 1 FROM lembretes_consulta l
+                                    WHERE l.agendamento_id = a.id AND l.tipo = ? AND l.data_consulta = a.data_consulta)
+                    ORDER BY a.data_consulta
+                ''', ((agora + timedelta(minutes=anterior)).strftime(FORMATO_CANONICO),
+                      (agora + timedelta(minutes=antecedencia)).strftime(FORMATO_CANONICO), evento))
+                consultas = cursor.fetchall()
+                anterior = antecedencia
+
+                for consulta in consultas:
+                    cursor.execute('''
+                        INSERT INTO lembretes_consulta (agendamento_id, tipo, data_consulta) VALUES (?, ?, ?)
+                    ''', (consulta['id'], evento, consulta['data_consulta']))
+                    rotulos = rotulos_data(consulta['data_consulta'])
+                    enfileirar(cursor, evento, [('paciente', canal, _endereco_paciente(canal, consulta))],
+                               'Lembrete de consulta',
+                               f"Olá, {consulta['nome'].strip()}! Lembrete da sua consulta com {consulta['medico_nome'].strip()}: "
+                               f"{rotulos['data_completa']}, às {rotulos['hora_formatada']}.",
+                               'lembretes_consulta', cursor.lastrowid)
+                if consultas:
+                    totais[evento] = len(consultas)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return totais
+
+
+# Despacho (agendador)
+
+def _espera(tentativas):
+    return min(BACKOFF_BASE * 2 ** (tentativas - 1), BACKOFF_MAXIMO)
+
+
+def _reservar(cursor, agora, tamanho):
+    """Mensagens vencidas do lote, reservadas por PRAZO_ENVIO (numa transação curta)"""
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('''
+        SELECT id, canal, destinatario, assunto, corpo, tentativas, origem, origem_id, destino
+        FROM notificacoes_saida
+        WHERE status = 'pendente' AND proxima_tentativa <= ?
+        ORDER BY proxima_tentativa, id
+        LIMIT ?
+    ''', (agora, tamanho))
+    mensagens = [dict(row) for row in cursor.fetchall()]
+    cursor.executemany('UPDATE notificacoes_saida SET proxima_tentativa = ? WHERE id = ?',
+                       [(agora + PRAZO_ENVIO, mensagem['id']) for mensagem in mensagens])
+    cursor.connection.commit()
+    return mensagens
+
+
+def _enviar_canal(canal, mensagens, resultados):
+    """
+    Entrega as mensagens ao canal em lotes do tamanho dele, cada lote limitado às fichas
+    do balde se o canal tem limite; grava os resultados e retorna as que ficaram sem fichas
+    """
+    tamanho = getattr(canal, 'tamanho_lote', None) or TAMANHO_LOTE
+    limite = getattr(canal, 'limite', None)
+    for inicio in range(0, len(mensagens), tamanho):
+        lote = mensagens[inicio:inicio + tamanho]
+        if limite:
+            lote = lote[:limite.retirar(len(lote), ESPERA_MAXIMA_TAXA)]
+            if not lote:
+                return mensagens[inicio:]
+        try:
+            resultados.update(canal.enviar_lote(lote))
+        except Exception as e:
+            logging.warning(f"Falha no canal {canal.nome}: {e}")
+            resultados.update({mensagem['id']: str(e) for mensagem in lote})
+        for mensagem in lote:
+            resultados.setdefault(mensagem['id'], 'sem resposta do canal')
+        if inicio + len(lote) < min(inicio + tamanho, len(mensagens)):
+            return mensagens[inicio + len(lote):]
+    return []
+
+
+def despachar(canais_envio=None, tamanho_lote=TAMANHO_LOTE, max_lotes=MAX_LOTES):
+    """Envia as mensagens vencidas em lotes por canal; retorna {'enviadas', 'falhas', 'desistencias', 'adiadas'}"""
+    canais_envio = canais if canais_envio is None else canais_envio
+    totais = {'enviadas': 0, 'falhas': 0, 'desistencias': 0, 'adiadas': 0}
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        for _ in range(max_lotes):
+            agora = time.time()
+            mensagens = _reservar(cursor, agora, tamanho_lote)
+            if not mensagens:
+                break
+
+            # Envio fora de qualquer transação: o banco não fica bloqueado esperando a rede
+            resultados, adiadas, sem_canal = {}, [], []
+            por_canal = {}
+            for mensagem in mensagens:
+                por_canal.setdefault(mensagem['canal'], []).append(mensagem)
+            for nome, pendentes in por_canal.items():
+                canal = canais_envio.get(nome)
+                if canal is None:
+                    # Continuam pendentes, sem gastar tentativa, até o canal ser configurado
+                    sem_canal += [(agora + ESPERA_CANAL_NAO_CONFIGURADO, mensagem['id']) for mensagem in pendentes]
+                    continue
+                sem_fichas = _enviar_canal(canal, pendentes, resultados)
+                if sem_fichas:
+                    # Voltam quando o balde tiver fichas para elas, sem gastar tentativa
+                    espera = canal.limite.espera(len(sem_fichas))
+                    adiadas += [(agora + espera, mensagem['id']) for mensagem in sem_fichas]
+
+            enviadas, falhas = [], []
+            for mensagem in mensagens:
+                if mensagem['id'] not in resultados:
+                    continue
+                erro = resultados[mensagem['id']]
+                if erro is None:
+                    enviadas.append(mensagem)
+                    continue
+                tentativas = mensagem['tentativas'] + 1
+                desistir = tentativas >= MAX_TENTATIVAS
+                falhas.append(('falhou' if desistir else 'pendente', tentativas, erro[:500],
+                               agora + _espera(tentativas), mensagem['id']))
+                totais['desistencias' if desistir else 'falhas'] += 1
+            totais['enviadas'] += len(enviadas)
+
+            cursor.executemany('''
+                UPDATE notificacoes_saida
+                SET status = 'enviada', tentativas = tentativas + 1, ultimo_erro = NULL,
+                    enviada_em = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [(mensagem['id'],) for mensagem in enviadas])
+            cursor.executemany('''
+                UPDATE notificacoes_saida
+                SET status = ?, tentativas = ?, ultimo_erro = ?, proxima_tentativa = ?
+                WHERE id = ?
+            ''', falhas)
+            cursor.executemany('UPDATE notificacoes_saida SET proxima_tentativa = ? WHERE id = ?', adiadas)
+            cursor.executemany('''
+                UPDATE notificacoes_saida SET ultimo_erro = 'canal não configurado', proxima_tentativa = ?
+                WHERE id = ?
+            ''', sem_canal)
+            totais['adiadas'] += len(adiadas) + len(sem_canal)
+            # Confirmações: marca quem já foi avisado
+            for destino in ('medico', 'admin'):
+                cursor.executemany(f'UPDATE confirmacoes_consulta SET notificado_{destino} = 1 WHERE id = ?',
+                                   {(mensagem['origem_id'],) for mensagem in enviadas
+                                    if mensagem['origem'] == 'confirmacoes_consulta' and mensagem['destino'] == destino})
+            conn.commit()
+
+            if len(mensagens) < tamanho_lote:
+                break
+
+    if totais['falhas'] or totais['desistencias']:
+        logging.warning(f"Notificações: {totais}")
+    return totais
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(enfileirar_lembretes())
+    print(despachar())
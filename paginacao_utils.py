@@ -0,0 +1,211 @@
+"""
+Keyset (seek) pagination with server-side filters for the large listings
+
+A Listagem describes one listing: the selected columns, the FROM/JOIN clause,
+the filters accepted from the query string and the sortable columns. A page is
+read with ``WHERE (ordem, chave) > (?, ?) ORDER BY ordem, chave LIMIT n`` from an
+index on the sort column, so its cost depends on the page size, not on how many
+rows come before it (no OFFSET). Per-row aggregates belong in correlated
+subqueries in ``colunas``, evaluated only for the rows of the page.
+
+The total count (plus the listing's summary aggregates) for each filter set is
+kept in the result cache and only recomputed when one of the listing's tables
+changes (cache_utils). A date/time bound that moves with the clock (e.g. "from
+now on") would give a new cache key on every request, so the cached count stops
+at the nearest midnight and the slice between it and the bound is counted
+separately, over the index on the column.
+
+Cursores são opacos (base64 de JSON com o valor de ordenação e a chave da linha);
+um cursor inválido volta para a primeira página.
+"""
+import base64
+import json
+from datetime import date, datetime, timedelta
+from cache_utils import GRAFO_DEPENDENCIAS, em_cache
+
+TAMANHO_PADRAO = 50
+TAMANHO_MAXIMO = 200
+
+
+def converter_data(valor):
+    """Conversor de filtro para datas 'YYYY-MM-DD' (ValueError se inválida)"""
+    return date.fromisoformat(valor).isoformat()
+
+
+def converter_data_hora(valor):
+    """Conversor de filtro para data/hora, normalizada para 'YYYY-MM-DD HH:MM'"""
+    return datetime.fromisoformat(valor.replace('T', ' ')).strftime('%Y-%m-%d %H:%M')
+
+
+def _codificar_cursor(valores):
+    return base64.urlsafe_b64encode(json.dumps(valores, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def _decodificar_cursor(cursor):
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if isinstance(valores, list) and len(valores) == 3 and valores[2] in ('depois', 'antes'):
+            return valores
+    except (ValueError, TypeError):
+        pass
+    return None
+
+
+class Pagina:
+    """Uma página da listagem e os parâmetros para navegar a partir dela"""
+
+    def __init__(self, listagem, itens, filtros, ordenar, direcao, tamanho, proximo, anterior, resumo, extras=None):
+        self.listagem = listagem
+        self.itens = itens
+        self.filtros = filtros
+        self.ordenar = ordenar
+        self.direcao = direcao
+        self.tamanho = tamanho
+        self.proximo = proximo
+        self.anterior = anterior
+        self.resumo = resumo
+        self.total = resumo['total']
+        self.extras = extras or {}
+
+    def parametros(self, **alteracoes):
+        """Query string (dict para url_for) com os filtros e a ordenação atuais"""
+        parametros = dict(self.extras)
+        parametros.update(self.filtros)
+        parametros.update(ordenar=self.ordenar, direcao=self.direcao)
+        if self.tamanho != TAMANHO_PADRAO:
+            parametros['por_pagina'] = self.tamanho
+        parametros.update(alteracoes)
+        return {chave: valor for chave, valor in parametros.items() if valor not in (None, '')}
+
+    def parametros_ordenacao(self, coluna):
+        """Parâmetros para ordenar pela coluna (inverte a direção se já ordena por ela)"""
+        if coluna == self.ordenar:
+            direcao = 'asc' if self.direcao == 'desc' else 'desc'
+        else:
+            direcao = self.listagem.direcao_padrao
+        return self.parametros(ordenar=coluna, direcao=direcao)
+
+
+class Listagem:
+    """
+    colunas/origem: SELECT e FROM (com JOINs) da listagem, sem WHERE.
+    filtros: {parâmetro: (condição SQL com um '?', conversor)}.
+    ordenacoes: {nome: expressão SQL não nula}; chave desempata (única, ex. 'p.id').
+    resumo: {nome: agregado SQL} calculado junto com o total (somável: COUNT/SUM).
+    limite_movel: (filtro de início, filtro de fim) de data/hora que andam com o relógio,
+    no formato de converter_data_hora; ver _resumo.
+    """
+
+    def __init__(self, nome, colunas, origem, tabelas, filtros, ordenacoes, ordenacao_padrao,
+                 direcao_padrao='asc', chave='id', condicoes=(), resumo=None, limite_movel=None):
+        self.nome = nome
+        self.colunas = colunas
+        self.origem = origem
+        self.filtros = filtros
+        self.ordenacoes = ordenacoes
+        self.ordenacao_padrao = ordenacao_padrao
+        self.direcao_padrao = direcao_padrao
+        self.chave = chave
+        self.condicoes = list(condicoes)
+        self.resumo = resumo or {}
+        self.limite_movel = limite_movel
+        GRAFO_DEPENDENCIAS[f'listagem.{nome}'] = lambda *filtros: list(tabelas)
+
+    def filtros_da_requisicao(self, args):
+        """Filtros válidos presentes na query string, já convertidos"""
+        filtros = {}
+        for parametro, (_, conversor) in self.filtros.items():
+            valor = args.get(parametro, '').strip()
+            if not valor:
+                continue
+            try:
+                filtros[parametro] = conversor(valor)
+            except (ValueError, TypeError):
+                continue
+        return filtros
+
+    def _where(self, filtros, busca=()):
+        condicoes = self.condicoes + [self.filtros[parametro][0] for parametro in filtros] + list(busca)
+        return f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+
+    def _contar(self, cursor, filtros):
+        agregados = ''.join(f', {expressao} as {nome}' for nome, expressao in self.resumo.items())
+        cursor.execute(f"SELECT COUNT(*) as total{agregados} {self.origem} {self._where(filtros)}",
+                       list(filtros.values()))
+        return dict(cursor.fetchone())
+
+    def _resumo(self, cursor, filtros):
+        """
+        Total e resumo dos filtros, em cache. Com só um lado do limite_movel, o cache
+        guarda a contagem até a meia-noite mais próxima (a chave muda uma vez por dia) e a
+        fatia entre ela e o instante pedido é contada fora do cache
+        """
+        inicio, fim = self.limite_movel or (None, None)
+        if inicio in filtros and fim not in filtros:
+            virada = (datetime.strptime(filtros[inicio][:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d %H:%M')
+            fixos, fatia = {**filtros, inicio: virada}, {**filtros, fim: virada}
+        elif fim in filtros and inicio not in filtros:
+            virada = f'{filtros[fim][:10]} 00:00'
+            fixos, fatia = {**filtros, fim: virada}, {**filtros, inicio: virada}
+        else:
+            fixos, fatia = filtros, None
+
+        resumo = em_cache(f'listagem.{self.nome}', tuple(sorted(fixos.items())),
+                          lambda: self._contar(cursor, fixos), cursor)
+        if fatia is None:
+            return resumo
+        parte = self._contar(cursor, fatia)
+        return {nome: resumo[nome] + parte[nome] for nome in resumo}
+
+    def paginar(self, cursor, args, extras=None):
+        """
+        Página pedida na query string (filtros, ordenar, direcao, cursor, por_pagina).
+        extras: parâmetros da rota repetidos nos links de navegação.
+        """
+        filtros = self.filtros_da_requisicao(args)
+        ordenar = args.get('ordenar') if args.get('ordenar') in self.ordenacoes else self.ordenacao_padrao
+        direcao = args.get('direcao') if args.get('direcao') in ('asc', 'desc') else self.direcao_padrao
+        try:
+            tamanho = min(max(int(args.get('por_pagina', TAMANHO_PADRAO)), 1), TAMANHO_MAXIMO)
+        except ValueError:
+            tamanho = TAMANHO_PADRAO
+
+        expressao = self.ordenacoes[ordenar]
+        posicao = _decodificar_cursor(args.get('cursor', ''))
+        # Página anterior: percorre ao contrário a partir do primeiro item e reverte
+        voltando = posicao is not None and posicao[2] == 'antes'
+        crescente = (direcao == 'asc') != voltando
+
+        busca, parametros = [], list(filtros.values())
+        if posicao is not None:
+            busca.append(f"({expressao}, {self.chave}) {'>' if crescente else '<'} (?, ?)")
+            parametros += posicao[:2]
+        sentido = 'ASC' if crescente else 'DESC'
+
+        cursor.execute(f'''
+            SELECT {self.colunas}, {expressao} as _ordem, {self.chave} as _chave
+            {self.origem}
+            {self._where(filtros, busca)}
+            ORDER BY {expressao} {sentido}, {self.chave} {sentido}
+            LIMIT ?
+        ''', parametros + [tamanho + 1])
+        linhas = [dict(linha) for linha in cursor.fetchall()]
+
+        ha_mais = len(linhas) > tamanho
+        linhas = linhas[:tamanho]
+        if voltando:
+            linhas.reverse()
+
+        # Indo para frente, há próxima se sobrou linha; voltando, a página de onde se veio
+        proximo = anterior = None
+        if linhas:
+            primeira, ultima = linhas[0], linhas[-1]
+            if ha_mais or voltando:
+                proximo = _codificar_cursor([ultima['_ordem'], ultima['_chave'], 'depois'])
+            if (posicao is not None and not voltando) or (voltando and ha_mais):
+                anterior = _codificar_cursor([primeira['_ordem'], primeira['_chave'], 'antes'])
+        for linha in linhas:
+            del linha['_ordem'], linha['_chave']
+
+        return Pagina(self, linhas, filtros, ordenar, direcao, tamanho, proximo, anterior,
+                      self._resumo(cursor, filtros), extras)
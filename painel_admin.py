@@ -0,0 +1,84 @@
+"""
+Admin dashboard payload in a fixed number of statements
+
+The counters (doctors, patients, teams), pending senhas and the month's session
+stats come from one CTE statement in which ``senhas`` and ``sessoes`` are each read
+once, through the indexes created in init_db; billing and payouts come from the
+payout rules engine (regras_pagamento.apurar_mes, a single pass over the month's
+facts), and recent activity is an index-ordered LIMIT 10. The statement count no
+longer grows with the number of cards on the page.
+
+Benchmark: python benchmark_painel_admin.py
+"""
+from dinheiro_utils import centavos_para_reais
+from sql_utils import rows_to_dicts
+
+_SQL_PAINEL = '''
+    WITH contagens AS (
+        SELECT (SELECT COUNT(*) FROM medicos WHERE ativo = 1) as total_medicos,
+               (SELECT COUNT(*) FROM pacientes WHERE status = 'ativo') as total_pacientes,
+               (SELECT COUNT(*) FROM equipes WHERE ativo = 1) as total_equipes
+    ),
+    pendentes AS (
+        SELECT COUNT(*) as senhas_pendentes, COALESCE(SUM(valor_centavos), 0) as valor_pendente_centavos
+        FROM senhas
+        WHERE aprovada_admin = 0 AND ativo = 1
+    ),
+    sessoes_mes AS (
+        SELECT COUNT(*) as total_sessoes,
+               COUNT(CASE WHEN s.realizada = 1 THEN 1 END) as sessoes_realizadas
+        FROM sessoes s
+        JOIN pacientes p ON s.paciente_id = p.id
+        WHERE s.data_sessao >= ? AND s.data_sessao < ?
+    )
+    SELECT * FROM contagens, pendentes, sessoes_mes
+'''
+
+_SQL_ATIVIDADES_RECENTES = '''
+    SELECT p.nome as paciente, m.nome as medico, s.data_sessao, s.numero_sessao
+    FROM sessoes s
+    JOIN pacientes p ON s.paciente_id = p.id
+    JOIN medicos m ON p.medico_id = m.id
+    WHERE s.realizada = 1
+    ORDER BY s.data_sessao DESC
+    LIMIT 10
+'''
+
+
+def _limites_mes(mes_referencia):
+    """('YYYY-MM-01', primeiro dia do mês seguinte) para filtrar datas ISO por intervalo"""
+    ano, mes = map(int, mes_referencia.split('-'))
+    ano_seguinte, mes_seguinte = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return f"{ano}-{mes:02d}-01", f"{ano_seguinte}-{mes_seguinte:02d}-01"
+
+
+def montar_painel_admin(cursor, mes_referencia):
+    """Dados do dashboard administrativo (variáveis do template admin/dashboard.html)"""
+    from regras_pagamento import apurar_mes
+
+    cursor.execute(_SQL_PAINEL, _limites_mes(mes_referencia))
+    painel = cursor.fetchone()
+
+    # Billing and payouts from the payout rules (approved senhas only)
+    apuracao = apurar_mes(cursor, mes_referencia)
+    faturamento_bruto_centavos = apuracao['faturamento_centavos']
+    total_pagamentos_centavos = apuracao['total_equipes_centavos'] + apuracao['total_externos_centavos']
+
+    cursor.execute(_SQL_ATIVIDADES_RECENTES)
+    atividades_recentes = rows_to_dicts(cursor.fetchall())
+
+    financeiro = {
+        'faturamento_bruto': centavos_para_reais(faturamento_bruto_centavos),
+        # Lucro líquido = Faturamento - Pagamentos para equipes - Pagamentos para médicos externos
+        'faturamento_liquido': centavos_para_reais(faturamento_bruto_centavos - total_pagamentos_centavos),
+        'total_senhas_aprovadas': len(apuracao['senhas']),
+        'senhas_pendentes': painel['senhas_pendentes'],
+        'valor_pendente': centavos_para_reais(painel['valor_pendente_centavos']),
+        'total_sessoes': painel['total_sessoes'],
+        'sessoes_realizadas': painel['sessoes_realizadas'],
+        'mes_referencia': mes_referencia
+    }
+
+    return {'total_medicos': painel['total_medicos'], 'total_pacientes': painel['total_pacientes'],
+            'total_equipes': painel['total_equipes'], 'financeiro': financeiro,
+            'atividades_recentes': atividades_recentes}
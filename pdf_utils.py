@@ -0,0 +1,166 @@
+"""
+Minimal PDF writer for tabular reports (no external dependency)
+
+Writes A4 pages with the standard Helvetica fonts (WinAnsiEncoding, which covers
+Portuguese accents), headings, text lines and tables with automatic page breaks.
+Enough for the printable financial reports; not a general layout engine.
+"""
+import unicodedata
+import zlib
+
+LARGURA_A4, ALTURA_A4 = 595, 842
+MARGEM = 40
+
+# Larguras da Helvetica (AFM, 1/1000 em) para ASCII 32..126
+_LARGURAS_HELVETICA = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+
+def largura_texto(texto, tamanho, negrito=False):
+    """Largura aproximada do texto em pontos"""
+    total = 0
+    for caractere in str(texto):
+        base = unicodedata.normalize('NFKD', caractere)[:1] or caractere
+        codigo = ord(base)
+        total += _LARGURAS_HELVETICA[codigo - 32] if 32 <= codigo <= 126 else 556
+    return total * tamanho / 1000 * (1.05 if negrito else 1)
+
+
+def _texto_pdf(texto):
+    """String PDF literal em WinAnsi (cp1252), com parênteses e barras escapados"""
+    dados = str(texto).encode('cp1252', 'replace')
+    return b'(' + dados.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+class DocumentoPDF:
+    """Documento A4 montado de cima para baixo; gerar() devolve os bytes do PDF"""
+
+    def __init__(self, titulo=''):
+        self.titulo = titulo
+        self.paginas = []
+        self._comandos = None
+        self.y = 0
+        self._nova_pagina()
+
+    def _nova_pagina(self):
+        self._comandos = []
+        self.paginas.append(self._comandos)
+        self.y = ALTURA_A4 - MARGEM
+
+    def _garantir_espaco(self, altura):
+        if self.y - altura < MARGEM:
+            self._nova_pagina()
+
+    def _escrever(self, x, y, texto, tamanho, negrito=False, cor=None):
+        fonte = b'/F2' if negrito else b'/F1'
+        cor_cmd = ('%.3f %.3f %.3f rg ' % cor).encode() if cor else b''
+        self._comandos.append(cor_cmd + b'BT ' + fonte + b' %d Tf %.2f %.2f Td ' % (tamanho, x, y)
+                              + _texto_pdf(texto) + b' Tj ET' + (b' 0 0 0 rg' if cor else b''))
+
+    def _linha_horizontal(self, y, espessura=0.5):
+        self._comandos.append(b'%.2f w %d %.2f m %d %.2f l S' % (espessura, MARGEM, y, LARGURA_A4 - MARGEM, y))
+
+    def _retangulo(self, x, y, largura, altura, cinza):
+        self._comandos.append(b'%.2f g %.2f %.2f %.2f %.2f re f 0 g' % (cinza, x, y, largura, altura))
+
+    def titulo_principal(self, texto, subtitulo=None):
+        self._garantir_espaco(50)
+        self.y -= 18
+        self._escrever((LARGURA_A4 - largura_texto(texto, 18, True)) / 2, self.y, texto, 18, True)
+        if subtitulo:
+            self.y -= 16
+            self._escrever((LARGURA_A4 - largura_texto(subtitulo, 11)) / 2, self.y, subtitulo, 11)
+        self.y -= 10
+        self._linha_horizontal(self.y, 1.5)
+        self.y -= 14
+
+    def secao(self, texto):
+        self._garantir_espaco(40)
+        self.y -= 16
+        self._escrever(MARGEM, self.y, texto, 13, True)
+        self.y -= 8
+
+    def texto(self, texto, tamanho=10, negrito=False):
+        self._garantir_espaco(tamanho + 4)
+        self.y -= tamanho + 4
+        self._escrever(MARGEM, self.y, texto, tamanho, negrito)
+
+    def espaco(self, pontos=10):
+        self.y -= pontos
+
+    def tabela(self, colunas, linhas, total=None, tamanho=9):
+        """
+        colunas: lista de (título, fração da largura, alinhamento 'esquerda'|'direita').
+        linhas: listas de textos já formatados; total: linha final em negrito (opcional).
+        """
+        largura_util = LARGURA_A4 - 2 * MARGEM
+        larguras = [fracao * largura_util for _, fracao, _ in colunas]
+        altura_linha = tamanho + 7
+
+        def desenhar(valores, negrito=False, fundo=None):
+            self._garantir_espaco(altura_linha)
+            self.y -= altura_linha
+            if fundo is not None:
+                self._retangulo(MARGEM, self.y - 3, largura_util, altura_linha, fundo)
+            x = MARGEM
+            for (_, _, alinhamento), largura, valor in zip(colunas, larguras, valores):
+                valor = str(valor)
+                while valor and largura_texto(valor, tamanho, negrito) > largura - 6:
+                    valor = valor[:-1]
+                if alinhamento == 'direita':
+                    self._escrever(x + largura - 3 - largura_texto(valor, tamanho, negrito), self.y, valor, tamanho, negrito)
+                else:
+                    self._escrever(x + 3, self.y, valor, tamanho, negrito)
+                x += largura
+
+        desenhar([titulo for titulo, _, _ in colunas], negrito=True, fundo=0.88)
+        for linha in linhas:
+            desenhar(linha)
+            self._linha_horizontal(self.y - 3, 0.2)
+        if total:
+            desenhar(total, negrito=True, fundo=0.94)
+        self.y -= 6
+
+    def gerar(self):
+        """Bytes do arquivo PDF"""
+        objetos = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            None,  # páginas, preenchido abaixo
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+            b'<< /Title ' + _texto_pdf(self.titulo) + b' /Producer (NeuroSystem) >>',
+        ]
+        ids_paginas = []
+        total_paginas = len(self.paginas)
+        for numero, comandos in enumerate(self.paginas, start=1):
+            rodape = f'Página {numero} de {total_paginas}'
+            comandos = comandos + [b'BT /F1 8 Tf %.2f %d Td ' % (LARGURA_A4 - MARGEM - largura_texto(rodape, 8), MARGEM / 2)
+                                   + _texto_pdf(rodape) + b' Tj ET']
+            conteudo = zlib.compress(b'\n'.join(comandos))
+            objetos.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(conteudo) + conteudo + b'\nendstream')
+            id_conteudo = len(objetos)
+            objetos.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                           b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+                           % (LARGURA_A4, ALTURA_A4, id_conteudo))
+            ids_paginas.append(len(objetos))
+        objetos[1] = (b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % i for i in ids_paginas)
+                      + b'] /Count %d >>' % len(ids_paginas))
+
+        saida = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for numero, objeto in enumerate(objetos, start=1):
+            offsets.append(len(saida))
+            saida += b'%d 0 obj\n' % numero + objeto + b'\nendobj\n'
+        inicio_xref = len(saida)
+        saida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+        for offset in offsets:
+            saida += b'%010d 00000 n \n' % offset
+        saida += (b'trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                  % (len(objetos) + 1, inicio_xref))
+        return bytes(saida)
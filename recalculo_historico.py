@@ -0,0 +1,212 @@
+"""
+Parallel historical recalculation (backfill) of the financial ledgers
+
+Months are sharded across a process pool; each worker evaluates the payout rules of
+regras_pagamento once for the month using a read-only connection, and returns the
+ledger rows to the main process. The main process is the single writer: it upserts
+faturamento_clinica, pagamentos_equipe, pagamentos_medicos_externos and
+faturamento_medicos in one transaction per month and records the month in recalculo_meses, so an interrupted run resumes where it stopped.
+
+Uso:
+    python recalculo_historico.py                      # do primeiro mês com dados ao último mês fechado
+    python recalculo_historico.py --inicio 2024-01 --fim 2024-12 --workers 4
+    python recalculo_historico.py --reiniciar          # ignora o progresso salvo e recalcula tudo
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import database
+from database import get_db_connection, get_db_readonly_connection
+from dinheiro_utils import somar_centavos, formatar_reais
+from financeiro_utils import (_apurar_faturamento_clinica, _gravar_faturamento_clinica,
+                              _apurar_pagamentos_equipe, _gravar_pagamentos_equipe,
+                              _apurar_pagamentos_medicos_externos, _gravar_pagamentos_medicos_externos)
+from medico_pagamento import _resultado_pagamento_medico, _gravar_pagamento_medico
+from regras_pagamento import apurar_mes as apurar_regras_mes
+from rollup_utils import meses_entre
+
+
+def primeiro_mes_com_dados():
+    """Mês de início de operação: primeiro mês com paciente, sessão ou senha"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT MIN(mes) as mes FROM (
+                SELECT MIN(strftime('%Y-%m', data_criacao)) as mes FROM pacientes
+                UNION ALL SELECT MIN(strftime('%Y-%m', data_sessao)) FROM sessoes
+                UNION ALL SELECT MIN(strftime('%Y-%m', COALESCE(data_aprovacao, data_criacao))) FROM senhas
+            )
+        ''')
+        result = cursor.fetchone()
+        return result['mes'] if result and result['mes'] else None
+
+
+def ultimo_mes_fechado():
+    """Mês anterior ao atual"""
+    hoje = datetime.now()
+    return f"{hoje.year - 1}-12" if hoje.month == 1 else f"{hoje.year}-{hoje.month - 1:02d}"
+
+
+def _inicializar_worker(database_path):
+    """Os workers apontam para o mesmo arquivo de banco do processo principal"""
+    database.DATABASE_PATH = database_path
+
+
+def apurar_mes(mes_referencia):
+    """Executado nos workers: apura todos os ledgers do mês sem escrever no banco"""
+    with get_db_readonly_connection() as conn:
+        cursor = conn.cursor()
+        regras = apurar_regras_mes(cursor, mes_referencia)
+
+        return {
+            'mes_referencia': mes_referencia,
+            'faturamento_clinica': _apurar_faturamento_clinica(cursor, mes_referencia, regras),
+            'pagamentos_equipe': _apurar_pagamentos_equipe(cursor, mes_referencia, regras),
+            'pagamentos_externos': _apurar_pagamentos_medicos_externos(cursor, mes_referencia, regras),
+            'pagamentos_medicos': [
+                _resultado_pagamento_medico(medico, mes_referencia)
+                for medico in regras['sessoes_medicos'] if medico['is_externo']
+            ]
+        }
+
+
+def gravar_mes(conn, apuracao):
+    """Escritor único: upsert dos ledgers do mês e registro do progresso, numa transação"""
+    mes_referencia = apuracao['mes_referencia']
+    totais = {
+        'faturamento_centavos': somar_centavos(l['valor_senha_centavos'] for l in apuracao['faturamento_clinica']),
+        'pagamentos_equipe_centavos': somar_centavos(p['valor_centavos'] for p in apuracao['pagamentos_equipe']),
+        'pagamentos_externos_centavos': somar_centavos(p['valor_total_centavos'] for p in apuracao['pagamentos_externos']),
+        'pagamentos_medicos_centavos': somar_centavos(r['pagamento_total_centavos'] for r in apuracao['pagamentos_medicos']),
+    }
+
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        _gravar_faturamento_clinica(cursor, mes_referencia, apuracao['faturamento_clinica'])
+        _gravar_pagamentos_equipe(cursor, mes_referencia, apuracao['pagamentos_equipe'])
+        _gravar_pagamentos_medicos_externos(cursor, mes_referencia, apuracao['pagamentos_externos'])
+        for resultado in apuracao['pagamentos_medicos']:
+            _gravar_pagamento_medico(cursor, resultado)
+
+        cursor.execute('''
+            INSERT INTO recalculo_meses
+            (mes_referencia, status, faturamento_centavos, pagamentos_equipe_centavos,
+             pagamentos_externos_centavos, pagamentos_medicos_centavos, erro, data_conclusao)
+            VALUES (?, 'concluido', ?, ?, ?, ?, NULL, CURRENT_TIMESTAMP)
+            ON CONFLICT (mes_referencia) DO UPDATE SET
+                status = 'concluido',
+                faturamento_centavos = excluded.faturamento_centavos,
+                pagamentos_equipe_centavos = excluded.pagamentos_equipe_centavos,
+                pagamentos_externos_centavos = excluded.pagamentos_externos_centavos,
+                pagamentos_medicos_centavos = excluded.pagamentos_medicos_centavos,
+                erro = NULL,
+                data_conclusao = CURRENT_TIMESTAMP
+        ''', (mes_referencia, totais['faturamento_centavos'], totais['pagamentos_equipe_centavos'],
+              totais['pagamentos_externos_centavos'], totais['pagamentos_medicos_centavos']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return totais
+
+
+def _registrar_erro(conn, mes_referencia, erro):
+    conn.execute('''
+        INSERT INTO recalculo_meses (mes_referencia, status, erro) VALUES (?, 'erro', ?)
+        ON CONFLICT (mes_referencia) DO UPDATE SET status = 'erro', erro = excluded.erro
+    ''', (mes_referencia, str(erro)))
+    conn.commit()
+
+
+def recalcular_historico(mes_inicio=None, mes_fim=None, workers=None, reiniciar=False, progresso=print):
+    """
+    Recalcula os ledgers de todos os meses do período em paralelo.
+    Meses já concluídos numa execução anterior são pulados (a menos que reiniciar=True).
+    Retorna um resumo com os meses processados, pulados e com erro.
+    """
+    mes_inicio = mes_inicio or primeiro_mes_com_dados()
+    mes_fim = mes_fim or ultimo_mes_fechado()
+    if not mes_inicio:
+        return {'total': 0, 'concluidos': [], 'pulados': [], 'erros': {}}
+
+    meses = meses_entre(mes_inicio, mes_fim)
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if reiniciar:
+            cursor.execute('DELETE FROM recalculo_meses WHERE mes_referencia BETWEEN ? AND ?', (mes_inicio, mes_fim))
+        cursor.execute('''
+            SELECT mes_referencia FROM recalculo_meses
+            WHERE status = 'concluido' AND mes_referencia BETWEEN ? AND ?
+        ''', (mes_inicio, mes_fim))
+        concluidos_antes = {row['mes_referencia'] for row in cursor.fetchall()}
+        pendentes = [mes for mes in meses if mes not in concluidos_antes]
+        cursor.executemany('''
+            INSERT INTO recalculo_meses (mes_referencia, status) VALUES (?, 'pendente')
+            ON CONFLICT (mes_referencia) DO UPDATE SET status = 'pendente'
+        ''', [(mes,) for mes in pendentes])
+        conn.commit()
+
+    resumo = {'total': len(meses), 'concluidos': [], 'pulados': sorted(concluidos_antes), 'erros': {}}
+    if concluidos_antes:
+        progresso(f"{len(concluidos_antes)} meses já concluídos em execução anterior (use --reiniciar para refazer)")
+    if not pendentes:
+        return resumo
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pendentes)))
+    progresso(f"Recalculando {len(pendentes)} meses ({pendentes[0]} a {pendentes[-1]}) com {workers} processos")
+    inicio = time.perf_counter()
+
+    with get_db_connection() as conn, ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_worker,
+                                                          initargs=(database.DATABASE_PATH,)) as executor:
+        futuros = {executor.submit(apurar_mes, mes): mes for mes in pendentes}
+        for n, futuro in enumerate(as_completed(futuros), start=1):
+            mes = futuros[futuro]
+            try:
+                totais = gravar_mes(conn, futuro.result())
+                resumo['concluidos'].append(mes)
+                situacao = (f"faturamento {formatar_reais(totais['faturamento_centavos'])}, "
+                            f"equipes {formatar_reais(totais['pagamentos_equipe_centavos'])}, "
+                            f"externos {formatar_reais(totais['pagamentos_medicos_centavos'])}")
+            except Exception as e:
+                logging.error(f"Erro ao recalcular o mês {mes}: {e}")
+                _registrar_erro(conn, mes, e)
+                resumo['erros'][mes] = str(e)
+                situacao = f"ERRO: {e}"
+
+            decorrido = time.perf_counter() - inicio
+            restante = decorrido / n * (len(pendentes) - n)
+            progresso(f"[{n}/{len(pendentes)}] {mes} - {situacao} ({decorrido:.1f}s, restante ~{restante:.1f}s)")
+
+    resumo['concluidos'].sort()
+    return resumo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recálculo histórico paralelo dos lançamentos financeiros')
+    parser.add_argument('--inicio', help='Primeiro mês (YYYY-MM); padrão: primeiro mês com dados')
+    parser.add_argument('--fim', help='Último mês (YYYY-MM); padrão: último mês fechado')
+    parser.add_argument('--workers', type=int, help='Número de processos; padrão: número de CPUs')
+    parser.add_argument('--reiniciar', action='store_true', help='Ignora o progresso salvo e recalcula todos os meses')
+    parser.add_argument('--db', help='Caminho do banco SQLite (padrão: neuropsychology.db)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.db:
+        database.DATABASE_PATH = args.db
+    database.init_db()
+
+    resumo = recalcular_historico(args.inicio, args.fim, args.workers, args.reiniciar)
+    print(f"{len(resumo['concluidos'])} meses recalculados, {len(resumo['pulados'])} pulados, "
+          f"{len(resumo['erros'])} com erro")
+    return 1 if resumo['erros'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,267 @@
+"""
+Payout rules engine shared by every finance path
+
+The payout rules are declared once below and parameterised by ``configuracoes``.
+compilar_regras() binds the configuration into plain functions (cached until a
+configuration changes) and apurar_mes() evaluates them in a single pass over a month's
+facts: approved senhas and sessions per patient, in integer centavos. Ledgers
+(financeiro_utils, medico_pagamento), reports, dashboards and the simulator all read
+the same apuração, so the clinic has a single definition of how much each party earns.
+
+Regras:
+- Equipe: porcentagem_participacao (pontos base) do faturamento das senhas aprovadas
+  dos médicos da equipe, arredondada meio-para-cima por equipe/mês
+- Médico externo: valor_sessao por sessão paga; as sessões pagas vêm da primeira regra
+  de REGRAS_SESSOES_EXTERNO que se aplicar ao paciente no mês
+"""
+from database import get_db_connection
+from dinheiro_utils import para_centavos, aplicar_pontos_base, somar_centavos
+
+# Configurações usadas pelas regras (chave em configuracoes -> valor padrão)
+CONFIGS_REGRAS = {
+    'garantia_8_sessoes': '1',
+    'sessoes_garantidas': '8',
+    'valor_sessao_medico_externo': '112.50',
+}
+
+# Sessões pagas ao médico externo por paciente/mês, em ordem de prioridade.
+# 'ativa' indica a configuração que liga/desliga a regra.
+REGRAS_SESSOES_EXTERNO = [
+    {
+        'nome': 'garantia_laudo_mes_inicio',
+        'descricao': 'Laudo liberado no mês de início do tratamento: paga as sessões garantidas',
+        'ativa': 'garantia_8_sessoes',
+        'condicao': lambda fato, mes, cfg: fato['laudo_mes_inicio'] and fato['mes_inicio'] == mes,
+        'sessoes': lambda fato, cfg: cfg['sessoes_garantidas'],
+    },
+    {
+        'nome': 'sessoes_realizadas',
+        'descricao': 'Paga as sessões efetivamente realizadas no mês',
+        'condicao': lambda fato, mes, cfg: True,
+        'sessoes': lambda fato, cfg: fato['sessoes_realizadas'],
+    },
+]
+
+_regras_compiladas = {'chave': None, 'regras': None}
+
+
+def compilar_regras(configs=None):
+    """
+    Compila as regras para um conjunto de configurações (dict chave -> valor em texto).
+    Retorna dict com os parâmetros e as funções de avaliação.
+    """
+    configs = dict(CONFIGS_REGRAS, **(configs or {}))
+    cfg = {
+        'garantia_8_sessoes': str(configs['garantia_8_sessoes']).strip() in ('1', 'true', 'True', 'sim'),
+        'sessoes_garantidas': int(float(configs['sessoes_garantidas'] or 0)),
+        'valor_sessao_padrao_centavos': para_centavos(configs['valor_sessao_medico_externo']),
+    }
+    regras_sessoes = [r for r in REGRAS_SESSOES_EXTERNO if not r.get('ativa') or cfg[r['ativa']]]
+
+    def sessoes_pagas(fato, mes_referencia):
+        """(sessões pagas, nome da regra aplicada) para um paciente de médico externo no mês"""
+        for regra in regras_sessoes:
+            if regra['condicao'](fato, mes_referencia, cfg):
+                return regra['sessoes'](fato, cfg), regra['nome']
+        return 0, None
+
+    def valor_sessao_centavos(valor_cadastrado_centavos):
+        return valor_cadastrado_centavos or cfg['valor_sessao_padrao_centavos']
+
+    return {
+        'config': cfg,
+        'regras_sessoes': [r['nome'] for r in regras_sessoes],
+        'sessoes_pagas': sessoes_pagas,
+        'valor_sessao_centavos': valor_sessao_centavos,
+        'pagamento_equipe': aplicar_pontos_base,
+    }
+
+
+def obter_regras(cursor=None):
+    """Regras compiladas a partir de configuracoes; recompila só quando a configuração muda"""
+    placeholders = ', '.join('?' * len(CONFIGS_REGRAS))
+    query = f'SELECT chave, valor FROM configuracoes WHERE chave IN ({placeholders})'
+
+    if cursor is None:
+        with get_db_connection() as conn:
+            linhas = conn.execute(query, list(CONFIGS_REGRAS)).fetchall()
+    else:
+        cursor.execute(query, list(CONFIGS_REGRAS))
+        linhas = cursor.fetchall()
+
+    configs = {linha['chave']: linha['valor'] for linha in linhas}
+    chave = tuple(sorted(configs.items()))
+    if _regras_compiladas['chave'] != chave:
+        _regras_compiladas['regras'] = compilar_regras(configs)
+        _regras_compiladas['chave'] = chave
+    return _regras_compiladas['regras']
+
+
+def _carregar_fatos_mes(cursor, mes_referencia, medico_id=None):
+    """Fatos do mês: senhas aprovadas, médicos pagos por sessão e sessões por paciente"""
+    cursor.execute('''
+        SELECT s.id as senha_id, s.paciente_id, COALESCE(s.valor_centavos, 0) as valor_centavos,
+               s.tipo, p.medico_id, m.nome as medico_nome, m.equipe_id,
+               e.nome as equipe_nome, e.ativo as equipe_ativa,
+               e.porcentagem_participacao, e.porcentagem_pontos_base
+        FROM senhas s
+        JOIN pacientes p ON s.paciente_id = p.id
+        LEFT JOIN medicos m ON p.medico_id = m.id
+        LEFT JOIN equipes e ON m.equipe_id = e.id
+        WHERE s.ativo = 1
+        AND s.aprovada_admin = 1
+        AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+        ORDER BY s.id
+    ''', (mes_referencia,))
+    senhas = cursor.fetchall()
+
+    # Médicos pagos por sessão: externos (ou o médico pedido, para o detalhamento)
+    filtro_medico = 'm.equipe_id IS NULL' if medico_id is None else 'm.id = ?'
+    params = () if medico_id is None else (medico_id,)
+
+    cursor.execute(f'''
+        SELECT m.id, m.nome, m.equipe_id, m.valor_sessao_centavos
+        FROM medicos m
+        WHERE m.ativo = 1 AND {filtro_medico}
+        ORDER BY m.nome
+    ''', params)
+    medicos = cursor.fetchall()
+
+    cursor.execute(f'''
+        SELECT p.id as paciente_id, p.nome as paciente_nome, p.medico_id,
+               substr(p.data_criacao, 1, 7) as mes_inicio,
+               (SELECT COUNT(*) FROM sessoes se
+                WHERE se.paciente_id = p.id AND se.realizada = 1
+                AND strftime('%Y-%m', se.data_sessao) = ?) as sessoes_realizadas,
+               EXISTS (
+                   SELECT 1 FROM laudos l
+                   WHERE l.paciente_id = p.id AND l.liberado_entrega = 1
+                   AND substr(l.data_liberacao, 1, 7) = substr(p.data_criacao, 1, 7)
+               ) as laudo_mes_inicio
+        FROM pacientes p
+        JOIN medicos m ON p.medico_id = m.id
+        WHERE m.ativo = 1 AND {filtro_medico}
+        AND p.status = 'ativo'
+        AND substr(p.data_criacao, 1, 7) <= ?
+        ORDER BY p.nome
+    ''', (mes_referencia,) + params + (mes_referencia,))
+    pacientes = cursor.fetchall()
+
+    return senhas, medicos, pacientes
+
+
+def apurar_mes(cursor, mes_referencia, medico_id=None, regras=None):
+    """
+    Avalia todas as regras de pagamento do mês numa única passada sobre os fatos.
+    Com medico_id, restringe o detalhamento por sessão a esse médico.
+    """
+    regras = regras or obter_regras(cursor)
+    senhas, medicos, pacientes = _carregar_fatos_mes(cursor, mes_referencia, medico_id)
+
+    faturamento_centavos = 0
+    equipes = {}
+    medicos_equipe = {}
+
+    for senha in senhas:
+        valor = senha['valor_centavos']
+        faturamento_centavos += valor
+
+        if senha['equipe_id'] is None or not senha['equipe_ativa']:
+            continue
+
+        equipe = equipes.setdefault(senha['equipe_id'], {
+            'equipe_id': senha['equipe_id'],
+            'equipe': senha['equipe_nome'],
+            'porcentagem': senha['porcentagem_participacao'],
+            'porcentagem_pontos_base': senha['porcentagem_pontos_base'],
+            'faturamento_base_centavos': 0,
+            'total_senhas': 0,
+        })
+        equipe['faturamento_base_centavos'] += valor
+        equipe['total_senhas'] += 1
+
+        medico = medicos_equipe.setdefault(senha['medico_id'], {
+            'medico_id': senha['medico_id'],
+            'medico_nome': senha['medico_nome'],
+            'equipe_id': senha['equipe_id'],
+            'equipe_nome': senha['equipe_nome'],
+            'porcentagem': senha['porcentagem_participacao'],
+            'porcentagem_pontos_base': senha['porcentagem_pontos_base'],
+            'pacientes': set(),
+            'total_senhas': 0,
+            'faturamento_centavos': 0,
+        })
+        medico['pacientes'].add(senha['paciente_id'])
+        medico['total_senhas'] += 1
+        medico['faturamento_centavos'] += valor
+
+    for equipe in equipes.values():
+        equipe['valor_centavos'] = regras['pagamento_equipe'](equipe['faturamento_base_centavos'],
+                                                               equipe['porcentagem_pontos_base'])
+    for medico in medicos_equipe.values():
+        medico['total_pacientes'] = len(medico.pop('pacientes'))
+        medico['valor_a_pagar_centavos'] = regras['pagamento_equipe'](medico['faturamento_centavos'],
+                                                                       medico['porcentagem_pontos_base'])
+
+    # Médicos pagos por sessão
+    sessoes_medicos = {
+        m['id']: {
+            'medico_id': m['id'],
+            'medico_nome': m['nome'],
+            'is_externo': m['equipe_id'] is None,
+            'valor_sessao_centavos': regras['valor_sessao_centavos'](m['valor_sessao_centavos']),
+            'sessoes_garantidas': regras['config']['sessoes_garantidas'],
+            'pacientes': [],
+            'sessoes_realizadas': 0,
+            'sessoes_pagas': 0,
+            'pacientes_garantia': 0,
+            'pagamento_centavos': 0,
+        }
+        for m in medicos
+    }
+    for fato in pacientes:
+        medico = sessoes_medicos.get(fato['medico_id'])
+        if not medico:
+            continue
+
+        if medico['is_externo']:
+            sessoes_pagas, regra = regras['sessoes_pagas'](fato, mes_referencia)
+        else:
+            # Médico de equipe é remunerado pela participação da equipe
+            sessoes_pagas, regra = 0, None
+        valor_centavos = sessoes_pagas * medico['valor_sessao_centavos']
+
+        medico['pacientes'].append({
+            'paciente_id': fato['paciente_id'],
+            'paciente_nome': fato['paciente_nome'],
+            'mes_inicio': fato['mes_inicio'],
+            'sessoes_realizadas': fato['sessoes_realizadas'],
+            'sessoes_pagas': sessoes_pagas,
+            'laudo_mes_inicio': bool(fato['laudo_mes_inicio']),
+            'regra': regra,
+            'valor_centavos': valor_centavos,
+        })
+        medico['sessoes_realizadas'] += fato['sessoes_realizadas']
+        medico['sessoes_pagas'] += sessoes_pagas
+        medico['pacientes_garantia'] += 1 if regra == 'garantia_laudo_mes_inicio' else 0
+        medico['pagamento_centavos'] += valor_centavos
+
+    total_equipes = somar_centavos(e['valor_centavos'] for e in equipes.values())
+    total_externos = somar_centavos(m['pagamento_centavos'] for m in sessoes_medicos.values() if m['is_externo'])
+
+    return {
+        'mes_referencia': mes_referencia,
+        'regras': regras['regras_sessoes'],
+        'senhas': [
+            {'senha_id': s['senha_id'], 'paciente_id': s['paciente_id'], 'valor_senha_centavos': s['valor_centavos']}
+            for s in senhas
+        ],
+        'faturamento_centavos': faturamento_centavos,
+        'equipes': sorted(equipes.values(), key=lambda e: e['equipe'] or ''),
+        'medicos_equipe': sorted(medicos_equipe.values(), key=lambda m: m['medico_nome'] or ''),
+        'sessoes_medicos': list(sessoes_medicos.values()),
+        'total_equipes_centavos': total_equipes,
+        'total_externos_centavos': total_externos,
+        'resultado_centavos': faturamento_centavos - total_equipes - total_externos,
+    }
+
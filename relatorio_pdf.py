@@ -0,0 +1,306 @@
+"""
+Relatório financeiro mensal (A4): dados, renderização em PDF e cache em disco
+
+montar_dados_relatorio() reúne os números do relatório (também usados pela página
+HTML de impressão). O PDF de um mês é gerado uma vez por versão dos dados: a chave
+combina o mês com as versões das dependências do relatório (cache_utils), e o arquivo é
+gravado em cache/pdf com o sha256 do conteúdo como nome (endereçado por conteúdo).
+A renderização roda num pool de processos, fora dos workers web; enquanto não fica
+pronta, obter_pdf_relatorio() informa que está em geração, e uma renderização que
+falhou é informada uma vez (a consulta seguinte tenta de novo).
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+from database import get_db_connection, get_db_readonly_connection
+from dinheiro_utils import centavos_para_reais, somar_centavos, formatar_reais
+from regras_pagamento import apurar_mes
+from sql_utils import rows_to_dicts
+
+DIRETORIO_CACHE_PDF = os.path.join('cache', 'pdf')
+
+# Mudar o layout do PDF exige incrementar VERSAO_LAYOUT
+VERSAO_LAYOUT = 1
+
+MESES_NOMES = ['', 'Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
+               'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+
+_pool = None
+_em_geracao = {}
+_falhas = {}
+_lock = threading.RLock()
+
+
+def montar_dados_relatorio(cursor, mes, ano):
+    """Números do relatório financeiro do mês, no formato do template de impressão"""
+    mes_referencia = f"{ano}-{mes:02d}"
+
+    # Faturamento e pagamentos do mês pelas regras de pagamento (uma apuração)
+    apuracao = apurar_mes(cursor, mes_referencia)
+    faturamento_bruto_centavos = apuracao['faturamento_centavos']
+    faturamento_bruto = centavos_para_reais(faturamento_bruto_centavos)
+    pagamento_por_equipe = {e['equipe_id']: e['valor_centavos'] for e in apuracao['equipes']}
+    pagamento_por_medico = {m['medico_id']: m['pagamento_centavos'] for m in apuracao['sessoes_medicos']}
+
+    # Faturamento por equipe com detalhes
+    cursor.execute('''
+        SELECT 
+            e.id as equipe_id,
+            e.nome as equipe_nome,
+            e.porcentagem_participacao,
+            COALESCE(SUM(s.valor_centavos), 0) as total_faturamento_centavos,
+            COUNT(DISTINCT m.id) as medicos_count,
+            COUNT(DISTINCT s.id) as sessoes_count
+        FROM equipes e
+        LEFT JOIN medicos m ON e.id = m.equipe_id
+        LEFT JOIN pacientes p ON m.id = p.medico_id
+        LEFT JOIN senhas s ON p.id = s.paciente_id 
+            AND s.aprovada_admin = 1 AND s.ativo = 1
+            AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+        GROUP BY e.id, e.nome, e.porcentagem_participacao
+        ORDER BY total_faturamento_centavos DESC
+    ''', (mes_referencia,))
+
+    faturamento_por_equipe = rows_to_dicts(cursor.fetchall())
+
+    # Faturamento por médico com detalhes
+    cursor.execute('''
+        SELECT 
+            m.id as medico_id,
+            m.nome as medico_nome,
+            COALESCE(e.nome, 'Externo') as equipe_nome,
+            COALESCE(SUM(s.valor_centavos), 0) as faturamento_centavos,
+            COUNT(DISTINCT s.id) as sessoes_count,
+            COUNT(DISTINCT CASE WHEN s.tipo = 'teste_neuropsicologico' THEN s.id END) as laudos_fechados
+        FROM medicos m
+        LEFT JOIN equipes e ON m.equipe_id = e.id
+        LEFT JOIN pacientes p ON m.id = p.medico_id
+        LEFT JOIN senhas s ON p.id = s.paciente_id 
+            AND s.aprovada_admin = 1 AND s.ativo = 1
+            AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+        GROUP BY m.id, m.nome, e.nome
+        ORDER BY faturamento_centavos DESC
+    ''', (mes_referencia,))
+
+    faturamento_por_medico = rows_to_dicts(cursor.fetchall()) or []
+
+    # Valores em reais apenas para exibição; os totais são somados em centavos inteiros
+    for e in faturamento_por_equipe:
+        e['pagamento_equipe_centavos'] = pagamento_por_equipe.get(e['equipe_id'], 0)
+        e['total_faturamento'] = centavos_para_reais(e['total_faturamento_centavos'])
+        e['pagamento_equipe'] = centavos_para_reais(e['pagamento_equipe_centavos'])
+    for m in faturamento_por_medico:
+        m['pagamento_medico_centavos'] = pagamento_por_medico.get(m['medico_id'], 0)
+        m['faturamento'] = centavos_para_reais(m['faturamento_centavos'])
+        m['pagamento_medico'] = centavos_para_reais(m['pagamento_medico_centavos'])
+
+    externos = [m for m in faturamento_por_medico if m.get('equipe_nome') == 'Externo']
+    equipes = [e for e in faturamento_por_equipe if e.get('equipe_nome') and e.get('equipe_nome') != 'Externo']
+
+    faturamento_externos_centavos = somar_centavos(m['faturamento_centavos'] for m in externos)
+    pagamento_externos_centavos = somar_centavos(m['pagamento_medico_centavos'] for m in externos)
+    faturamento_equipes_centavos = somar_centavos(e['total_faturamento_centavos'] for e in equipes)
+    pagamento_equipes_centavos = somar_centavos(e['pagamento_equipe_centavos'] for e in equipes)
+
+    faturamento_externos = centavos_para_reais(faturamento_externos_centavos)
+    faturamento_equipes = centavos_para_reais(faturamento_equipes_centavos)
+    total_pagamento_externos = centavos_para_reais(pagamento_externos_centavos)
+    total_pagamento_equipes = centavos_para_reais(pagamento_equipes_centavos)
+
+    lucro_liquido_centavos = faturamento_bruto_centavos - pagamento_externos_centavos - pagamento_equipes_centavos
+    lucro_liquido = centavos_para_reais(lucro_liquido_centavos)
+
+    # Lista de equipes para organização
+    equipes_nomes = []
+    for e in faturamento_por_equipe:
+        if e and isinstance(e, dict) and e.get('equipe_nome') and e.get('equipe_nome') != 'Externo':
+            nome = e.get('equipe_nome')
+            if nome not in equipes_nomes:
+                equipes_nomes.append(nome)
+
+    data_relatorio = f"{MESES_NOMES[mes]} de {ano}"
+
+    return {
+        'faturamento_bruto': faturamento_bruto,
+        'faturamento_bruto_centavos': faturamento_bruto_centavos,
+        'faturamento_externos_centavos': faturamento_externos_centavos,
+        'faturamento_equipes_centavos': faturamento_equipes_centavos,
+        'pagamento_externos_centavos': pagamento_externos_centavos,
+        'pagamento_equipes_centavos': pagamento_equipes_centavos,
+        'lucro_liquido_centavos': lucro_liquido_centavos,
+        'faturamento_por_equipe': faturamento_por_equipe,
+        'faturamento_por_medico': faturamento_por_medico,
+        'faturamento_externos': faturamento_externos,
+        'faturamento_equipes': faturamento_equipes,
+        'total_pagamento_externos': total_pagamento_externos,
+        'total_pagamento_equipes': total_pagamento_equipes,
+        'lucro_liquido': lucro_liquido,
+        'equipes_nomes': equipes_nomes,
+        'data_relatorio': data_relatorio,
+        'mes': mes,
+        'ano': ano,
+    }
+
+
+def renderizar_pdf(dados):
+    """
+    Bytes do PDF do relatório a partir de montar_dados_relatorio().
+    Determinístico (sem data/hora de geração): os mesmos dados produzem o mesmo hash.
+    """
+    from pdf_utils import DocumentoPDF
+
+    doc = DocumentoPDF(f"Relatório Financeiro - {dados['data_relatorio']}")
+    doc.titulo_principal('Relatório Financeiro Mensal', dados['data_relatorio'])
+
+    doc.secao('Resumo Executivo')
+    doc.tabela(
+        [('Indicador', 0.6, 'esquerda'), ('Valor', 0.4, 'direita')],
+        [
+            ['Faturamento bruto', formatar_reais(dados['faturamento_bruto_centavos'])],
+            ['Faturamento médicos externos', formatar_reais(dados['faturamento_externos_centavos'])],
+            ['Faturamento equipes', formatar_reais(dados['faturamento_equipes_centavos'])],
+            ['Pagamento médicos externos', formatar_reais(dados['pagamento_externos_centavos'])],
+            ['Pagamento equipes', formatar_reais(dados['pagamento_equipes_centavos'])],
+        ],
+        total=['Lucro líquido', formatar_reais(dados['lucro_liquido_centavos'])],
+    )
+
+    externos = [m for m in dados['faturamento_por_medico'] if m['equipe_nome'] == 'Externo']
+    doc.secao('Médicos Externos')
+    if externos:
+        doc.tabela(
+            [('Médico', 0.36, 'esquerda'), ('Sessões', 0.12, 'direita'), ('Laudos', 0.12, 'direita'),
+             ('Faturamento', 0.2, 'direita'), ('Pagamento', 0.2, 'direita')],
+            [[m['medico_nome'], m['sessoes_count'], m['laudos_fechados'],
+              formatar_reais(m['faturamento_centavos']), formatar_reais(m['pagamento_medico_centavos'])]
+             for m in externos],
+            total=['Total', '', '', formatar_reais(dados['faturamento_externos_centavos']),
+                   formatar_reais(dados['pagamento_externos_centavos'])],
+        )
+    else:
+        doc.texto('Nenhum médico externo no período.')
+
+    equipes = [e for e in dados['faturamento_por_equipe'] if e['equipe_nome'] in dados['equipes_nomes']]
+    doc.secao('Equipes')
+    if equipes:
+        doc.tabela(
+            [('Equipe', 0.34, 'esquerda'), ('Médicos', 0.12, 'direita'), ('Faturamento', 0.2, 'direita'),
+             ('Pagamento', 0.2, 'direita'), ('%', 0.14, 'direita')],
+            [[e['equipe_nome'], e['medicos_count'], formatar_reais(e['total_faturamento_centavos']),
+              formatar_reais(e['pagamento_equipe_centavos']), f"{e['porcentagem_participacao'] or 0:.2f}%"]
+             for e in equipes],
+            total=['Total', '', formatar_reais(dados['faturamento_equipes_centavos']),
+                   formatar_reais(dados['pagamento_equipes_centavos']), ''],
+        )
+    else:
+        doc.texto('Nenhuma equipe no período.')
+
+    for nome in dados['equipes_nomes']:
+        medicos = [m for m in dados['faturamento_por_medico'] if m['equipe_nome'] == nome]
+        if not medicos:
+            continue
+        doc.secao(f'Equipe {nome}')
+        doc.tabela(
+            [('Médico', 0.46, 'esquerda'), ('Sessões', 0.12, 'direita'), ('Laudos', 0.12, 'direita'),
+             ('Faturamento', 0.3, 'direita')],
+            [[m['medico_nome'], m['sessoes_count'], m['laudos_fechados'], formatar_reais(m['faturamento_centavos'])]
+             for m in medicos],
+        )
+
+    return doc.gerar()
+
+
+def versao_dados_relatorio(mes_referencia, cursor=None):
+    """Versão dos dados lidos pelo relatório (dependências de 'relatorio_pdf' em cache_utils)"""
+    from cache_utils import versao_artefato
+    versoes = versao_artefato('relatorio_pdf', (mes_referencia,), cursor)
+    return f"l{VERSAO_LAYOUT}-" + '-'.join(str(versao) for versao in versoes)
+
+
+def caminho_pdf(hash_conteudo):
+    return os.path.abspath(os.path.join(DIRETORIO_CACHE_PDF, f'{hash_conteudo}.pdf'))
+
+
+def gerar_pdf_relatorio(mes_referencia, versao_dados):
+    """
+    Gera o PDF do mês e grava no cache (executado no pool de processos).
+    Retorna o sha256 do conteúdo.
+    """
+    ano, mes = (int(parte) for parte in mes_referencia.split('-'))
+    with get_db_readonly_connection() as conn:
+        dados = montar_dados_relatorio(conn.cursor(), mes, ano)
+    conteudo = renderizar_pdf(dados)
+    hash_conteudo = hashlib.sha256(conteudo).hexdigest()
+
+    # Conteúdo idêntico (mesmo hash) reaproveita o arquivo já gravado
+    destino = caminho_pdf(hash_conteudo)
+    if not os.path.exists(destino):
+        os.makedirs(DIRETORIO_CACHE_PDF, exist_ok=True)
+        temporario = f'{destino}.{os.getpid()}.tmp'
+        with open(temporario, 'wb') as arquivo:
+            arquivo.write(conteudo)
+        os.replace(temporario, destino)
+
+    with get_db_connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO relatorios_pdf (mes_referencia, versao_dados, hash_conteudo, tamanho)
+            VALUES (?, ?, ?, ?)
+        ''', (mes_referencia, versao_dados, hash_conteudo, len(conteudo)))
+        conn.commit()
+    return hash_conteudo
+
+
+def _inicializar_worker(database_path, diretorio_trabalho):
+    """Os workers usam o mesmo banco e o mesmo diretório de cache do processo web"""
+    database.DATABASE_PATH = database_path
+    os.chdir(diretorio_trabalho)
+
+
+def _obter_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=2, initializer=_inicializar_worker,
+                                    initargs=(database.DATABASE_PATH, os.getcwd()))
+    return _pool
+
+
+def _geracao_concluida(chave, futuro):
+    with _lock:
+        _em_geracao.pop(chave, None)
+        if futuro.exception() is not None:
+            _falhas[chave] = str(futuro.exception())
+    if futuro.exception() is not None:
+        logging.error(f"Erro ao gerar PDF do relatório {chave}: {futuro.exception()}")
+
+
+def obter_pdf_relatorio(mes_referencia):
+    """
+    PDF do mês para a versão atual dos dados.
+    Retorna ('pronto', caminho, hash), ('gerando', None, None) enquanto o pool renderiza
+    ou ('erro', None, mensagem) se a última renderização dessa versão falhou.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        versao_dados = versao_dados_relatorio(mes_referencia, cursor)
+        cursor.execute('''
+            SELECT hash_conteudo FROM relatorios_pdf
+            WHERE mes_referencia = ? AND versao_dados = ?
+        ''', (mes_referencia, versao_dados))
+        registro = cursor.fetchone()
+
+    if registro and os.path.exists(caminho_pdf(registro['hash_conteudo'])):
+        return 'pronto', caminho_pdf(registro['hash_conteudo']), registro['hash_conteudo']
+
+    chave = (mes_referencia, versao_dados)
+    with _lock:
+        if chave in _falhas:
+            return 'erro', None, _falhas.pop(chave)
+        if chave not in _em_geracao:
+            futuro = _obter_pool().submit(gerar_pdf_relatorio, mes_referencia, versao_dados)
+            _em_geracao[chave] = futuro
+            futuro.add_done_callback(lambda f: _geracao_concluida(chave, f))
+    return 'gerando', None, None
@@ -0,0 +1,206 @@
+"""
+Daily time-series rollup for multi-month trend charts
+
+The ``rollup_diario`` table keeps one row per day x equipe x médico x localização
+with revenue, approved senhas, sessions held, appointments and confirmations.
+Triggers on the source tables record touched days in ``rollup_dias_pendentes``;
+the incremental job only recomputes those days, so trend queries read a few
+hundred pre-aggregated rows instead of scanning the raw tables. The job runs in
+the background scheduler (agendador.py); readers never recompute, so a chart shows
+the rollup as of the last run.
+
+Uso manual:
+    python rollup_utils.py              # processa apenas os dias pendentes
+    python rollup_utils.py --completo   # reconstrói todo o histórico
+"""
+import logging
+import sys
+from datetime import datetime
+from database import get_db_connection
+from dinheiro_utils import centavos_para_reais
+
+# Métricas agregadas na tabela rollup_diario
+METRICAS_ROLLUP = ['receita_centavos', 'senhas_aprovadas', 'sessoes_realizadas', 'agendamentos', 'confirmacoes']
+
+_SQL_FATOS_DIARIOS = '''
+    SELECT date(COALESCE(s.data_aprovacao, s.data_criacao)) as dia,
+           COALESCE(m.equipe_id, 0) as equipe_id, COALESCE(p.medico_id, 0) as medico_id,
+           COALESCE(p.localizacao, '') as localizacao,
+           s.valor_centavos as receita_centavos, 1 as senhas_aprovadas, 0 as sessoes_realizadas,
+           0 as agendamentos, 0 as confirmacoes
+    FROM senhas s
+    JOIN pacientes p ON s.paciente_id = p.id
+    LEFT JOIN medicos m ON p.medico_id = m.id
+    WHERE s.ativo = 1 AND s.aprovada_admin = 1
+    AND date(COALESCE(s.data_aprovacao, s.data_criacao)) IN (SELECT dia FROM temp_rollup_dias)
+
+    UNION ALL
+
+    SELECT date(se.data_sessao), COALESCE(m.equipe_id, 0), COALESCE(p.medico_id, 0),
+           COALESCE(p.localizacao, ''), 0, 0, 1, 0, 0
+    FROM sessoes se
+    JOIN pacientes p ON se.paciente_id = p.id
+    LEFT JOIN medicos m ON p.medico_id = m.id
+    WHERE se.realizada = 1
+    AND date(se.data_sessao) IN (SELECT dia FROM temp_rollup_dias)
+
+    UNION ALL
+
+    SELECT date(a.data_consulta), COALESCE(m.equipe_id, 0), a.medico_id,
+           COALESCE(p.localizacao, ''), 0, 0, 0, 1, 0
+    FROM agendamentos a
+    JOIN pacientes p ON a.paciente_id = p.id
+    LEFT JOIN medicos m ON a.medico_id = m.id
+    WHERE date(a.data_consulta) IN (SELECT dia FROM temp_rollup_dias)
+
+    UNION ALL
+
+    SELECT date(cc.data_confirmacao), COALESCE(m.equipe_id, 0), a.medico_id,
+           COALESCE(p.localizacao, ''), 0, 0, 0, 0, 1
+    FROM confirmacoes_consulta cc
+    JOIN agendamentos a ON cc.agendamento_id = a.id
+    JOIN pacientes p ON a.paciente_id = p.id
+    LEFT JOIN medicos m ON a.medico_id = m.id
+    WHERE cc.confirmado = 1
+    AND date(cc.data_confirmacao) IN (SELECT dia FROM temp_rollup_dias)
+'''
+
+
+def _recalcular_dias(cursor):
+    """Recalcula o rollup dos dias listados em temp_rollup_dias"""
+    cursor.execute('DELETE FROM rollup_diario WHERE dia IN (SELECT dia FROM temp_rollup_dias)')
+    cursor.execute(f'''
+        INSERT INTO rollup_diario
+        (dia, equipe_id, medico_id, localizacao, receita_centavos, senhas_aprovadas,
+         sessoes_realizadas, agendamentos, confirmacoes)
+        SELECT dia, equipe_id, medico_id, localizacao,
+               SUM(receita_centavos), SUM(senhas_aprovadas), SUM(sessoes_realizadas),
+               SUM(agendamentos), SUM(confirmacoes)
+        FROM ({_SQL_FATOS_DIARIOS})
+        WHERE dia IS NOT NULL
+        GROUP BY dia, equipe_id, medico_id, localizacao
+    ''')
+    return cursor.rowcount
+
+
+def atualizar_rollup_diario(completo=False):
+    """
+    Processa os dias pendentes do rollup diário (ou todo o histórico se completo=True).
+    Retorna o número de dias recalculados.
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+
+            cursor.execute('DROP TABLE IF EXISTS temp.temp_rollup_dias')
+            cursor.execute('CREATE TEMP TABLE temp_rollup_dias (dia TEXT PRIMARY KEY)')
+
+            if completo:
+                cursor.execute('DELETE FROM rollup_diario')
+                cursor.execute('''
+                    INSERT OR IGNORE INTO temp_rollup_dias (dia)
+                    SELECT date(COALESCE(data_aprovacao, data_criacao)) FROM senhas
+                    UNION SELECT date(data_sessao) FROM sessoes
+                    UNION SELECT date(data_consulta) FROM agendamentos
+                    UNION SELECT date(data_confirmacao) FROM confirmacoes_consulta
+                ''')
+                cursor.execute('DELETE FROM temp_rollup_dias WHERE dia IS NULL')
+            else:
+                cursor.execute('INSERT INTO temp_rollup_dias (dia) SELECT dia FROM rollup_dias_pendentes')
+
+            cursor.execute('SELECT COUNT(*) as total FROM temp_rollup_dias')
+            total_dias = cursor.fetchone()['total']
+
+            if total_dias:
+                _recalcular_dias(cursor)
+            cursor.execute('DELETE FROM rollup_dias_pendentes WHERE dia IN (SELECT dia FROM temp_rollup_dias)')
+            cursor.execute('DROP TABLE temp.temp_rollup_dias')
+
+            conn.commit()
+
+            if total_dias:
+                logging.info(f"Rollup diário atualizado: {total_dias} dias recalculados")
+            return total_dias
+
+    except Exception as e:
+        logging.error(f"Erro ao atualizar rollup diário: {e}")
+        return 0
+
+
+def meses_entre(mes_inicio, mes_fim):
+    """Lista de meses 'YYYY-MM' de mes_inicio até mes_fim (inclusive)"""
+    ano, mes = map(int, mes_inicio.split('-'))
+    ano_fim, mes_fim_num = map(int, mes_fim.split('-'))
+    meses = []
+    while (ano, mes) <= (ano_fim, mes_fim_num):
+        meses.append(f"{ano}-{mes:02d}")
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return meses
+
+
+def _intervalo_meses(meses, mes_fim=None):
+    """Retorna a lista de meses 'YYYY-MM' terminando em mes_fim (padrão: mês atual)"""
+    try:
+        ano, mes = map(int, (mes_fim or '').split('-'))
+    except ValueError:
+        ano, mes = datetime.now().year, datetime.now().month
+    indice = ano * 12 + mes - max(int(meses), 1)
+    return meses_entre(f"{indice // 12}-{indice % 12 + 1:02d}", f"{ano}-{mes:02d}")
+
+
+def obter_tendencia_mensal(meses=12, mes_fim=None, equipe_id=None, medico_id=None, localizacao=None):
+    """
+    Retorna a série mensal (uma linha por mês, inclusive meses sem movimento) a partir
+    do rollup diário. Aceita qualquer janela, ex.: 12, 24 ou 36 meses.
+    """
+    lista_meses = _intervalo_meses(meses, mes_fim)
+    serie = {mes: dict({'mes_referencia': mes}, **{m: 0 for m in METRICAS_ROLLUP}) for mes in lista_meses}
+
+    try:
+        query = '''
+            SELECT substr(dia, 1, 7) as mes_referencia,
+                   SUM(receita_centavos) as receita_centavos,
+                   SUM(senhas_aprovadas) as senhas_aprovadas,
+                   SUM(sessoes_realizadas) as sessoes_realizadas,
+                   SUM(agendamentos) as agendamentos,
+                   SUM(confirmacoes) as confirmacoes
+            FROM rollup_diario
+            WHERE dia >= ? AND dia < ?
+        '''
+        ano_fim, mes_fim_num = map(int, lista_meses[-1].split('-'))
+        limite = f"{ano_fim + 1}-01-01" if mes_fim_num == 12 else f"{ano_fim}-{mes_fim_num + 1:02d}-01"
+        params = [f"{lista_meses[0]}-01", limite]
+
+        if equipe_id is not None:
+            query += ' AND equipe_id = ?'
+            params.append(equipe_id)
+        if medico_id is not None:
+            query += ' AND medico_id = ?'
+            params.append(medico_id)
+        if localizacao:
+            query += ' AND localizacao = ?'
+            params.append(localizacao)
+
+        query += ' GROUP BY substr(dia, 1, 7) ORDER BY mes_referencia'
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            for row in cursor.fetchall():
+                if row['mes_referencia'] in serie:
+                    serie[row['mes_referencia']].update({m: row[m] or 0 for m in METRICAS_ROLLUP})
+
+    except Exception as e:
+        logging.error(f"Erro ao obter tendência mensal: {e}")
+
+    # Receita somada em centavos inteiros; 'receita' em reais apenas para exibição
+    for mes in serie.values():
+        mes['receita'] = centavos_para_reais(mes['receita_centavos'])
+    return [serie[mes] for mes in lista_meses]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    dias = atualizar_rollup_diario(completo='--completo' in sys.argv)
+    print(f"{dias} dias recalculados")
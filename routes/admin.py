@@ -2,9 +2,12 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from werkzeug.security import generate_password_hash
 from auth import admin_required
 from database import get_db_connection, get_config, set_config
-from agendamento_utils import obter_todos_agendamentos_admin
+from paginacao_utils import Listagem, converter_data, converter_data_hora
+from datas_utils import formatar_datas
+from agenda_utils import ACOES_LOTE, reorganizar_agenda
 import logging
 import os
+import time
 from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__)
@@ -17,129 +20,17 @@ def dashboard():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Get system statistics
-            cursor.execute('SELECT COUNT(*) as total FROM medicos WHERE ativo = 1')
-            result = cursor.fetchone()
-            total_medicos = result['total'] if result else 0
-            
-            cursor.execute('SELECT COUNT(*) as total FROM pacientes WHERE status = ?', ('ativo',))
-            result = cursor.fetchone()
-            total_pacientes = result['total'] if result else 0
-            
-            cursor.execute('SELECT COUNT(*) as total FROM equipes WHERE ativo = 1')
-            result = cursor.fetchone()
-            total_equipes = result['total'] if result else 0
-            
-            # Financial overview - calculate based on approved senhas (real billing)
             mes_atual = datetime.now().strftime('%Y-%m')
             
-            # Total billing from approved senhas
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_senhas,
-                    COALESCE(SUM(valor), 0) as faturamento_bruto
-                FROM senhas 
-                WHERE aprovada_admin = 1 
-                AND ativo = 1
-                AND strftime('%Y-%m', COALESCE(data_aprovacao, data_criacao)) = ?
-            ''', (mes_atual,))
-            result = cursor.fetchone()
-            
-            faturamento_bruto = result['faturamento_bruto'] if result else 0
-            total_senhas_aprovadas = result['total_senhas'] if result else 0
-            
-            # Pending approvals
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as senhas_pendentes,
-                    COALESCE(SUM(valor), 0) as valor_pendente
-                FROM senhas 
-                WHERE aprovada_admin = 0 
-                AND ativo = 1
-            ''')
-            result = cursor.fetchone()
-            
-            senhas_pendentes = result['senhas_pendentes'] if result else 0
-            valor_pendente = result['valor_pendente'] if result else 0
-            
-            # Calcular pagamentos para equipes (baseado no faturamento das senhas aprovadas)
-            cursor.execute('''
-                SELECT 
-                    e.porcentagem_participacao,
-                    COALESCE(SUM(s.valor), 0) as faturamento_equipe
-                FROM equipes e
-                JOIN medicos m ON e.id = m.equipe_id
-                JOIN pacientes p ON m.id = p.medico_id
-                JOIN senhas s ON p.id = s.paciente_id 
-                WHERE s.aprovada_admin = 1 AND s.ativo = 1
-                AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
-                GROUP BY e.id, e.porcentagem_participacao
-            ''', (mes_atual,))
-            
-            equipes_pagamentos = cursor.fetchall()
-            total_pagamento_equipes = sum(eq['faturamento_equipe'] * eq['porcentagem_participacao'] / 100 for eq in equipes_pagamentos)
-            
-            # Calcular pagamentos para médicos externos (apenas pacotes fechados)
-            cursor.execute('''
-                SELECT 
-                    m.valor_sessao,
-                    COUNT(*) as pacientes_finalizados
-                FROM medicos m
-                JOIN pacientes p ON m.id = p.medico_id 
-                WHERE m.equipe_id IS NULL AND p.status = 'finalizado'
-                GROUP BY m.id, m.valor_sessao
-            ''')
-            
-            medicos_externos = cursor.fetchall()
-            total_pagamento_externos = sum(med['pacientes_finalizados'] * 8 * med['valor_sessao'] for med in medicos_externos)
-            
-            # Lucro líquido = Faturamento - Pagamentos para equipes - Pagamentos para médicos externos
-            faturamento_liquido = faturamento_bruto - total_pagamento_equipes - total_pagamento_externos
-            
-            # Sessions statistics
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_sessoes,
-                    COUNT(CASE WHEN realizada = 1 THEN 1 END) as sessoes_realizadas
-                FROM sessoes s
-                JOIN pacientes p ON s.paciente_id = p.id
-                WHERE strftime('%Y-%m', COALESCE(s.data_sessao, s.data_criacao)) = ?
-            ''', (mes_atual,))
-            result = cursor.fetchone()
+            def calcular():
+                from painel_admin import montar_painel_admin
+                return montar_painel_admin(cursor, mes_atual)
             
-            total_sessoes = result['total_sessoes'] if result else 0
-            sessoes_realizadas = result['sessoes_realizadas'] if result else 0
-            
-            financeiro = {
-                'faturamento_bruto': faturamento_bruto,
-                'faturamento_liquido': faturamento_liquido,
-                'total_senhas_aprovadas': total_senhas_aprovadas,
-                'senhas_pendentes': senhas_pendentes,
-                'valor_pendente': valor_pendente,
-                'total_sessoes': total_sessoes,
-                'sessoes_realizadas': sessoes_realizadas,
-                'mes_referencia': mes_atual
-            }
+            # Recalcula só quando alguma dependência do painel mudou desde a última visita
+            from cache_utils import em_cache
+            dados = em_cache('admin.dashboard', (mes_atual,), calcular, cursor)
             
-            # Recent activities
-            cursor.execute('''
-                SELECT p.nome as paciente, m.nome as medico, s.data_sessao, s.numero_sessao
-                FROM sessoes s
-                JOIN pacientes p ON s.paciente_id = p.id
-                JOIN medicos m ON p.medico_id = m.id
-                WHERE s.realizada = 1
-                ORDER BY s.data_sessao DESC
-                LIMIT 10
-            ''')
-            from sql_utils import rows_to_dicts
-            atividades_recentes = rows_to_dicts(cursor.fetchall())
-            
-            return render_template('admin/dashboard.html',
-                                 total_medicos=total_medicos,
-                                 total_pacientes=total_pacientes,
-                                 total_equipes=total_equipes,
-                                 financeiro=financeiro,
-                                 atividades_recentes=atividades_recentes)
+            return render_template('admin/dashboard.html', **dados)
     
     except Exception as e:
         logging.error(f"Admin dashboard error: {e}")
@@ -242,35 +133,88 @@ def add_medico():
     
     return redirect(url_for('admin.medicos'))
 
+# Listagem paginada por cursor; contagens de sessões só para as linhas da página
+LISTAGEM_PACIENTES = Listagem(
+    'admin.pacientes',
+    colunas='''p.id, p.nome, p.cpf, p.localizacao, p.medico_id, p.status, p.data_criacao,
+               m.nome as medico_nome, e.nome as equipe_nome,
+               (SELECT COUNT(*) FROM sessoes s WHERE s.paciente_id = p.id) as total_sessoes,
+               (SELECT COUNT(*) FROM sessoes s WHERE s.paciente_id = p.id AND s.realizada = 1) as sessoes_realizadas''',
+    origem='''FROM pacientes p
+              LEFT JOIN medicos m ON p.medico_id = m.id
+              LEFT JOIN equipes e ON m.equipe_id = e.id''',
+    tabelas=['pacientes', 'medicos'],
+    filtros={
+        'medico_id': ('p.medico_id = ?', int),
+        'equipe_id': ('COALESCE(m.equipe_id, 0) = ?', int),
+        'localizacao': ('p.localizacao = ?', str),
+        'status': ('p.status = ?', str),
+        'de': ('p.data_criacao >= ?', converter_data),
+        'ate': ("p.data_criacao < date(?, '+1 day')", converter_data),
+    },
+    ordenacoes={
+        'nome': 'p.nome',
+        'data_criacao': 'p.data_criacao',
+        'localizacao': 'p.localizacao',
+        'status': "COALESCE(p.status, '')",
+    },
+    ordenacao_padrao='nome',
+    chave='p.id',
+)
+
 @admin_bp.route('/pacientes')
 @admin_required
 def pacientes():
-    """Manage patients"""
+    """Manage patients (keyset-paginated, filtered server-side)"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT p.*, m.nome as medico_nome,
-                       COUNT(s.id) as total_sessoes,
-                       COUNT(CASE WHEN s.realizada = 1 THEN 1 END) as sessoes_realizadas
-                FROM pacientes p
-                LEFT JOIN medicos m ON p.medico_id = m.id
-                LEFT JOIN sessoes s ON p.id = s.paciente_id
-                GROUP BY p.id, p.nome, p.cpf, p.data_nascimento, p.telefone, p.email, p.endereco, p.localizacao, p.medico_id, p.status, p.data_criacao, m.nome
-                ORDER BY p.nome
-            ''')
-            pacientes_list = cursor.fetchall()
+            pagina = LISTAGEM_PACIENTES.paginar(cursor, request.args)
             
-            # Get doctors for form
-            cursor.execute('SELECT * FROM medicos WHERE ativo = 1 AND tipo IN ("medico", "admin") ORDER BY nome')
+            # Options for the filters
+            cursor.execute('SELECT id, nome FROM medicos WHERE ativo = 1 AND tipo IN ("medico", "admin") ORDER BY nome')
             medicos = cursor.fetchall()
+            cursor.execute('SELECT id, nome FROM equipes WHERE ativo = 1 ORDER BY nome')
+            equipes = cursor.fetchall()
             
-            return render_template('admin/pacientes.html', pacientes=pacientes_list, medicos=medicos)
+            return render_template('admin/pacientes.html', pagina=pagina, medicos=medicos, equipes=equipes)
     
     except Exception as e:
         logging.error(f"Admin pacientes error: {e}")
         flash('Erro ao carregar pacientes', 'error')
-        return render_template('admin/pacientes.html', pacientes=[], medicos=[])
+        return redirect(url_for('admin.dashboard'))
+
+@admin_bp.route('/pacientes/exportar')
+@admin_required
+def exportar_pacientes():
+    """Export all patients (CSV/XLSX, streamed)"""
+    from exportacao_utils import iterar_consulta, resposta_exportacao
+    
+    colunas = [
+        ('id', 'ID', 'numero'),
+        ('nome', 'Nome', 'texto'),
+        ('cpf', 'CPF', 'texto'),
+        ('data_nascimento', 'Nascimento', 'texto'),
+        ('telefone', 'Telefone', 'texto'),
+        ('email', 'Email', 'texto'),
+        ('localizacao', 'Localização', 'texto'),
+        ('medico_nome', 'Médico', 'texto'),
+        ('status', 'Status', 'texto'),
+        ('total_sessoes', 'Sessões', 'numero'),
+        ('sessoes_realizadas', 'Sessões Realizadas', 'numero'),
+        ('data_criacao', 'Cadastro', 'texto'),
+    ]
+    lotes = iterar_consulta('''
+        SELECT p.id, p.nome, p.cpf, p.data_nascimento, p.telefone, p.email, p.localizacao,
+               m.nome as medico_nome, p.status, p.data_criacao,
+               (SELECT COUNT(*) FROM sessoes s WHERE s.paciente_id = p.id) as total_sessoes,
+               (SELECT COUNT(*) FROM sessoes s WHERE s.paciente_id = p.id AND s.realizada = 1) as sessoes_realizadas
+        FROM pacientes p
+        LEFT JOIN medicos m ON p.medico_id = m.id
+        ORDER BY p.nome
+    ''')
+    
+    return resposta_exportacao('pacientes', colunas, lotes, request.args.get('formato', 'csv'), 'Pacientes')
 
 @admin_bp.route('/paciente/<int:paciente_id>/sessoes')
 @admin_required
@@ -387,12 +331,18 @@ def configuracoes():
                 ('imposto_inss', request.form.get('imposto_inss')),
                 ('imposto_iss', request.form.get('imposto_iss')),
                 ('sessoes_max', request.form.get('sessoes_max')),
-                ('valor_sessao_padrao', request.form.get('valor_sessao_padrao'))
+                ('valor_sessao_padrao', request.form.get('valor_sessao_padrao')),
+                ('valor_sessao_medico_externo', request.form.get('valor_sessao_medico_externo')),
+                ('garantia_8_sessoes', request.form.get('garantia_8_sessoes')),
+                ('sessoes_garantidas', request.form.get('sessoes_garantidas')),
+                ('janela_confirmacao_dias', request.form.get('janela_confirmacao_dias'))
             ]
             
-            for chave, valor in configs:
-                if valor:
-                    set_config(chave, valor)
+            alteradas = [chave for chave, valor in configs if valor and set_config(chave, valor)]
+            
+            # Só os relatórios que leram as chaves alteradas deixam o cache
+            from cache_utils import invalidar
+            invalidar(*[f'config:{chave}' for chave in alteradas])
             
             flash('Configurações salvas com sucesso', 'success')
         
@@ -408,7 +358,11 @@ def configuracoes():
             'imposto_inss': get_config('imposto_inss', '11'),
             'imposto_iss': get_config('imposto_iss', '5'),
             'sessoes_max': get_config('sessoes_max', '8'),
-            'valor_sessao_padrao': get_config('valor_sessao_padrao', '30')
+            'valor_sessao_padrao': get_config('valor_sessao_padrao', '30'),
+            'valor_sessao_medico_externo': get_config('valor_sessao_medico_externo', '112.50'),
+            'garantia_8_sessoes': get_config('garantia_8_sessoes', '1'),
+            'sessoes_garantidas': get_config('sessoes_garantidas', '8'),
+            'janela_confirmacao_dias': get_config('janela_confirmacao_dias', '3')
         }
         
         return render_template('admin/configuracoes.html', configs=configs)
@@ -418,6 +372,51 @@ def configuracoes():
         flash('Erro ao carregar configurações', 'error')
         return render_template('admin/configuracoes.html', configs={})
 
+@admin_bp.route('/simulador', methods=['GET', 'POST'])
+@admin_required
+def simulador():
+    """What-if payout simulator (percentages, session values, guarantee) - read only"""
+    hoje = datetime.now()
+    mes_fim = request.values.get('mes_fim') or hoje.strftime('%Y-%m')
+    mes_inicio = request.values.get('mes_inicio') or f"{hoje.year - 1}-{hoje.month:02d}"
+
+    try:
+        from simulador_pagamentos import (carregar_base_simulacao, cenario_atual,
+                                          simular_cenarios, variar_porcentagem_equipes)
+
+        base = carregar_base_simulacao(mes_inicio, mes_fim)
+        atual = cenario_atual(base)
+
+        # Cenário informado no formulário (campos ausentes mantêm o valor atual)
+        cenario = {
+            'nome': 'Simulado',
+            'porcentagens': {e['id']: request.form.get(f"porcentagem_{e['id']}", atual['porcentagens'][e['id']], type=float)
+                             for e in base['equipes']},
+            'valores_sessao': {m['id']: request.form.get(f"valor_sessao_{m['id']}", atual['valores_sessao'][m['id']], type=float)
+                               for m in base['medicos']},
+            'sessoes_garantidas': request.form.get('sessoes_garantidas', atual['sessoes_garantidas'], type=int)
+        }
+
+        # Sensibilidade: mesmo percentual para todas as equipes, de 20% a 80%
+        variacoes = variar_porcentagem_equipes(base, range(20, 85, 5), cenario)
+
+        inicio = time.perf_counter()
+        resultados = simular_cenarios(base, [atual, cenario] + variacoes)
+        tempo_ms = (time.perf_counter() - inicio) * 1000
+
+        return render_template('admin/simulador.html',
+                             mes_inicio=base['meses'][0], mes_fim=base['meses'][-1],
+                             equipes=base['equipes'], medicos=base['medicos'],
+                             cenario=cenario,
+                             atual=resultados[0], simulado=resultados[1],
+                             variacoes=resultados[2:],
+                             total_cenarios=len(resultados), tempo_ms=tempo_ms)
+
+    except Exception as e:
+        logging.error(f"Admin simulador error: {e}")
+        flash('Erro ao executar simulação', 'error')
+        return redirect(url_for('admin.dashboard'))
+
 @admin_bp.route('/equipes')
 @admin_required
 def equipes():
@@ -539,6 +538,10 @@ def edit_medico(medico_id):
                 ''', (nome, email, tipo, equipe_id, valor_sessao, medico_id))
             
             conn.commit()
+            
+            # Só os artefatos que leram este médico (as versões no banco já mudaram pelos triggers)
+            from cache_utils import invalidar
+            invalidar(f'medico:{medico_id}')
             flash('Médico atualizado com sucesso', 'success')
     
     except Exception as e:
@@ -592,6 +595,9 @@ def edit_equipe(equipe_id):
                 WHERE id = ?
             ''', (nome, porcentagem, equipe_id))
             conn.commit()
+            
+            from cache_utils import invalidar
+            invalidar(f'equipe:{equipe_id}')
             flash('Equipe atualizada com sucesso', 'success')
     
     except Exception as e:
@@ -641,10 +647,10 @@ def confirmacoes_consulta():
                        e.nome as equipe_nome
                 FROM confirmacoes_consulta c
                 JOIN agendamentos a ON c.agendamento_id = a.id
-                JOIN pacientes p ON c.paciente_id = p.id
+                JOIN pacientes p ON a.paciente_id = p.id
                 JOIN medicos m ON a.medico_id = m.id
                 LEFT JOIN equipes e ON m.equipe_id = e.id
-                WHERE a.status = 'agendado'
+                WHERE a.status IN ('agendado', 'cancelado')
                 ORDER BY 
                     CASE WHEN c.confirmado IS NULL THEN 0 ELSE 1 END,
                     a.data_consulta ASC
@@ -678,110 +684,237 @@ def confirmacoes_consulta():
         flash('Erro ao carregar confirmações', 'error')
         return redirect(url_for('admin.dashboard'))
 
-@admin_bp.route('/agendamentos')
+@admin_bp.route('/agendamentos/exportar')
 @admin_required
-def agendamentos():
-    """View all appointments in the system (admin overview)"""
-    try:
-        # Get ALL appointments in the system
-        todos_agendamentos = obter_todos_agendamentos_admin()
-        logging.info(f"Total agendamentos no sistema: {len(todos_agendamentos)}")
-        
-        # Format dates for display
-        dias_semana = ['Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo']
-        meses = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 
-                'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+def exportar_agendamentos():
+    """Export all appointments (CSV/XLSX, streamed)"""
+    from exportacao_utils import iterar_consulta, resposta_exportacao
+    
+    colunas = [
+        ('id', 'ID', 'numero'),
+        ('data_consulta', 'Data da Consulta', 'texto'),
+        ('paciente_nome', 'Paciente', 'texto'),
+        ('paciente_telefone', 'Telefone', 'texto'),
+        ('medico_nome', 'Médico', 'texto'),
+        ('equipe_nome', 'Equipe', 'texto'),
+        ('status', 'Status', 'texto'),
+        ('confirmado', 'Confirmado', 'numero'),
+        ('data_confirmacao', 'Data da Confirmação', 'texto'),
+        ('observacoes', 'Observações', 'texto'),
+    ]
+    lotes = iterar_consulta('''
+        SELECT a.id, a.data_consulta, a.observacoes, a.status,
+               p.nome as paciente_nome, p.telefone as paciente_telefone,
+               m.nome as medico_nome, COALESCE(e.nome, 'Externo') as equipe_nome,
+               cc.confirmado, cc.data_confirmacao
+        FROM agendamentos a
+        JOIN pacientes p ON a.paciente_id = p.id
+        JOIN medicos m ON a.medico_id = m.id
+        LEFT JOIN equipes e ON m.equipe_id = e.id
+        LEFT JOIN confirmacoes_consulta cc ON a.id = cc.agendamento_id
+        ORDER BY a.data_consulta DESC
+    ''')
+    
+    return resposta_exportacao('agendamentos', colunas, lotes, request.args.get('formato', 'csv'), 'Agendamentos')
+
+# data_consulta is canonical ('YYYY-MM-DD HH:MM:SS', datas_utils), so the listing sorts
+# and filters on the column itself (idx_agendamentos_data_consulta)
+DATA_CONSULTA_SQL = 'a.data_consulta'
+
+_ORIGEM_AGENDAMENTOS = '''FROM agendamentos a
+              JOIN pacientes p ON a.paciente_id = p.id
+              JOIN medicos m ON a.medico_id = m.id
+              LEFT JOIN equipes e ON m.equipe_id = e.id
+              LEFT JOIN confirmacoes_consulta cc ON cc.agendamento_id = a.id'''
+
+_SITUACAO_CONFIRMACAO_SQL = ("CASE WHEN cc.confirmado IS NULL THEN 'pendente' "
+                             "WHEN cc.confirmado = 1 THEN 'confirmado' ELSE 'cancelado' END")
+
+def _converter_situacao(valor):
+    if valor not in ('pendente', 'confirmado', 'cancelado'):
+        raise ValueError(valor)
+    return valor
+
+LISTAGEM_AGENDAMENTOS = Listagem(
+    'admin.agendamentos',
+    colunas='''a.id, a.data_consulta, a.observacoes, a.status, a.data_criacao,
+               p.nome as paciente_nome, p.cpf as paciente_cpf, p.telefone as paciente_telefone,
+               m.nome as medico_nome, m.tipo as medico_tipo, e.nome as equipe_nome,
+               cc.id as confirmacao_id, cc.confirmado, cc.data_confirmacao,
+               cc.observacoes_paciente, cc.disponivel_confirmacao''',
+    origem=_ORIGEM_AGENDAMENTOS,
+    tabelas=['agendamentos', 'confirmacoes_consulta', 'pacientes', 'medicos', 'equipes'],
+    filtros={
+        'medico_id': ('a.medico_id = ?', int),
+        'equipe_id': ('COALESCE(m.equipe_id, 0) = ?', int),
+        'localizacao': ('p.localizacao = ?', str),
+        'situacao': (f'{_SITUACAO_CONFIRMACAO_SQL} = ?', _converter_situacao),
+        'apos': (f'{DATA_CONSULTA_SQL} >= ?', converter_data_hora),
+        'antes': (f'{DATA_CONSULTA_SQL} < ?', converter_data_hora),
+        'de': (f'{DATA_CONSULTA_SQL} >= ?', converter_data),
+        'ate': (f"{DATA_CONSULTA_SQL} < date(?, '+1 day')", converter_data),
+    },
+    ordenacoes={
+        'data_consulta': DATA_CONSULTA_SQL,
+        'paciente': 'p.nome',
+        'medico': 'm.nome',
+    },
+    ordenacao_padrao='data_consulta',
+    chave='a.id',
+    resumo={
+        'pendentes': 'COUNT(CASE WHEN cc.confirmado IS NULL THEN 1 END)',
+        'confirmados': 'COUNT(CASE WHEN cc.confirmado = 1 THEN 1 END)',
+        'cancelados': 'COUNT(CASE WHEN cc.confirmado = 0 THEN 1 END)',
+    },
+    limite_movel=('apos', 'antes'),
+)
+
+def _resumo_agendamentos(cursor, agora):
+    """
+    Totais gerais e contagens por equipe/médico (em cache até mudarem os agendamentos).
+    A chave é o dia: o cache conta as consultas a partir de amanhã e as de hoje ainda por
+    vir são contadas à parte
+    """
+    amanha = (datetime.strptime(agora[:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    def calcular():
+        cursor.execute(f'''
+            SELECT COUNT(*) as total,
+                   COUNT(CASE WHEN {DATA_CONSULTA_SQL} >= ? THEN 1 END) as a_partir_de_amanha,
+                   COUNT(CASE WHEN cc.confirmado IS NULL THEN 1 END) as pendentes,
+                   COUNT(CASE WHEN cc.confirmado = 1 THEN 1 END) as confirmados,
+                   COUNT(CASE WHEN cc.confirmado = 0 THEN 1 END) as cancelados
+            {_ORIGEM_AGENDAMENTOS}
+        ''', (amanha,))
+        stats = dict(cursor.fetchone())
         
-        for agendamento in todos_agendamentos:
-            if agendamento['data_consulta']:
-                try:
-                    date_str = str(agendamento['data_consulta'])
-                    if 'T' in date_str:
-                        if len(date_str.split('T')[1]) == 5:
-                            date_str += ':00'
-                        date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                    else:
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                    
-                    dia_semana = dias_semana[date_obj.weekday()]
-                    mes_nome = meses[date_obj.month - 1]
-                    
-                    agendamento['data_formatada'] = date_obj.strftime('%d/%m/%Y')
-                    agendamento['hora_formatada'] = date_obj.strftime('%H:%M')
-                    agendamento['data_completa'] = f"{dia_semana}, {date_obj.day} de {mes_nome} de {date_obj.year}"
-                    agendamento['periodo'] = "manhã" if date_obj.hour < 12 else "tarde" if date_obj.hour < 18 else "noite"
-                    
-                except Exception as e:
-                    logging.error(f"Erro ao formatar data do agendamento: {e}")
-                    agendamento['data_formatada'] = agendamento['data_consulta']
-                    agendamento['hora_formatada'] = ''
-                    agendamento['data_completa'] = agendamento['data_consulta']
-                    agendamento['periodo'] = ''
+        cursor.execute(f'''
+            SELECT COALESCE(m.equipe_id, 0) as equipe_id, COALESCE(e.nome, 'Médicos Externos') as equipe_nome,
+                   m.id as medico_id, m.nome as medico_nome, COUNT(*) as total,
+                   COUNT(CASE WHEN cc.confirmado IS NULL THEN 1 END) as pendentes,
+                   COUNT(CASE WHEN cc.confirmado = 1 THEN 1 END) as confirmados,
+                   COUNT(CASE WHEN cc.confirmado = 0 THEN 1 END) as cancelados
+            {_ORIGEM_AGENDAMENTOS}
+            GROUP BY m.id
+            ORDER BY equipe_nome, m.nome
+        ''')
+        por_medico = [dict(row) for row in cursor.fetchall()]
         
-        # Separate future and past appointments
-        agora = datetime.now()
-        agendamentos_futuros = []
-        agendamentos_passados = []
+        por_equipe = {}
+        for medico in por_medico:
+            equipe = por_equipe.setdefault(medico['equipe_id'], {
+                'equipe_id': medico['equipe_id'], 'equipe_nome': medico['equipe_nome'],
+                'total': 0, 'pendentes': 0, 'confirmados': 0, 'cancelados': 0})
+            for campo in ('total', 'pendentes', 'confirmados', 'cancelados'):
+                equipe[campo] += medico[campo]
         
-        for agendamento in todos_agendamentos:
-            try:
-                date_str = str(agendamento['data_consulta'])
-                if 'T' in date_str:
-                    if len(date_str.split('T')[1]) == 5:
-                        date_str += ':00'
-                    date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                else:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                
-                if date_obj >= agora:
-                    agendamentos_futuros.append(agendamento)
-                else:
-                    agendamentos_passados.append(agendamento)
-            except:
-                agendamentos_passados.append(agendamento)
+        stats['equipes'] = len(por_equipe)
+        stats['medicos'] = len(por_medico)
+        stats['taxa_confirmacao'] = round((stats['confirmados'] / stats['total'] * 100) if stats['total'] else 0, 1)
+        return {'stats': stats, 'por_equipe': list(por_equipe.values()), 'por_medico': por_medico}
+    
+    from cache_utils import em_cache
+    resumo = em_cache('admin.agendamentos', (agora[:10],), calcular, cursor)
+    
+    cursor.execute(f'''
+        SELECT COUNT(*) {_ORIGEM_AGENDAMENTOS}
+        WHERE {DATA_CONSULTA_SQL} >= ? AND {DATA_CONSULTA_SQL} < ?
+    ''', (agora, amanha))
+    stats = dict(resumo['stats'])
+    stats['futuros'] = stats.pop('a_partir_de_amanha') + cursor.fetchone()[0]
+    stats['passados'] = stats['total'] - stats['futuros']
+    return {**resumo, 'stats': stats}
+
+@admin_bp.route('/agendamentos')
+@admin_required
+def agendamentos():
+    """View all appointments in the system (keyset-paginated, filtered server-side)"""
+    try:
+        agora = datetime.now().strftime('%Y-%m-%d %H:%M')
         
-        # Group by team and doctor for better organization
-        agendamentos_por_equipe = {}
-        agendamentos_por_medico = {}
+        # Futuros/passados viram um limite fixo (apos/antes), repetido nos links das páginas
+        periodo = request.args.get('periodo', 'futuros')
+        if periodo not in ('futuros', 'passados', 'todos'):
+            periodo = 'futuros'
+        args = request.args.to_dict()
+        if periodo == 'futuros':
+            args.setdefault('apos', agora)
+        elif periodo == 'passados':
+            args.setdefault('antes', agora)
+            args.setdefault('direcao', 'desc')
         
-        for agendamento in todos_agendamentos:
-            equipe = agendamento.get('equipe_nome', 'Médicos Externos')
-            medico = agendamento['medico_nome']
-            
-            if equipe not in agendamentos_por_equipe:
-                agendamentos_por_equipe[equipe] = []
-            agendamentos_por_equipe[equipe].append(agendamento)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            pagina = LISTAGEM_AGENDAMENTOS.paginar(cursor, args, extras={'periodo': periodo})
+            resumo = _resumo_agendamentos(cursor, agora)
             
-            if medico not in agendamentos_por_medico:
-                agendamentos_por_medico[medico] = []
-            agendamentos_por_medico[medico].append(agendamento)
-        
-        # Statistics
-        total_agendamentos = len(todos_agendamentos)
-        pendentes = len([a for a in todos_agendamentos if a['confirmado'] is None])
-        confirmados = len([a for a in todos_agendamentos if a['confirmado'] == 1])
-        cancelados = len([a for a in todos_agendamentos if a['confirmado'] == 0])
+            cursor.execute('SELECT id, nome FROM medicos WHERE ativo = 1 ORDER BY nome')
+            medicos = cursor.fetchall()
+            cursor.execute('SELECT id, nome FROM equipes WHERE ativo = 1 ORDER BY nome')
+            equipes = cursor.fetchall()
         
-        stats = {
-            'total': total_agendamentos,
-            'futuros': len(agendamentos_futuros),
-            'passados': len(agendamentos_passados),
-            'pendentes': pendentes,
-            'confirmados': confirmados,
-            'cancelados': cancelados,
-            'equipes': len(agendamentos_por_equipe),
-            'medicos': len(agendamentos_por_medico),
-            'taxa_confirmacao': round((confirmados / total_agendamentos * 100) if total_agendamentos else 0, 1)
-        }
+        formatar_datas(pagina.itens)
         
         return render_template('admin/agendamentos.html',
-                             agendamentos_futuros=agendamentos_futuros,
-                             agendamentos_passados=agendamentos_passados,
-                             agendamentos_por_equipe=agendamentos_por_equipe,
-                             agendamentos_por_medico=agendamentos_por_medico,
-                             stats=stats)
+                             pagina=pagina,
+                             periodo=periodo,
+                             agendamentos=pagina.itens,
+                             agendamentos_por_equipe=resumo['por_equipe'],
+                             agendamentos_por_medico=resumo['por_medico'],
+                             stats=resumo['stats'],
+                             medicos=medicos,
+                             equipes=equipes,
+                             acoes_lote=ACOES_LOTE)
     
     except Exception as e:
         logging.error(f"Admin agendamentos error: {e}")
         flash('Erro ao carregar agendamentos do sistema', 'error')
-        return redirect(url_for('admin.dashboard'))
\ No newline at end of file
+        return redirect(url_for('admin.dashboard'))
+
+@admin_bp.route('/agendamentos/reorganizar', methods=['POST'])
+@admin_required
+def reorganizar_agendamentos():
+    """Postpone, reassign or cancel every appointment of a doctor in a date range (doctor absence)"""
+    destino = url_for('admin.agendamentos')
+    try:
+        medico_id = request.form.get('medico_id', type=int)
+        acao = request.form.get('acao', '')
+        try:
+            inicio = datetime.strptime(request.form.get('data_inicio', ''), '%Y-%m-%d')
+            fim = datetime.strptime(request.form.get('data_fim', ''), '%Y-%m-%d') + timedelta(days=1)
+        except ValueError:
+            flash('Informe o período da ausência', 'error')
+            return redirect(destino)
+        if not medico_id or fim <= inicio:
+            flash('Escolha o profissional e um período válido', 'error')
+            return redirect(destino)
+        dias = request.form.get('dias', 0, type=int)
+        
+        with get_db_connection() as conn:
+            try:
+                resultado = reorganizar_agenda(conn, medico_id, inicio, fim, acao,
+                                               deslocamento=timedelta(days=dias) if dias > 0 else None,
+                                               medico_destino=request.form.get('medico_destino_id', type=int),
+                                               motivo=request.form.get('motivo', '').strip(),
+                                               executado_por=session.get('user_id'))
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(destino)
+        
+        if resultado['conflitos']:
+            detalhes = [f"{item['agendamento']['paciente_nome']} em {item['agendamento']['nova_data'].strftime('%d/%m %H:%M')} "
+                        f"(conflita com {item['conflito']['paciente_nome']})" for item in resultado['conflitos'][:5]]
+            if len(resultado['conflitos']) > 5:
+                detalhes.append(f"e mais {len(resultado['conflitos']) - 5}")
+            flash('Nada foi alterado. Conflitos: ' + '; '.join(detalhes), 'error')
+        elif not resultado['agendamentos']:
+            flash('Nenhuma consulta ativa do profissional nesse período', 'info')
+        else:
+            verbo = {'adiar': 'remarcada(s)', 'transferir': 'transferida(s)', 'cancelar': 'cancelada(s)'}[acao]
+            flash(f"{len(resultado['agendamentos'])} consulta(s) {verbo}. Os pacientes serão avisados.", 'success')
+    
+    except Exception as e:
+        logging.error(f"Reorganizar agendamentos error: {e}")
+        flash('Erro ao reorganizar os agendamentos', 'error')
+    
+    return redirect(destino)
@@ -1,11 +1,48 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from auth import admin_required
 from database import get_db_connection, verificar_senhas_aprovadas_para_entrega, liberar_entrega_laudo
+from dinheiro_utils import centavos_para_reais
+from paginacao_utils import Listagem, converter_data
+from notificacoes import notificar_senhas_aprovadas
 import logging
 from datetime import datetime
 
 admin_senhas_bp = Blueprint('admin_senhas', __name__)
 
+# Senhas aguardando aprovação, paginadas por cursor (índice parcial sobre as pendentes)
+LISTAGEM_SENHAS_PENDENTES = Listagem(
+    'admin_senhas.senhas_pendentes',
+    colunas='''s.id, s.codigo, s.senha, s.valor, s.data_criacao, s.tipo,
+               p.nome as paciente_nome, p.cpf as paciente_cpf,
+               m.nome as medico_nome, e.nome as equipe_nome''',
+    origem='''FROM senhas s
+              JOIN pacientes p ON s.paciente_id = p.id
+              JOIN medicos m ON p.medico_id = m.id
+              LEFT JOIN equipes e ON m.equipe_id = e.id''',
+    tabelas=['senhas', 'pacientes', 'medicos', 'equipes'],
+    condicoes=['s.aprovada_admin = 0', 's.ativo = 1'],
+    filtros={
+        'medico_id': ('p.medico_id = ?', int),
+        'equipe_id': ('COALESCE(m.equipe_id, 0) = ?', int),
+        'localizacao': ('p.localizacao = ?', str),
+        'tipo': ('s.tipo = ?', str),
+        'de': ('s.data_criacao >= ?', converter_data),
+        'ate': ("s.data_criacao < date(?, '+1 day')", converter_data),
+    },
+    ordenacoes={
+        'data_criacao': 's.data_criacao',
+        'valor': 'COALESCE(s.valor_centavos, 0)',
+        'paciente': 'p.nome',
+    },
+    ordenacao_padrao='data_criacao',
+    direcao_padrao='desc',
+    chave='s.id',
+    resumo={
+        'valor_centavos': 'COALESCE(SUM(s.valor_centavos), 0)',
+        'senhas_equipe': 'COUNT(e.id)',
+    },
+)
+
 @admin_senhas_bp.route('/senhas-pendentes')
 @admin_required
 def senhas_pendentes():
@@ -13,28 +50,28 @@ def senhas_pendentes():
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
+            pagina = LISTAGEM_SENHAS_PENDENTES.paginar(cursor, request.args)
             
-            cursor.execute('''
-                SELECT s.id, s.codigo, s.senha, s.valor, s.data_criacao, s.tipo,
-                       p.nome as paciente_nome, p.cpf as paciente_cpf,
-                       m.nome as medico_nome, e.nome as equipe_nome
-                FROM senhas s
-                JOIN pacientes p ON s.paciente_id = p.id
-                JOIN medicos m ON p.medico_id = m.id
-                LEFT JOIN equipes e ON m.equipe_id = e.id
-                WHERE s.aprovada_admin = 0 AND s.ativo = 1
-                ORDER BY s.data_criacao DESC
-            ''')
-            
-            senhas_pendentes = cursor.fetchall()
+            cursor.execute('SELECT id, nome FROM medicos WHERE ativo = 1 ORDER BY nome')
+            medicos = cursor.fetchall()
+            cursor.execute('SELECT id, nome FROM equipes WHERE ativo = 1 ORDER BY nome')
+            equipes = cursor.fetchall()
+            
+            resumo = {
+                'total': pagina.total,
+                'valor': centavos_para_reais(pagina.resumo['valor_centavos']),
+                'equipe': pagina.resumo['senhas_equipe'],
+                'externos': pagina.total - pagina.resumo['senhas_equipe'],
+            }
             
             return render_template('admin/senhas_pendentes.html', 
-                                 senhas_pendentes=senhas_pendentes)
+                                 senhas_pendentes=pagina.itens, pagina=pagina, resumo=resumo,
+                                 medicos=medicos, equipes=equipes)
             
     except Exception as e:
         logging.error(f"Erro ao carregar senhas pendentes: {e}")
         flash('Erro ao carregar senhas pendentes', 'error')
-        return render_template('admin/senhas_pendentes.html', senhas_pendentes=[])
+        return redirect(url_for('admin.dashboard'))
 
 @admin_senhas_bp.route('/aprovar-senha/<int:senha_id>', methods=['POST'])
 @admin_required
@@ -64,16 +101,18 @@ def aprovar_senha(senha_id):
             ''', (admin_id, senha_id))
             
             if cursor.rowcount > 0:
-                conn.commit()
+                notificar_senhas_aprovadas(cursor, [senha_id])
                 
                 # Verificar se ambas as senhas foram aprovadas para liberar entrega do laudo
-                if verificar_senhas_aprovadas_para_entrega(paciente_id):
-                    if liberar_entrega_laudo(paciente_id):
+                # (na mesma transação da aprovação, com os avisos)
+                if verificar_senhas_aprovadas_para_entrega(paciente_id, cursor):
+                    if liberar_entrega_laudo(paciente_id, cursor):
                         flash('Senha aprovada! Entrega do laudo foi liberada automaticamente (ambas as senhas aprovadas).', 'success')
                     else:
                         flash('Senha aprovada! Não há laudo para liberar ainda.', 'success')
                 else:
                     flash('Senha aprovada para faturamento!', 'success')
+                conn.commit()
             else:
                 flash('Senha não encontrada', 'error')
                 
@@ -123,6 +162,7 @@ def aprovar_lote():
             admin_id = session.get('user_id')
             
             pacientes_atualizados = set()
+            aprovadas = []
             
             # Convert to integers and approve
             for senha_id in senha_ids:
@@ -141,16 +181,19 @@ def aprovar_lote():
                             aprovada_por = ?
                         WHERE id = ?
                     ''', (admin_id, int(senha_id)))
+                    aprovadas.append(int(senha_id))
             
-            conn.commit()
+            notificar_senhas_aprovadas(cursor, aprovadas)
             
-            # Verificar liberação de laudos para cada paciente atualizado
+            # Verificar liberação de laudos para cada paciente atualizado (mesma transação)
             laudos_liberados = 0
             for paciente_id in pacientes_atualizados:
-                if verificar_senhas_aprovadas_para_entrega(paciente_id):
-                    if liberar_entrega_laudo(paciente_id):
+                if verificar_senhas_aprovadas_para_entrega(paciente_id, cursor):
+                    if liberar_entrega_laudo(paciente_id, cursor):
                         laudos_liberados += 1
             
+            conn.commit()
+            
             if laudos_liberados > 0:
                 flash(f'{len(senha_ids)} senhas aprovadas em lote! {laudos_liberados} laudos liberados para entrega.', 'success')
             else:
@@ -162,6 +205,44 @@ def aprovar_lote():
     
     return redirect(url_for('admin_senhas.senhas_pendentes'))
 
+# Uma linha por laudo; as senhas aprovadas do paciente são contadas só para a página
+LISTAGEM_STATUS_LAUDOS = Listagem(
+    'admin_senhas.status_laudos',
+    colunas='''p.id, p.nome, p.cpf, m.nome as medico_nome,
+               l.id as laudo_id, l.liberado_entrega, l.data_liberacao,
+               (SELECT COUNT(*) FROM senhas s WHERE s.paciente_id = p.id AND s.ativo = 1
+                AND s.tipo = 'teste_neuropsicologico' AND s.aprovada_admin = 1) as teste_aprovado,
+               (SELECT COUNT(*) FROM senhas s WHERE s.paciente_id = p.id AND s.ativo = 1
+                AND s.tipo = 'consulta_sessao' AND s.aprovada_admin = 1) as consulta_aprovada''',
+    origem='''FROM laudos l
+              JOIN pacientes p ON l.paciente_id = p.id
+              JOIN medicos m ON p.medico_id = m.id''',
+    tabelas=['laudos', 'pacientes', 'medicos', 'senhas'],
+    filtros={
+        'medico_id': ('p.medico_id = ?', int),
+        'equipe_id': ('COALESCE(m.equipe_id, 0) = ?', int),
+        'localizacao': ('p.localizacao = ?', str),
+        'liberado': ('COALESCE(l.liberado_entrega, 0) = ?', int),
+        'de': ('l.data_liberacao >= ?', converter_data),
+        'ate': ("l.data_liberacao < date(?, '+1 day')", converter_data),
+    },
+    ordenacoes={
+        'paciente': 'p.nome',
+        'data_liberacao': "COALESCE(l.data_liberacao, '')",
+    },
+    ordenacao_padrao='paciente',
+    chave='l.id',
+    resumo={
+        'liberados': 'COUNT(CASE WHEN l.liberado_entrega = 1 THEN 1 END)',
+        'prontos': '''COUNT(CASE WHEN COALESCE(l.liberado_entrega, 0) = 0
+                        AND EXISTS (SELECT 1 FROM senhas s WHERE s.paciente_id = p.id AND s.ativo = 1
+                                    AND s.tipo = 'teste_neuropsicologico' AND s.aprovada_admin = 1)
+                        AND EXISTS (SELECT 1 FROM senhas s WHERE s.paciente_id = p.id AND s.ativo = 1
+                                    AND s.tipo = 'consulta_sessao' AND s.aprovada_admin = 1)
+                        THEN 1 END)''',
+    },
+)
+
 @admin_senhas_bp.route('/status-laudos')
 @admin_required
 def status_laudos():
@@ -169,30 +250,21 @@ def status_laudos():
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
+            pagina = LISTAGEM_STATUS_LAUDOS.paginar(cursor, request.args)
             
-            # Buscar todos os pacientes com laudos e verificar status das senhas
-            cursor.execute('''
-                SELECT DISTINCT p.id, p.nome, p.cpf, m.nome as medico_nome,
-                       l.id as laudo_id, l.liberado_entrega, l.data_liberacao,
-                       COUNT(CASE WHEN s.tipo = 'teste_neuropsicologico' AND s.aprovada_admin = 1 THEN 1 END) as teste_aprovado,
-                       COUNT(CASE WHEN s.tipo = 'consulta_sessao' AND s.aprovada_admin = 1 THEN 1 END) as consulta_aprovada
-                FROM pacientes p
-                JOIN medicos m ON p.medico_id = m.id
-                JOIN laudos l ON p.id = l.paciente_id
-                LEFT JOIN senhas s ON p.id = s.paciente_id AND s.ativo = 1
-                GROUP BY p.id, p.nome, p.cpf, m.nome, l.id, l.liberado_entrega, l.data_liberacao
-                ORDER BY p.nome
-            ''')
-            
-            pacientes_laudos = cursor.fetchall()
+            cursor.execute('SELECT id, nome FROM medicos WHERE ativo = 1 ORDER BY nome')
+            medicos = cursor.fetchall()
+            cursor.execute('SELECT id, nome FROM equipes WHERE ativo = 1 ORDER BY nome')
+            equipes = cursor.fetchall()
             
             return render_template('admin/status_laudos.html', 
-                                 pacientes_laudos=pacientes_laudos)
+                                 pacientes_laudos=pagina.itens, pagina=pagina,
+                                 medicos=medicos, equipes=equipes)
             
     except Exception as e:
         logging.error(f"Erro ao carregar status de laudos: {e}")
         flash('Erro ao carregar status de laudos', 'error')
-        return render_template('admin/status_laudos.html', pacientes_laudos=[])
+        return redirect(url_for('admin.dashboard'))
 
 @admin_senhas_bp.route('/liberar-laudo/<int:paciente_id>', methods=['POST'])
 @admin_required
@@ -0,0 +1,188 @@
+from flask import Blueprint, request, session, jsonify, Response
+from database import get_db_connection
+from dinheiro_utils import centavos_para_reais
+from datetime import datetime
+import hashlib
+import json
+import time
+
+# Séries compactas para os gráficos (Chart.js) dos dashboards, carregadas depois da página.
+# Cada resposta leva um ETag forte derivado das versões dos dados (cache_utils), então o
+# navegador revalida com If-None-Match e recebe 304 sem corpo enquanto nada mudou.
+# /ao_vivo entrega as métricas do dia por SSE ou long-poll (ver metricas_ao_vivo).
+analytics_bp = Blueprint('analytics', __name__, url_prefix='/api/analytics')
+
+# Mudar o formato das respostas exige incrementar (invalida os ETags já emitidos)
+VERSAO_API = 1
+
+def _mes_referencia():
+    mes = request.args.get('mes', datetime.now().month)
+    ano = request.args.get('ano', datetime.now().year)
+
+    try:
+        mes, ano = int(mes), int(ano)
+        if not 1 <= mes <= 12:
+            raise ValueError
+    except ValueError:
+        mes, ano = datetime.now().month, datetime.now().year
+
+    return f"{ano}-{mes:02d}"
+
+def _resposta_versionada(nome, params, calcular):
+    """JSON do artefato com ETag das versões dos dados; 304 se o cliente já tem essa versão"""
+    from cache_utils import versao_artefato, em_cache
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        versao = versao_artefato(nome, params, cursor)
+        etag = hashlib.sha256(repr((VERSAO_API, nome, params, versao)).encode()).hexdigest()[:32]
+
+        if request.if_none_match.contains(etag):
+            resposta = Response(status=304)
+        else:
+            resposta = jsonify(em_cache(nome, params, lambda: calcular(cursor), cursor, versao))
+
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+@analytics_bp.before_request
+def verificar_acesso():
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return jsonify({'status': 'error', 'message': 'Acesso negado'}), 403
+
+@analytics_bp.route('/faturamento_equipes')
+def faturamento_equipes():
+    """Faturamento (senhas aprovadas) por equipe no mês"""
+    mes_referencia = _mes_referencia()
+
+    def calcular(cursor):
+        cursor.execute('''
+            SELECT e.nome as equipe_nome, COALESCE(SUM(s.valor_centavos), 0) as faturamento_centavos
+            FROM equipes e
+            LEFT JOIN medicos m ON e.id = m.equipe_id
+            LEFT JOIN pacientes p ON m.id = p.medico_id
+            LEFT JOIN senhas s ON p.id = s.paciente_id
+                AND s.aprovada_admin = 1 AND s.ativo = 1
+                AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+            WHERE e.ativo = 1
+            GROUP BY e.id, e.nome
+            ORDER BY faturamento_centavos DESC
+        ''', (mes_referencia,))
+        return {
+            'mes_referencia': mes_referencia,
+            'equipes': [{'equipe_nome': row['equipe_nome'],
+                         'faturamento': centavos_para_reais(row['faturamento_centavos'])}
+                        for row in cursor.fetchall()]
+        }
+
+    return _resposta_versionada('analytics.faturamento_equipes', (mes_referencia,), calcular)
+
+@analytics_bp.route('/faturamento_medicos')
+def faturamento_medicos():
+    """Faturamento (senhas aprovadas) por médico no mês"""
+    mes_referencia = _mes_referencia()
+
+    def calcular(cursor):
+        cursor.execute('''
+            SELECT m.nome as medico_nome, COALESCE(e.nome, 'Externo') as equipe_nome,
+                   COALESCE(SUM(s.valor_centavos), 0) as faturamento_centavos
+            FROM medicos m
+            LEFT JOIN equipes e ON m.equipe_id = e.id
+            LEFT JOIN pacientes p ON m.id = p.medico_id
+            LEFT JOIN senhas s ON p.id = s.paciente_id
+                AND s.aprovada_admin = 1 AND s.ativo = 1
+                AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+            WHERE m.ativo = 1
+            GROUP BY m.id, m.nome, e.nome
+            ORDER BY faturamento_centavos DESC
+        ''', (mes_referencia,))
+        return {
+            'mes_referencia': mes_referencia,
+            'medicos': [{'medico_nome': row['medico_nome'], 'equipe_nome': row['equipe_nome'],
+                         'faturamento': centavos_para_reais(row['faturamento_centavos'])}
+                        for row in cursor.fetchall()]
+        }
+
+    return _resposta_versionada('analytics.faturamento_medicos', (mes_referencia,), calcular)
+
+@analytics_bp.route('/resumo')
+def resumo():
+    """Faturamento, pagamentos e resultado do mês pelas regras de pagamento"""
+    mes_referencia = _mes_referencia()
+
+    def calcular(cursor):
+        from regras_pagamento import apurar_mes
+        apuracao = apurar_mes(cursor, mes_referencia)
+        return {
+            'mes_referencia': mes_referencia,
+            'faturamento_bruto': centavos_para_reais(apuracao['faturamento_centavos']),
+            'pagamento_equipes': centavos_para_reais(apuracao['total_equipes_centavos']),
+            'pagamento_externos': centavos_para_reais(apuracao['total_externos_centavos']),
+            'lucro_liquido': centavos_para_reais(apuracao['resultado_centavos']),
+            'senhas_aprovadas': len(apuracao['senhas']),
+        }
+
+    return _resposta_versionada('analytics.resumo', (mes_referencia,), calcular)
+
+@analytics_bp.route('/evolucao_mensal')
+def evolucao_mensal():
+    """Série mensal do rollup diário (receita, senhas, sessões, agendamentos, confirmações)"""
+    from rollup_utils import obter_tendencia_mensal, _intervalo_meses
+
+    meses = min(max(request.args.get('meses', 12, type=int), 1), 120)
+    mes_fim = _intervalo_meses(1, request.args.get('mes_fim'))[-1]
+
+    def calcular(cursor):
+        serie = obter_tendencia_mensal(meses=meses, mes_fim=mes_fim)
+        return {
+            'meses': [item['mes_referencia'] for item in serie],
+            'receita': [item['receita'] for item in serie],
+            'senhas_aprovadas': [item['senhas_aprovadas'] for item in serie],
+            'sessoes_realizadas': [item['sessoes_realizadas'] for item in serie],
+            'agendamentos': [item['agendamentos'] for item in serie],
+            'confirmacoes': [item['confirmacoes'] for item in serie],
+        }
+
+    return _resposta_versionada('analytics.evolucao_mensal', (meses, mes_fim), calcular)
+
+# Duração máxima de uma conexão SSE; o navegador reconecta sozinho com Last-Event-ID
+DURACAO_MAXIMA_STREAM = 300
+
+@analytics_bp.route('/ao_vivo')
+def ao_vivo():
+    """
+    Long-poll das métricas ao vivo: responde assim que algo mudar depois de ?cursor=
+    (ou após ?espera= segundos, com metricas vazio). Sem cursor, devolve o snapshot.
+    """
+    from metricas_ao_vivo import feed_metricas
+
+    espera = min(max(request.args.get('espera', 25, type=int), 0), 55)
+    cursor, metricas = feed_metricas.aguardar(request.args.get('cursor'), espera)
+
+    resposta = jsonify({'cursor': cursor, 'metricas': metricas})
+    resposta.headers['Cache-Control'] = 'no-store'
+    return resposta
+
+@analytics_bp.route('/ao_vivo/stream')
+def ao_vivo_stream():
+    """Server-Sent Events com as métricas alteradas (evento 'metricas', id = cursor)"""
+    from metricas_ao_vivo import feed_metricas
+
+    ultimo = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+
+    def eventos(cursor):
+        fim = time.monotonic() + DURACAO_MAXIMA_STREAM
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < fim:
+            cursor, metricas = feed_metricas.aguardar(cursor, 15)
+            if metricas:
+                yield f"id: {cursor}\nevent: metricas\ndata: {json.dumps(metricas)}\n\n"
+            else:
+                # Comentário SSE: mantém a conexão aberta através de proxies
+                yield ': keepalive\n\n'
+
+    resposta = Response(eventos(ultimo), mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-store'
+    resposta.headers['X-Accel-Buffering'] = 'no'
+    return resposta
@@ -0,0 +1,43 @@
+from flask import Blueprint, request, session, jsonify, url_for
+from database import get_db_connection
+from busca_utils import buscar_pacientes
+import logging
+
+# Typeahead de pacientes da barra de navegação (static/js/busca.js); cada perfil só
+# encontra os pacientes que pode ver (médico: os seus, admin de equipe: os da equipe)
+busca_bp = Blueprint('busca', __name__, url_prefix='/busca')
+
+@busca_bp.before_request
+def verificar_acesso():
+    if 'user_id' not in session or session.get('user_type') not in ['admin', 'admin_equipe', 'medico']:
+        return jsonify({'status': 'error', 'message': 'Acesso negado'}), 403
+
+def _url_paciente(paciente):
+    """Página do paciente para o usuário logado (None se ele não tem uma)"""
+    if session.get('user_type') == 'admin':
+        return url_for('admin.paciente_sessoes', paciente_id=paciente['paciente_id'])
+    if paciente['medico_id'] == session.get('user_id'):
+        return url_for('medico.paciente_sessoes', paciente_id=paciente['paciente_id'])
+    return None
+
+@busca_bp.route('/pacientes')
+def pacientes():
+    """Sugestões para ?q= (nome, CPF, telefone, observações das sessões, laudos)"""
+    texto = request.args.get('q', '')[:100]
+    limite = min(max(request.args.get('limite', 8, type=int), 1), 20)
+
+    try:
+        with get_db_connection() as conn:
+            resultados = buscar_pacientes(conn.cursor(), texto, session.get('user_type'),
+                                          session.get('user_id'), session.get('equipe_id'), limite)
+    except Exception as e:
+        logging.error(f"Busca de pacientes error: {e}")
+        return jsonify({'status': 'error', 'message': 'Erro na busca'}), 500
+
+    for resultado in resultados:
+        resultado['url'] = _url_paciente(resultado)
+        del resultado['medico_id']
+
+    resposta = jsonify({'q': texto, 'resultados': resultados})
+    resposta.headers['Cache-Control'] = 'no-store'
+    return resposta
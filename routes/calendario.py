@@ -0,0 +1,89 @@
+from flask import Blueprint, request, session, redirect, url_for, flash, Response, abort
+from werkzeug.http import is_resource_modified
+from database import get_db_connection
+from calendario_utils import gerar_token, eventos_medico, montar_calendario, versao_feed
+from datetime import date
+import hashlib
+import logging
+
+# Feed .ics das consultas para assinar no celular: o link secreto de um médico traz as
+# consultas dele, o de um admin de equipe as de todos os médicos da equipe. Os clientes
+# consultam a cada poucos minutos e recebem 304 enquanto a agenda não muda.
+calendario_bp = Blueprint('calendario', __name__, url_prefix='/calendario')
+
+# Mudar o formato do feed exige incrementar (invalida os ETags já emitidos)
+VERSAO_FEED = 1
+
+def url_feed(token):
+    return url_for('calendario.feed', token=token, _external=True) if token else None
+
+def link_calendario_usuario(cursor):
+    """URL do feed do usuário logado (None se ele ainda não gerou o link)"""
+    cursor.execute('SELECT token_calendario FROM medicos WHERE id = ?', (session.get('user_id'),))
+    usuario = cursor.fetchone()
+    return url_feed(usuario['token_calendario']) if usuario else None
+
+@calendario_bp.route('/link', methods=['POST'])
+def gerar_link():
+    """Generate (or replace, revoking the old one) the logged-in user's feed link"""
+    destino = request.referrer or url_for('index')
+    if 'user_id' not in session or session.get('user_type') not in ['medico', 'admin_equipe']:
+        flash('Acesso negado', 'error')
+        return redirect(url_for('auth.login'))
+
+    try:
+        with get_db_connection() as conn:
+            conn.execute('UPDATE medicos SET token_calendario = ? WHERE id = ?', (gerar_token(), session.get('user_id')))
+            conn.commit()
+        flash('Link da agenda gerado. O link anterior, se havia um, deixou de funcionar.', 'success')
+    except Exception as e:
+        logging.error(f"Gerar link do calendario error: {e}")
+        flash('Erro ao gerar o link da agenda', 'error')
+
+    return redirect(destino)
+
+@calendario_bp.route('/<token>.ics')
+def feed(token):
+    """iCalendar feed for the token's owner: their appointments, or their team's"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT m.id, m.nome, m.tipo, m.equipe_id, m.ativo, e.nome as equipe_nome
+            FROM medicos m
+            LEFT JOIN equipes e ON e.id = m.equipe_id
+            WHERE m.token_calendario = ?
+        ''', (token,))
+        dono = cursor.fetchone()
+    # Fora do with: o HTTPException do abort seria registrado como erro de banco
+    if not dono or not dono['ativo']:
+        abort(404)
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if dono['tipo'] == 'admin_equipe' and dono['equipe_id']:
+            cursor.execute('SELECT id FROM medicos WHERE equipe_id = ? AND ativo = 1 ORDER BY id', (dono['equipe_id'],))
+            medicos = [row['id'] for row in cursor.fetchall()]
+            equipe_id, nome = dono['equipe_id'], f"Agenda - {dono['equipe_nome'] or 'Equipe'}"
+        else:
+            medicos, equipe_id, nome = [dono['id']], None, f"Agenda - {dono['nome']}"
+
+        # A janela publicada anda com o dia, então o dia também faz parte da versão
+        dia = date.today()
+        versoes, ultima_mudanca = versao_feed(cursor, medicos, equipe_id)
+        etag = hashlib.sha256(repr((VERSAO_FEED, token, dia.isoformat(), medicos, versoes)).encode()).hexdigest()[:32]
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=ultima_mudanca):
+            resposta = Response(status=304)
+        else:
+            from cache_utils import em_cache
+            blocos = [em_cache('calendario.medico', (medico_id, dia.isoformat()),
+                               lambda: eventos_medico(cursor, medico_id, dia), cursor)
+                      for medico_id in medicos]
+            resposta = Response(montar_calendario(nome, blocos), mimetype='text/calendar')
+            resposta.headers['Content-Disposition'] = 'inline; filename="agenda.ics"'
+
+    resposta.set_etag(etag)
+    if ultima_mudanca:
+        resposta.last_modified = ultima_mudanca
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
@@ -3,6 +3,9 @@ from werkzeug.security import generate_password_hash
 from auth import equipe_admin_required
 from database import get_db_connection
 from agendamento_utils import obter_agendamentos_equipe
+from datas_utils import formatar_datas
+from rollup_utils import obter_tendencia_mensal
+from dinheiro_utils import centavos_para_reais, aplicar_pontos_base
 import logging
 from datetime import datetime
 
@@ -25,88 +28,91 @@ def dashboard():
                 flash('Equipe não encontrada', 'error')
                 return redirect(url_for('auth.login'))
             
-            # Team statistics
-            cursor.execute('SELECT COUNT(*) as total FROM medicos WHERE equipe_id = ? AND ativo = 1', (equipe_id,))
-            result = cursor.fetchone()
-            total_medicos = result['total'] if result else 0
-            
-            cursor.execute('''
-                SELECT COUNT(*) as total FROM pacientes p
-                JOIN medicos m ON p.medico_id = m.id
-                WHERE m.equipe_id = ? AND p.status = 'ativo'
-            ''', (equipe_id,))
-            result = cursor.fetchone()
-            total_pacientes = result['total'] if result else 0
-            
-            # Financial overview - calculate based on approved senhas from team doctors
             current_month = datetime.now().strftime('%Y-%m')
             
-            # Total billing from approved senhas of team doctors
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_senhas,
-                    COALESCE(SUM(s.valor), 0) as faturamento_total
-                FROM senhas s
-                JOIN pacientes p ON s.paciente_id = p.id
-                JOIN medicos m ON p.medico_id = m.id
-                WHERE m.equipe_id = ? 
-                AND s.aprovada_admin = 1 
-                AND s.ativo = 1
-                AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
-            ''', (equipe_id, current_month))
-            result = cursor.fetchone()
-            
-            faturamento_total = result['faturamento_total'] if result else 0
-            total_senhas = result['total_senhas'] if result else 0
-            
-            # Pending senhas from team doctors
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as senhas_pendentes,
-                    COALESCE(SUM(s.valor), 0) as valor_pendente
-                FROM senhas s
-                JOIN pacientes p ON s.paciente_id = p.id
-                JOIN medicos m ON p.medico_id = m.id
-                WHERE m.equipe_id = ? 
-                AND s.aprovada_admin = 0 
-                AND s.ativo = 1
-            ''', (equipe_id,))
-            result = cursor.fetchone()
-            
-            senhas_pendentes = result['senhas_pendentes'] if result else 0
-            valor_pendente = result['valor_pendente'] if result else 0
-            
-            # Calculate team partnership value (50% of team's billing)
-            valor_parceria = faturamento_total * (equipe['porcentagem_participacao'] / 100)
-            
-            financeiro = {
-                'faturamento_total': faturamento_total,
-                'valor_parceria': valor_parceria,
-                'total_senhas': total_senhas,
-                'senhas_pendentes': senhas_pendentes,
-                'valor_pendente': valor_pendente,
-                'porcentagem_equipe': equipe['porcentagem_participacao']
-            }
+            def calcular():
+                # Team statistics
+                cursor.execute('SELECT COUNT(*) as total FROM medicos WHERE equipe_id = ? AND ativo = 1', (equipe_id,))
+                result = cursor.fetchone()
+                total_medicos = result['total'] if result else 0
+                
+                cursor.execute('''
+                    SELECT COUNT(*) as total FROM pacientes p
+                    JOIN medicos m ON p.medico_id = m.id
+                    WHERE m.equipe_id = ? AND p.status = 'ativo'
+                ''', (equipe_id,))
+                result = cursor.fetchone()
+                total_pacientes = result['total'] if result else 0
+                
+                # Financial overview - calculate based on approved senhas from team doctors
+                # Total billing from approved senhas of team doctors
+                cursor.execute('''
+                    SELECT 
+                        COUNT(*) as total_senhas,
+                        COALESCE(SUM(s.valor_centavos), 0) as faturamento_total
+                    FROM senhas s
+                    JOIN pacientes p ON s.paciente_id = p.id
+                    JOIN medicos m ON p.medico_id = m.id
+                    WHERE m.equipe_id = ? 
+                    AND s.aprovada_admin = 1 
+                    AND s.ativo = 1
+                    AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+                ''', (equipe_id, current_month))
+                result = cursor.fetchone()
+                
+                faturamento_centavos = result['faturamento_total'] if result else 0
+                total_senhas = result['total_senhas'] if result else 0
+                
+                # Pending senhas from team doctors
+                cursor.execute('''
+                    SELECT 
+                        COUNT(*) as senhas_pendentes,
+                        COALESCE(SUM(s.valor_centavos), 0) as valor_pendente
+                    FROM senhas s
+                    JOIN pacientes p ON s.paciente_id = p.id
+                    JOIN medicos m ON p.medico_id = m.id
+                    WHERE m.equipe_id = ? 
+                    AND s.aprovada_admin = 0 
+                    AND s.ativo = 1
+                ''', (equipe_id,))
+                result = cursor.fetchone()
+                
+                senhas_pendentes = result['senhas_pendentes'] if result else 0
+                valor_pendente_centavos = result['valor_pendente'] if result else 0
+                
+                # Calculate team partnership value (50% of team's billing)
+                valor_parceria_centavos = aplicar_pontos_base(faturamento_centavos, equipe['porcentagem_pontos_base'])
+                
+                financeiro = {
+                    'faturamento_total': centavos_para_reais(faturamento_centavos),
+                    'valor_parceria': centavos_para_reais(valor_parceria_centavos),
+                    'total_senhas': total_senhas,
+                    'senhas_pendentes': senhas_pendentes,
+                    'valor_pendente': centavos_para_reais(valor_pendente_centavos),
+                    'porcentagem_equipe': equipe['porcentagem_participacao']
+                }
+                
+                # Get recent activities for the team
+                cursor.execute('''
+                    SELECT p.nome as paciente, m.nome as medico, s.data_sessao, s.numero_sessao
+                    FROM sessoes s
+                    JOIN pacientes p ON s.paciente_id = p.id
+                    JOIN medicos m ON p.medico_id = m.id
+                    WHERE m.equipe_id = ? AND s.realizada = 1
+                    ORDER BY s.data_sessao DESC
+                    LIMIT 5
+                ''', (equipe_id,))
+                from sql_utils import rows_to_dicts
+                atividades_recentes = rows_to_dicts(cursor.fetchall())
+                
+                return {'total_medicos': total_medicos, 'total_pacientes': total_pacientes,
+                        'financeiro': financeiro, 'atividades_recentes': atividades_recentes}
             
-            # Get recent activities for the team
-            cursor.execute('''
-                SELECT p.nome as paciente, m.nome as medico, s.data_sessao, s.numero_sessao
-                FROM sessoes s
-                JOIN pacientes p ON s.paciente_id = p.id
-                JOIN medicos m ON p.medico_id = m.id
-                WHERE m.equipe_id = ? AND s.realizada = 1
-                ORDER BY s.data_sessao DESC
-                LIMIT 5
-            ''', (equipe_id,))
-            from sql_utils import rows_to_dicts, row_to_dict
-            atividades_recentes = rows_to_dicts(cursor.fetchall())
+            from cache_utils import em_cache
+            dados = em_cache('equipe.dashboard', (equipe_id, current_month), calcular, cursor)
             
-            return render_template('equipe/dashboard.html',
-                                 equipe=row_to_dict(equipe),
-                                 total_medicos=total_medicos,
-                                 total_pacientes=total_pacientes,
-                                 financeiro=financeiro,
-                                 atividades_recentes=atividades_recentes)
+            from sql_utils import row_to_dict
+            return render_template('equipe/dashboard.html', equipe=row_to_dict(equipe), **dados)
     
     except Exception as e:
         logging.error(f"Equipe dashboard error: {e}")
@@ -174,26 +180,20 @@ def financeiro():
                 flash('Equipe não encontrada', 'error')
                 return redirect(url_for('auth.login'))
             
-            # Monthly billing based on approved senhas from team doctors
-            cursor.execute('''
-                SELECT 
-                    strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) as mes_referencia,
-                    COUNT(*) as total_senhas,
-                    SUM(s.valor) as total_bruto,
-                    SUM(s.valor * e.porcentagem_participacao / 100) as total_equipe
-                FROM senhas s
-                JOIN pacientes p ON s.paciente_id = p.id
-                JOIN medicos m ON p.medico_id = m.id
-                JOIN equipes e ON m.equipe_id = e.id
-                WHERE m.equipe_id = ? 
-                AND s.aprovada_admin = 1 
-                AND s.ativo = 1
-                GROUP BY strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao))
-                ORDER BY mes_referencia DESC
-                LIMIT 12
-            ''', (equipe_id,))
-            billing_monthly = cursor.fetchall()
-            
+            # Monthly billing based on approved senhas from team doctors (pre-aggregated daily rollup)
+            meses = request.args.get('meses', 36, type=int)
+            tendencia = obter_tendencia_mensal(meses=meses, equipe_id=equipe_id)
+            billing_monthly = [
+                {
+                    'mes_referencia': mes['mes_referencia'],
+                    'total_senhas': mes['senhas_aprovadas'],
+                    'total_bruto': mes['receita'],
+                    'total_equipe': centavos_para_reais(
+                        aplicar_pontos_base(mes['receita_centavos'], equipe['porcentagem_pontos_base']))
+                }
+                for mes in reversed(tendencia) if mes['senhas_aprovadas'] > 0
+            ][:12]
+
             return render_template('equipe/financeiro.html', 
                                  billing_monthly=billing_monthly,
                                  equipe=equipe)
@@ -272,6 +272,9 @@ def edit_medico(medico_id):
             # Update doctor
             cursor.execute('UPDATE medicos SET valor_sessao = ? WHERE id = ?', (valor_sessao, medico_id))
             conn.commit()
+            
+            from cache_utils import invalidar
+            invalidar(f'medico:{medico_id}')
             flash('Valor por sessão atualizado com sucesso', 'success')
     
     except Exception as e:
@@ -337,58 +340,8 @@ def agendamentos():
         todos_agendamentos = obter_agendamentos_equipe(equipe_id)
         logging.info(f"Total agendamentos para equipe {equipe_id}: {len(todos_agendamentos)}")
         
-        # Format dates for display
-        dias_semana = ['Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo']
-        meses = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 
-                'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
-        
-        for agendamento in todos_agendamentos:
-            if agendamento['data_consulta']:
-                try:
-                    date_str = str(agendamento['data_consulta'])
-                    if 'T' in date_str:
-                        if len(date_str.split('T')[1]) == 5:
-                            date_str += ':00'
-                        date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                    else:
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                    
-                    dia_semana = dias_semana[date_obj.weekday()]
-                    mes_nome = meses[date_obj.month - 1]
-                    
-                    agendamento['data_formatada'] = date_obj.strftime('%d/%m/%Y')
-                    agendamento['hora_formatada'] = date_obj.strftime('%H:%M')
-                    agendamento['data_completa'] = f"{dia_semana}, {date_obj.day} de {mes_nome} de {date_obj.year}"
-                    agendamento['periodo'] = "manhã" if date_obj.hour < 12 else "tarde" if date_obj.hour < 18 else "noite"
-                    
-                except Exception as e:
-                    logging.error(f"Erro ao formatar data do agendamento: {e}")
-                    agendamento['data_formatada'] = agendamento['data_consulta']
-                    agendamento['hora_formatada'] = ''
-                    agendamento['data_completa'] = agendamento['data_consulta']
-                    agendamento['periodo'] = ''
-        
-        # Separate future and past appointments
-        agora = datetime.now()
-        agendamentos_futuros = []
-        agendamentos_passados = []
-        
-        for agendamento in todos_agendamentos:
-            try:
-                date_str = str(agendamento['data_consulta'])
-                if 'T' in date_str:
-                    if len(date_str.split('T')[1]) == 5:
-                        date_str += ':00'
-                    date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                else:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                
-                if date_obj >= agora:
-                    agendamentos_futuros.append(agendamento)
-                else:
-                    agendamentos_passados.append(agendamento)
-            except:
-                agendamentos_passados.append(agendamento)
+        # Display labels and future/past split in one pass (datas_utils)
+        agendamentos_futuros, agendamentos_passados = formatar_datas(todos_agendamentos)
         
         # Group by doctor for better organization
         agendamentos_por_medico = {}
@@ -414,11 +367,17 @@ def agendamentos():
             'medicos': len(agendamentos_por_medico)
         }
         
+        # Link of the team's .ics feed to subscribe in a phone calendar
+        from routes.calendario import link_calendario_usuario
+        with get_db_connection() as conn:
+            url_calendario = link_calendario_usuario(conn.cursor())
+        
         return render_template('equipe/agendamentos.html',
                              agendamentos_futuros=agendamentos_futuros,
                              agendamentos_passados=agendamentos_passados,
                              agendamentos_por_medico=agendamentos_por_medico,
-                             stats=stats)
+                             stats=stats,
+                             url_calendario=url_calendario)
     
     except Exception as e:
         logging.error(f"Equipe agendamentos error: {e}")
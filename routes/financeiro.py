@@ -25,6 +25,39 @@ def faturamento():
         flash('Erro ao carregar faturamento', 'error')
         return render_template('financeiro/faturamento.html', relatorio={})
 
+@financeiro_bp.route('/relatorios/exportar')
+@admin_required
+def exportar_relatorios():
+    """Exporta (CSV/XLSX, em streaming) as senhas faturadas do mês"""
+    from exportacao_utils import iterar_consulta, resposta_exportacao
+    
+    mes_referencia = request.args.get('mes', datetime.now().strftime('%Y-%m'))
+    colunas = [
+        ('senha_id', 'Senha', 'numero'),
+        ('paciente_nome', 'Paciente', 'texto'),
+        ('medico_nome', 'Médico', 'texto'),
+        ('equipe_nome', 'Equipe', 'texto'),
+        ('tipo', 'Tipo', 'texto'),
+        ('data_aprovacao', 'Aprovação', 'texto'),
+        ('valor_centavos', 'Valor (R$)', 'centavos'),
+    ]
+    lotes = iterar_consulta('''
+        SELECT s.id as senha_id, p.nome as paciente_nome, m.nome as medico_nome,
+               COALESCE(e.nome, 'Externo') as equipe_nome, s.tipo,
+               COALESCE(s.data_aprovacao, s.data_criacao) as data_aprovacao, s.valor_centavos
+        FROM senhas s
+        JOIN pacientes p ON s.paciente_id = p.id
+        JOIN medicos m ON p.medico_id = m.id
+        LEFT JOIN equipes e ON m.equipe_id = e.id
+        WHERE s.ativo = 1 
+        AND s.aprovada_admin = 1
+        AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+        ORDER BY s.data_criacao DESC
+    ''', (mes_referencia,))
+    
+    return resposta_exportacao(f'faturamento_{mes_referencia}', colunas, lotes,
+                               request.args.get('formato', 'csv'), 'Faturamento')
+
 @financeiro_bp.route('/relatorios')
 @admin_required
 def relatorios():
@@ -69,7 +102,7 @@ def relatorios():
                 SELECT 
                     m.nome,
                     COUNT(DISTINCT p.id) as total_pacientes,
-                    SUM(s.valor) as faturamento_bruto
+                    SUM(s.valor_centavos) / 100.0 as faturamento_bruto
                 FROM medicos m
                 LEFT JOIN pacientes p ON m.id = p.medico_id
                 LEFT JOIN senhas s ON p.id = s.paciente_id 
@@ -78,7 +111,7 @@ def relatorios():
                     AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
                 WHERE m.ativo = 1
                 GROUP BY m.id, m.nome
-                HAVING SUM(s.valor) > 0
+                HAVING SUM(s.valor_centavos) > 0
                 ORDER BY faturamento_bruto DESC
             ''', (mes_referencia,))
             
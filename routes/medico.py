@@ -2,6 +2,10 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from auth import medico_required
 from database import get_db_connection, get_config, verificar_senhas_aprovadas_para_entrega
 from agendamento_utils import obter_agendamentos_medico
+from datas_utils import formatar_datas
+from agenda_utils import (RECORRENCIAS, agendar_serie, conflitos, converter_data_consulta, converter_duracao,
+                          proximos_horarios_livres, horarios_livres as horarios_livres_agenda)
+from lista_espera_utils import PRIORIDADES, indice as indice_espera
 import logging
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
@@ -41,20 +45,17 @@ def dashboard():
             equipe_id = medico_info['equipe_id'] if medico_info else None
             faturamento_mes = sessoes_mes * valor_sessao
             
-            # Para médicos externos, calcular faturamento baseado apenas em pacotes fechados
+            # Para médicos externos, faturamento pelas regras de pagamento por sessão
             if not equipe_id:
-                # Contar pacientes finalizados (recebe APENAS 8 sessões por pacote fechado)
-                cursor.execute('''
-                    SELECT COUNT(*) as pacientes_finalizados
-                    FROM pacientes p
-                    WHERE p.medico_id = ? AND p.status = 'finalizado'
-                ''', (medico_id,))
-                result = cursor.fetchone()
-                pacientes_finalizados = result['pacientes_finalizados'] if result else 0
+                from regras_pagamento import apurar_mes
+                from dinheiro_utils import centavos_para_reais
+                from cache_utils import em_cache
+                
+                def calcular():
+                    apuracao = apurar_mes(cursor, current_month, medico_id=medico_id)
+                    return centavos_para_reais(sum(m['pagamento_centavos'] for m in apuracao['sessoes_medicos']))
                 
-                # Médico externo recebe APENAS o valor dos pacotes fechados (8 sessões cada)
-                # Sessões avulsas ou após 2 meses do fechamento não contam
-                faturamento_mes = pacientes_finalizados * 8 * valor_sessao
+                faturamento_mes = em_cache('medico.pagamento', (medico_id, current_month), calcular, cursor)
             
             # Recent patients with senha information
             cursor.execute('''
@@ -102,35 +103,7 @@ def dashboard():
             agendamentos_recentes = obter_agendamentos_medico(medico_id)
             
             # Format dates for recent appointments
-            dias_semana = ['Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo']
-            meses = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 
-                    'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
-            
-            for agendamento in agendamentos_recentes[:10]:  # Only show recent ones
-                if agendamento.get('data_consulta'):
-                    try:
-                        date_str = str(agendamento['data_consulta'])
-                        if 'T' in date_str:
-                            if len(date_str.split('T')[1]) == 5:
-                                date_str += ':00'
-                            date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                        else:
-                            date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                        
-                        dia_semana = dias_semana[date_obj.weekday()]
-                        mes_nome = meses[date_obj.month - 1]
-                        
-                        agendamento['data_formatada'] = date_obj.strftime('%d/%m/%Y')
-                        agendamento['hora_formatada'] = date_obj.strftime('%H:%M')
-                        agendamento['data_completa'] = f"{dia_semana}, {date_obj.day} de {mes_nome} de {date_obj.year}"
-                        agendamento['periodo'] = "manhã" if date_obj.hour < 12 else "tarde" if date_obj.hour < 18 else "noite"
-                        
-                    except Exception as e:
-                        logging.error(f"Erro ao formatar data do agendamento: {e}")
-                        agendamento['data_formatada'] = agendamento['data_consulta']
-                        agendamento['hora_formatada'] = ''
-                        agendamento['data_completa'] = agendamento['data_consulta']
-                        agendamento['periodo'] = ''
+            formatar_datas(agendamentos_recentes[:10])
             
             return render_template('medico/dashboard.html',
                                  total_pacientes=total_pacientes,
@@ -352,22 +325,35 @@ def paciente_sessoes(paciente_id):
             ''', (paciente_id,))
             senhas_paciente = rows_to_dicts(cursor.fetchall())
             
-            # Get active appointment for this patient
+            # Get the next active appointment for this patient (a series books several)
             cursor.execute('''
-                SELECT * FROM agendamentos 
-                WHERE paciente_id = ? AND status = 'agendado'
-                ORDER BY data_criacao DESC
+                SELECT a.*, cc.disponivel_confirmacao as confirmacao_disponivel
+                FROM agendamentos a
+                LEFT JOIN confirmacoes_consulta cc ON cc.agendamento_id = a.id
+                WHERE a.paciente_id = ? AND a.status = 'agendado'
+                ORDER BY a.data_consulta
                 LIMIT 1
             ''', (paciente_id,))
             agendamento_ativo = row_to_dict(cursor.fetchone())
             
+            # Waitlist entry for this doctor, if the patient is waiting for a slot
+            cursor.execute('''
+                SELECT * FROM lista_espera
+                WHERE paciente_id = ? AND medico_id = ? AND status = 'aguardando'
+            ''', (paciente_id, session.get('user_id')))
+            espera = row_to_dict(cursor.fetchone())
+            
             return render_template('medico/paciente_sessoes.html', 
                                  paciente=row_to_dict(paciente),
                                  sessoes=sessoes,
                                  laudos=laudos,
                                  senhas_paciente=senhas_paciente,
                                  todas_sessoes_completas=todas_sessoes_completas,
-                                 agendamento_ativo=agendamento_ativo)
+                                 agendamento_ativo=agendamento_ativo,
+                                 sessoes_max=int(get_config('sessoes_max', '8')),
+                                 recorrencias=RECORRENCIAS,
+                                 espera=espera,
+                                 prioridades=PRIORIDADES)
     
     except Exception as e:
         logging.error(f"Paciente sessoes error: {e}")
@@ -431,8 +417,9 @@ def nova_sessao(paciente_id):
             current_count = result['count'] if result else 0
             next_sessao = (result['max_sessao'] if result['max_sessao'] else 0) + 1
             
-            if current_count >= 8:
-                flash('Paciente já possui o máximo de 8 sessões', 'error')
+            sessoes_max = int(get_config('sessoes_max', '8'))
+            if current_count >= sessoes_max:
+                flash(f'Paciente já possui o máximo de {sessoes_max} sessões', 'error')
                 return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
             
             # Create next session with today's date
@@ -642,32 +629,62 @@ def agendar_consulta(paciente_id):
             
             data_agendamento = request.form.get('data_agendamento')
             observacoes = request.form.get('observacoes', '')
+            duracao = converter_duracao(request.form.get('duracao_minutos'))
             
             if not data_agendamento:
                 flash('Data do agendamento é obrigatória', 'error')
                 return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
             
-            # Check if there's already an active appointment
+            try:
+                inicio = converter_data_consulta(data_agendamento)
+            except ValueError:
+                flash('Data do agendamento inválida', 'error')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+            
+            # Write lock before the checks: the conflict check and the write must not
+            # interleave with another booking for the same doctor
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Check if there's already an active appointment (the next one, if a series is booked)
             cursor.execute('''
-                SELECT id FROM agendamentos 
+                SELECT id, sessao_id FROM agendamentos 
                 WHERE paciente_id = ? AND status = 'agendado'
+                ORDER BY data_consulta
+                LIMIT 1
             ''', (paciente_id,))
             agendamento_existente = cursor.fetchone()
+            ignorar_id = agendamento_existente['id'] if agendamento_existente else None
+            
+            # The doctor's other appointments may not overlap this one
+            sobrepostos = conflitos(cursor, medico_id, inicio, duracao, ignorar_id)
+            if sobrepostos:
+                sugestoes = proximos_horarios_livres(cursor, medico_id, inicio, duracao, ignorar_id=ignorar_id)
+                conflito = sobrepostos[0]
+                mensagem = (f"Horário em conflito com a consulta de {conflito['paciente_nome']} "
+                            f"({converter_data_consulta(conflito['data_consulta']).strftime('%d/%m/%Y %H:%M')}).")
+                if sugestoes:
+                    mensagem += ' Próximos horários livres: ' + ', '.join(h.strftime('%d/%m %H:%M') for h in sugestoes)
+                flash(mensagem, 'error')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
             
+            data_consulta = inicio.strftime('%Y-%m-%d %H:%M:%S')
             if agendamento_existente:
                 # Update existing appointment
                 cursor.execute('''
                     UPDATE agendamentos 
-                    SET data_consulta = ?, observacoes = ?
-                    WHERE paciente_id = ? AND status = 'agendado'
-                ''', (data_agendamento, observacoes, paciente_id))
+                    SET data_consulta = ?, duracao_minutos = ?, observacoes = ?
+                    WHERE id = ?
+                ''', (data_consulta, duracao, observacoes, agendamento_existente['id']))
+                if agendamento_existente['sessao_id']:
+                    cursor.execute('UPDATE sessoes SET data_sessao = ? WHERE id = ? AND realizada = 0',
+                                   (inicio.date().isoformat(), agendamento_existente['sessao_id']))
                 flash('Agendamento atualizado com sucesso', 'success')
             else:
                 # Create new appointment
                 cursor.execute('''
-                    INSERT INTO agendamentos (paciente_id, medico_id, data_consulta, observacoes)
-                    VALUES (?, ?, ?, ?)
-                ''', (paciente_id, medico_id, data_agendamento, observacoes))
+                    INSERT INTO agendamentos (paciente_id, medico_id, data_consulta, duracao_minutos, observacoes)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (paciente_id, medico_id, data_consulta, duracao, observacoes))
                 flash('Consulta agendada com sucesso', 'success')
             
             conn.commit()
@@ -678,6 +695,162 @@ def agendar_consulta(paciente_id):
     
     return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
 
+@medico_bp.route('/paciente/<int:paciente_id>/agendar_serie', methods=['POST'])
+@medico_required
+def agendar_serie_sessoes(paciente_id):
+    """Book the patient's next sessions as a recurring series (all or nothing)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            medico_id = session.get('user_id')
+            
+            # Verify patient belongs to doctor
+            cursor.execute('SELECT id, status FROM pacientes WHERE id = ? AND medico_id = ?', (paciente_id, medico_id))
+            paciente = cursor.fetchone()
+            
+            if not paciente:
+                flash('Paciente não encontrado', 'error')
+                return redirect(url_for('medico.pacientes'))
+            
+            recorrencia = request.form.get('recorrencia', 'semanal')
+            quantidade = request.form.get('quantidade', type=int)
+            duracao = converter_duracao(request.form.get('duracao_minutos'))
+            observacoes = request.form.get('observacoes', '')
+            
+            if paciente['status'] != 'ativo':
+                flash('Só é possível agendar sessões de pacientes ativos', 'error')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+            
+            if recorrencia not in RECORRENCIAS or not quantidade or quantidade < 1:
+                flash('Informe a recorrência e a quantidade de sessões', 'error')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+            
+            try:
+                inicio = converter_data_consulta(request.form.get('data_inicio', ''))
+            except ValueError:
+                flash('Data da primeira sessão inválida', 'error')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+            
+            try:
+                resultado = agendar_serie(conn, paciente_id, medico_id, inicio, recorrencia, quantidade,
+                                          int(get_config('sessoes_max', '8')), duracao, observacoes)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+            
+            if not resultado['criadas']:
+                # Nothing was booked: list each conflicting date with the nearest free slot
+                detalhes = []
+                for item in resultado['plano']:
+                    if not item['conflitos']:
+                        continue
+                    texto = (f"{item['inicio'].strftime('%d/%m %H:%M')} "
+                             f"(consulta de {item['conflitos'][0]['paciente_nome']})")
+                    sugestao = proximos_horarios_livres(cursor, medico_id, item['inicio'], duracao, quantidade=1)
+                    if sugestao:
+                        texto += f" - livre: {sugestao[0].strftime('%d/%m %H:%M')}"
+                    detalhes.append(texto)
+                flash('Nenhuma sessão foi agendada. Datas em conflito: ' + '; '.join(detalhes), 'error')
+            else:
+                ultima = resultado['primeira_sessao'] + resultado['criadas'] - 1
+                flash(f"Sessões {resultado['primeira_sessao']} a {ultima} agendadas "
+                      f"({resultado['criadas']} consultas)", 'success')
+    
+    except Exception as e:
+        logging.error(f"Agendar serie error: {e}")
+        flash('Erro ao agendar a série de sessões', 'error')
+    
+    return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+
+@medico_bp.route('/paciente/<int:paciente_id>/lista_espera', methods=['POST'])
+@medico_required
+def entrar_lista_espera(paciente_id):
+    """Put the patient on the doctor's waitlist: offered the first slot another patient cancels"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            medico_id = session.get('user_id')
+            
+            cursor.execute('SELECT id, status, localizacao FROM pacientes WHERE id = ? AND medico_id = ?',
+                           (paciente_id, medico_id))
+            paciente = cursor.fetchone()
+            
+            if not paciente:
+                flash('Paciente não encontrado', 'error')
+                return redirect(url_for('medico.pacientes'))
+            
+            if paciente['status'] != 'ativo':
+                flash('Só pacientes ativos podem entrar na lista de espera', 'error')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+            
+            prioridade = request.form.get('prioridade', 0, type=int)
+            if prioridade not in PRIORIDADES:
+                prioridade = 0
+            
+            cursor.execute('''
+                SELECT 1 FROM lista_espera WHERE paciente_id = ? AND medico_id = ? AND status = 'aguardando'
+            ''', (paciente_id, medico_id))
+            if cursor.fetchone():
+                flash('O paciente já está na lista de espera', 'warning')
+                return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+            
+            indice_espera.adicionar(cursor, paciente_id, medico_id, paciente['localizacao'], prioridade,
+                                    request.form.get('observacoes', ''))
+            conn.commit()
+            flash('Paciente incluído na lista de espera. Ele receberá o primeiro horário cancelado.', 'success')
+    
+    except Exception as e:
+        logging.error(f"Entrar lista de espera error: {e}")
+        flash('Erro ao incluir o paciente na lista de espera', 'error')
+    
+    return redirect(url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+
+@medico_bp.route('/paciente/<int:paciente_id>/lista_espera/remover', methods=['POST'])
+@medico_required
+def sair_lista_espera(paciente_id):
+    """Take the patient off the doctor's waitlist"""
+    try:
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE lista_espera SET status = 'removida'
+                WHERE paciente_id = ? AND medico_id = ? AND status = 'aguardando'
+            ''', (paciente_id, session.get('user_id')))
+            conn.commit()
+        flash('Paciente removido da lista de espera', 'success')
+    except Exception as e:
+        logging.error(f"Sair lista de espera error: {e}")
+        flash('Erro ao remover o paciente da lista de espera', 'error')
+    
+    return redirect(request.referrer or url_for('medico.paciente_sessoes', paciente_id=paciente_id))
+
+@medico_bp.route('/agenda/horarios_livres')
+@medico_required
+def horarios_livres():
+    """Free slots of the logged-in doctor (JSON): ?data=YYYY-MM-DD&dias=7&duracao=50&ignorar=<agendamento>"""
+    try:
+        dia = datetime.strptime(request.args.get('data', ''), '%Y-%m-%d').date()
+    except ValueError:
+        dia = datetime.now().date()
+    dias = min(max(request.args.get('dias', 1, type=int), 1), 31)
+    duracao = converter_duracao(request.args.get('duracao'))
+    ignorar_id = request.args.get('ignorar', type=int)
+    medico_id = session.get('user_id')
+    
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            livres = horarios_livres_agenda(cursor, medico_id, dia, dias, duracao, ignorar_id=ignorar_id)
+            proximos = proximos_horarios_livres(cursor, medico_id, max(datetime.combine(dia, datetime.min.time()), datetime.now()),
+                                                duracao, quantidade=5, ignorar_id=ignorar_id)
+    except Exception as e:
+        logging.error(f"Horarios livres error: {e}")
+        return jsonify({'status': 'error', 'message': 'Erro ao consultar a agenda'}), 500
+    
+    formato = '%Y-%m-%dT%H:%M'
+    return jsonify({'data': dia.isoformat(), 'dias': dias, 'duracao_minutos': duracao,
+                    'horarios': [horario.strftime(formato) for horario in livres],
+                    'proximos': [horario.strftime(formato) for horario in proximos]})
+
 @medico_bp.route('/agendamentos')
 @medico_required
 def agendamentos():
@@ -689,58 +862,8 @@ def agendamentos():
         todos_agendamentos = obter_agendamentos_medico(medico_id)
         logging.info(f"Total agendamentos para médico {medico_id}: {len(todos_agendamentos)}")
         
-        # Format dates for display
-        dias_semana = ['Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo']
-        meses = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 
-                'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
-        
-        for agendamento in todos_agendamentos:
-            if agendamento['data_consulta']:
-                try:
-                    date_str = str(agendamento['data_consulta'])
-                    if 'T' in date_str:
-                        if len(date_str.split('T')[1]) == 5:
-                            date_str += ':00'
-                        date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                    else:
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                    
-                    dia_semana = dias_semana[date_obj.weekday()]
-                    mes_nome = meses[date_obj.month - 1]
-                    
-                    agendamento['data_formatada'] = date_obj.strftime('%d/%m/%Y')
-                    agendamento['hora_formatada'] = date_obj.strftime('%H:%M')
-                    agendamento['data_completa'] = f"{dia_semana}, {date_obj.day} de {mes_nome} de {date_obj.year}"
-                    agendamento['periodo'] = "manhã" if date_obj.hour < 12 else "tarde" if date_obj.hour < 18 else "noite"
-                    
-                except Exception as e:
-                    logging.error(f"Erro ao formatar data do agendamento: {e}")
-                    agendamento['data_formatada'] = agendamento['data_consulta']
-                    agendamento['hora_formatada'] = ''
-                    agendamento['data_completa'] = agendamento['data_consulta']
-                    agendamento['periodo'] = ''
-        
-        # Separate future and past appointments
-        agora = datetime.now()
-        agendamentos_futuros = []
-        agendamentos_passados = []
-        
-        for agendamento in todos_agendamentos:
-            try:
-                date_str = str(agendamento['data_consulta'])
-                if 'T' in date_str:
-                    if len(date_str.split('T')[1]) == 5:
-                        date_str += ':00'
-                    date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                else:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                
-                if date_obj >= agora:
-                    agendamentos_futuros.append(agendamento)
-                else:
-                    agendamentos_passados.append(agendamento)
-            except:
-                agendamentos_passados.append(agendamento)
+        # Display labels and future/past split in one pass (datas_utils)
+        agendamentos_futuros, agendamentos_passados = formatar_datas(todos_agendamentos)
         
         # Statistics
         total_agendamentos = len(todos_agendamentos)
@@ -757,10 +880,30 @@ def agendamentos():
             'cancelados': cancelados
         }
         
+        # Link of the .ics feed to subscribe in a phone calendar
+        from routes.calendario import link_calendario_usuario
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            url_calendario = link_calendario_usuario(cursor)
+            
+            # Patients waiting for a cancelled slot, in the order they will be offered one
+            cursor.execute('''
+                SELECT l.id, l.paciente_id, l.localizacao, l.prioridade, l.observacoes, l.criado_em,
+                       p.nome as paciente_nome
+                FROM lista_espera l
+                JOIN pacientes p ON l.paciente_id = p.id
+                WHERE l.medico_id = ? AND l.status = 'aguardando'
+                ORDER BY l.localizacao, l.prioridade DESC, l.criado_em, l.id
+            ''', (medico_id,))
+            lista_espera = [dict(row) for row in cursor.fetchall()]
+        
         return render_template('medico/agendamentos.html',
                              agendamentos_futuros=agendamentos_futuros,
                              agendamentos_passados=agendamentos_passados,
-                             stats=stats)
+                             stats=stats,
+                             url_calendario=url_calendario,
+                             lista_espera=lista_espera,
+                             prioridades=PRIORIDADES)
     
     except Exception as e:
         logging.error(f"Médico agendamentos error: {e}")
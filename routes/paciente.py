@@ -2,9 +2,9 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from auth import paciente_required
 from database import get_db_connection
 from agendamento_utils import obter_confirmacoes_pendentes, confirmar_consulta, obter_agendamentos_futuros, obter_todos_agendamentos_paciente
+from datas_utils import agora_canonico, formatar_datas, formatar_data_hora
 import logging
 import os
-from datetime import datetime
 
 paciente_bp = Blueprint('paciente', __name__)
 
@@ -56,51 +56,12 @@ def dashboard():
             ''', (paciente_id,))
             senhas = cursor.fetchall()
             
-            # Update available confirmations first
-            from agendamento_utils import atualizar_confirmacoes_disponiveis
-            atualizar_confirmacoes_disponiveis()
-            
-            # Get pending confirmations using utility function
+            # Get pending confirmations (made available by the background scheduler, agendador.py)
             confirmacoes_pendentes = obter_confirmacoes_pendentes(paciente_id)
             logging.info(f"Confirmações pendentes para paciente {paciente_id}: {len(confirmacoes_pendentes) if confirmacoes_pendentes else 0}")
             
             # Format dates in confirmacoes_pendentes with Brazilian formatting
-            dias_semana = ['Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo']
-            meses = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 
-                    'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
-            
-            for confirmacao in confirmacoes_pendentes:
-                if confirmacao['data_consulta']:
-                    try:
-                        # Parse different possible date formats
-                        date_str = str(confirmacao['data_consulta'])
-                        logging.info(f"Parsing date string: {date_str}")
-                        
-                        if 'T' in date_str:
-                            # Handle ISO format like "2025-08-16T13:15"
-                            if len(date_str.split('T')[1]) == 5:  # Only HH:MM
-                                date_str += ':00'  # Add seconds
-                            date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                        else:
-                            date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                        
-                        # Format in Brazilian style
-                        dia_semana = dias_semana[date_obj.weekday()]
-                        mes_nome = meses[date_obj.month - 1]
-                        
-                        confirmacao['data_formatada'] = date_obj.strftime('%d/%m/%Y')
-                        confirmacao['hora_formatada'] = date_obj.strftime('%H:%M')
-                        confirmacao['data_completa'] = f"{dia_semana}, {date_obj.day} de {mes_nome} de {date_obj.year}"
-                        confirmacao['periodo'] = "manhã" if date_obj.hour < 12 else "tarde" if date_obj.hour < 18 else "noite"
-                        
-                        logging.info(f"Formatted date: {confirmacao['data_completa']} às {confirmacao['hora_formatada']} ({confirmacao['periodo']})")
-                        
-                    except Exception as e:
-                        logging.error(f"Erro ao formatar data: {e}")
-                        confirmacao['data_formatada'] = confirmacao['data_consulta']
-                        confirmacao['hora_formatada'] = ''
-                        confirmacao['data_completa'] = confirmacao['data_consulta']
-                        confirmacao['periodo'] = ''
+            formatar_datas(confirmacoes_pendentes)
             
             # Get all future appointments for this patient
             agendamentos_futuros = obter_agendamentos_futuros(paciente_id=paciente_id)
@@ -110,49 +71,10 @@ def dashboard():
             logging.info(f"Total agendamentos para paciente {paciente_id}: {len(todas_consultas_raw)}")
             
             # Format dates for todas_consultas
-            todas_consultas = []
-            for consulta in todas_consultas_raw:
-                consulta_dict = dict(consulta)
-                if consulta_dict['data_consulta']:
-                    try:
-                        # Parse different possible date formats
-                        date_str = str(consulta_dict['data_consulta'])
-                        
-                        if 'T' in date_str:
-                            # Handle ISO format like "2025-08-16T13:15"
-                            if len(date_str.split('T')[1]) == 5:  # Only HH:MM
-                                date_str += ':00'  # Add seconds
-                            date_obj = datetime.fromisoformat(date_str.replace('T', ' '))
-                        else:
-                            date_obj = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                        
-                        # Format in Brazilian style
-                        dia_semana = dias_semana[date_obj.weekday()]
-                        mes_nome = meses[date_obj.month - 1]
-                        
-                        consulta_dict['data_formatada'] = date_obj.strftime('%d/%m/%Y')
-                        consulta_dict['hora_formatada'] = date_obj.strftime('%H:%M')
-                        consulta_dict['data_completa'] = f"{dia_semana}, {date_obj.day} de {mes_nome} de {date_obj.year}"
-                        consulta_dict['periodo'] = "manhã" if date_obj.hour < 12 else "tarde" if date_obj.hour < 18 else "noite"
-                        
-                    except Exception as e:
-                        logging.error(f"Erro ao formatar data da consulta: {e}")
-                        consulta_dict['data_formatada'] = consulta_dict['data_consulta']
-                        consulta_dict['hora_formatada'] = ''
-                        consulta_dict['data_completa'] = consulta_dict['data_consulta']
-                        consulta_dict['periodo'] = ''
-                
-                # Format confirmation date if exists
-                if consulta_dict['data_confirmacao']:
-                    try:
-                        conf_date_obj = datetime.strptime(str(consulta_dict['data_confirmacao']), '%Y-%m-%d %H:%M:%S')
-                        consulta_dict['data_confirmacao_formatada'] = conf_date_obj.strftime('%d/%m/%Y às %H:%M')
-                    except:
-                        consulta_dict['data_confirmacao_formatada'] = consulta_dict['data_confirmacao']
-                else:
-                    consulta_dict['data_confirmacao_formatada'] = ''
-                
-                todas_consultas.append(consulta_dict)
+            todas_consultas = [dict(consulta) for consulta in todas_consultas_raw]
+            formatar_datas(todas_consultas)
+            for consulta in todas_consultas:
+                consulta['data_confirmacao_formatada'] = formatar_data_hora(consulta['data_confirmacao'], '%d/%m/%Y às %H:%M')
             
             return render_template('paciente/dashboard.html',
                                  paciente=paciente,
@@ -308,18 +230,20 @@ def confirmar_consulta_route(confirmacao_id):
             # Update confirmation
             cursor.execute('''
                 UPDATE confirmacoes_consulta 
-                SET confirmado = ?, data_confirmacao = datetime('now'),
+                SET confirmado = ?, data_confirmacao = ?,
                     observacoes_paciente = ?
                 WHERE id = ?
-            ''', (int(confirmado), observacoes, confirmacao_id))
+            ''', (int(confirmado), agora_canonico(), observacoes, confirmacao_id))
             
-            # Get doctor info for notification
-            cursor.execute('''
-                SELECT m.nome as medico_nome, m.tipo, m.equipe_id
-                FROM medicos m
-                WHERE m.id = ?
-            ''', (confirmacao['medico_id'],))
-            medico = cursor.fetchone()
+            # Notify the doctor (and the admins on a cancellation) in the same transaction;
+            # the scheduler sends the messages
+            from notificacoes import notificar_confirmacao
+            notificar_confirmacao(cursor, confirmacao_id)
+            
+            # A rejection frees the slot and offers it to the doctor's waitlist
+            if confirmado == '0':
+                from lista_espera_utils import cancelar_pelo_paciente
+                cancelar_pelo_paciente(cursor, confirmacao['agendamento_id'])
             
             conn.commit()
             
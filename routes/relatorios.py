@@ -1,7 +1,10 @@
-from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify
+from flask import Blueprint, render_template, session, redirect, url_for, request, jsonify, Response, stream_with_context, send_file
 from database import get_db_connection
+from dinheiro_utils import centavos_para_reais
 from datetime import datetime, timedelta
 import calendar
+import json
+import logging
 
 relatorios_bp = Blueprint('relatorios', __name__, url_prefix='/relatorios')
 
@@ -26,80 +29,105 @@ def admin_dashboard():
         primeiro_dia = f"{ano}-{mes:02d}-01"
         ultimo_dia = f"{ano}-{mes:02d}-{calendar.monthrange(ano, mes)[1]}"
         
-        # Faturamento bruto total
-        cursor.execute('''
-            SELECT 
-                COALESCE(SUM(s.valor), 0) as faturamento_bruto
-            FROM senhas s
-            WHERE s.aprovada_admin = 1
-            AND s.data_aprovacao BETWEEN ? AND ?
-        ''', (primeiro_dia, ultimo_dia))
-        
-        faturamento_bruto = cursor.fetchone()['faturamento_bruto']
-        
-        # Faturamento por equipe
-        cursor.execute('''
-            SELECT 
-                e.nome as equipe_nome,
-                COALESCE(SUM(s.valor), 0) as faturamento
-            FROM equipes e
-            LEFT JOIN medicos m ON e.id = m.equipe_id
-            LEFT JOIN pacientes p ON m.id = p.medico_id
-            LEFT JOIN senhas s ON p.id = s.paciente_id 
-                AND s.aprovada_admin = 1 
-                AND s.data_aprovacao BETWEEN ? AND ?
-            GROUP BY e.id, e.nome
-            ORDER BY faturamento DESC
-        ''', (primeiro_dia, ultimo_dia))
-        
-        # Convert Row objects to JSON-serializable dictionaries
-        from sql_utils import rows_to_dicts
-        faturamento_por_equipe = rows_to_dicts(cursor.fetchall())
-        
-        # Faturamento por médico
-        cursor.execute('''
-            SELECT 
-                m.nome as medico_nome,
-                COALESCE(e.nome, 'Externo') as equipe_nome,
-                COALESCE(SUM(s.valor), 0) as faturamento
-            FROM medicos m
-            LEFT JOIN equipes e ON m.equipe_id = e.id
-            LEFT JOIN pacientes p ON m.id = p.medico_id
-            LEFT JOIN senhas s ON p.id = s.paciente_id 
-                AND s.aprovada_admin = 1 
-                AND s.data_aprovacao BETWEEN ? AND ?
-            GROUP BY m.id, m.nome, e.nome
-            ORDER BY faturamento DESC
-        ''', (primeiro_dia, ultimo_dia))
-        
-        # Convert Row objects to JSON-serializable dictionaries
-        from sql_utils import rows_to_dicts
-        faturamento_por_medico = rows_to_dicts(cursor.fetchall())
-        
-        # Calcular pagamentos de médicos externos com nova lógica
-        from medico_pagamento import calcular_pagamentos_todos_medicos
         mes_referencia = f"{ano}-{mes:02d}"
         
-        # Calcular pagamentos médicos externos
-        pagamentos_medicos = calcular_pagamentos_todos_medicos(mes_referencia)
-        total_pagamento_externos = pagamentos_medicos.get('total_geral', 0)
-        
-        # Gerar relatório financeiro para equipes
-        from financeiro_utils import gerar_relatorio_financeiro_completo
-        relatorio_financeiro = gerar_relatorio_financeiro_completo(mes_referencia)
-        total_pagamento_equipes = relatorio_financeiro.get('total_pagamentos_equipe', 0)
-        lucro_liquido = faturamento_bruto - total_pagamento_equipes - total_pagamento_externos
-        
+        def calcular():
+            # Faturamento e pagamentos do mês pelas regras de pagamento (grava os ledgers)
+            from financeiro_utils import gerar_relatorio_financeiro_completo
+            relatorio_financeiro = gerar_relatorio_financeiro_completo(mes_referencia)
+            faturamento_bruto = relatorio_financeiro.get('faturamento_clinica', 0)
+            
+            # Faturamento por equipe
+            cursor.execute('''
+                SELECT 
+                    e.nome as equipe_nome,
+                    COALESCE(SUM(s.valor_centavos), 0) / 100.0 as faturamento
+                FROM equipes e
+                LEFT JOIN medicos m ON e.id = m.equipe_id
+                LEFT JOIN pacientes p ON m.id = p.medico_id
+                LEFT JOIN senhas s ON p.id = s.paciente_id 
+                    AND s.aprovada_admin = 1 
+                    AND s.data_aprovacao BETWEEN ? AND ?
+                GROUP BY e.id, e.nome
+                ORDER BY faturamento DESC
+            ''', (primeiro_dia, ultimo_dia))
+            
+            # Convert Row objects to JSON-serializable dictionaries
+            from sql_utils import rows_to_dicts
+            faturamento_por_equipe = rows_to_dicts(cursor.fetchall())
+            
+            # Faturamento por médico
+            cursor.execute('''
+                SELECT 
+                    m.nome as medico_nome,
+                    COALESCE(e.nome, 'Externo') as equipe_nome,
+                    COALESCE(SUM(s.valor_centavos), 0) / 100.0 as faturamento
+                FROM medicos m
+                LEFT JOIN equipes e ON m.equipe_id = e.id
+                LEFT JOIN pacientes p ON m.id = p.medico_id
+                LEFT JOIN senhas s ON p.id = s.paciente_id 
+                    AND s.aprovada_admin = 1 
+                    AND s.data_aprovacao BETWEEN ? AND ?
+                GROUP BY m.id, m.nome, e.nome
+                ORDER BY faturamento DESC
+            ''', (primeiro_dia, ultimo_dia))
+            
+            # Convert Row objects to JSON-serializable dictionaries
+            from sql_utils import rows_to_dicts
+            faturamento_por_medico = rows_to_dicts(cursor.fetchall())
+            
+            # Pagamentos de médicos externos e equipes, da mesma apuração
+            pagamentos_medicos = {
+                'mes_referencia': mes_referencia,
+                'total_medicos': len(relatorio_financeiro.get('pagamentos_individuais', [])),
+                'pagamentos_individuais': relatorio_financeiro.get('pagamentos_individuais', []),
+                'total_geral': relatorio_financeiro.get('total_pagamentos_externos', 0),
+                'total_geral_centavos': relatorio_financeiro.get('total_pagamentos_externos_centavos', 0)
+            }
+            total_pagamento_externos = pagamentos_medicos['total_geral']
+            total_pagamento_equipes = relatorio_financeiro.get('total_pagamentos_equipe', 0)
+            lucro_liquido = relatorio_financeiro.get('resultado_liquido', 0)
+            
+            return {'faturamento_bruto': faturamento_bruto,
+                    'faturamento_por_equipe': faturamento_por_equipe,
+                    'faturamento_por_medico': faturamento_por_medico,
+                    'pagamentos_medicos': pagamentos_medicos,
+                    'total_pagamento_equipes': total_pagamento_equipes,
+                    'total_pagamento_externos': total_pagamento_externos,
+                    'lucro_liquido': lucro_liquido}
+        
+        # Recalcula (e regrava os ledgers) só quando os dados do mês podem ter mudado
+        from cache_utils import em_cache
+        dados = em_cache('relatorios.admin_dashboard', (mes_referencia,), calcular, cursor)
+        
+        # Séries dos gráficos (incl. evolução mensal) vêm de /api/analytics depois da página
         return render_template('relatorios/admin_dashboard.html',
-                             faturamento_bruto=faturamento_bruto,
-                             faturamento_por_equipe=faturamento_por_equipe,
-                             faturamento_por_medico=faturamento_por_medico,
-                             pagamentos_medicos=pagamentos_medicos,
-                             total_pagamento_equipes=total_pagamento_equipes,
-                             total_pagamento_externos=total_pagamento_externos,
-                             lucro_liquido=lucro_liquido,
+                             **dados,
                              mes=mes, ano=ano, calendar=calendar)
 
+@relatorios_bp.route('/tendencias')
+def tendencias():
+    """Série mensal pré-agregada (12/24/36 meses) para os gráficos de tendência"""
+    if 'user_id' not in session or session.get('user_type') not in ['admin', 'admin_equipe']:
+        return jsonify({'status': 'error', 'message': 'Acesso negado'}), 403
+    
+    from rollup_utils import obter_tendencia_mensal
+    
+    meses = request.args.get('meses', 12, type=int)
+    meses = min(max(meses, 1), 120)
+    equipe_id = request.args.get('equipe_id', type=int)
+    medico_id = request.args.get('medico_id', type=int)
+    localizacao = request.args.get('localizacao')
+    
+    # Admin de equipe só enxerga a própria equipe
+    if session.get('user_type') == 'admin_equipe':
+        equipe_id = session.get('equipe_id')
+    
+    serie = obter_tendencia_mensal(meses=meses, mes_fim=request.args.get('mes_fim'),
+                                   equipe_id=equipe_id, medico_id=medico_id,
+                                   localizacao=localizacao)
+    return jsonify({'status': 'success', 'meses': meses, 'serie': serie})
+
 @relatorios_bp.route('/equipe')
 def equipe_dashboard():
     if 'user_id' not in session or session.get('user_type') not in ['admin_equipe', 'admin']:
@@ -132,51 +160,46 @@ def equipe_dashboard():
         primeiro_dia = f"{ano}-{mes:02d}-01"
         ultimo_dia = f"{ano}-{mes:02d}-{calendar.monthrange(ano, mes)[1]}"
         
-        # Informações da equipe
-        cursor.execute('SELECT nome, porcentagem_participacao FROM equipes WHERE id = ?', (equipe_id,))
-        equipe_info = cursor.fetchone()
-        
-        # Faturamento total da equipe
-        cursor.execute('''
-            SELECT 
-                COALESCE(SUM(s.valor), 0) as faturamento_bruto
-            FROM senhas s
-            JOIN pacientes p ON s.paciente_id = p.id
-            JOIN medicos m ON p.medico_id = m.id
-            WHERE m.equipe_id = ? AND s.aprovada_admin = 1
-            AND s.data_aprovacao BETWEEN ? AND ?
-        ''', (equipe_id, primeiro_dia, ultimo_dia))
-        
-        faturamento_bruto = cursor.fetchone()['faturamento_bruto']
-        
-        # Valor que a equipe receberá
-        valor_equipe = faturamento_bruto * equipe_info['porcentagem_participacao'] / 100
-        
-        # Faturamento por médico da equipe
-        cursor.execute('''
-            SELECT 
-                m.nome as medico_nome,
-                COUNT(DISTINCT s.id) as total_senhas,
-                COALESCE(SUM(s.valor), 0) as faturamento,
-                COUNT(DISTINCT p.id) as total_pacientes
-            FROM medicos m
-            LEFT JOIN pacientes p ON m.id = p.medico_id
-            LEFT JOIN senhas s ON p.id = s.paciente_id 
-                AND s.aprovada_admin = 1 
-                AND s.data_aprovacao BETWEEN ? AND ?
-            WHERE m.equipe_id = ?
-            GROUP BY m.id, m.nome
-            ORDER BY faturamento DESC
-        ''', (primeiro_dia, ultimo_dia, equipe_id))
-        
-        medicos_performance = cursor.fetchall()
-        
-        return render_template('relatorios/equipe_dashboard.html',
-                             equipe_info=equipe_info,
-                             faturamento_bruto=faturamento_bruto,
-                             valor_equipe=valor_equipe,
-                             medicos_performance=medicos_performance,
-                             mes=mes, ano=ano)
+        def calcular():
+            from sql_utils import rows_to_dicts, row_to_dict
+            
+            # Informações da equipe
+            cursor.execute('SELECT nome, porcentagem_participacao, porcentagem_pontos_base FROM equipes WHERE id = ?', (equipe_id,))
+            equipe_info = row_to_dict(cursor.fetchone())
+            
+            # Faturamento da equipe e valor que ela receberá, pelas regras de pagamento
+            from regras_pagamento import apurar_mes
+            apuracao = apurar_mes(cursor, f"{ano}-{mes:02d}")
+            pagamento = next((e for e in apuracao['equipes'] if e['equipe_id'] == int(equipe_id)), None)
+            faturamento_bruto = centavos_para_reais(pagamento['faturamento_base_centavos'] if pagamento else 0)
+            valor_equipe = centavos_para_reais(pagamento['valor_centavos'] if pagamento else 0)
+            
+            # Faturamento por médico da equipe
+            cursor.execute('''
+                SELECT 
+                    m.nome as medico_nome,
+                    COUNT(DISTINCT s.id) as total_senhas,
+                    COALESCE(SUM(s.valor_centavos), 0) / 100.0 as faturamento,
+                    COUNT(DISTINCT p.id) as total_pacientes
+                FROM medicos m
+                LEFT JOIN pacientes p ON m.id = p.medico_id
+                LEFT JOIN senhas s ON p.id = s.paciente_id 
+                    AND s.aprovada_admin = 1 
+                    AND s.data_aprovacao BETWEEN ? AND ?
+                WHERE m.equipe_id = ?
+                GROUP BY m.id, m.nome
+                ORDER BY faturamento DESC
+            ''', (primeiro_dia, ultimo_dia, equipe_id))
+            
+            medicos_performance = rows_to_dicts(cursor.fetchall())
+            
+            return {'equipe_info': equipe_info, 'faturamento_bruto': faturamento_bruto,
+                    'valor_equipe': valor_equipe, 'medicos_performance': medicos_performance}
+        
+        from cache_utils import em_cache
+        dados = em_cache('relatorios.equipe_dashboard', (int(equipe_id), primeiro_dia), calcular, cursor)
+        
+        return render_template('relatorios/equipe_dashboard.html', **dados, mes=mes, ano=ano)
 
 @relatorios_bp.route('/pagamentos_medicos')
 def pagamentos_medicos():
@@ -211,8 +234,13 @@ def pagamentos_medicos():
         # Visão geral de todos os médicos
         pagamentos_gerais = calcular_pagamentos_todos_medicos(mes_referencia)
         
+        # Favorecidos da remessa em aberto: o que "Marcar Todos como Pagos" envia
+        from exportacao_utils import iterar_remessa
+        remessa = [{'tipo': row['tipo'], 'favorecido_id': row['favorecido_id'], 'valor_centavos': row['valor_centavos']}
+                   for row in iterar_remessa(mes_referencia)]
+        
         return render_template('relatorios/pagamentos_medicos.html',
-                             pagamentos=pagamentos_gerais,
+                             pagamentos=pagamentos_gerais, remessa=remessa,
                              mes=mes, ano=ano, calendar=calendar)
 
 @relatorios_bp.route('/marcar_pagamento_efetuado', methods=['POST'])
@@ -235,6 +263,118 @@ def marcar_pagamento_efetuado():
     
     return jsonify({'status': 'error', 'message': 'Dados inválidos'})
 
+@relatorios_bp.route('/remessa_pagamentos')
+def remessa_pagamentos():
+    """Remessa de pagamentos do mês (médicos externos e equipes) em CSV ou CNAB, gerada em streaming"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return redirect(url_for('auth.login'))
+    
+    mes = request.args.get('mes', datetime.now().month)
+    ano = request.args.get('ano', datetime.now().year)
+    formato = request.args.get('formato', 'csv')
+    
+    try:
+        mes, ano = int(mes), int(ano)
+    except:
+        mes, ano = datetime.now().month, datetime.now().year
+    
+    mes_referencia = f"{ano}-{mes:02d}"
+    
+    # Atualiza os ledgers do mês antes de gerar a remessa
+    from financeiro_utils import gerar_relatorio_financeiro_completo
+    gerar_relatorio_financeiro_completo(mes_referencia)
+    
+    from exportacao_utils import gerar_remessa_csv, gerar_remessa_cnab
+    if formato == 'cnab':
+        gerador, mimetype, extensao = gerar_remessa_cnab(mes_referencia), 'text/plain', 'rem'
+    else:
+        gerador, mimetype, extensao = gerar_remessa_csv(mes_referencia), 'text/csv', 'csv'
+    
+    return Response(stream_with_context(gerador), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=remessa_pagamentos_{mes_referencia}.{extensao}'})
+
+@relatorios_bp.route('/marcar_remessa_paga', methods=['POST'])
+def marcar_remessa_paga():
+    """
+    Marca como pagos os favorecidos da remessa do mês (lista JSON de tipo, favorecido_id
+    e valor_centavos, as colunas da remessa CSV); só o que estava na remessa é marcado
+    """
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return redirect(url_for('auth.login'))
+    
+    mes_referencia = request.form.get('mes_referencia')
+    try:
+        favorecidos = [(f['tipo'], int(f['favorecido_id']), int(f['valor_centavos']))
+                       for f in json.loads(request.form.get('favorecidos') or '[]')]
+    except (ValueError, TypeError, KeyError):
+        favorecidos = []
+    if not mes_referencia or not favorecidos or any(f[0] not in ('medico', 'equipe') for f in favorecidos):
+        return jsonify({'status': 'error', 'message': 'Dados inválidos'})
+    
+    from financeiro_utils import marcar_pagamentos_mes_efetuados
+    marcados = marcar_pagamentos_mes_efetuados(mes_referencia, favorecidos)
+    
+    if marcados is None:
+        return jsonify({'status': 'error', 'message': 'Erro ao marcar pagamentos'})
+    
+    mensagem = f"{marcados['medicos']} lançamentos de médicos e {marcados['equipes']} de equipes marcados como pagos"
+    if marcados['divergentes']:
+        mensagem += (f". {len(marcados['divergentes'])} favorecido(s) mudaram desde a remessa e continuam em aberto: "
+                     "baixe a remessa novamente")
+    return jsonify({'status': 'success', 'message': mensagem, 'marcados': marcados})
+
+@relatorios_bp.route('/relatorio_impressao/exportar')
+def exportar_relatorio_impressao():
+    """Exporta (CSV/XLSX, em streaming) o faturamento e o pagamento por médico do mês"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return redirect(url_for('auth.login'))
+    
+    mes = request.args.get('mes', datetime.now().month)
+    ano = request.args.get('ano', datetime.now().year)
+    
+    try:
+        mes, ano = int(mes), int(ano)
+    except:
+        mes, ano = datetime.now().month, datetime.now().year
+    
+    mes_referencia = f"{ano}-{mes:02d}"
+    
+    # Pagamentos pelas regras (um valor por equipe/médico, pequeno); as linhas vêm em streaming
+    from regras_pagamento import apurar_mes
+    with get_db_connection() as conn:
+        apuracao = apurar_mes(conn.cursor(), mes_referencia)
+    pagamento_por_medico = {m['medico_id']: m['pagamento_centavos'] for m in apuracao['sessoes_medicos']}
+    pagamento_por_medico.update({m['medico_id']: m['valor_a_pagar_centavos'] for m in apuracao['medicos_equipe']})
+    
+    from exportacao_utils import iterar_consulta, resposta_exportacao
+    
+    def lotes_com_pagamento():
+        for lote in iterar_consulta('''
+            SELECT m.id as medico_id, m.nome as medico_nome,
+                   COALESCE(e.nome, 'Externo') as equipe_nome,
+                   COUNT(DISTINCT s.id) as sessoes_count,
+                   COALESCE(SUM(s.valor_centavos), 0) as faturamento_centavos
+            FROM medicos m
+            LEFT JOIN equipes e ON m.equipe_id = e.id
+            LEFT JOIN pacientes p ON m.id = p.medico_id
+            LEFT JOIN senhas s ON p.id = s.paciente_id 
+                AND s.aprovada_admin = 1 AND s.ativo = 1
+                AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) = ?
+            GROUP BY m.id, m.nome, e.nome
+            ORDER BY faturamento_centavos DESC
+        ''', (mes_referencia,)):
+            yield [dict(row, pagamento_centavos=pagamento_por_medico.get(row['medico_id'], 0)) for row in lote]
+    
+    colunas = [
+        ('medico_nome', 'Médico', 'texto'),
+        ('equipe_nome', 'Equipe', 'texto'),
+        ('sessoes_count', 'Senhas', 'numero'),
+        ('faturamento_centavos', 'Faturamento (R$)', 'centavos'),
+        ('pagamento_centavos', 'Pagamento (R$)', 'centavos'),
+    ]
+    return resposta_exportacao(f'relatorio_financeiro_{mes_referencia}', colunas, lotes_com_pagamento(),
+                               request.args.get('formato', 'csv'), 'Relatório Financeiro')
+
 @relatorios_bp.route('/relatorio_impressao')
 def relatorio_impressao():
     """Gera relatório financeiro detalhado para impressão em A4"""
@@ -253,118 +393,48 @@ def relatorio_impressao():
         except:
             mes, ano = datetime.now().month, datetime.now().year
         
-        primeiro_dia = f"{ano}-{mes:02d}-01"
-        ultimo_dia = f"{ano}-{mes:02d}-{calendar.monthrange(ano, mes)[1]}"
-        
-        # Faturamento bruto total
-        cursor.execute('''
-            SELECT 
-                COALESCE(SUM(s.valor), 0) as faturamento_bruto
-            FROM senhas s
-            WHERE s.aprovada_admin = 1
-            AND s.data_aprovacao BETWEEN ? AND ?
-        ''', (primeiro_dia, ultimo_dia))
-        
-        faturamento_bruto = cursor.fetchone()['faturamento_bruto']
-        
-        # Faturamento por equipe com detalhes
-        cursor.execute('''
-            SELECT 
-                e.nome as equipe_nome,
-                e.porcentagem_participacao,
-                COALESCE(SUM(s.valor), 0) as total_faturamento,
-                COUNT(DISTINCT m.id) as medicos_count,
-                COUNT(DISTINCT s.id) as sessoes_count,
-                COALESCE(SUM(s.valor) * e.porcentagem_participacao / 100, 0) as pagamento_equipe
-            FROM equipes e
-            LEFT JOIN medicos m ON e.id = m.equipe_id
-            LEFT JOIN pacientes p ON m.id = p.medico_id
-            LEFT JOIN senhas s ON p.id = s.paciente_id 
-                AND s.aprovada_admin = 1 
-                AND s.data_aprovacao BETWEEN ? AND ?
-            GROUP BY e.id, e.nome, e.porcentagem_participacao
-            ORDER BY total_faturamento DESC
-        ''', (primeiro_dia, ultimo_dia))
-        
-        from sql_utils import rows_to_dicts
-        faturamento_por_equipe = rows_to_dicts(cursor.fetchall())
-        
-        # Faturamento por médico com detalhes e pagamentos corretos
-        cursor.execute('''
-            SELECT 
-                m.nome as medico_nome,
-                COALESCE(e.nome, 'Externo') as equipe_nome,
-                COALESCE(SUM(s.valor), 0) as faturamento,
-                COUNT(DISTINCT s.id) as sessoes_count,
-                COUNT(DISTINCT CASE WHEN s.tipo = 'teste_neuropsicologico' AND s.aprovada_admin = 1 THEN s.id END) as laudos_fechados,
-                CASE 
-                    WHEN e.nome IS NULL THEN 
-                        CASE 
-                            WHEN COUNT(DISTINCT CASE WHEN s.tipo = 'teste_neuropsicologico' AND s.aprovada_admin = 1 THEN s.id END) > 0 THEN
-                                -- Se fechou laudo, recebe R$ 128 TOTAL pelo laudo finalizado
-                                128.0
-                            ELSE 
-                                -- Se não fechou laudo, recebe valor por sessão realizada
-                                COALESCE(COUNT(DISTINCT s.id) * 16.0, 0)
-                        END
-                    ELSE 0
-                END as pagamento_medico
-            FROM medicos m
-            LEFT JOIN equipes e ON m.equipe_id = e.id
-            LEFT JOIN pacientes p ON m.id = p.medico_id
-            LEFT JOIN senhas s ON p.id = s.paciente_id 
-                AND s.aprovada_admin = 1 
-                AND s.data_aprovacao BETWEEN ? AND ?
-            GROUP BY m.id, m.nome, e.nome
-            ORDER BY faturamento DESC
-        ''', (primeiro_dia, ultimo_dia))
-        
-        faturamento_por_medico = rows_to_dicts(cursor.fetchall()) or []
-        
-        # Cálculos de totais com tratamento de valores None
-        faturamento_externos = 0
-        faturamento_equipes = 0
-        total_pagamento_externos = 0
-        total_pagamento_equipes = 0
-        
-        # Calculate external doctors totals
-        for m in faturamento_por_medico:
-            if m and isinstance(m, dict) and m.get('equipe_nome') == 'Externo':
-                faturamento_externos += float(m.get('faturamento', 0) or 0)
-                total_pagamento_externos += float(m.get('pagamento_medico', 0) or 0)
-        
-        # Calculate team totals
-        for e in faturamento_por_equipe:
-            if e and isinstance(e, dict) and e.get('equipe_nome') != 'Externo' and e.get('equipe_nome'):
-                faturamento_equipes += float(e.get('total_faturamento', 0) or 0)
-                total_pagamento_equipes += float(e.get('pagamento_equipe', 0) or 0)
-        
-        lucro_liquido = faturamento_bruto - (total_pagamento_externos + total_pagamento_equipes)
-        
-        # Lista de equipes para organização
-        equipes_nomes = []
-        for e in faturamento_por_equipe:
-            if e and isinstance(e, dict) and e.get('equipe_nome') and e.get('equipe_nome') != 'Externo':
-                nome = e.get('equipe_nome')
-                if nome not in equipes_nomes:
-                    equipes_nomes.append(nome)
-        
-        # Formatação de datas
-        meses_nomes = ['', 'Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
-                      'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
-        data_relatorio = f"{meses_nomes[mes]} de {ano}"
+        from relatorio_pdf import montar_dados_relatorio
+        dados = montar_dados_relatorio(cursor, mes, ano)
         data_geracao = datetime.now().strftime("%d/%m/%Y às %H:%M")
         
-        return render_template('relatorios/relatorio_impressao.html',
-                             faturamento_bruto=faturamento_bruto,
-                             faturamento_por_equipe=faturamento_por_equipe,
-                             faturamento_por_medico=faturamento_por_medico,
-                             faturamento_externos=faturamento_externos,
-                             faturamento_equipes=faturamento_equipes,
-                             total_pagamento_externos=total_pagamento_externos,
-                             total_pagamento_equipes=total_pagamento_equipes,
-                             lucro_liquido=lucro_liquido,
-                             equipes_nomes=equipes_nomes,
-                             data_relatorio=data_relatorio,
-                             data_geracao=data_geracao,
-                             mes=mes, ano=ano)
\ No newline at end of file
+        return render_template('relatorios/relatorio_impressao.html', data_geracao=data_geracao, **dados)
+
+@relatorios_bp.route('/relatorio_impressao/pdf')
+def relatorio_impressao_pdf():
+    """PDF do relatório financeiro, gerado uma vez por mês/versão dos dados e servido do cache"""
+    if 'user_id' not in session or session.get('user_type') != 'admin':
+        return redirect(url_for('auth.login'))
+    
+    mes = request.args.get('mes', datetime.now().month)
+    ano = request.args.get('ano', datetime.now().year)
+    
+    try:
+        mes, ano = int(mes), int(ano)
+    except:
+        mes, ano = datetime.now().month, datetime.now().year
+    if not 1 <= mes <= 12:
+        return jsonify({'erro': 'Mês inválido'}), 400
+    
+    mes_referencia = f"{ano}-{mes:02d}"
+    
+    from relatorio_pdf import obter_pdf_relatorio
+    try:
+        situacao, caminho, hash_conteudo = obter_pdf_relatorio(mes_referencia)
+    except Exception as e:
+        logging.error(f"Erro ao obter PDF do relatório {mes_referencia}: {e}")
+        return jsonify({'erro': 'Erro ao gerar o PDF do relatório'}), 500
+    
+    if situacao == 'erro':
+        return jsonify({'erro': 'Erro ao gerar o PDF do relatório'}), 500
+    if situacao != 'pronto':
+        # Renderização em andamento no pool de processos: o cliente tenta de novo
+        resposta = jsonify({'status': 'gerando', 'mensagem': 'O PDF está sendo gerado, tente novamente em instantes'})
+        resposta.status_code = 202
+        resposta.headers['Retry-After'] = '2'
+        return resposta
+    
+    # Conteúdo imutável para o hash: ETag forte e revalidação condicional (304)
+    resposta = send_file(caminho, mimetype='application/pdf', conditional=True, etag=hash_conteudo,
+                         download_name=f'relatorio_financeiro_{mes_referencia}.pdf', max_age=0)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
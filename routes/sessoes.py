@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from database import get_db_connection
+from database import get_db_connection, get_config
 from datetime import datetime
 import logging
 
@@ -100,9 +100,10 @@ def criar_sessao():
             result = cursor.fetchone()
             next_sessao = (result['count'] if result else 0) + 1
             
-            # Check if patient already has 8 sessions
-            if next_sessao > 8:
-                flash('Paciente já possui o máximo de 8 sessões', 'error')
+            # Check the configured maximum of sessions per patient
+            sessoes_max = int(get_config('sessoes_max', '8'))
+            if next_sessao > sessoes_max:
+                flash(f'Paciente já possui o máximo de {sessoes_max} sessões', 'error')
                 return redirect(url_for('medico.pacientes'))
             
             # Create session
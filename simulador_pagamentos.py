@@ -0,0 +1,248 @@
+"""
+What-if simulator for team percentages, per-session values and the 8-session guarantee
+
+The month range is loaded once into NumPy integer matrices (centavos and session
+counts per equipe/médico x mês); each scenario is then evaluated with broadcasting
+only, so dozens of parameter sets over years of history take milliseconds.
+Nothing is written to the database.
+
+Regras (as de regras_pagamento; o cenário atual usa os parâmetros compilados de lá):
+- Equipe recebe porcentagem_participacao do faturamento das senhas aprovadas dos seus médicos
+- Médico externo recebe valor_sessao por sessão realizada, exceto no mês de início do
+  paciente com laudo liberado nesse mesmo mês, quando recebe as sessões garantidas
+"""
+import logging
+from datetime import datetime
+import numpy as np
+from database import get_db_connection
+from dinheiro_utils import para_centavos, para_pontos_base, centavos_para_reais, pontos_base_para_percentual
+from regras_pagamento import obter_regras
+from rollup_utils import meses_entre
+
+
+def carregar_base_simulacao(mes_inicio, mes_fim=None):
+    """
+    Carrega o histórico do período em matrizes NumPy (uma leitura do banco por simulação).
+    Retorna dict com índices de equipes/médicos/meses e as matrizes agregadas.
+    """
+    if not mes_fim:
+        mes_fim = datetime.now().strftime('%Y-%m')
+    meses = meses_entre(mes_inicio, mes_fim)
+    if not meses:
+        raise ValueError('Período inválido')
+    idx_mes = {mes: i for i, mes in enumerate(meses)}
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        regras = obter_regras(cursor)
+
+        cursor.execute('''
+            SELECT id, nome, porcentagem_participacao, porcentagem_pontos_base
+            FROM equipes WHERE ativo = 1 ORDER BY nome
+        ''')
+        equipes = [dict(row) for row in cursor.fetchall()]
+
+        cursor.execute('''
+            SELECT id, nome, valor_sessao, valor_sessao_centavos
+            FROM medicos WHERE ativo = 1 AND equipe_id IS NULL ORDER BY nome
+        ''')
+        medicos = [dict(row) for row in cursor.fetchall()]
+
+        idx_equipe = {e['id']: i for i, e in enumerate(equipes)}
+        idx_medico = {m['id']: i for i, m in enumerate(medicos)}
+
+        # Senhas aprovadas do período (faturamento da clínica e base das equipes)
+        cursor.execute('''
+            SELECT strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) as mes,
+                   m.equipe_id, COALESCE(s.valor_centavos, 0) as valor_centavos
+            FROM senhas s
+            JOIN pacientes p ON s.paciente_id = p.id
+            LEFT JOIN medicos m ON p.medico_id = m.id
+            WHERE s.ativo = 1 AND s.aprovada_admin = 1
+            AND strftime('%Y-%m', COALESCE(s.data_aprovacao, s.data_criacao)) BETWEEN ? AND ?
+        ''', (meses[0], meses[-1]))
+        senhas = cursor.fetchall()
+
+        # Pacientes ativos dos médicos externos com a elegibilidade à garantia
+        cursor.execute('''
+            SELECT p.id, p.medico_id, substr(p.data_criacao, 1, 7) as mes_inicio,
+                   EXISTS (
+                       SELECT 1 FROM laudos l
+                       WHERE l.paciente_id = p.id AND l.liberado_entrega = 1
+                       AND substr(l.data_liberacao, 1, 7) = substr(p.data_criacao, 1, 7)
+                   ) as laudo_mes_inicio
+            FROM pacientes p
+            JOIN medicos m ON p.medico_id = m.id
+            WHERE m.ativo = 1 AND m.equipe_id IS NULL AND p.status = 'ativo'
+        ''')
+        pacientes = cursor.fetchall()
+
+        cursor.execute('''
+            SELECT se.paciente_id, substr(se.data_sessao, 1, 7) as mes, COUNT(*) as total
+            FROM sessoes se
+            JOIN pacientes p ON se.paciente_id = p.id
+            JOIN medicos m ON p.medico_id = m.id
+            WHERE se.realizada = 1 AND m.equipe_id IS NULL
+            AND substr(se.data_sessao, 1, 7) BETWEEN ? AND ?
+            GROUP BY se.paciente_id, substr(se.data_sessao, 1, 7)
+        ''', (meses[0], meses[-1]))
+        sessoes = cursor.fetchall()
+
+    n_meses, n_equipes, n_medicos = len(meses), len(equipes), len(medicos)
+
+    # Faturamento (centavos) total e por equipe x mês
+    receita_mes = np.zeros(n_meses, dtype=np.int64)
+    receita_equipe = np.zeros((n_equipes, n_meses), dtype=np.int64)
+    if senhas:
+        mes_s = np.array([idx_mes[r['mes']] for r in senhas], dtype=np.int64)
+        valor_s = np.array([r['valor_centavos'] for r in senhas], dtype=np.int64)
+        equipe_s = np.array([idx_equipe.get(r['equipe_id'], -1) for r in senhas], dtype=np.int64)
+        np.add.at(receita_mes, mes_s, valor_s)
+        da_equipe = equipe_s >= 0
+        np.add.at(receita_equipe, (equipe_s[da_equipe], mes_s[da_equipe]), valor_s[da_equipe])
+
+    # Sessões por médico x mês, separando os meses elegíveis à garantia
+    sessoes_normais = np.zeros((n_medicos, n_meses), dtype=np.int64)
+    sessoes_elegiveis = np.zeros((n_medicos, n_meses), dtype=np.int64)
+    elegiveis = np.zeros((n_medicos, n_meses), dtype=np.int64)
+
+    pacientes_por_id = {p['id']: p for p in pacientes}
+    for p in pacientes:
+        if p['laudo_mes_inicio'] and p['mes_inicio'] in idx_mes:
+            elegiveis[idx_medico[p['medico_id']], idx_mes[p['mes_inicio']]] += 1
+
+    for s in sessoes:
+        p = pacientes_por_id.get(s['paciente_id'])
+        if not p:
+            continue
+        i, j = idx_medico[p['medico_id']], idx_mes[s['mes']]
+        if p['laudo_mes_inicio'] and p['mes_inicio'] == s['mes']:
+            sessoes_elegiveis[i, j] += s['total']
+        else:
+            sessoes_normais[i, j] += s['total']
+
+    return {
+        'meses': meses,
+        'equipes': equipes,
+        'medicos': medicos,
+        'receita_mes': receita_mes,
+        'receita_equipe': receita_equipe,
+        'sessoes_normais': sessoes_normais,
+        'sessoes_elegiveis': sessoes_elegiveis,
+        'elegiveis': elegiveis,
+        'regras': regras,
+    }
+
+
+def cenario_atual(base):
+    """Parâmetros atualmente cadastrados (ponto de comparação das simulações)"""
+    regras = base['regras']
+    return {
+        'nome': 'Atual',
+        'porcentagens': {e['id']: pontos_base_para_percentual(e['porcentagem_pontos_base']) for e in base['equipes']},
+        'valores_sessao': {m['id']: centavos_para_reais(regras['valor_sessao_centavos'](m['valor_sessao_centavos']))
+                           for m in base['medicos']},
+        'sessoes_garantidas': regras['config']['sessoes_garantidas'] if regras['config']['garantia_8_sessoes'] else 0,
+    }
+
+
+def variar_porcentagem_equipes(base, percentuais, cenario=None):
+    """Gera um cenário por percentual, aplicando o mesmo percentual a todas as equipes"""
+    cenario = cenario or cenario_atual(base)
+    return [
+        dict(cenario, nome=f"{p:g}%", porcentagens={e['id']: p for e in base['equipes']})
+        for p in percentuais
+    ]
+
+
+def simular_cenarios(base, cenarios):
+    """
+    Avalia vários cenários de uma vez. Cada cenário é um dict com 'porcentagens'
+    {equipe_id: %}, 'valores_sessao' {medico_id: R$} e 'sessoes_garantidas'
+    (0 desliga a garantia); valores ausentes usam o cadastro atual.
+    """
+    atual = cenario_atual(base)
+    equipes, medicos = base['equipes'], base['medicos']
+
+    # Parâmetros empilhados: cenários x equipes / cenários x médicos
+    bp = np.array([
+        [para_pontos_base(c.get('porcentagens', {}).get(e['id'], atual['porcentagens'][e['id']])) for e in equipes]
+        for c in cenarios
+    ], dtype=np.int64).reshape(len(cenarios), len(equipes))
+    valor_sessao = np.array([
+        [para_centavos(c.get('valores_sessao', {}).get(m['id'], atual['valores_sessao'][m['id']])) for m in medicos]
+        for c in cenarios
+    ], dtype=np.int64).reshape(len(cenarios), len(medicos))
+    garantia = np.array([int(c.get('sessoes_garantidas', atual['sessoes_garantidas'])) for c in cenarios], dtype=np.int64)
+
+    # Equipes: percentual em pontos base com arredondamento meio-para-cima por equipe/mês
+    pagamento_equipes = (base['receita_equipe'][None, :, :] * bp[:, :, None] + 5000) // 10000
+
+    # Externos: sessões realizadas, ou as garantidas nos meses elegíveis
+    g = garantia[:, None, None]
+    sessoes_pagas = base['sessoes_normais'][None] + np.where(
+        g > 0, base['elegiveis'][None] * g, base['sessoes_elegiveis'][None])
+    pagamento_externos = sessoes_pagas * valor_sessao[:, :, None]
+
+    equipes_mes = pagamento_equipes.sum(axis=1)
+    externos_mes = pagamento_externos.sum(axis=1)
+    resultado_mes = base['receita_mes'][None, :] - equipes_mes - externos_mes
+
+    resultados = []
+    for k, cenario in enumerate(cenarios):
+        total_equipes = int(equipes_mes[k].sum())
+        total_externos = int(externos_mes[k].sum())
+        total_receita = int(base['receita_mes'].sum())
+        resultados.append({
+            'nome': cenario.get('nome', f"Cenário {k + 1}"),
+            'sessoes_garantidas': int(garantia[k]),
+            'total_receita': centavos_para_reais(total_receita),
+            'total_equipes': centavos_para_reais(total_equipes),
+            'total_externos': centavos_para_reais(total_externos),
+            'resultado_liquido': centavos_para_reais(total_receita - total_equipes - total_externos),
+            'total_equipes_centavos': total_equipes,
+            'total_externos_centavos': total_externos,
+            'resultado_liquido_centavos': total_receita - total_equipes - total_externos,
+            'por_mes': [
+                {
+                    'mes_referencia': mes,
+                    'receita': centavos_para_reais(int(base['receita_mes'][j])),
+                    'equipes': centavos_para_reais(int(equipes_mes[k, j])),
+                    'externos': centavos_para_reais(int(externos_mes[k, j])),
+                    'resultado': centavos_para_reais(int(resultado_mes[k, j])),
+                }
+                for j, mes in enumerate(base['meses'])
+            ],
+            'por_equipe': [
+                {
+                    'equipe_id': e['id'],
+                    'nome': e['nome'],
+                    'porcentagem': pontos_base_para_percentual(int(bp[k, i])),
+                    'faturamento': centavos_para_reais(int(base['receita_equipe'][i].sum())),
+                    'valor': centavos_para_reais(int(pagamento_equipes[k, i].sum())),
+                }
+                for i, e in enumerate(equipes)
+            ],
+            'por_medico': [
+                {
+                    'medico_id': m['id'],
+                    'nome': m['nome'],
+                    'valor_sessao': centavos_para_reais(int(valor_sessao[k, i])),
+                    'sessoes_pagas': int(sessoes_pagas[k, i].sum()),
+                    'valor': centavos_para_reais(int(pagamento_externos[k, i].sum())),
+                }
+                for i, m in enumerate(medicos)
+            ],
+        })
+
+    return resultados
+
+
+def simular(mes_inicio, mes_fim=None, cenarios=None):
+    """Atalho: carrega o período e avalia o cenário atual seguido dos cenários informados"""
+    try:
+        base = carregar_base_simulacao(mes_inicio, mes_fim)
+        return simular_cenarios(base, [cenario_atual(base)] + list(cenarios or []))
+    except Exception as e:
+        logging.error(f"Erro na simulação de pagamentos: {e}")
+        return []
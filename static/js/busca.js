@@ -0,0 +1,97 @@
+// Patient typeahead for the navigation bar (/busca/pacientes)
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('[data-busca-pacientes]').forEach(iniciarBuscaPacientes);
+});
+
+const ROTULOS_ORIGEM = { sessao: 'Sessão', laudo: 'Laudo' };
+
+function escaparHtml(texto) {
+    const div = document.createElement('div');
+    div.textContent = texto == null ? '' : texto;
+    return div.innerHTML;
+}
+
+// Trecho do servidor: \x02 ... \x03 marcam os termos encontrados
+function destacarTrecho(trecho) {
+    return escaparHtml(trecho).replace(/\x02/g, '<mark>').replace(/\x03/g, '</mark>');
+}
+
+function iniciarBuscaPacientes(campo) {
+    const menu = document.querySelector(campo.dataset.buscaPacientes);
+    const url = campo.dataset.url;
+    let temporizador = null;
+    let controlador = null;
+    let selecionado = -1;
+
+    function fechar() {
+        menu.classList.remove('show');
+        selecionado = -1;
+    }
+
+    function renderizar(resultados) {
+        if (!resultados.length) {
+            menu.innerHTML = '<span class="dropdown-item-text text-muted small">Nenhum paciente encontrado</span>';
+        } else {
+            menu.innerHTML = resultados.map(r => {
+                const nome = r.origem === 'paciente' && r.trecho ? destacarTrecho(r.trecho) : escaparHtml(r.nome);
+                const detalhe = r.origem !== 'paciente'
+                    ? `<div class="small text-muted">${ROTULOS_ORIGEM[r.origem]}: ${destacarTrecho(r.trecho)}</div>` : '';
+                const conteudo = `<strong>${nome}</strong>
+                    <div class="small text-muted">${escaparHtml(r.cpf)} · ${escaparHtml(r.medico_nome || '')}</div>${detalhe}`;
+                return r.url
+                    ? `<a class="dropdown-item text-wrap" href="${escaparHtml(r.url)}">${conteudo}</a>`
+                    : `<span class="dropdown-item-text text-wrap">${conteudo}</span>`;
+            }).join('');
+        }
+        selecionado = -1;
+        menu.classList.add('show');
+    }
+
+    async function buscar(texto) {
+        if (controlador) controlador.abort();
+        controlador = new AbortController();
+        try {
+            const resposta = await fetch(`${url}?q=${encodeURIComponent(texto)}`, {
+                credentials: 'same-origin',
+                signal: controlador.signal
+            });
+            if (!resposta.ok) throw new Error(`HTTP ${resposta.status}`);
+            const dados = await resposta.json();
+            // Ignora respostas de um texto que já foi alterado
+            if (dados.q === campo.value.trim()) renderizar(dados.resultados);
+        } catch (erro) {
+            if (erro.name !== 'AbortError') console.error('Erro na busca de pacientes:', erro);
+        }
+    }
+
+    campo.addEventListener('input', function() {
+        clearTimeout(temporizador);
+        const texto = campo.value.trim();
+        if (texto.length < 2) {
+            if (controlador) controlador.abort();
+            fechar();
+            return;
+        }
+        temporizador = setTimeout(() => buscar(texto), 150);
+    });
+
+    campo.addEventListener('keydown', function(evento) {
+        const itens = menu.querySelectorAll('a.dropdown-item');
+        if (evento.key === 'Escape') {
+            fechar();
+        } else if ((evento.key === 'ArrowDown' || evento.key === 'ArrowUp') && itens.length) {
+            evento.preventDefault();
+            selecionado = (selecionado + (evento.key === 'ArrowDown' ? 1 : itens.length - 1)) % itens.length;
+            itens.forEach((item, i) => item.classList.toggle('active', i === selecionado));
+        } else if (evento.key === 'Enter') {
+            evento.preventDefault();
+            const item = itens[Math.max(selecionado, 0)];
+            if (item) window.location.href = item.href;
+        }
+    });
+
+    document.addEventListener('click', function(evento) {
+        if (!menu.contains(evento.target) && evento.target !== campo) fechar();
+    });
+}
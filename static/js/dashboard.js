@@ -80,9 +80,9 @@ function loadDashboardData() {
     // Update real-time statistics
     updateStatistics();
     
-    // Initialize charts if Chart.js is available
+    // Charts are fetched from /api/analytics after the first paint
     if (typeof Chart !== 'undefined') {
-        initializeCharts();
+        aposPrimeiraPintura(initializeCharts);
     }
     
     // Load recent activities
@@ -145,13 +145,13 @@ function initializeCharts() {
     // Financial chart
     const financialChart = document.getElementById('financialChart');
     if (financialChart) {
-        createFinancialChart(financialChart);
+        quandoVisivel(financialChart, createFinancialChart);
     }
     
     // Performance chart
     const performanceChart = document.getElementById('performanceChart');
     if (performanceChart) {
-        createPerformanceChart(performanceChart);
+        quandoVisivel(performanceChart, createPerformanceChart);
     }
     
     // Tax chart
@@ -162,22 +162,24 @@ function initializeCharts() {
 }
 
 // Create financial chart
-function createFinancialChart(canvas) {
+async function createFinancialChart(canvas) {
     if (typeof Chart === 'undefined') {
         console.warn('Chart.js not available');
         return;
     }
     
     const ctx = canvas.getContext('2d');
+    const serie = await buscarAnalytics('evolucao_mensal', { meses: canvas.dataset.meses || 6 });
+    if (!serie) return;
     
     // Chart configuration
     const config = {
         type: 'line',
         data: {
-            labels: ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun'],
+            labels: serie.meses.map(formatarMesCurto),
             datasets: [{
                 label: 'Faturamento',
-                data: [12000, 19000, 15000, 25000, 22000, 30000],
+                data: serie.receita,
                 borderColor: 'rgb(13, 110, 253)',
                 backgroundColor: 'rgba(13, 110, 253, 0.1)',
                 tension: 0.4
@@ -216,16 +218,19 @@ function createFinancialChart(canvas) {
 }
 
 // Create performance chart
-function createPerformanceChart(canvas) {
+async function createPerformanceChart(canvas) {
     const ctx = canvas.getContext('2d');
+    const dados = await buscarAnalytics('faturamento_medicos');
+    if (!dados) return;
+    const medicos = dados.medicos.slice(0, 4);
     
     const config = {
         type: 'bar',
         data: {
-            labels: ['Dr. Silva', 'Dr. Santos', 'Dr. Oliveira', 'Dr. Costa'],
+            labels: medicos.map(m => m.medico_nome),
             datasets: [{
-                label: 'Pacientes Atendidos',
-                data: [25, 30, 20, 35],
+                label: 'Faturamento (R$)',
+                data: medicos.map(m => m.faturamento),
                 backgroundColor: [
                     'rgba(40, 167, 69, 0.8)',
                     'rgba(13, 110, 253, 0.8)',
@@ -435,6 +440,125 @@ function formatDate(date) {
     return new Intl.DateTimeFormat('pt-BR').format(new Date(date));
 }
 
+// Fetch a chart series from the analytics API. Responses carry an ETag and
+// Cache-Control: no-cache, so the browser revalidates and reuses its copy on 304.
+async function buscarAnalytics(serie, params = {}) {
+    const url = new URL(`/api/analytics/${serie}`, window.location.origin);
+    Object.entries(params).forEach(([chave, valor]) => {
+        if (valor !== undefined && valor !== null && valor !== '') {
+            url.searchParams.set(chave, valor);
+        }
+    });
+    
+    try {
+        const response = await fetch(url, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return await response.json();
+    } catch (error) {
+        console.error(`Error loading analytics series ${serie}:`, error);
+        return null;
+    }
+}
+
+// Run after the page has been painted (charts never delay the first render)
+function aposPrimeiraPintura(callback) {
+    requestAnimationFrame(() => {
+        if ('requestIdleCallback' in window) {
+            requestIdleCallback(() => callback(), { timeout: 500 });
+        } else {
+            setTimeout(callback, 0);
+        }
+    });
+}
+
+// Call callback(element) once the element scrolls into view
+function quandoVisivel(element, callback) {
+    if (!('IntersectionObserver' in window)) {
+        callback(element);
+        return;
+    }
+    const observer = new IntersectionObserver((entries) => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            observer.disconnect();
+            callback(element);
+        }
+    }, { rootMargin: '200px 0px' });
+    observer.observe(element);
+}
+
+// 'YYYY-MM' -> 'Ago/25'
+function formatarMesCurto(mesReferencia) {
+    const nomesMeses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez'];
+    const [ano, mes] = mesReferencia.split('-');
+    return `${nomesMeses[parseInt(mes, 10) - 1]}/${ano.slice(2)}`;
+}
+
+// Live metrics: Server-Sent Events from /api/analytics/ao_vivo/stream, falling back to
+// long-poll when EventSource is unavailable or the stream keeps failing (e.g. a buffering proxy).
+// Only changed metrics arrive; aoAtualizar receives {metrica: valor}.
+function assinarMetricasAoVivo(aoAtualizar = atualizarMetricasAoVivo) {
+    let cursor = null;
+    
+    const longPoll = async () => {
+        while (true) {
+            try {
+                const url = new URL('/api/analytics/ao_vivo', window.location.origin);
+                if (cursor) {
+                    url.searchParams.set('cursor', cursor);
+                }
+                const response = await fetch(url, { credentials: 'same-origin', cache: 'no-store' });
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                const dados = await response.json();
+                cursor = dados.cursor;
+                if (Object.keys(dados.metricas).length) {
+                    aoAtualizar(dados.metricas);
+                }
+            } catch (error) {
+                console.error('Error polling live metrics:', error);
+                await new Promise(resolve => setTimeout(resolve, 10000));
+            }
+        }
+    };
+    
+    if (!('EventSource' in window)) {
+        longPoll();
+        return;
+    }
+    
+    let falhas = 0;
+    const fonte = new EventSource('/api/analytics/ao_vivo/stream');
+    fonte.addEventListener('open', () => {
+        falhas = 0;
+    });
+    fonte.addEventListener('metricas', event => {
+        cursor = event.lastEventId;
+        aoAtualizar(JSON.parse(event.data));
+    });
+    fonte.addEventListener('error', () => {
+        falhas += 1;
+        if (falhas >= 3) {
+            fonte.close();
+            longPoll();
+        }
+    });
+}
+
+// Default renderer: elements marked data-metrica="<nome>" (data-formato="moeda" for BRL)
+function atualizarMetricasAoVivo(metricas) {
+    Object.entries(metricas).forEach(([nome, valor]) => {
+        document.querySelectorAll(`[data-metrica="${nome}"]`).forEach(element => {
+            element.textContent = element.dataset.formato === 'moeda' ? formatCurrency(valor) : valor;
+            element.classList.remove('metrica-atualizada');
+            void element.offsetWidth;
+            element.classList.add('metrica-atualizada');
+        });
+    });
+}
+
 // Export functions for use in other scripts
 window.DashboardUtils = {
     showNotification,
@@ -442,5 +566,11 @@ window.DashboardUtils = {
     formatDate,
     animateNumber,
     filterTable,
-    sortTable
+    sortTable,
+    buscarAnalytics,
+    aposPrimeiraPintura,
+    quandoVisivel,
+    formatarMesCurto,
+    assinarMetricasAoVivo,
+    atualizarMetricasAoVivo
 };
@@ -17,9 +17,9 @@ function initializeFinancialModule() {
         });
     });
 
-    // Initialize financial charts
+    // Initialize financial charts after the first paint (data comes from /api/analytics)
     if (typeof Chart !== 'undefined') {
-        initializeFinancialCharts();
+        requestAnimationFrame(() => setTimeout(initializeFinancialCharts, 0));
     }
 
     // Setup auto-calculation forms
@@ -103,28 +103,58 @@ function initializeFinancialCharts() {
     }
 }
 
+// Analytics API series (shared helper from dashboard.js when it is loaded)
+function buscarSerieFinanceira(serie, params = {}) {
+    if (window.DashboardUtils && window.DashboardUtils.buscarAnalytics) {
+        return window.DashboardUtils.buscarAnalytics(serie, params);
+    }
+    const query = new URLSearchParams(params).toString();
+    return fetch(`/api/analytics/${serie}${query ? '?' + query : ''}`, { credentials: 'same-origin' })
+        .then(response => response.ok ? response.json() : null)
+        .catch(() => null);
+}
+
+// Selected month 'YYYY-MM' (month selector or ?mes=), defaulting to the current month
+function mesSelecionado() {
+    const valor = document.getElementById('monthSelector')?.value
+        || new URL(window.location).searchParams.get('mes');
+    if (valor && /^\d{4}-\d{2}$/.test(valor)) {
+        return valor;
+    }
+    const hoje = new Date();
+    return `${hoje.getFullYear()}-${String(hoje.getMonth() + 1).padStart(2, '0')}`;
+}
+
+// 'YYYY-MM' -> { mes, ano } query parameters of the analytics API
+function parametrosMes(mesReferencia) {
+    const [ano, mes] = mesReferencia.split('-');
+    return { mes: parseInt(mes, 10), ano: parseInt(ano, 10) };
+}
+
+function rotuloMes(mesReferencia) {
+    const nomesMeses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez'];
+    const [ano, mes] = mesReferencia.split('-');
+    return `${nomesMeses[parseInt(mes, 10) - 1]}/${ano.slice(2)}`;
+}
+
 // Create revenue trend chart
-function createRevenueTrendChart(canvas) {
+async function createRevenueTrendChart(canvas) {
     const ctx = canvas.getContext('2d');
+    const serie = await buscarSerieFinanceira('evolucao_mensal', { meses: 6, mes_fim: mesSelecionado() });
+    if (!serie) return;
     
-    new Chart(ctx, {
+    window.financialCharts = window.financialCharts || {};
+    window.financialCharts.revenueTrend = new Chart(ctx, {
         type: 'line',
         data: {
-            labels: ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun'],
+            labels: serie.meses.map(rotuloMes),
             datasets: [{
                 label: 'Faturamento Bruto',
-                data: [45000, 52000, 48000, 61000, 58000, 67000],
+                data: serie.receita,
                 borderColor: '#0d6efd',
                 backgroundColor: 'rgba(13, 110, 253, 0.1)',
                 tension: 0.4,
                 fill: true
-            }, {
-                label: 'Faturamento Líquido',
-                data: [31500, 36400, 33600, 42700, 40600, 46900],
-                borderColor: '#198754',
-                backgroundColor: 'rgba(25, 135, 84, 0.1)',
-                tension: 0.4,
-                fill: true
             }]
         },
         options: {
@@ -199,16 +229,20 @@ function createTaxDistributionChart(canvas) {
 }
 
 // Create team performance chart
-function createTeamPerformanceChart(canvas) {
+async function createTeamPerformanceChart(canvas) {
     const ctx = canvas.getContext('2d');
+    const dados = await buscarSerieFinanceira('faturamento_equipes', parametrosMes(mesSelecionado()));
+    if (!dados) return;
+    const equipes = dados.equipes.slice(0, 4);
     
-    new Chart(ctx, {
+    window.financialCharts = window.financialCharts || {};
+    window.financialCharts.teamPerformance = new Chart(ctx, {
         type: 'bar',
         data: {
-            labels: ['Equipe Alpha', 'Equipe Beta', 'Equipe Gamma', 'Independentes'],
+            labels: equipes.map(e => e.equipe_nome),
             datasets: [{
                 label: 'Faturamento (R$)',
-                data: [85000, 72000, 96000, 45000],
+                data: equipes.map(e => e.faturamento),
                 backgroundColor: [
                     'rgba(13, 110, 253, 0.8)',
                     'rgba(25, 135, 84, 0.8)',
@@ -251,20 +285,24 @@ function createTeamPerformanceChart(canvas) {
 }
 
 // Create monthly comparison chart
-function createMonthlyComparisonChart(canvas) {
+async function createMonthlyComparisonChart(canvas) {
     const ctx = canvas.getContext('2d');
+    // 18 months: the last 6 and the same 6 months one year earlier
+    const serie = await buscarSerieFinanceira('evolucao_mensal', { meses: 18, mes_fim: mesSelecionado() });
+    if (!serie) return;
     
-    new Chart(ctx, {
+    window.financialCharts = window.financialCharts || {};
+    window.financialCharts.monthlyComparison = new Chart(ctx, {
         type: 'bar',
         data: {
-            labels: ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun'],
+            labels: serie.meses.slice(12).map(rotuloMes),
             datasets: [{
                 label: 'Ano Atual',
-                data: [45000, 52000, 48000, 61000, 58000, 67000],
+                data: serie.receita.slice(12),
                 backgroundColor: 'rgba(13, 110, 253, 0.6)'
             }, {
                 label: 'Ano Anterior',
-                data: [41000, 48000, 45000, 55000, 52000, 59000],
+                data: serie.receita.slice(0, 6),
                 backgroundColor: 'rgba(108, 117, 125, 0.6)'
             }]
         },